@@ -0,0 +1,39 @@
+# atfm_core/__main__.py
+
+import argparse
+import logging
+import sys
+
+from .scenarios import load_scenarios, run_scenarios
+from .timing import DEFAULT_RECORDER
+
+def main(argv=None):
+    """
+    Chạy không cần giao diện:
+        python -m atfm_core run kich_ban.json [kich_ban_khac.json ...] --output-dir ket_qua
+    Mỗi kịch bản ghi <output-dir>/<name>/regulated_schedule.csv và kpis.json; bảng tổng hợp ở <output-dir>/summary.csv.
+    """
+    parser = argparse.ArgumentParser(prog='python -m atfm_core', description="Mô phỏng ATFM/GDP theo lô, không cần Streamlit.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="Chạy các kịch bản GDP từ file JSON.")
+    run_parser.add_argument('scenario_files', nargs='+', help="File kịch bản JSON (xem scenarios.load_scenarios).")
+    run_parser.add_argument('--output-dir', default='atfm_results')
+    run_parser.add_argument('--schedule', default=None, help="vvts_schedule.csv hoặc thư mục kho dạng cột của generate_data.py --format columnar (mặc định: file cạnh package).")
+    run_parser.add_argument('--eets', default=None, help="eets.csv (mặc định: file cạnh package).")
+    run_parser.add_argument('--quiet', action='store_true', help="Chỉ in cảnh báo và lỗi.")
+    run_parser.add_argument('--timing-log', default=None, help="Ghi thời gian từng bước (JSON lines) vào file này.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    scenarios = [scenario for path in args.scenario_files for scenario in load_scenarios(path)]
+    names = [scenario['name'] for scenario in scenarios]
+    if len(set(names)) != len(names):
+        parser.error("Tên kịch bản bị trùng; đặt 'name' riêng cho từng kịch bản.")
+    if args.timing_log:
+        DEFAULT_RECORDER.log_path = args.timing_log
+    summary = run_scenarios(scenarios, args.output_dir, args.schedule, args.eets)
+    print(summary.to_string(index=False))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
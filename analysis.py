@@ -1,27 +1,46 @@
 # atfm_core/analysis.py
 
+import numpy as np
 import pandas as pd
 from datetime import datetime, time
+from .demand_cube import MINUTES_PER_DAY, ROLLING_WINDOW_MINUTES, DemandCube, RollingDemandIndex
+from .timing import timed
 
-def analyze_hourly_demand(flights_df, time_column_local, landing_capacity, takeoff_capacity):
+@timed
+def analyze_hourly_demand(flights_df, time_column_local, landing_capacity, takeoff_capacity,
+                          window_minutes=ROLLING_WINDOW_MINUTES, step_minutes=60):
     """
-    Hàm tổng quát để phân tích nhu cầu theo giờ từ một cột thời gian cụ thể.
+    Hàm tổng quát để phân tích nhu cầu theo giờ từ một cột thời gian cụ thể (đếm bằng RollingDemandIndex của ngày phân tích).
+
+    Mặc định mỗi dòng là một giờ cố định; step_minutes < window_minutes (ví dụ 15) cho chuỗi cửa sổ trượt: mỗi dòng là
+    cửa sổ [t, t + window_minutes), năng lực là năng lực giờ nhân window_minutes / 60 (làm tròn xuống), và điểm nóng là các cửa sổ quá tải.
     """
     if flights_df is None or flights_df.empty or time_column_local not in flights_df.columns:
         return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
 
     analysis_date = pd.to_datetime(flights_df[time_column_local].iloc[0]).date()
     # Tạo index với múi giờ địa phương để đảm bảo tính nhất quán
-    hourly_index = pd.date_range(start=datetime.combine(analysis_date, time.min), periods=24, freq='H', tz='Asia/Ho_Chi_Minh')
+    window_index = pd.date_range(start=datetime.combine(analysis_date, time.min), periods=MINUTES_PER_DAY // step_minutes,
+                                 freq=f'{step_minutes}min', tz='Asia/Ho_Chi_Minh')
     
+    # Tổng tiền tố theo phút của đúng ngày phân tích (giờ tường địa phương); chuyến ngoài ngày không được đếm
+    demand_cube = DemandCube.from_flights({'analysis': (flights_df, time_column_local)}, start_date=analysis_date, days=1,
+                                          bin_minutes=1, dimensions=())
+    rolling_index = RollingDemandIndex.from_cube(demand_cube)
+    arrival_demand = rolling_index.rolling('arrival', window_minutes, step_minutes).to_numpy()
+    departure_demand = rolling_index.rolling('departure', window_minutes, step_minutes).to_numpy()
+    # Số chuyến là số nguyên nên so với phần nguyên của năng lực cửa sổ cũng cho đúng các điểm nóng
+    return build_demand_analysis(window_index, arrival_demand, departure_demand,
+                                 landing_capacity * window_minutes // 60, takeoff_capacity * window_minutes // 60)
+
+def build_demand_analysis(hourly_index, arrival_demand, departure_demand, landing_capacity, takeoff_capacity):
+    """
+    Dựng bảng nhu cầu/năng lực theo giờ và tách các điểm nóng từ số chuyến đã đếm sẵn
+    (dùng chung cho analyze_hourly_demand và bộ đếm của flight_updates.FlightUpdateStream).
+    """
     analysis_df = pd.DataFrame(index=hourly_index)
-    
-    # Chuyển đổi cột thời gian sang timezone-aware để groupby một cách an toàn
-    flights_df_aware = flights_df.copy()
-    flights_df_aware[time_column_local] = pd.to_datetime(flights_df_aware[time_column_local]).dt.tz_localize('Asia/Ho_Chi_Minh', ambiguous='NaT', nonexistent='raise')
-    
-    analysis_df['arrival_demand'] = flights_df_aware[flights_df_aware['flight_type']=='arrival'].groupby(flights_df_aware[time_column_local].dt.floor('H')).size().reindex(analysis_df.index, fill_value=0)
-    analysis_df['departure_demand'] = flights_df_aware[flights_df_aware['flight_type']=='departure'].groupby(flights_df_aware[time_column_local].dt.floor('H')).size().reindex(analysis_df.index, fill_value=0)
+    analysis_df['arrival_demand'] = np.asarray(arrival_demand)
+    analysis_df['departure_demand'] = np.asarray(departure_demand)
     analysis_df['landing_capacity'] = landing_capacity
     analysis_df['takeoff_capacity'] = takeoff_capacity
 
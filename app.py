@@ -2,9 +2,21 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 from datetime import datetime, timedelta, time, date
+import functools
 import os
-import random
-import heapq
+from pre_tactical import PRE_TACTICAL_PARAMS, generate_pre_tactical_demand_data
+from ensemble import run_pre_tactical_ensemble
+from capacity_profile import CapacityProfile
+from capacity_sweep import NO_EVENTS, run_capacity_sweep, sweep_surface
+from demand_cube import ROLLING_STEP_MINUTES, DemandCube
+from gdp_engine import ASSIGNMENT_MODES, assignment_delay_summary
+from pipeline import (
+    apply_slot_compression, build_initial_traffic_for_pre_tactical, calculate_initial_schedules, get_empty_display_dataframe_schema,
+    keep_flights_for_date, open_schedule_store, run_dual_pass_gdp_simulation, run_gdp_simulation_for_all_traffic,
+    simulate_ctot_compliance, spill_over_hours_for
+)
+from slot_allocator import to_epoch_seconds
+from timing import DEFAULT_HISTORY_RUNS, TIMING_LOG_ENV, TimingRecorder, stage_timer, use_recorder
 
 # --- Cấu hình trang và Hằng số Toàn cục ---
 st.set_page_config(page_title="ATFM Simulation Dashboard - VVTS (Hoàn Chỉnh)", layout="wide")
@@ -17,106 +29,43 @@ VVTS_CONFIG = {
     "airport_timezone_offset_hours": 7 # Múi giờ của sân bay (UTC+7 cho VN)
 }
 
-# Hàm giúp khởi tạo DataFrame rỗng với đúng schema và dtypes
-def get_empty_display_dataframe_schema():
-    columns_with_types = {
-        'callsign': str, 'origin': str, 'destination': str, 'aircraft_type': str,
-        'eobt_dt_local': 'datetime64[ns]', 'eobt_dt_utc': 'datetime64[ns]',
-        'eldt_dt_utc': 'datetime64[ns]', 'eet_minutes': float, 'eet_delta': 'timedelta64[ns]',
-        'cldt_dt_utc': 'datetime64[ns]', 'etot_dt_utc': 'datetime64[ns]',
-        'atfm_delay_minutes': float, 'is_regulated': bool, 'flight_type': str, 'flight_scope': str,
-        'regulated_time_utc': 'datetime64[ns]', 'original_event_time_utc': 'datetime64[ns]',
-        'regulated_time_local': 'datetime64[ns]', 'original_event_time_local': 'datetime64[ns]',
-        'eobt_dt_local_display': str, 'ctot_new_local': str,
-        'new_scheduled_time_local': 'datetime64[ns]', 'original_scheduled_time_local': str,
-
-        # Các cột từ eets_df_merged để đảm bảo schema đủ cho strategic data
-        'eet_to_vvts_minutes': float, 'eet_from_vvts_minutes': float,
-        'taxi_in_minutes': float, 'taxi_out_minutes': float,
-        'origin_eet_to_vvts_minutes': float, 'origin_eet_from_vvts_minutes': float, 'origin_taxi_in_minutes': float, 'origin_taxi_out_minutes': float,
-        'dest_eet_to_vvts_minutes': float, 'dest_eet_from_vvts_minutes': float, 'dest_taxi_in_minutes': float, 'dest_taxi_out_minutes': float,
-
-        # Các cột mới tính toán trong calculate_initial_schedules
-        'etot_origin_dt_utc': 'datetime64[ns]', 'eet_to_vvts_delta': 'timedelta64[ns]', 'eibt_vvts_dt_utc': 'datetime64[ns]',
-        'eet_from_vvts_delta': 'timedelta64[ns]', 'eldt_at_dest_dt_utc': 'datetime64[ns]', 'eibt_at_dest_dt_utc': 'datetime64[ns]',
-
-        # Các cột cho Strategic Data Display (dạng string)
-        'EOBT_local_str': str, 'ETOT_local_str': str, 'ELDT_local_str': str, 'EIBT_local_str': str,
-        'EOBT_origin_local_str': str, 'ETOT_origin_local_str': str, 'ELDT_vvts_dt_local_str': str, 'EIBT_vvts_dt_local_str': str,
-
-        # Các cột cho Pre-Tactical Demand Data
-        'predicted_event_time_utc': 'datetime64[ns]',
-        'predicted_event_time_local': 'datetime64[ns]',
-        'is_predicted_delayed': bool,
-        'prediction_delay_minutes': float
-    }
-
-    empty_df = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in columns_with_types.items()})
-    return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in columns_with_types.items()})
-
 # --- Các Hàm Xử Lý Dữ Liệu (Core Logic) ---
+# Các bước xử lý lõi nằm trong pipeline.py (dùng được ngoài Streamlit, xem `python -m atfm_core run`);
+# ở đây thông báo tiến trình của chúng được hiển thị bằng st.info / st.warning / st.success.
 
-@st.cache_data
-def load_data():
+def streamlit_progress(level, message):
+    getattr(st, level)(message)
+
+def tab_fragment(stage):
+    """
+    Decorator biến hàm hiển thị một tab thành st.fragment: tương tác với widget trong tab chỉ chạy lại hàm đó.
+    Mỗi lần chạy (cùng lần chạy toàn bộ hay riêng fragment) được đo bằng stage_timer(stage) vào recorder của phiên.
     """
-    Tải dữ liệu từ các file CSV và tiền xử lý.
-    Cột 'aircraft_type' trong vvts_schedule.csv.
-    Các cột 'airport_code', 'eet_to_vvts_minutes', 'eet_from_vvts_minutes', 'taxi_in_minutes', 'taxi_out_minutes' trong eets.csv.
+    def decorate(render):
+        @functools.wraps(render)
+        def run_tab(*args, **kwargs):
+            use_recorder(st.session_state.timing_recorder)
+            with stage_timer(stage):
+                render(*args, **kwargs)
+        return st.fragment(run_tab)
+    return decorate
+
+def show_chart(stage, fig, container=st):
+    """plotly_chart có đo thời gian (tuần tự hóa và gửi biểu đồ là phần tốn thời gian của khối hiển thị)."""
+    with stage_timer(f'render: {stage}'):
+        container.plotly_chart(fig, use_container_width=True)
+
+@st.cache_resource
+def load_schedule_store():
+    """
+    Trả về (kho lịch bay phân vùng theo ngày EOBT địa phương, eets_df) của pipeline.open_schedule_store;
+    mỗi lần chọn ngày chỉ đọc phân vùng của ngày đó.
     """
     try:
         script_dir = os.path.dirname(os.path.realpath(__file__))
         schedule_path = os.path.join(script_dir, 'vvts_schedule.csv')
         eets_path = os.path.join(script_dir, 'eets.csv')
-
-        flights_df = pd.read_csv(schedule_path)
-        eets_df = pd.read_csv(eets_path)
-
-        flights_df['eobt_dt_local'] = pd.to_datetime(flights_df['flight_date'] + ' ' + flights_df['eobt'], format='%Y-%m-%d %H:%M', errors='coerce')
-        flights_df.dropna(subset=['eobt_dt_local'], inplace=True)
-        flights_df['eobt_dt_utc'] = flights_df['eobt_dt_local'] - timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
-
-        if 'aircraft_type' not in flights_df.columns:
-            flights_df['aircraft_type'] = 'N/A'
-            st.warning("File 'vvts_schedule.csv' thiếu cột 'aircraft_type'. Đã thêm cột rỗng.")
-
-        # --- FIX: Hợp nhất dữ liệu từ eets_df một cách an toàn và rõ ràng ---
-
-        # Merge thông tin của sân bay origin vào flights_df
-        eets_origin_rename_map = {
-            'airport_code': 'origin_airport_code',
-            'eet_to_vvts_minutes': 'origin_eet_to_vvts_minutes',
-            'eet_from_vvts_minutes': 'origin_eet_from_vvts_minutes',
-            'taxi_in_minutes': 'origin_taxi_in_minutes',
-            'taxi_out_minutes': 'origin_taxi_out_minutes'
-        }
-        flights_df = pd.merge(flights_df, eets_df.rename(columns=eets_origin_rename_map),
-                                  left_on='origin', right_on='origin_airport_code', how='left')
-        flights_df.drop(columns=['origin_airport_code'], inplace=True, errors='ignore')
-
-        # Merge thông tin của sân bay destination vào flights_df
-        eets_dest_rename_map = {
-            'airport_code': 'dest_airport_code',
-            'eet_to_vvts_minutes': 'dest_eet_to_vvts_minutes',
-            'eet_from_vvts_minutes': 'dest_eet_from_vvts_minutes',
-            'taxi_in_minutes': 'dest_taxi_in_minutes',
-            'taxi_out_minutes': 'dest_taxi_out_minutes'
-        }
-        flights_df = pd.merge(flights_df, eets_df.rename(columns=eets_dest_rename_map),
-                                  left_on='destination', right_on='dest_airport_code', how='left')
-        flights_df.drop(columns=['dest_airport_code'], inplace=True, errors='ignore')
-
-        # Điền các giá trị NaN cuối cùng sau khi merge xong
-        for col in ['origin_eet_to_vvts_minutes', 'origin_eet_from_vvts_minutes', 'origin_taxi_in_minutes', 'origin_taxi_out_minutes',
-                    'dest_eet_to_vvts_minutes', 'dest_eet_from_vvts_minutes', 'dest_taxi_in_minutes', 'dest_taxi_out_minutes']:
-            flights_df[col] = pd.to_numeric(flights_df[col], errors='coerce').fillna(15 if 'taxi' in col else 60)
-
-        # Phân loại chuyến bay nội địa/quốc tế dựa trên mã sân bay
-        flights_df['flight_scope'] = flights_df.apply(
-            lambda row: 'domestic' if str(row['origin']).startswith('VV') and str(row['destination']).startswith('VV') else 'international',
-            axis=1
-        )
-
-        return flights_df, eets_df
+        return open_schedule_store(schedule_path, eets_path, progress=streamlit_progress)
     except FileNotFoundError:
         st.error("Không tìm thấy file dữ liệu. Vui lòng đảm bảo 'vvts_schedule.csv' (có cột 'flight_date' và 'aircraft_type') và 'eets.csv' nằm cùng thư mục với ứng dụng.")
         return None, None
@@ -127,358 +76,193 @@ def load_data():
         st.error(f"Lỗi khi tải hoặc xử lý dữ liệu: {e}. Vui lòng kiểm tra định dạng file và dữ liệu.")
         return None, None
 
-def calculate_initial_schedules(flights_df, eets_df):
+@st.cache_data(max_entries=8)
+def load_flights_for_date(selected_date, spill_over_hours):
+    """Các chuyến có EOBT trong ngày được chọn, cùng các chuyến EOBT trong `spill_over_hours` giờ trước nửa đêm."""
+    store, _ = load_schedule_store()
+    return store.read_date(selected_date, spill_over_hours)
+
+# Hàm tạo Pre-tactical Demand Data (phiên bản vector hóa, có seed) nằm trong pre_tactical.py.
+# Kết quả được cache theo (ngày, seed, thông số) để chạy lại cùng kịch bản không phải rút mẫu lại.
+@st.cache_data(max_entries=32)
+def get_pre_tactical_demand_data(_all_initial_traffic_df, selected_date, seed, params):
     """
-    Tính toán lịch trình ban đầu (ELDT cho chuyến đến, ETOT cho chuyến đi).
-    Tất cả các thời gian được tính toán và lưu trữ ở múi giờ UTC để nhất quán.
-    Bổ sung tính toán ELDT/EIBT cho DEP và EIBT cho ARR cho mục Strategic Data.
+    Trả về dữ liệu Pre-tactical cho một ngày. DataFrame đầu vào (tham số có dấu `_`) không tham gia khóa cache;
+    khóa cache là (selected_date, seed, params).
     """
-    # Xử lý chuyến đến (Arrivals)
-    arrivals_df = flights_df[flights_df['destination'] == 'VVTS'].copy()
-
-    # ETOT at Origin for Arrivals = EOBT at Origin + Taxi-out at Origin
-    arrivals_df['origin_taxi_out_delta'] = pd.to_timedelta(arrivals_df['origin_taxi_out_minutes'], unit='m', errors='coerce')
-    arrivals_df['etot_origin_dt_utc'] = arrivals_df['eobt_dt_utc'] + arrivals_df['origin_taxi_out_delta']
-
-    # ELDT at VVTS (Arrivals) = ETOT at Origin + EET from Origin to VVTS
-    arrivals_df['eet_to_vvts_delta'] = pd.to_timedelta(arrivals_df['origin_eet_to_vvts_minutes'], unit='m', errors='coerce')
-    arrivals_df['eldt_dt_utc'] = arrivals_df['etot_origin_dt_utc'] + arrivals_df['eet_to_vvts_delta'] # Corrected ELDT formula from ETOT + EET
-
-    # EIBT at VVTS for Arrivals = ELDT at VVTS + Taxi-in at VVTS
-    arrivals_df['eibt_vvts_dt_utc'] = arrivals_df['eldt_dt_utc'] + pd.to_timedelta(arrivals_df['dest_taxi_in_minutes'], unit='m', errors='coerce') # dest_taxi_in_minutes is VVTS taxi-in here
-
-
-    # Xử lý chuyến đi (Departures)
-    departures_df = flights_df[flights_df['origin'] == 'VVTS'].copy()
-
-    # ETOT at VVTS (Departures) = EOBT at VVTS + Taxi-out from VVTS
-    departures_df['etot_dt_utc'] = departures_df['eobt_dt_utc'] + pd.to_timedelta(VVTS_CONFIG['taxi_out_time_minutes'], unit='m', errors='coerce') # VVTS_CONFIG['taxi_out_time_minutes'] is STT for VVTS
-
-    # ELDT at Destination for Departures = ETOT at VVTS + EET from VVTS to Destination
-    departures_df['eet_from_vvts_delta'] = pd.to_timedelta(departures_df['dest_eet_from_vvts_minutes'], unit='m', errors='coerce') # Use dest EET from VVTS
-    departures_df['eldt_at_dest_dt_utc'] = departures_df['etot_dt_utc'] + departures_df['eet_from_vvts_delta']
+    return generate_pre_tactical_demand_data(
+        _all_initial_traffic_df,
+        seed=seed,
+        params=dict(params),
+        timezone_offset_hours=VVTS_CONFIG['airport_timezone_offset_hours']
+    )
 
-    # EIBT at Destination for Departures = ELDT at Destination + Taxi-in at Destination
-    departures_df['eibt_at_dest_dt_utc'] = departures_df['eldt_at_dest_dt_utc'] + pd.to_timedelta(departures_df['dest_taxi_in_minutes'], unit='m', errors='coerce')
+# --- Bộ nhớ đệm tính toán theo ngày ---
+# Mỗi tương tác làm Streamlit chạy lại toàn bộ script; lịch trình ban đầu, bảng nhu cầu theo giờ và các biểu đồ chỉ được
+# tính lại khi khóa (ngày, năng lực, sự kiện giảm năng lực, seed, ...) đổi. Mỗi cache giữ tối đa `max_entries` khóa
+# (bỏ khóa ít dùng nhất); clear_computation_caches() xóa toàn bộ (nút "Tính lại" và nút Reset ở sidebar).
 
-    return arrivals_df, departures_df
+def capacity_events_key(events):
+    """Khóa cache của danh sách sự kiện giảm năng lực: tuple (bắt đầu, kết thúc theo giờ địa phương, năng lực mới)."""
+    return tuple((event['start_time_local'], event['end_time_local'], int(event['new_capacity'])) for event in events)
 
-# Hàm tạo Pre-tactical Demand Data
-def generate_pre_tactical_demand_data(all_initial_traffic_df):
+@st.cache_data(max_entries=16)
+def get_capacity_profile(takeoff_capacity, landing_capacity, events_key, capacity_forecast):
     """
-    Tạo dữ liệu nhu cầu tiền chiến thuật bằng cách áp dụng độ trễ/biến động ngẫu nhiên.
-    Args:
-        all_initial_traffic_df (pd.DataFrame): DataFrame chứa tất cả các chuyến bay ban đầu (đã được tính toán ELDT/ETOT gốc).
-    Returns:
-        pd.DataFrame: DataFrame mới với các cột thời gian dự đoán tiền chiến thuật.
+    Hồ sơ năng lực (CapacityProfile: hạ cánh / cất cánh / tổng theo ô 15 phút, UTC) của năng lực cơ bản, các sự kiện
+    giảm năng lực (`events_key`) và file dự báo năng lực đã tải (DataFrame hoặc None); biểu đồ Tab 1, Tab 3 và
+    engine GDP cùng tra năng lực từ hồ sơ này.
     """
-    pre_tactical_df = all_initial_traffic_df.copy()
-
-    # Các thông số mô phỏng độ trễ/biến động tiền chiến thuật
-    delay_prob_overall = 0.15  # 15% chuyến bay bị ảnh hưởng
-    min_delay = 5
-    max_delay = 45 # Có thể delay nặng hơn trong Pre-Tactical
-
-    eet_variance_prob = 0.10 # 10% chuyến bay ARR có biến động EET
-    max_eet_variance = 20 # Biến động EET lên đến +-20 phút (gió, đường bay)
+    offset = timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
+    events = [{'start_time_utc': start_local - offset, 'end_time_utc': end_local - offset, 'new_capacity': new_capacity}
+              for start_local, end_local, new_capacity in events_key]
+    return CapacityProfile.build(takeoff_capacity, landing_capacity, events, capacity_forecast, VVTS_CONFIG['airport_timezone_offset_hours'])
 
-    pre_tactical_df['is_predicted_delayed'] = False
-    pre_tactical_df['prediction_delay_minutes'] = 0.0
-    pre_tactical_df['predicted_event_time_utc'] = pre_tactical_df['event_time_utc'] # Khởi tạo bằng thời gian ban đầu
-
-    for idx, row in pre_tactical_df.iterrows():
-        current_predicted_time_utc = row['event_time_utc']
-
-        # 1. Áp dụng độ trễ ngẫu nhiên tổng thể (cho cả ARR và DEP)
-        if random.random() < delay_prob_overall:
-            delay_minutes = random.randint(min_delay, max_delay)
-            current_predicted_time_utc += timedelta(minutes=delay_minutes)
-            pre_tactical_df.loc[idx, 'is_predicted_delayed'] = True
-            pre_tactical_df.loc[idx, 'prediction_delay_minutes'] = delay_minutes
+@st.cache_data(max_entries=8)
+def get_initial_schedules(selected_date, spill_over_hours):
+    """
+    Trả về (initial_arrivals_df, initial_departures_df, all_initial_traffic, initial_demand_cube) của một ngày: lịch trình
+    ban đầu (calculate_initial_schedules) có thêm cột giờ địa phương, toàn bộ lưu lượng ban đầu (đến + đi, cột
+    event_time_local / movement_type_display / flight_type) sắp theo thời gian cho bảng Strategic, và khối nhu cầu
+    (DemandCube, kịch bản 'initial', giờ địa phương) mà các biểu đồ nhu cầu ban đầu đọc.
+    """
+    _, eets = load_schedule_store()
+    initial_arrivals, initial_departures = keep_flights_for_date(
+        *calculate_initial_schedules(load_flights_for_date(selected_date, spill_over_hours), eets), selected_date
+    )
+    offset = timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
+    initial_arrivals['eldt_dt_local'] = initial_arrivals['eldt_dt_utc'] + offset
+    initial_departures['etot_dt_local'] = initial_departures['etot_dt_utc'] + offset
+    all_initial_traffic = pd.concat([
+        initial_arrivals.assign(event_time_local=initial_arrivals['eldt_dt_local'], movement_type_display='Arrival', flight_type='arrival'),
+        initial_departures.assign(event_time_local=initial_departures['etot_dt_local'], movement_type_display='Departure', flight_type='departure')
+    ]).sort_values(by='event_time_local').reset_index(drop=True)
+    initial_demand_cube = DemandCube.from_flights({'initial': (all_initial_traffic, 'event_time_local')})
+    return initial_arrivals, initial_departures, all_initial_traffic, initial_demand_cube
+
+@st.cache_data(max_entries=16)
+def get_initial_demand(selected_date, spill_over_hours, takeoff_capacity, landing_capacity, events_key, capacity_forecast):
+    """
+    Bảng nhu cầu / năng lực theo giờ (24 giờ của ngày) và biểu đồ cột chồng Nhu cầu Ban đầu của Tab 1.
+    `events_key` là capacity_events_key(...) của các sự kiện giảm năng lực đang cấu hình, `capacity_forecast` là file
+    dự báo năng lực đã tải (hoặc None); năng lực tổng của mỗi giờ tra từ get_capacity_profile.
+    """
+    initial_demand_cube = get_initial_schedules(selected_date, spill_over_hours)[3]
 
-        # 2. Áp dụng biến động EET (chủ yếu ảnh hưởng Arrival ELDT)
-        if row['flight_type'] == 'arrival' and random.random() < eet_variance_prob:
-            eet_change_minutes = random.randint(-max_eet_variance, max_eet_variance)
-            current_predicted_time_utc += timedelta(minutes=eet_change_minutes)
-            # Cộng dồn vào prediction_delay_minutes
-            pre_tactical_df.loc[idx, 'prediction_delay_minutes'] += eet_change_minutes
+    # --- Đảm bảo full_demand_df luôn có đủ 24 giờ của ngày được chọn ---
+    selected_date_full_hours = pd.date_range(
+        start=datetime.combine(selected_date, time(0,0,0)),
+        end=datetime.combine(selected_date, time(23,0,0)),
+        freq='H'
+    )
+    full_demand_df = pd.DataFrame(index=selected_date_full_hours)
 
-        pre_tactical_df.loc[idx, 'predicted_event_time_utc'] = current_predicted_time_utc
+    # Tính nhu cầu cất và hạ cánh thực tế theo từng giờ cụ thể (cắt từ khối nhu cầu)
+    full_demand_df['arrival_demand'] = initial_demand_cube.series('arrival', 'initial', start_date=selected_date, days=1).to_numpy()
+    full_demand_df['departure_demand'] = initial_demand_cube.series('departure', 'initial', start_date=selected_date, days=1).to_numpy()
 
-    # Tính toán các cột hiển thị thời gian Local cho dữ liệu Pre-Tactical
-    pre_tactical_df['predicted_event_time_local'] = pre_tactical_df['predicted_event_time_utc'] + timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
+    # Năng lực hạ cánh / cất cánh / tổng của từng giờ trong hồ sơ năng lực (đã tính sự kiện / dự báo), như engine GDP dùng
+    capacity_profile = get_capacity_profile(takeoff_capacity, landing_capacity, events_key, capacity_forecast)
+    offset = timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
+    (full_demand_df['effective_landing_capacity_for_gdp'], full_demand_df['effective_takeoff_capacity'],
+     full_demand_df['total_effective_capacity']) = capacity_profile.hourly_rates(to_epoch_seconds(full_demand_df.index - offset))
 
-    return pre_tactical_df
+    # Xác định các điểm quá tải cho luồng hạ cánh (dựa trên nhu cầu hạ cánh so với năng lực hạ cánh)
+    full_demand_df['is_landing_overload'] = full_demand_df['arrival_demand'] > full_demand_df['effective_landing_capacity_for_gdp']
 
-def run_gdp_simulation_for_all_traffic(initial_all_traffic_df, takeoff_capacity_hourly, landing_capacity_hourly, reduced_capacity_events):
-    """
-    Thực hiện mô phỏng GDP với thuật toán được thiết kế lại:
-    Ưu tiên 1: Kiểm tra năng lực theo giờ.
-    Ưu tiên 2: Kiểm tra khoảng cách theo phút.
-    """
-    all_traffic = initial_all_traffic_df.copy()
-    all_traffic['regulated_time_utc'] = pd.NaT
-    all_traffic['atfm_delay_minutes'] = 0.0
-    all_traffic['is_regulated'] = False
-
-    # Sắp xếp các chuyến bay theo thời gian dự kiến để xử lý
-    all_traffic.sort_values(by='predicted_event_time_utc', inplace=True)
-
-    # Chuẩn bị các heap slot cho ARR và DEP
-    start_hour = all_traffic['predicted_event_time_utc'].min().floor('H')
-    end_hour = all_traffic['predicted_event_time_utc'].max().ceil('H') + timedelta(hours=6)
-
-    arrival_slots, departure_slots = [], []
-    current = start_hour
-    while current <= end_hour:
-        arr_cap = landing_capacity_hourly
-        dep_cap = takeoff_capacity_hourly
-        for event in reduced_capacity_events:
-            if event['start_time_utc'] <= current < event['end_time_utc']:
-                total_cap = min(takeoff_capacity_hourly + landing_capacity_hourly, event['new_capacity'])
-                arr_cap = min(landing_capacity_hourly, total_cap // 2)
-                dep_cap = min(takeoff_capacity_hourly, total_cap - arr_cap)
-                break
-        if arr_cap > 0:
-            interval = 60 / arr_cap
-            for i in range(int(arr_cap)):
-                heapq.heappush(arrival_slots, current + timedelta(minutes=i * interval))
-        if dep_cap > 0:
-            interval = 60 / dep_cap
-            for i in range(int(dep_cap)):
-                heapq.heappush(departure_slots, current + timedelta(minutes=i * interval))
-        current += timedelta(hours=1)
-
-    for idx, flight in all_traffic.iterrows():
-        desired_time = flight['predicted_event_time_utc']
-        if pd.isna(desired_time):
-            st.warning(f"Bỏ qua chuyến bay {flight.get('callsign', 'N/A')} do thiếu thời gian dự đoán.")
-            continue
-        heap = arrival_slots if flight['flight_type'] == 'arrival' else departure_slots
-        slot_time = None
-        while heap:
-            candidate = heapq.heappop(heap)
-            if candidate >= desired_time:
-                slot_time = candidate
-                break
-        if slot_time is None:
-            slot_time = desired_time
-        all_traffic.loc[idx, 'regulated_time_utc'] = slot_time
-        delay = (slot_time - desired_time).total_seconds() / 60
-        if delay > 0.1:
-            all_traffic.loc[idx, 'atfm_delay_minutes'] = delay
-            all_traffic.loc[idx, 'is_regulated'] = True
-    
-    # ----- PHẦN CODE CÒN LẠI CỦA HÀM GIỮ NGUYÊN -----
-    df_result_with_display_cols = all_traffic.copy()
-
-    df_result_with_display_cols['regulated_time_local'] = df_result_with_display_cols['regulated_time_utc'] + timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
-    df_result_with_display_cols['original_event_time_local'] = df_result_with_display_cols['original_event_time_utc'] + timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
-    df_result_with_display_cols['eobt_dt_local_display'] = df_result_with_display_cols['eobt_dt_local'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
-
-    def calculate_ctot_utc(row):
-        if pd.isna(row['regulated_time_utc']):
-            return pd.NaT
-        if row['flight_type'] == 'arrival':
-            eet_delta = pd.to_timedelta(row['origin_eet_to_vvts_minutes'], unit='m', errors='coerce')
-            if pd.isna(eet_delta):
-                eet_delta = timedelta(0)
-            return row['regulated_time_utc'] - eet_delta
-        else:
-            return row['regulated_time_utc']
+    # --- Biểu đồ cột chồng Nhu cầu Ban đầu (Chart 1 - cố định) ---
+    fig_initial_stacked_demand = go.Figure()
 
-    df_result_with_display_cols['ctot_utc'] = df_result_with_display_cols.apply(calculate_ctot_utc, axis=1)
-    tz_offset = timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
-    df_result_with_display_cols['ctot_new_local'] = (df_result_with_display_cols['ctot_utc'] + tz_offset).dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
-    df_result_with_display_cols.drop(columns=['ctot_utc'], inplace=True)
+    # Cột cất cánh (màu xanh dương) - Đặt dưới cùng
+    fig_initial_stacked_demand.add_trace(go.Bar(
+        x=full_demand_df.index,
+        y=full_demand_df['departure_demand'],
+        name='Nhu cầu Cất cánh',
+        marker_color='blue'
+    ))
 
-    df_result_with_display_cols['new_scheduled_time_local'] = df_result_with_display_cols['regulated_time_local'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
-    df_result_with_display_cols['original_scheduled_time_local'] = df_result_with_display_cols['original_event_time_local'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+    # Cột hạ cánh (màu cam) - Chồng lên trên cột cất cánh
+    fig_initial_stacked_demand.add_trace(go.Bar(
+        x=full_demand_df.index,
+        y=full_demand_df['arrival_demand'],
+        name='Nhu cầu Hạ cánh',
+        marker_color='orange'
+    ))
 
-    final_schema_cols = get_empty_display_dataframe_schema().columns
-    for col in final_schema_cols:
-        if col not in df_result_with_display_cols.columns:
-            df_result_with_display_cols[col] = pd.NA
-    
-    return df_result_with_display_cols
+    # Đường năng lực tổng cộng (màu đỏ)
+    fig_initial_stacked_demand.add_trace(go.Scatter(
+        x=full_demand_df.index,
+        y=full_demand_df['total_effective_capacity'],
+        mode='lines',
+        name='Capacity',
+        line=dict(color='red', dash='dash', width=3)
+    ))
 
-# --- HÀM MỚI: MÔ PHỎNG SỰ TUÂN THỦ CTOT TRONG THỰC TẾ ---
-def simulate_ctot_compliance(regulated_df):
-    """
-    Mô phỏng sự tuân thủ CTOT với dung sai -5/+10 phút.
-
-    Hàm này lấy DataFrame đã điều tiết và thêm vào các cột:
-      - ``actual_time_utc``: thời gian thực tế sau khi hãng thực hiện.
-      - ``compliance_offset_minutes``: độ lệch so với CTOT.
-      - ``slot_compliance``: đánh dấu tuân thủ (True nếu lệch trong [-5, +10]).
-    """
-    st.info("Bước cuối: Mô phỏng sự tuân thủ CTOT với dung sai -5/+10 phút...")
-
-    df_with_actuals = regulated_df.copy()
-
-    # Khởi tạo các cột mới
-    df_with_actuals['actual_time_utc'] = df_with_actuals['regulated_time_utc']
-    df_with_actuals['compliance_offset_minutes'] = 0
-    df_with_actuals['slot_compliance'] = True
-
-    # Chỉ áp dụng lệch cho các chuyến bay bị điều tiết
-    regulated_indices = df_with_actuals[df_with_actuals['is_regulated'] == True].index
-
-    for index in regulated_indices:
-        # Sinh độ lệch ngẫu nhiên rộng hơn để có trường hợp vi phạm
-        compliance_offset = random.randint(-20, 20)
-        df_with_actuals.loc[index, 'actual_time_utc'] = (
-            df_with_actuals.loc[index, 'regulated_time_utc'] + timedelta(minutes=compliance_offset)
-        )
-        df_with_actuals.loc[index, 'compliance_offset_minutes'] = compliance_offset
-        df_with_actuals.loc[index, 'slot_compliance'] = -5 <= compliance_offset <= 10
-
-    return df_with_actuals
+    fig_initial_stacked_demand.update_layout(
+        barmode='stack', # Chế độ cột chồng
+        title='Nhu cầu Hoạt động Ban đầu (Đến và Đi) so với Năng lực Sân bay',
+        xaxis_title=f'Thời gian (Giờ địa phương - UTC+{VVTS_CONFIG["airport_timezone_offset_hours"]})',
+        yaxis_title='Số lượt cất/hạ cánh',
+        plot_bgcolor='rgba(0,0,0,0)',
+        hovermode="x unified",
+        xaxis_tickformat="%H:%M<br>%d/%m"
+    )
+    return full_demand_df, fig_initial_stacked_demand
 
-# --- CẢI TIẾN: Thuật toán GDP 2 bước (Dual-Pass) phiên bản CUỐI CÙNG, SỬA LỖI MẤT DỮ LIỆU ---
-def run_dual_pass_gdp_simulation(pre_tactical_df, takeoff_capacity, landing_capacity, capacity_events, timezone_offset_hours):
+@st.cache_data(max_entries=16)
+def get_gdp_comparison(regulated_df, selected_date, freq_minutes, takeoff_capacity, landing_capacity, events_key, capacity_forecast):
     """
-    Thực hiện mô phỏng GDP 2 bước, phiên bản cuối cùng:
-    - Sửa lỗi mất dữ liệu của các chuyến bay không bị điều tiết.
-    - Đảm bảo tất cả chuyến bay đều có trong kết quả cuối cùng.
+    Nhu cầu trước / sau GDP gom theo `freq_minutes` (60, 30, 15) và hai biểu đồ so sánh của Tab 3, đọc từ một khối
+    nhu cầu với hai kịch bản: 'pre_tactical' (thời gian dự đoán) và 'regulated' (thời gian thực tế sau điều tiết).
+    Khóa cache gồm cả nội dung lịch trình điều tiết (Streamlit băm DataFrame), nên chạy lại GDP hay nén slot
+    tạo khóa mới; đổi độ phân giải qua lại chỉ đọc lại cache.
     """
-    st.info("Bắt đầu quy trình điều tiết 2 bước (phiên bản cuối cùng)...")
-    
-    arrivals_df = pre_tactical_df[pre_tactical_df['flight_type'] == 'arrival'].copy()
-    departures_df = pre_tactical_df[pre_tactical_df['flight_type'] == 'departure'].copy()
-
-    # ==============================================================================
-    # ===== BƯỚC A: ĐIỀU TIẾT LUỒNG ĐẾN (ARRIVAL PASS) =============================
-    # ==============================================================================
-    st.info("Bước A: Điều tiết các chuyến bay hạ cánh (Arrivals)...")
-    
-    regulated_arrivals_df = arrivals_df.copy() # Khởi tạo df kết quả cho arrival
-    
-    if not arrivals_df.empty and arrivals_df['predicted_event_time_local'].notna().any():
-        hourly_arrival_demand = arrivals_df.groupby(arrivals_df['predicted_event_time_local'].dt.floor('H')).size()
-        demand_df = pd.DataFrame(index=hourly_arrival_demand.index)
-        demand_df['predicted_demand'] = hourly_arrival_demand
-        demand_df['capacity'] = landing_capacity
-        congested_arrival_hours = demand_df[demand_df['predicted_demand'] > demand_df['capacity']].index
-
-        if not congested_arrival_hours.empty:
-            st.warning(f"Phát hiện {len(congested_arrival_hours)} giờ tắc nghẽn hạ cánh.")
-            arr_reg_start_utc = (congested_arrival_hours.min() - timedelta(hours=timezone_offset_hours))
-            arr_reg_end_utc = (congested_arrival_hours.max() + timedelta(hours=1) - timedelta(hours=timezone_offset_hours))
-            
-            arrivals_to_regulate = arrivals_df[(arrivals_df['predicted_event_time_utc'] >= arr_reg_start_utc) & (arrivals_df['predicted_event_time_utc'] < arr_reg_end_utc)].copy()
-            arrivals_not_regulated = arrivals_df.drop(arrivals_to_regulate.index)
-            
-            arrivals_to_regulate.sort_values(by='predicted_event_time_utc', inplace=True)
-            slot_interval_minutes = 60 / landing_capacity
-            current_slot_time_utc = arr_reg_start_utc
-            
-            for index, flight in arrivals_to_regulate.iterrows():
-                new_slot_time = max(current_slot_time_utc, flight['predicted_event_time_utc'])
-                arrivals_to_regulate.loc[index, 'regulated_time_utc'] = new_slot_time
-                current_slot_time_utc = new_slot_time + timedelta(minutes=slot_interval_minutes)
-            
-            # --- SỬA LỖI: Gán thời gian cho các chuyến KHÔNG bị điều tiết ---
-            arrivals_not_regulated['regulated_time_utc'] = arrivals_not_regulated['predicted_event_time_utc']
-            
-            regulated_arrivals_df = pd.concat([arrivals_to_regulate, arrivals_not_regulated])
-        else:
-            st.success("Luồng hạ cánh thông thoáng.")
-            regulated_arrivals_df['regulated_time_utc'] = regulated_arrivals_df['predicted_event_time_utc']
+    actual_time_local = regulated_df['actual_time_utc'] + timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
+    demand_cube = DemandCube.from_flights({
+        'pre_tactical': (regulated_df, 'predicted_event_time_local'),
+        'regulated': (regulated_df, actual_time_local),
+    }, start_date=selected_date, days=1)
+
+    # Nhu cầu theo khoảng thời gian đã chọn, đủ các mốc trong ngày
+    resampled_df = pd.DataFrame({
+        f'{scenario}_{flow}_demand': demand_cube.series(flow, scenario_name, freq_minutes=freq_minutes)
+        for scenario, scenario_name in (('initial', 'pre_tactical'), ('regulated', 'regulated'))
+        for flow in ('arrival', 'departure')
+    })
+
+    # Đường năng lực tương ứng với độ phân giải: năng lực tổng (lượt/giờ) đầu mỗi khoảng trong hồ sơ năng lực x số giờ của khoảng
+    capacity_profile = get_capacity_profile(takeoff_capacity, landing_capacity, events_key, capacity_forecast)
+    period_starts_utc = resampled_df.index - timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
+    resampled_df['scaled_total_capacity'] = capacity_profile.rates(period_starts_utc)[2] * freq_minutes / 60
+
+    # Tính toán Y-axis chung để 2 biểu đồ có cùng tỷ lệ (cách an toàn)
+    combined_initial_demand = resampled_df['initial_arrival_demand'] + resampled_df['initial_departure_demand']
+    if not combined_initial_demand.empty and combined_initial_demand.max() > 0:
+        max_y = combined_initial_demand.max() * 1.15
     else:
-        st.success("Không có chuyến bay hạ cánh nào trong dữ liệu.")
-    
-    # ==============================================================================
-    # ===== BƯỚC B: ĐIỀU TIẾT LUỒNG ĐI (DEPARTURE PASS) ============================
-    # ==============================================================================
-    st.info("Bước B: Điều tiết các chuyến bay cất cánh (Departures)...")
-    
-    regulated_departures_df = departures_df.copy() # Khởi tạo df kết quả cho departure
+        max_y = 50
+
+    # BIỂU ĐỒ 1: TRƯỚC ĐIỀU TIẾT
+    fig_before = go.Figure()
+    fig_before.add_trace(go.Bar(x=resampled_df.index, y=resampled_df['initial_departure_demand'], name='Cất cánh', marker_color='#80B4E0'))
+    fig_before.add_trace(go.Bar(x=resampled_df.index, y=resampled_df['initial_arrival_demand'], name='Hạ cánh', marker_color='#A0D498'))
+    fig_before.add_trace(go.Scatter(x=resampled_df.index, y=resampled_df['scaled_total_capacity'], name='Năng lực', mode='lines', line=dict(color='red', dash='dash', width=2)))
+    fig_before.update_layout(barmode='stack', yaxis_title='Số lượt cất/hạ cánh', plot_bgcolor='rgba(240, 240, 240, 0.95)', hovermode="x unified", xaxis_tickformat="%H:%M", margin=dict(l=40, r=20, t=40, b=20), legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1), yaxis_range=[0, max_y])
+
+    # BIỂU ĐỒ 2: SAU ĐIỀU TIẾT
+    fig_after = go.Figure()
+    fig_after.add_trace(go.Bar(x=resampled_df.index, y=resampled_df['regulated_departure_demand'], name='Cất cánh', marker_color='#005A9E'))
+    fig_after.add_trace(go.Bar(x=resampled_df.index, y=resampled_df['regulated_arrival_demand'], name='Hạ cánh', marker_color='#2E8540'))
+    fig_after.add_trace(go.Scatter(x=resampled_df.index, y=resampled_df['scaled_total_capacity'], name='Năng lực', mode='lines', line=dict(color='red', dash='dash', width=2)))
+    fig_after.update_layout(barmode='stack', plot_bgcolor='rgba(240, 240, 240, 0.95)', hovermode="x unified", xaxis_tickformat="%H:%M", margin=dict(l=40, r=20, t=40, b=20), legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1), yaxis_range=[0, max_y])
+    return fig_before, fig_after
+
+def clear_computation_caches():
+    """Xóa tường minh mọi cache tính toán (kể cả kho lịch bay): lần chạy sau đọc lại dữ liệu và tính lại từ đầu."""
+    for cached_function in (load_schedule_store, load_flights_for_date, get_pre_tactical_demand_data, get_capacity_profile,
+                            get_initial_schedules, get_initial_demand, get_gdp_comparison):
+        cached_function.clear()
 
-    # Tính toán năng lực còn lại...
-    total_capacity = takeoff_capacity + landing_capacity
-    regulated_arrivals_df['regulated_time_local'] = regulated_arrivals_df['regulated_time_utc'] + timedelta(hours=timezone_offset_hours)
-    regulated_arrivals_per_hour = regulated_arrivals_df.groupby(regulated_arrivals_df['regulated_time_local'].dt.floor('H')).size()
-    
-    if not departures_df.empty and departures_df['predicted_event_time_local'].notna().any():
-        departures_per_hour = departures_df.groupby(departures_df['predicted_event_time_local'].dt.floor('H')).size()
-        
-        start_hour_range = min(regulated_arrivals_df['regulated_time_local'].min(), departures_df['predicted_event_time_local'].min()) if not regulated_arrivals_df.empty else departures_df['predicted_event_time_local'].min()
-        end_hour_range = max(regulated_arrivals_df['regulated_time_local'].max(), departures_df['predicted_event_time_local'].max()) if not regulated_arrivals_df.empty else departures_df['predicted_event_time_local'].max()
-
-        full_day_hours = pd.date_range(start=start_hour_range.floor('H'), end=end_hour_range.floor('H'), freq='H')
-        
-        hourly_summary = pd.DataFrame(index=full_day_hours)
-        hourly_summary['regulated_arrivals'] = regulated_arrivals_per_hour.reindex(full_day_hours, fill_value=0)
-        hourly_summary['predicted_departures'] = departures_per_hour.reindex(full_day_hours, fill_value=0)
-        hourly_summary['departure_capacity'] = total_capacity - hourly_summary['regulated_arrivals']
-        hourly_summary['departure_capacity'] = hourly_summary['departure_capacity'].apply(lambda x: max(takeoff_capacity/4, x))
-        
-        congested_departure_hours = hourly_summary[hourly_summary['predicted_departures'] > hourly_summary['departure_capacity']].index
-        
-        if not congested_departure_hours.empty:
-            st.warning(f"Phát hiện {len(congested_departure_hours)} giờ tắc nghẽn cất cánh.")
-            
-            dep_reg_start_utc = (congested_departure_hours.min() - timedelta(hours=timezone_offset_hours))
-            
-            departures_to_regulate = departures_df[departures_df['predicted_event_time_utc'] >= dep_reg_start_utc].copy()
-            departures_not_regulated = departures_df.drop(departures_to_regulate.index)
-            
-            departures_to_regulate.sort_values(by='predicted_event_time_utc', inplace=True)
-            
-            current_slot_time_utc = dep_reg_start_utc
-            for index, flight in departures_to_regulate.iterrows():
-                new_slot_time = max(current_slot_time_utc, flight['predicted_event_time_utc'])
-                slot_hour_local = (new_slot_time + timedelta(hours=timezone_offset_hours)).floor('H')
-                dep_capacity_this_hour = hourly_summary.loc[slot_hour_local, 'departure_capacity'] if slot_hour_local in hourly_summary.index else takeoff_capacity
-                slot_interval_minutes = 60 / dep_capacity_this_hour
-                departures_to_regulate.loc[index, 'regulated_time_utc'] = new_slot_time
-                current_slot_time_utc = new_slot_time + timedelta(minutes=slot_interval_minutes)
-
-            # --- SỬA LỖI: Gán thời gian cho các chuyến KHÔNG bị điều tiết ---
-            departures_not_regulated['regulated_time_utc'] = departures_not_regulated['predicted_event_time_utc']
-
-            regulated_departures_df = pd.concat([departures_to_regulate, departures_not_regulated])
-        else:
-            st.success("Luồng cất cánh thông thoáng.")
-            regulated_departures_df['regulated_time_utc'] = regulated_departures_df['predicted_event_time_utc']
-    else:
-        st.success("Không có chuyến bay cất cánh nào trong dữ liệu.")
-    
-    # ==============================================================================
-    # ===== BƯỚC C: KẾT HỢP VÀ HOÀN THIỆN ==========================================
-    # ==============================================================================
-    final_df = pd.concat([regulated_arrivals_df, regulated_departures_df]).dropna(subset=['callsign'])
-    
-    # Phần tính toán cuối cùng không thay đổi
-    # ... (toàn bộ phần code tính toán các cột cuối cùng và return giữ nguyên)
-    final_df['atfm_delay_minutes'] = (final_df['regulated_time_utc'] - final_df['predicted_event_time_utc']).dt.total_seconds() / 60
-    final_df['atfm_delay_minutes'] = final_df['atfm_delay_minutes'].apply(lambda x: max(0, x))
-    final_df['is_regulated'] = final_df['atfm_delay_minutes'] > 0.1
-
-    df_result_with_display_cols = final_df.copy()
-    df_result_with_display_cols['regulated_time_local'] = pd.to_datetime(df_result_with_display_cols['regulated_time_utc']).dt.tz_localize('UTC').dt.tz_convert(f'Etc/GMT-{timezone_offset_hours}').dt.tz_localize(None)
-    df_result_with_display_cols['original_event_time_local'] = pd.to_datetime(df_result_with_display_cols['original_event_time_utc']).dt.tz_localize('UTC').dt.tz_convert(f'Etc/GMT-{timezone_offset_hours}').dt.tz_localize(None)
-    
-    def calculate_ctot_utc(row):
-        if pd.isna(row['regulated_time_utc']) or not row['is_regulated']: return pd.NaT
-        if row['flight_type'] == 'arrival':
-            eet_delta = pd.to_timedelta(row['origin_eet_to_vvts_minutes'], unit='m')
-            return row['regulated_time_utc'] - eet_delta
-        else: return row['regulated_time_utc']
-
-    df_result_with_display_cols['ctot_utc'] = df_result_with_display_cols.apply(calculate_ctot_utc, axis=1)
-    df_result_with_display_cols['ctot_new_local'] = pd.to_datetime(df_result_with_display_cols['ctot_utc']).dt.tz_localize('UTC').dt.tz_convert(f'Etc/GMT-{timezone_offset_hours}').dt.tz_localize(None).dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
-    df_result_with_display_cols['new_scheduled_time_local'] = df_result_with_display_cols['regulated_time_local'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
-    df_result_with_display_cols['original_scheduled_time_local'] = pd.to_datetime(df_result_with_display_cols['original_event_time_local']).dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
-
-    final_schema_cols = get_empty_display_dataframe_schema().columns
-    for col in final_schema_cols:
-        if col not in df_result_with_display_cols.columns:
-            df_result_with_display_cols[col] = pd.NA
-    
-    st.success("Hoàn tất mô phỏng điều tiết!")
-    return df_result_with_display_cols[list(final_schema_cols)]
 def run_selective_gdp_simulation(pre_tactical_df, takeoff_capacity, landing_capacity, capacity_events, timezone_offset_hours):
     """
     Điều phối việc chạy GDP bằng cách xác định các giờ tắc nghẽn trước,
@@ -488,18 +272,11 @@ def run_selective_gdp_simulation(pre_tactical_df, takeoff_capacity, landing_capa
 
     # --- Bước 1: Xác định các khung giờ tắc nghẽn (dựa trên luồng hạ cánh) ---
     # Sử dụng dữ liệu dự báo tiền chiến thuật để xác định tắc nghẽn
-    arrivals_predicted = pre_tactical_df[pre_tactical_df['flight_type'] == 'arrival'].copy()
-    if 'predicted_event_time_local' not in arrivals_predicted.columns:
-         arrivals_predicted['predicted_event_time_local'] = arrivals_predicted['predicted_event_time_utc'] + timedelta(hours=timezone_offset_hours)
+    predicted_time_local = pre_tactical_df['predicted_event_time_utc'] + timedelta(hours=timezone_offset_hours)
+    demand_cube = DemandCube.from_flights({'pre_tactical': (pre_tactical_df, predicted_time_local)}, dimensions=())
 
-    hourly_predicted_demand = arrivals_predicted.groupby(arrivals_predicted['predicted_event_time_local'].dt.floor('H')).size()
-    
-    # Tạo một DataFrame đầy đủ 24h để so sánh
-    first_hour = hourly_predicted_demand.index.min().floor('H')
-    last_hour = hourly_predicted_demand.index.max().floor('H')
-    full_day_hours = pd.date_range(start=first_hour, end=last_hour, freq='H')
-    demand_df = pd.DataFrame(index=full_day_hours)
-    demand_df['predicted_demand'] = hourly_predicted_demand.reindex(demand_df.index, fill_value=0)
+    # Nhu cầu hạ cánh theo giờ trên toàn bộ các ngày có dữ liệu để so sánh
+    demand_df = pd.DataFrame({'predicted_demand': demand_cube.series('arrival')})
     demand_df['capacity'] = landing_capacity
 
     # Xác định các giờ tắc nghẽn
@@ -543,21 +320,23 @@ def run_selective_gdp_simulation(pre_tactical_df, takeoff_capacity, landing_capa
             flights_to_regulate,
             takeoff_capacity,
             landing_capacity,
-            capacity_events
+            capacity_events,
+            progress=streamlit_progress
         )
     with st.spinner("Đang chạy mô phỏng GDP..."):
                 # Bước 1: Chạy GDP để có lịch trình lý tưởng
-                ideal_regulated_data = run_dual_pass_gdp_simulation(
+                ideal_regulated_data, _ = run_dual_pass_gdp_simulation(
                     st.session_state.pre_tactical_demand_data,
                     st.session_state.takeoff_capacity,
                     st.session_state.landing_capacity,
                     st.session_state.reduced_capacity_events,
-                    VVTS_CONFIG['airport_timezone_offset_hours']
+                    VVTS_CONFIG['airport_timezone_offset_hours'],
+                    progress=streamlit_progress
                 )
                 
                 # --- THÊM MỚI: Áp dụng dung sai tuân thủ ---
                 # Bước 2: Mô phỏng sự tuân thủ trong thực tế
-                st.session_state.regulated_flights_data = simulate_ctot_compliance(ideal_regulated_data)
+                st.session_state.regulated_flights_data = simulate_ctot_compliance(ideal_regulated_data, progress=streamlit_progress)
                 st.session_state.simulation_run = True
     # --- Bước 4: Kết hợp kết quả ---
     # Chuẩn bị dữ liệu cho các chuyến không bị điều tiết
@@ -586,6 +365,8 @@ if 'regulated_flights_data' not in st.session_state:
     st.session_state.regulated_flights_data = get_empty_display_dataframe_schema()
 if 'pre_tactical_demand_data' not in st.session_state:
     st.session_state.pre_tactical_demand_data = get_empty_display_dataframe_schema()
+if 'pre_tactical_demand_cube' not in st.session_state:
+    st.session_state.pre_tactical_demand_cube = None
 
 if 'initial_arrivals' not in st.session_state:
     st.session_state.initial_arrivals = pd.DataFrame()
@@ -597,8 +378,24 @@ if 'landing_capacity' not in st.session_state:
     st.session_state.landing_capacity = VVTS_CONFIG['landing_capacity_hourly']
 if 'reduced_capacity_events' not in st.session_state:
     st.session_state.reduced_capacity_events = []
+if 'capacity_forecast' not in st.session_state:
+    st.session_state.capacity_forecast = None
+if 'gdp_allocation' not in st.session_state:
+    st.session_state.gdp_allocation = None
+if 'gdp_ctot_changes' not in st.session_state:
+    st.session_state.gdp_ctot_changes = pd.DataFrame()
+if 'slot_compression_moves' not in st.session_state:
+    st.session_state.slot_compression_moves = None
+if 'gdp_assignment_comparison' not in st.session_state:
+    st.session_state.gdp_assignment_comparison = None
 if 'selected_date' not in st.session_state:
     st.session_state.selected_date = datetime.utcnow().date()
+if 'timing_recorder' not in st.session_state:
+    st.session_state.timing_recorder = TimingRecorder(log_path=os.environ.get(TIMING_LOG_ENV))
+
+# Mỗi lần Streamlit chạy lại script là một lần chạy của bộ đo thời gian (riêng cho từng phiên)
+timing_recorder = use_recorder(st.session_state.timing_recorder)
+timing_recorder.start_run()
 
 st.title("ATFM Simulation Dashboard - Sân bay Quốc tế Tân Sơn Nhất (VVTS)")
 
@@ -612,10 +409,12 @@ st.sidebar.markdown("---")
 
 # Tùy chọn ngày mô phỏng
 st.sidebar.subheader("Chọn Ngày Mô phỏng")
-temp_flights_df, temp_eets_df = load_data()
-if temp_flights_df is not None and not temp_flights_df.empty:
-    min_date_data = temp_flights_df['eobt_dt_local'].dt.date.min()
-    max_date_data = temp_flights_df['eobt_dt_local'].dt.date.max()
+with stage_timer('load_data'):
+    schedule_store, eets_df = load_schedule_store()
+if schedule_store is not None and schedule_store.dates:
+    # Khoảng ngày lấy từ chỉ mục của kho phân vùng, không cần tải lịch bay
+    min_date_data = schedule_store.dates[0]
+    max_date_data = schedule_store.dates[-1]
 
     default_date_picker = st.session_state.selected_date
     if not (min_date_data <= default_date_picker <= max_date_data):
@@ -628,8 +427,7 @@ if temp_flights_df is not None and not temp_flights_df.empty:
         max_value=max_date_data,
         key="simulation_date_picker"
     )
-    flights_df_for_selected_date = temp_flights_df[temp_flights_df['eobt_dt_local'].dt.date == st.session_state.selected_date].copy()
-    eets_df = temp_eets_df
+    # Lịch bay của ngày được đọc (load_flights_for_date) bên trong get_initial_schedules, chỉ khi đổi ngày
 else:
     st.error("Không thể tải dữ liệu chuyến bay hoặc dữ liệu trống. Vui lòng kiểm tra file CSV và chạy lại.")
     st.stop()
@@ -703,16 +501,42 @@ if st.session_state.reduced_capacity_events:
 else:
     st.sidebar.info("Chưa có sự kiện giảm năng lực nào được thêm.")
 
+# Dự báo năng lực theo thời gian (tùy chọn); trong khoảng chồng nhau, sự kiện giảm năng lực được ưu tiên
+capacity_forecast_file = st.sidebar.file_uploader(
+    "File dự báo năng lực (CSV):", type="csv", key="capacity_forecast_file",
+    help="Các cột: start_time_local (hoặc start_time_utc), tùy chọn end_time_local/end_time_utc, landing_capacity, "
+         "takeoff_capacity, total_capacity (lượt/giờ). Dòng không có thời điểm kết thúc kéo dài tới dòng kế tiếp."
+)
+if capacity_forecast_file is None:
+    st.session_state.capacity_forecast = None
+else:
+    capacity_forecast_file.seek(0)
+    capacity_forecast = pd.read_csv(capacity_forecast_file)
+    if {'start_time_local', 'start_time_utc'}.isdisjoint(capacity_forecast.columns):
+        st.sidebar.error("File dự báo năng lực cần cột 'start_time_local' hoặc 'start_time_utc'.")
+        st.session_state.capacity_forecast = None
+    else:
+        st.session_state.capacity_forecast = capacity_forecast
+        st.sidebar.success(f"Đã tải dự báo năng lực: {len(capacity_forecast)} dòng.")
+
 st.sidebar.markdown("---")
 
+# Xóa bộ nhớ đệm tính toán (ví dụ khi file dữ liệu thay đổi)
+if st.sidebar.button("Tính lại (xóa bộ nhớ đệm)", key="clear_caches_button"):
+    clear_computation_caches()
+    st.rerun()
+
 # Nút Reset Dashboard hoàn toàn
 if st.sidebar.button("Reset Dashboard (Bắt đầu lại)"):
     for key in st.session_state.keys():
         del st.session_state[key]
+    clear_computation_caches()
     st.rerun()
 
-# Tính lịch trình ban đầu cho ngày được chọn
-initial_arrivals_df, initial_departures_df = calculate_initial_schedules(flights_df_for_selected_date, eets_df)
+# Lịch trình ban đầu cho ngày được chọn (cache theo ngày)
+with stage_timer('initial schedules') as schedules_timing:
+    initial_arrivals_df, initial_departures_df, all_initial_traffic, initial_demand_cube = get_initial_schedules(st.session_state.selected_date, spill_over_hours_for(eets_df))
+    schedules_timing['rows'] = len(all_initial_traffic)
 st.session_state.initial_arrivals = initial_arrivals_df
 st.session_state.initial_departures = initial_departures_df
 
@@ -722,90 +546,23 @@ st.session_state.initial_departures = initial_departures_df
 # --- Định nghĩa các Tabs ---
 tab_demand_strategic, tab_pre_tactical, tab_gdp = st.tabs(["Demand & Strategic Data", "Pre-tactical Demand", "Tactical (GDP) Simulation Results"])
 
-with tab_demand_strategic: # Nội dung Tab 1
-    st.header(f"Air Traffic Demand on VVTS (Ngày {st.session_state.selected_date.strftime('%d/%m/%Y')})")
-
-    # Chuyển đổi thời gian về múi giờ địa phương để hiển thị trên biểu đồ
-    initial_arrivals_df['eldt_dt_local'] = initial_arrivals_df['eldt_dt_utc'] + timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
-    initial_departures_df['etot_dt_local'] = initial_departures_df['etot_dt_utc'] + timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
-
-    # --- Đảm bảo full_demand_df luôn có đủ 24 giờ của ngày được chọn ---
-    selected_date_full_hours = pd.date_range(
-        start=datetime.combine(st.session_state.selected_date, time(0,0,0)),
-        end=datetime.combine(st.session_state.selected_date, time(23,0,0)),
-        freq='H'
-    )
-    full_demand_df = pd.DataFrame(index=selected_date_full_hours)
-
-    # Tính nhu cầu cất và hạ cánh thực tế theo từng giờ cụ thể
-    hourly_arr_demand_series = initial_arrivals_df.groupby(initial_arrivals_df['eldt_dt_local'].dt.floor('H')).size().reindex(full_demand_df.index, fill_value=0)
-    hourly_dep_demand_series = initial_departures_df.groupby(initial_departures_df['etot_dt_local'].dt.floor('H')).size().reindex(full_demand_df.index, fill_value=0)
-
-    full_demand_df['arrival_demand'] = hourly_arr_demand_series
-    full_demand_df['departure_demand'] = hourly_dep_demand_series
-
-
-    # Lấy năng lực hạ cánh cơ bản
-    full_demand_df['base_landing_capacity'] = st.session_state.landing_capacity
-    full_demand_df['base_takeoff_capacity'] = st.session_state.takeoff_capacity
-
-    # Tính tổng năng lực để vẽ đường trên biểu đồ (Năng lực Hạ cánh thực tế + Năng lực Cất cánh)
-    full_demand_df['total_effective_capacity'] = full_demand_df['base_landing_capacity'] + full_demand_df['base_takeoff_capacity']
-
-    # Áp dụng các sự kiện giảm năng lực lên TỔNG năng lực
-    for event in st.session_state.reduced_capacity_events:
-        event_start_local = event['start_time_local']
-        event_end_local = event['end_time_local']
-        event_capacity = event['new_capacity']
-
-        mask = (full_demand_df.index >= event_start_local) & (full_demand_df.index < event_end_local)
-        full_demand_df.loc[mask, 'total_effective_capacity'] = full_demand_df.loc[mask, 'total_effective_capacity'].apply(lambda cap: min(cap, event_capacity))
+# Bảng nhu cầu / năng lực theo giờ và biểu đồ được cache theo (ngày, năng lực, sự kiện giảm năng lực, dự báo năng lực)
+full_demand_df, fig_initial_stacked_demand = get_initial_demand(
+    st.session_state.selected_date, spill_over_hours_for(eets_df), st.session_state.takeoff_capacity,
+    st.session_state.landing_capacity, capacity_events_key(st.session_state.reduced_capacity_events), st.session_state.capacity_forecast
+)
 
+# Mỗi tab là một fragment (tab_fragment): widget trong một tab chỉ chạy lại tab đó với dữ liệu đã cache truyền vào
+# từ lần chạy toàn bộ gần nhất. Thao tác làm thay đổi dữ liệu dùng chung (sinh Pre-tactical, chạy GDP, nén slot)
+# gọi st.rerun() để chạy lại toàn bộ ứng dụng.
 
-    # Xác định các điểm quá tải cho luồng hạ cánh (dựa trên nhu cầu hạ cánh so với năng lực hạ cánh)
-    full_demand_df['effective_landing_capacity_for_gdp'] = st.session_state.landing_capacity # Dùng riêng cho điều kiện GDP
-    full_demand_df['is_landing_overload'] = full_demand_df['arrival_demand'] > full_demand_df['effective_landing_capacity_for_gdp']
-
+@tab_fragment('render: tab Demand & Strategic')
+def render_demand_strategic_tab(full_demand_df, fig_initial_stacked_demand, all_initial_traffic): # Nội dung Tab 1
+    st.header(f"Air Traffic Demand on VVTS (Ngày {st.session_state.selected_date.strftime('%d/%m/%Y')})")
 
     # --- Biểu đồ cột chồng Nhu cầu Ban đầu (Chart 1 - cố định) ---
     st.subheader("Airport Initial Demand")
-    fig_initial_stacked_demand = go.Figure()
-
-    # Cột cất cánh (màu xanh dương) - Đặt dưới cùng
-    fig_initial_stacked_demand.add_trace(go.Bar(
-        x=full_demand_df.index,
-        y=full_demand_df['departure_demand'],
-        name='Nhu cầu Cất cánh',
-        marker_color='blue'
-    ))
-
-    # Cột hạ cánh (màu cam) - Chồng lên trên cột cất cánh
-    fig_initial_stacked_demand.add_trace(go.Bar(
-        x=full_demand_df.index,
-        y=full_demand_df['arrival_demand'],
-        name='Nhu cầu Hạ cánh',
-        marker_color='orange'
-    ))
-
-    # Đường năng lực tổng cộng (màu đỏ)
-    fig_initial_stacked_demand.add_trace(go.Scatter(
-        x=full_demand_df.index,
-        y=full_demand_df['total_effective_capacity'],
-        mode='lines',
-        name='Capacity',
-        line=dict(color='red', dash='dash', width=3)
-    ))
-
-    fig_initial_stacked_demand.update_layout(
-        barmode='stack', # Chế độ cột chồng
-        title='Nhu cầu Hoạt động Ban đầu (Đến và Đi) so với Năng lực Sân bay',
-        xaxis_title=f'Thời gian (Giờ địa phương - UTC+{VVTS_CONFIG["airport_timezone_offset_hours"]})',
-        yaxis_title='Số lượt cất/hạ cánh',
-        plot_bgcolor='rgba(0,0,0,0)',
-        hovermode="x unified",
-        xaxis_tickformat="%H:%M<br>%d/%m"
-    )
-    st.plotly_chart(fig_initial_stacked_demand, use_container_width=True)
+    show_chart('initial demand chart', fig_initial_stacked_demand)
 
     # Hiển thị cảnh báo quá tải cho luồng hạ cánh
     if full_demand_df['is_landing_overload'].any():
@@ -833,13 +590,7 @@ with tab_demand_strategic: # Nội dung Tab 1
     time_options.insert(0, "Toàn bộ ngày")
     selected_time_frame = st.selectbox("Chọn khung giờ để hiển thị:", time_options, key="strategic_time_frame")
 
-    # Lọc dữ liệu chuyến bay ban đầu cho mục Strategic Data
-    all_initial_traffic = pd.concat([
-        initial_arrivals_df.assign(event_time_local=initial_arrivals_df['eldt_dt_local'], movement_type_display='Arrival'),
-        initial_departures_df.assign(event_time_local=initial_departures_df['etot_dt_local'], movement_type_display='Departure')
-    ])
-    all_initial_traffic = all_initial_traffic.sort_values(by='event_time_local').reset_index(drop=True)
-
+    # Dữ liệu chuyến bay ban đầu cho mục Strategic Data: all_initial_traffic (get_initial_schedules, đã sắp theo thời gian)
 
     if selected_time_frame == "Toàn bộ ngày":
         strategic_flights_to_display = all_initial_traffic
@@ -901,60 +652,80 @@ with tab_demand_strategic: # Nội dung Tab 1
     else:
         st.info("Không có dữ liệu chuyến bay cho ngày đã chọn trong khung giờ này.")
 
-with tab_pre_tactical: # Nội dung Tab 2
+with tab_demand_strategic:
+    render_demand_strategic_tab(full_demand_df, fig_initial_stacked_demand, all_initial_traffic)
+
+@tab_fragment('render: tab Pre-tactical')
+def render_pre_tactical_tab(initial_arrivals_df, initial_departures_df, initial_demand_cube, full_demand_df): # Nội dung Tab 2
     st.header(f"Pre-tactical Demand Data Analysis (Ngày {st.session_state.selected_date.strftime('%d/%m/%Y')})")
 
+    # Seed cho bộ sinh ngẫu nhiên: cùng ngày + cùng seed + cùng thông số cho cùng một kết quả
+    pt_seed = st.number_input("Seed mô phỏng:", min_value=0, max_value=2**31 - 1, value=42, step=1, key="pt_seed")
+
     # Nút để tạo dữ liệu Pre-tactical (dữ liệu này sẽ được lưu vào session_state)
     if st.button("Tạo Dữ liệu Dự đoán Tiền Chiến thuật (Pre-tactical)", key="generate_pt_data_button"):
-        # Initial traffic for pre-tactical generation should come from initial_arrivals_df and initial_departures_df
-        # Combine initial arrivals and departures into one DataFrame, ensuring all original columns are carried
-        all_initial_traffic_for_pt = pd.concat([
-            initial_arrivals_df.assign(event_time_utc=initial_arrivals_df['eldt_dt_utc'], original_event_time_utc=initial_arrivals_df['eldt_dt_utc'], flight_type='arrival'),
-            initial_departures_df.assign(event_time_utc=initial_departures_df['etot_dt_utc'], original_event_time_utc=initial_departures_df['etot_dt_utc'], flight_type='departure')
-        ])
-
-        # Reindex to ensure all columns from the common initial schema are present
-        common_cols_pt = list(set(initial_arrivals_df.columns.tolist() + initial_departures_df.columns.tolist()))
-        # Reindex with the union of original columns plus the new assigned columns
-        all_initial_traffic_for_pt = all_initial_traffic_for_pt.reindex(columns=list(set(common_cols_pt + ['event_time_utc', 'original_event_time_utc', 'flight_type'])))
-
-        # Fill potential NaN after reindex with appropriate defaults before passing to function
-        for col in all_initial_traffic_for_pt.columns:
-            if 'dt' in str(all_initial_traffic_for_pt[col].dtype) or 'time' in str(all_initial_traffic_for_pt[col].dtype):
-                all_initial_traffic_for_pt[col].fillna(pd.NaT, inplace=True)
-            elif 'delta' in str(all_initial_traffic_for_pt[col].dtype):
-                all_initial_traffic_for_pt[col].fillna(pd.NaT, inplace=True)
-            elif 'float' in str(all_initial_traffic_for_pt[col].dtype):
-                all_initial_traffic_for_pt[col].fillna(0.0, inplace=True)
-            elif 'bool' in str(all_initial_traffic_for_pt[col].dtype):
-                all_initial_traffic_for_pt[col].fillna(False, inplace=True)
-            else:
-                all_initial_traffic_for_pt[col].fillna('', inplace=True)
+        all_initial_traffic_for_pt = build_initial_traffic_for_pre_tactical(initial_arrivals_df, initial_departures_df)
+        st.session_state.pre_tactical_demand_data = get_pre_tactical_demand_data(
+            all_initial_traffic_for_pt,
+            st.session_state.selected_date,
+            int(pt_seed),
+            tuple(sorted(PRE_TACTICAL_PARAMS.items()))
+        )
+        st.session_state.pre_tactical_demand_cube = DemandCube.from_flights(
+            {'pre_tactical': (st.session_state.pre_tactical_demand_data, 'predicted_event_time_local')}
+        )
+        # Tab GDP dùng dữ liệu này: chạy lại toàn bộ ứng dụng thay vì chỉ fragment của tab
+        st.rerun()
+
+    # --- Dự báo Ensemble (Monte Carlo): N realisation có seed thay vì một lần rút mẫu ---
+    st.subheader("Dự báo Ensemble (Monte Carlo)")
+    col_n_ens, col_workers_ens = st.columns(2)
+    n_realisations = col_n_ens.number_input("Số realisation:", min_value=10, max_value=5000, value=500, step=10, key="pt_ensemble_size")
+    ensemble_workers = col_workers_ens.number_input("Số tiến trình song song:", min_value=1, max_value=os.cpu_count() or 1, value=os.cpu_count() or 1, key="pt_ensemble_workers")
+
+    # Kết quả ensemble chỉ dùng được khi ngày, seed, số realisation, thông số và năng lực theo giờ trùng với lúc chạy
+    ensemble_capacities = tuple(tuple(full_demand_df[column].tolist()) for column in ('effective_landing_capacity_for_gdp', 'effective_takeoff_capacity', 'total_effective_capacity'))
+    ensemble_key = (st.session_state.selected_date, int(pt_seed), int(n_realisations), tuple(sorted(PRE_TACTICAL_PARAMS.items())), ensemble_capacities)
+
+    if st.button("Chạy Dự báo Ensemble", key="run_pt_ensemble_button"):
+        with st.spinner(f"Đang chạy {n_realisations} realisation trên {ensemble_workers} tiến trình..."):
+            st.session_state.pt_ensemble = run_pre_tactical_ensemble(
+                build_initial_traffic_for_pre_tactical(initial_arrivals_df, initial_departures_df),
+                st.session_state.selected_date,
+                full_demand_df['effective_landing_capacity_for_gdp'].to_numpy(),
+                full_demand_df['effective_takeoff_capacity'].to_numpy(),
+                n_realisations=int(n_realisations),
+                base_seed=int(pt_seed),
+                params=PRE_TACTICAL_PARAMS,
+                timezone_offset_hours=VVTS_CONFIG['airport_timezone_offset_hours'],
+                max_workers=int(ensemble_workers),
+                total_capacity=full_demand_df['total_effective_capacity'].to_numpy()
+            )
+            st.session_state.pt_ensemble_key = ensemble_key
 
-        st.session_state.pre_tactical_demand_data = generate_pre_tactical_demand_data(all_initial_traffic_for_pt)
-        st.success("Đã tạo dữ liệu dự đoán tiền chiến thuật.")
+    # Đổi một trong các thông số trên thì bỏ kết quả ensemble cũ
+    if st.session_state.get('pt_ensemble_key') != ensemble_key:
+        st.session_state.pt_ensemble = None
+    pt_ensemble = st.session_state.get('pt_ensemble')
+    st.markdown("---")
 
     # --- SỬA LỖI: TOÀN BỘ LOGIC HIỂN THỊ ĐƯỢC ĐƯA VÀO ĐÂY ---
-    # Chỉ hiển thị biểu đồ và các tùy chọn nếu dữ liệu Pre-tactical đã được tạo
-    if not st.session_state.pre_tactical_demand_data.empty:
+    # Chỉ hiển thị biểu đồ và các tùy chọn nếu dữ liệu Pre-tactical (một lần rút mẫu hoặc ensemble) đã được tạo
+    if not st.session_state.pre_tactical_demand_data.empty or pt_ensemble is not None:
         col_forecast, col_period_pt, col_movement_pt = st.columns(3)
 
         chart_forecast_type = col_forecast.selectbox("Loại Dự báo:", ["Initial FPL Demand", "Pre-tactical Predicted Demand"], key="pt_forecast_type")
         chart_period_pt = col_period_pt.selectbox("Phạm vi thời gian:", ["1 Hour", "2 Hours", "3 Hours", "6 Hours", "Full Day"], index=4, key="pt_period")
         chart_movement_type_pt = col_movement_pt.selectbox("Loại lưu lượng:", ["Arrival", "Departure", "Total"], index=2, key="pt_movement")
 
-        # Lọc dữ liệu cho biểu đồ Pre-Tactical
-        df_for_chart_pt = None
-        demand_col = None
+        # Khối nhu cầu và kịch bản cho biểu đồ Pre-Tactical
         if chart_forecast_type == "Initial FPL Demand":
-            df_for_chart_pt = pd.concat([
-                initial_arrivals_df.assign(chart_event_time_local=initial_arrivals_df['eldt_dt_local'], flight_type='arrival'),
-                initial_departures_df.assign(chart_event_time_local=initial_departures_df['etot_dt_local'], flight_type='departure')
-            ]).sort_values(by='chart_event_time_local')
-            demand_col = 'chart_event_time_local'
+            demand_cube_pt, scenario_pt = initial_demand_cube, 'initial'
         else: # Pre-tactical Predicted Demand
-            df_for_chart_pt = st.session_state.pre_tactical_demand_data.copy()
-            demand_col = 'predicted_event_time_local'
+            demand_cube_pt, scenario_pt = st.session_state.pre_tactical_demand_cube, 'pre_tactical'
+        # Đã có ensemble thì nhu cầu dự đoán vẽ bằng dải P10/P50/P90 thay cho một lần rút mẫu
+        use_ensemble_pt = chart_forecast_type == "Pre-tactical Predicted Demand" and pt_ensemble is not None
+        ensemble_flow_pt = chart_movement_type_pt.lower()
 
         # Tính toán nhu cầu dựa trên lựa chọn Movement Type
         hourly_demand_pt = None
@@ -963,27 +734,30 @@ with tab_pre_tactical: # Nội dung Tab 2
         chart_capacity_value_pt = None
         chart_capacity_name_pt = ""
 
-        if demand_col in df_for_chart_pt.columns and not df_for_chart_pt[demand_col].isnull().all():
+        if use_ensemble_pt or (demand_cube_pt is not None and demand_cube_pt.counts.any()):
             if chart_movement_type_pt == "Arrival":
-                hourly_demand_pt = df_for_chart_pt[df_for_chart_pt['flight_type'] == 'arrival'].groupby(df_for_chart_pt[demand_col].dt.floor('H')).size()
+                flow_pt = 'arrival'
                 chart_yaxis_title_pt = "Số lượt hạ cánh"
                 chart_marker_color_pt = 'orange'
-                chart_capacity_value_pt = full_demand_df['base_landing_capacity']
+                chart_capacity_value_pt = full_demand_df['effective_landing_capacity_for_gdp']
                 chart_capacity_name_pt = "Năng lực Hạ cánh"
             elif chart_movement_type_pt == "Departure":
-                hourly_demand_pt = df_for_chart_pt[df_for_chart_pt['flight_type'] == 'departure'].groupby(df_for_chart_pt[demand_col].dt.floor('H')).size()
+                flow_pt = 'departure'
                 chart_yaxis_title_pt = "Số lượt cất cánh"
                 chart_marker_color_pt = 'blue'
-                chart_capacity_value_pt = full_demand_df['base_takeoff_capacity']
+                chart_capacity_value_pt = full_demand_df['effective_takeoff_capacity']
                 chart_capacity_name_pt = "Năng lực Cất cánh"
             else: # Total
-                hourly_demand_pt = df_for_chart_pt.groupby(df_for_chart_pt[demand_col].dt.floor('H')).size()
+                flow_pt = None
                 chart_yaxis_title_pt = "Số lượt cất/hạ cánh"
                 chart_marker_color_pt = 'cornflowerblue'
                 chart_capacity_value_pt = full_demand_df['total_effective_capacity']
                 chart_capacity_name_pt = "Năng lực Tổng cộng"
 
-            hourly_demand_pt = hourly_demand_pt.reindex(full_demand_df.index, fill_value=0)
+            if use_ensemble_pt:
+                hourly_demand_pt = pt_ensemble[f'{ensemble_flow_pt}_p50'].set_axis(full_demand_df.index)
+            else:
+                hourly_demand_pt = demand_cube_pt.series(flow_pt, scenario_pt, start_date=st.session_state.selected_date, days=1).set_axis(full_demand_df.index)
         else:
             st.warning(f"Không có dữ liệu hợp lệ cho '{chart_movement_type_pt}' trong loại dự báo '{chart_forecast_type}'. Vui lòng tạo dữ liệu tiền chiến thuật hoặc kiểm tra lại dữ liệu gốc.")
             hourly_demand_pt = pd.Series(0, index=full_demand_df.index)
@@ -1023,12 +797,26 @@ with tab_pre_tactical: # Nội dung Tab 2
         # Vẽ Biểu đồ Pre-Tactical Demand
         fig_pre_tactical_demand = go.Figure()
 
-        fig_pre_tactical_demand.add_trace(go.Bar(
-            x=hourly_demand_pt_filtered.index,
-            y=hourly_demand_pt_filtered.values,
-            name=chart_movement_type_pt + " Demand",
-            marker_color=chart_marker_color_pt
-        ))
+        if use_ensemble_pt:
+            ensemble_filtered = pt_ensemble.set_axis(full_demand_df.index).loc[filtered_demand_index]
+            fig_pre_tactical_demand.add_trace(go.Scatter(x=filtered_demand_index, y=ensemble_filtered[f'{ensemble_flow_pt}_p90'], mode='lines', line=dict(width=0), name='P90', showlegend=False))
+            fig_pre_tactical_demand.add_trace(go.Scatter(x=filtered_demand_index, y=ensemble_filtered[f'{ensemble_flow_pt}_p10'], mode='lines', line=dict(width=0), fill='tonexty', fillcolor='rgba(100, 149, 237, 0.3)', name='P10 - P90'))
+            fig_pre_tactical_demand.add_trace(go.Scatter(
+                x=hourly_demand_pt_filtered.index,
+                y=hourly_demand_pt_filtered.values,
+                mode='lines+markers',
+                name=chart_movement_type_pt + " Demand (P50)",
+                line=dict(color=chart_marker_color_pt, width=3)
+            ))
+            chart_forecast_label_pt = f"Ensemble {pt_ensemble.attrs.get('n_realisations', '')} realisation (P10/P50/P90)"
+        else:
+            fig_pre_tactical_demand.add_trace(go.Bar(
+                x=hourly_demand_pt_filtered.index,
+                y=hourly_demand_pt_filtered.values,
+                name=chart_movement_type_pt + " Demand",
+                marker_color=chart_marker_color_pt
+            ))
+            chart_forecast_label_pt = chart_forecast_type
 
         fig_pre_tactical_demand.add_trace(go.Scatter(
             x=chart_capacity_value_pt_filtered.index,
@@ -1039,7 +827,7 @@ with tab_pre_tactical: # Nội dung Tab 2
         ))
 
         fig_pre_tactical_demand.update_layout(
-            title=f'Pre-tactical Demand Forecast: {chart_forecast_type} - {chart_movement_type_pt} Demand',
+            title=f'Pre-tactical Demand Forecast: {chart_forecast_label_pt} - {chart_movement_type_pt} Demand',
             xaxis_title=f'Thời gian (Giờ địa phương - UTC+{VVTS_CONFIG["airport_timezone_offset_hours"]})',
             yaxis_title='Số lượt cất/hạ cánh',
             plot_bgcolor='rgba(0,0,0,0)',
@@ -1047,41 +835,220 @@ with tab_pre_tactical: # Nội dung Tab 2
             xaxis_tickformat="%H:%M<br>%d/%m",
             xaxis_range=[chart_start_time, chart_end_time]
         )
-        st.plotly_chart(fig_pre_tactical_demand, use_container_width=True)
+        show_chart('pre-tactical demand chart', fig_pre_tactical_demand)
+
+        if pt_ensemble is not None:
+            fig_overload_prob = go.Figure()
+            fig_overload_prob.add_trace(go.Bar(x=pt_ensemble.index, y=pt_ensemble[f'prob_{ensemble_flow_pt}_overload'] * 100, marker_color='indianred', name='Xác suất quá tải'))
+            fig_overload_prob.update_layout(
+                title=f'Xác suất nhu cầu {chart_movement_type_pt} vượt năng lực theo giờ (Ensemble)',
+                yaxis_title='Xác suất (%)',
+                yaxis_range=[0, 100],
+                plot_bgcolor='rgba(0,0,0,0)',
+                xaxis_tickformat="%H:%M"
+            )
+            show_chart('overload probability chart', fig_overload_prob)
+
 
-with tab_gdp: # Nội dung Tab 3
+with tab_pre_tactical:
+    render_pre_tactical_tab(initial_arrivals_df, initial_departures_df, initial_demand_cube, full_demand_df)
+
+@tab_fragment('render: tab GDP')
+def render_gdp_tab(): # Nội dung Tab 3
     st.header(f"Tactical (GDP Simulation Results) (Ngày {st.session_state.selected_date.strftime('%d/%m/%Y')})")
+    assignment_mode_labels = {'greedy': 'Tham lam (theo thứ tự thời gian dự kiến)', 'optimal': 'Tối ưu (tổng trễ có trọng số nhỏ nhất)'}
+    assignment_mode = st.radio(
+        "Chế độ phân bổ slot:", options=list(ASSIGNMENT_MODES), format_func=assignment_mode_labels.get,
+        horizontal=True, key="gdp_assignment_mode"
+    )
+    rolling_detection = st.checkbox(
+        f"Phát hiện tắc nghẽn theo cửa sổ trượt 60 phút (kiểm tra mỗi {ROLLING_STEP_MINUTES} phút)",
+        help="Bắt được các đợt cao điểm vắt qua ranh giới giờ mà cách đếm theo giờ cố định bỏ sót.", key="gdp_rolling_detection"
+    )
+    rolling_step_minutes = ROLLING_STEP_MINUTES if rolling_detection else None
+    capacity_profile = get_capacity_profile(
+        st.session_state.takeoff_capacity, st.session_state.landing_capacity,
+        capacity_events_key(st.session_state.reduced_capacity_events), st.session_state.capacity_forecast
+    )
     # Nút để kích hoạt chạy GDP
     if st.button("Mô phỏng Ground Delay Programme", key="apply_gdp_button_main"):
             if st.session_state.pre_tactical_demand_data.empty:
                 st.error("Vui lòng tạo 'Dữ liệu Dự đoán Tiền Chiến thuật' ở Tab 2 trước khi chạy GDP.")
             else:
                 with st.spinner("Đang chạy mô phỏng..."):
-                    # BƯỚC 1: Chạy GDP để có lịch trình lý tưởng
-                    ideal_regulated_data = run_dual_pass_gdp_simulation(
+                    # BƯỚC 1: Chạy GDP để có lịch trình lý tưởng (chỉ phân bổ lại từ giờ bị ảnh hưởng nếu đã chạy trước đó)
+                    ideal_regulated_data, st.session_state.gdp_allocation = run_dual_pass_gdp_simulation(
                         st.session_state.pre_tactical_demand_data,
                         st.session_state.takeoff_capacity,
                         st.session_state.landing_capacity,
-                        st.session_state.reduced_capacity_events,
-                        VVTS_CONFIG['airport_timezone_offset_hours']
+                        capacity_profile,
+                        VVTS_CONFIG['airport_timezone_offset_hours'],
+                        previous_allocation=st.session_state.gdp_allocation,
+                        assignment_mode=assignment_mode,
+                        rolling_step_minutes=rolling_step_minutes,
+                        progress=streamlit_progress
                     )
+                    # Chế độ tối ưu: chạy thêm phân bổ tham lam (ẩn thông báo tiến trình) để so sánh độ trễ
+                    st.session_state.gdp_assignment_comparison = None
+                    if assignment_mode == 'optimal':
+                        progress_placeholder = st.empty()
+                        with progress_placeholder.container():
+                            greedy_regulated_data, _ = run_dual_pass_gdp_simulation(
+                                st.session_state.pre_tactical_demand_data,
+                                st.session_state.takeoff_capacity,
+                                st.session_state.landing_capacity,
+                                capacity_profile,
+                                VVTS_CONFIG['airport_timezone_offset_hours'],
+                                rolling_step_minutes=rolling_step_minutes,
+                                progress=streamlit_progress
+                            )
+                        progress_placeholder.empty()
+                        weights = st.session_state.gdp_allocation['weights']
+                        st.session_state.gdp_assignment_comparison = {
+                            'greedy': assignment_delay_summary(greedy_regulated_data.reindex(st.session_state.pre_tactical_demand_data.index), weights),
+                            'optimal': assignment_delay_summary(ideal_regulated_data.reindex(st.session_state.pre_tactical_demand_data.index), weights),
+                        }
+                    st.session_state.gdp_ctot_changes = ideal_regulated_data.loc[
+                        st.session_state.gdp_allocation['changed_index'],
+                        ['callsign', 'flight_type', 'original_scheduled_time_local', 'new_scheduled_time_local', 'ctot_new_local', 'atfm_delay_minutes']
+                    ].assign(previous_scheduled_time_local=st.session_state.regulated_flights_data['new_scheduled_time_local'].reindex(st.session_state.gdp_allocation['changed_index']).fillna('').to_numpy())
                     
                     # BƯỚC 2: Mô phỏng sự tuân thủ trong thực tế với dung sai
                     # Kết quả cuối cùng có cột 'actual_time_utc' sẽ được lưu lại vào session_state
-                    st.session_state.regulated_flights_data = simulate_ctot_compliance(ideal_regulated_data)
+                    st.session_state.regulated_flights_data = simulate_ctot_compliance(ideal_regulated_data, progress=streamlit_progress)
+                    st.session_state.slot_compression_moves = None
                     
                 st.session_state.simulation_run = True
                 # Rất quan trọng: Chạy lại ứng dụng để tải lại giao diện với dữ liệu mới nhất
                 st.rerun()
                 # st.rerun() # Thêm lệnh này để tự động cập nhật giao diện sau khi chạy xong
 
+    # --- Quét what-if năng lực: độ trễ theo năng lực hạ cánh x cất cánh (x sự kiện), chạy song song ---
+    with st.expander("Quét năng lực (what-if): độ trễ theo năng lực hạ cánh / cất cánh"):
+        if st.session_state.pre_tactical_demand_data.empty:
+            st.info("Tạo 'Dữ liệu Dự đoán Tiền Chiến thuật' ở Tab 2 để chạy quét năng lực.")
+        else:
+            col_sweep_landing, col_sweep_takeoff = st.columns(2)
+            sweep_landing_range = col_sweep_landing.slider("Năng lực hạ cánh (lượt/giờ):", min_value=1, max_value=100, value=(16, 40), key="sweep_landing_range")
+            sweep_takeoff_range = col_sweep_takeoff.slider("Năng lực cất cánh (lượt/giờ):", min_value=1, max_value=100, value=(16, 40), key="sweep_takeoff_range")
+            col_sweep_step, col_sweep_workers = st.columns(2)
+            sweep_step = col_sweep_step.number_input("Bước năng lực:", min_value=1, max_value=20, value=2, key="sweep_step")
+            sweep_workers = col_sweep_workers.number_input("Số tiến trình song song:", min_value=1, max_value=os.cpu_count() or 1, value=os.cpu_count() or 1, key="sweep_workers")
+            sweep_with_events = st.checkbox(
+                "Thêm bộ kịch bản có các sự kiện giảm năng lực đang cấu hình",
+                value=bool(st.session_state.reduced_capacity_events), disabled=not st.session_state.reduced_capacity_events, key="sweep_with_events"
+            )
+
+            if st.button("Chạy quét năng lực", key="run_capacity_sweep_button"):
+                sweep_event_sets = {NO_EVENTS: []}
+                if sweep_with_events and st.session_state.reduced_capacity_events:
+                    sweep_event_sets["Có sự kiện giảm năng lực"] = st.session_state.reduced_capacity_events
+                sweep_landing_values = list(range(sweep_landing_range[0], sweep_landing_range[1] + 1, int(sweep_step)))
+                sweep_takeoff_values = list(range(sweep_takeoff_range[0], sweep_takeoff_range[1] + 1, int(sweep_step)))
+                n_combinations = len(sweep_landing_values) * len(sweep_takeoff_values) * len(sweep_event_sets)
+                with st.spinner(f"Đang chạy {n_combinations} tổ hợp năng lực trên {sweep_workers} tiến trình..."):
+                    st.session_state.capacity_sweep = run_capacity_sweep(
+                        st.session_state.pre_tactical_demand_data,
+                        sweep_landing_values,
+                        sweep_takeoff_values,
+                        sweep_event_sets,
+                        assignment_mode=assignment_mode,
+                        max_workers=int(sweep_workers),
+                        rolling_step_minutes=rolling_step_minutes
+                    )
+                    st.session_state.capacity_sweep.attrs['selected_date'] = st.session_state.selected_date
+
+            capacity_sweep = st.session_state.get('capacity_sweep')
+            if capacity_sweep is not None and not capacity_sweep.empty and capacity_sweep.attrs.get('selected_date') == st.session_state.selected_date:
+                sweep_metric_labels = {
+                    'Tổng trễ ATFM (phút)': 'total_delay_minutes',
+                    'Trễ trung bình (phút/chuyến)': 'average_delay_minutes',
+                    'Trễ lớn nhất (phút)': 'max_delay_minutes',
+                    'Số chuyến bị điều tiết': 'regulated_flights',
+                }
+                col_sweep_metric, col_sweep_events = st.columns(2)
+                sweep_metric_label = col_sweep_metric.selectbox("Chỉ số:", list(sweep_metric_labels.keys()), key="sweep_metric")
+                sweep_event_set = col_sweep_events.selectbox("Bộ sự kiện:", capacity_sweep['event_set'].unique().tolist(), key="sweep_event_set")
+                surface = sweep_surface(capacity_sweep, sweep_metric_labels[sweep_metric_label], sweep_event_set)
+
+                fig_sweep_heatmap = go.Figure(go.Heatmap(
+                    z=surface.to_numpy(), x=surface.columns, y=surface.index, colorscale='YlOrRd',
+                    colorbar=dict(title=sweep_metric_label), hovertemplate='Cất cánh: %{x}<br>Hạ cánh: %{y}<br>%{z:,.1f}<extra></extra>'
+                ))
+                fig_sweep_heatmap.update_layout(
+                    title=f"{sweep_metric_label} theo năng lực ({sweep_event_set})",
+                    xaxis_title='Năng lực cất cánh (lượt/giờ)',
+                    yaxis_title='Năng lực hạ cánh (lượt/giờ)',
+                    plot_bgcolor='rgba(0,0,0,0)'
+                )
+                show_chart('sweep heatmap', fig_sweep_heatmap)
+
+                # Đường cong: chỉ số theo năng lực hạ cánh (mỗi đường một năng lực cất cánh) và ngược lại
+                col_curve_landing, col_curve_takeoff = st.columns(2)
+                fig_curve_landing = go.Figure()
+                for takeoff_value in surface.columns:
+                    fig_curve_landing.add_trace(go.Scatter(x=surface.index, y=surface[takeoff_value], mode='lines+markers', name=f'Cất cánh {takeoff_value}'))
+                fig_curve_landing.update_layout(title=f"{sweep_metric_label} theo năng lực hạ cánh", xaxis_title='Năng lực hạ cánh (lượt/giờ)',
+                                                yaxis_title=sweep_metric_label, plot_bgcolor='rgba(0,0,0,0)', hovermode="x unified")
+                show_chart('sweep landing curve', fig_curve_landing, col_curve_landing)
+                fig_curve_takeoff = go.Figure()
+                for landing_value in surface.index:
+                    fig_curve_takeoff.add_trace(go.Scatter(x=surface.columns, y=surface.loc[landing_value], mode='lines+markers', name=f'Hạ cánh {landing_value}'))
+                fig_curve_takeoff.update_layout(title=f"{sweep_metric_label} theo năng lực cất cánh", xaxis_title='Năng lực cất cánh (lượt/giờ)',
+                                                yaxis_title=sweep_metric_label, plot_bgcolor='rgba(0,0,0,0)', hovermode="x unified")
+                show_chart('sweep takeoff curve', fig_curve_takeoff, col_curve_takeoff)
+
     # --- PHẦN HIỂN THỊ KẾT QUẢ VÀ BIỂU ĐỒ GIỮ NGUYÊN NHƯ PHIÊN BẢN TRƯỚC ---
     if st.session_state.simulation_run and not st.session_state.regulated_flights_data.empty:
         df_regulated_full = st.session_state.regulated_flights_data.copy()
+
+        # Báo cáo lần tính lại gần nhất: tăng dần hay toàn bộ, và các chuyến có CTOT thay đổi
+        gdp_allocation = st.session_state.gdp_allocation
+        if gdp_allocation is not None and gdp_allocation['is_incremental']:
+            if gdp_allocation['recompute_from_utc'] is None:
+                st.caption("Tính lại tăng dần: năng lực không thay đổi so với lần chạy trước.")
+            else:
+                recompute_from_local = gdp_allocation['recompute_from_utc'] + timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
+                st.caption(f"Tính lại tăng dần từ {recompute_from_local.strftime('%H:%M %d/%m')} (giờ địa phương); các slot trước đó được giữ nguyên.")
+            with st.expander(f"Chuyến bay thay đổi CTOT so với lần chạy trước ({len(st.session_state.gdp_ctot_changes)})"):
+                st.dataframe(st.session_state.gdp_ctot_changes, use_container_width=True)
+
+        # So sánh phân bổ tối ưu với phân bổ tham lam
+        comparison = st.session_state.gdp_assignment_comparison
+        if comparison is not None:
+            greedy_summary, optimal_summary = comparison['greedy'], comparison['optimal']
+            weighted_saved = greedy_summary['weighted_delay_minutes'] - optimal_summary['weighted_delay_minutes']
+            weighted_saved_pct = 100 * weighted_saved / greedy_summary['weighted_delay_minutes'] if greedy_summary['weighted_delay_minutes'] > 0 else 0.0
+            col_w, col_t, col_m = st.columns(3)
+            col_w.metric("Trễ có trọng số (tối ưu)", f"{optimal_summary['weighted_delay_minutes']:,.0f}", delta=f"-{weighted_saved:,.0f} ({weighted_saved_pct:.1f}%) so với tham lam", delta_color="inverse")
+            col_t.metric("Tổng trễ (tối ưu / tham lam)", f"{optimal_summary['total_delay_minutes']:,.0f} / {greedy_summary['total_delay_minutes']:,.0f} phút")
+            col_m.metric("Trễ lớn nhất (tối ưu / tham lam)", f"{optimal_summary['max_delay_minutes']:,.0f} / {greedy_summary['max_delay_minutes']:,.0f} phút")
+
+        # Nén slot: chuyến hủy / không tuân thủ trả lại slot, các chuyến phía sau được đẩy lên
+        with st.expander("Nén slot (chuyến hủy hoặc không tuân thủ CTOT)"):
+            cancelled_callsigns = st.multiselect(
+                "Chuyến bay hủy:", options=sorted(df_regulated_full['callsign'].dropna().unique()), key="compression_cancelled"
+            )
+            include_non_compliant = st.checkbox(
+                "Xếp lại các chuyến không tuân thủ CTOT (trả slot, nhận slot trống đầu tiên từ thời điểm thực tế)",
+                key="compression_non_compliant"
+            )
+            if st.button("Nén slot", key="compress_slots_button"):
+                compressed_df, moves_df = apply_slot_compression(
+                    df_regulated_full, cancelled_callsigns, include_non_compliant, VVTS_CONFIG['airport_timezone_offset_hours']
+                )
+                st.session_state.regulated_flights_data = compressed_df
+                st.session_state.slot_compression_moves = moves_df
+                st.rerun()
+            moves_df = st.session_state.slot_compression_moves
+            if moves_df is not None:
+                saved = moves_df.loc[~moves_df['non_compliant'], 'delay_saved_minutes'].sum()
+                st.caption(f"Lần nén gần nhất: {len(moves_df)} chuyến đổi slot, tổng trễ giảm {saved:.1f} phút.")
+                st.dataframe(moves_df, use_container_width=True)
         
         # --- BƯỚC 1: TÍNH TOÁN DỮ LIỆU GOM NHÓM (RESAMPLE) ---
         # Widget chọn độ phân giải thời gian
-        agg_period_options = {'1 giờ': 'H', '30 phút': '30T', '15 phút': '15T'}
+        agg_period_options = {'1 giờ': 60, '30 phút': 30, '15 phút': 15}
         selected_agg_label = st.radio(
             "Chọn độ phân giải thời gian hiển thị:",
             options=list(agg_period_options.keys()),
@@ -1089,74 +1056,31 @@ with tab_gdp: # Nội dung Tab 3
             index=0,
             key="agg_period_selector"
         )
-        pandas_freq = agg_period_options[selected_agg_label]
+        freq_minutes = agg_period_options[selected_agg_label]
         
-        # Tạo một DataFrame rỗng với đầy đủ các mốc thời gian trong ngày
-        start_time = datetime.combine(st.session_state.selected_date, time(0, 0))
-        end_time = datetime.combine(st.session_state.selected_date, time(23, 59))
-        full_time_index = pd.date_range(start=start_time, end=end_time, freq=pandas_freq)
-        resampled_df = pd.DataFrame(index=full_time_index)
-
-        # Tách và làm sạch dữ liệu ban đầu và sau điều tiết
-        initial_flights_df = df_regulated_full.dropna(subset=['predicted_event_time_local'])
+        # Nhu cầu trước / sau GDP theo độ phân giải và hai biểu đồ so sánh (cache theo lịch trình điều tiết + độ phân giải)
+        fig_before, fig_after = get_gdp_comparison(
+            df_regulated_full, st.session_state.selected_date, freq_minutes,
+            st.session_state.takeoff_capacity, st.session_state.landing_capacity,
+            capacity_events_key(st.session_state.reduced_capacity_events), st.session_state.capacity_forecast
+        )
         df_regulated_full['actual_time_local'] = df_regulated_full['actual_time_utc'] + timedelta(hours=VVTS_CONFIG['airport_timezone_offset_hours'])
-        regulated_flights_df = df_regulated_full.dropna(subset=['actual_time_local'])
-
-        # Gom nhóm dữ liệu theo giờ
-        initial_arr_demand = initial_flights_df[initial_flights_df['flight_type']=='arrival'].set_index('predicted_event_time_local').resample(pandas_freq).size()
-        initial_dep_demand = initial_flights_df[initial_flights_df['flight_type']=='departure'].set_index('predicted_event_time_local').resample(pandas_freq).size()
-        regulated_arr_demand = regulated_flights_df[regulated_flights_df['flight_type']=='arrival'].set_index('actual_time_local').resample(pandas_freq).size()
-        regulated_dep_demand = regulated_flights_df[regulated_flights_df['flight_type']=='departure'].set_index('actual_time_local').resample(pandas_freq).size()
-
-        # Điền dữ liệu đã gom nhóm vào DataFrame chính
-        resampled_df['initial_arrival_demand'] = initial_arr_demand.reindex(full_time_index, fill_value=0)
-        resampled_df['initial_departure_demand'] = initial_dep_demand.reindex(full_time_index, fill_value=0)
-        resampled_df['regulated_arrival_demand'] = regulated_arr_demand.reindex(full_time_index, fill_value=0)
-        resampled_df['regulated_departure_demand'] = regulated_dep_demand.reindex(full_time_index, fill_value=0)
-
-        # Tính toán đường năng lực tương ứng với độ phân giải
-        if pandas_freq == 'H':
-            scaling_factor = 1
-        elif pandas_freq == '30T':
-            scaling_factor = 2
-        else: # 15T
-            scaling_factor = 4
-        scaled_total_capacity = (st.session_state.landing_capacity + st.session_state.takeoff_capacity) / scaling_factor
-        resampled_df['scaled_total_capacity'] = scaled_total_capacity
-        # (Bạn có thể thêm code áp dụng sự kiện giảm năng lực ở đây nếu muốn)
 
         # --- BƯỚC 2: VẼ CÁC BIỂU ĐỒ ---
         st.subheader("So sánh trực quan trước và sau khi áp dụng GDP")
 
-        # Tính toán Y-axis chung để 2 biểu đồ có cùng tỷ lệ (cách an toàn)
-        combined_initial_demand = resampled_df['initial_arrival_demand'] + resampled_df['initial_departure_demand']
-        if not combined_initial_demand.empty and combined_initial_demand.max() > 0:
-            max_y = combined_initial_demand.max() * 1.15
-        else:
-            max_y = 50 
-
         # Tạo layout 2 cột
         col1, col2 = st.columns(2)
 
         # BIỂU ĐỒ 1: TRƯỚC ĐIỀU TIẾT
         with col1:
             st.markdown("Trước khi áp dụng GDP")
-            fig_before = go.Figure()
-            fig_before.add_trace(go.Bar(x=resampled_df.index, y=resampled_df['initial_departure_demand'], name='Cất cánh', marker_color='#80B4E0'))
-            fig_before.add_trace(go.Bar(x=resampled_df.index, y=resampled_df['initial_arrival_demand'], name='Hạ cánh', marker_color='#A0D498'))
-            fig_before.add_trace(go.Scatter(x=resampled_df.index, y=resampled_df['scaled_total_capacity'], name='Năng lực', mode='lines', line=dict(color='red', dash='dash', width=2)))
-            fig_before.update_layout(barmode='stack', yaxis_title='Số lượt cất/hạ cánh', plot_bgcolor='rgba(240, 240, 240, 0.95)', hovermode="x unified", xaxis_tickformat="%H:%M", margin=dict(l=40, r=20, t=40, b=20), legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1), yaxis_range=[0, max_y])
-            st.plotly_chart(fig_before, use_container_width=True)
+            show_chart('GDP before chart', fig_before)
 
         # BIỂU ĐỒ 2: SAU ĐIỀU TIẾT
         with col2:
             st.markdown("Sau khi áp dụng GDP")
-            fig_after = go.Figure()
-            fig_after.add_trace(go.Bar(x=resampled_df.index, y=resampled_df['regulated_departure_demand'], name='Cất cánh', marker_color='#005A9E'))
-            fig_after.add_trace(go.Bar(x=resampled_df.index, y=resampled_df['regulated_arrival_demand'], name='Hạ cánh', marker_color='#2E8540'))
-            fig_after.add_trace(go.Scatter(x=resampled_df.index, y=resampled_df['scaled_total_capacity'], name='Năng lực', mode='lines', line=dict(color='red', dash='dash', width=2)))
-            fig_after.update_layout(barmode='stack', plot_bgcolor='rgba(240, 240, 240, 0.95)', hovermode="x unified", xaxis_tickformat="%H:%M", margin=dict(l=40, r=20, t=40, b=20), legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1), yaxis_range=[0, max_y])
-            st.plotly_chart(fig_after, use_container_width=True)
+            show_chart('GDP after chart', fig_after)
         # --- BƯỚC 3: HIỂN THỊ BẢNG CHI TIẾT CÁC CHUYẾN BAY BỊ ĐIỀU TIẾT ---
         st.markdown("---")
         st.subheader("Chi tiết thay đổi CTOT của các chuyến bay")
@@ -1270,7 +1194,7 @@ with tab_gdp: # Nội dung Tab 3
             delay_fig = go.Figure()
             delay_fig.add_trace(go.Histogram(x=regulated_flights_only_df['atfm_delay_minutes'], nbinsx=20))
             delay_fig.update_layout(xaxis_title='Độ trễ (phút)', yaxis_title='Số chuyến bay', bargap=0.1)
-            st.plotly_chart(delay_fig, use_container_width=True)
+            show_chart('delay histogram', delay_fig)
         else:
             st.info("Không có chuyến bay bị điều tiết để hiển thị biểu đồ độ trễ.")
 
@@ -1287,3 +1211,28 @@ with tab_gdp: # Nội dung Tab 3
         st.info("Mô phỏng đã chạy nhưng không có dữ liệu kết quả cho ngày đã chọn.")
     else:
         st.info("Thiết lập các thông số ở thanh bên trái và nhấn nút 'Chạy Mô phỏng Điều tiết (GDP)' để xem kết quả.")
+
+with tab_gdp:
+    render_gdp_tab()
+
+# --- Bảng Performance: thời gian từng bước của lần chạy này và p50/p95 của các lần chạy gần đây ---
+with st.sidebar.expander("Performance", expanded=False):
+    latest_timings = timing_recorder.latest()
+    if latest_timings.empty:
+        st.caption("Chưa có bước nào được đo trong lần chạy này.")
+    else:
+        performance_df = latest_timings.merge(timing_recorder.rolling_summary(), on='stage', how='left')
+        st.caption(f"Lần chạy #{timing_recorder.run_id}; p50/p95 trên {min(timing_recorder.run_id, DEFAULT_HISTORY_RUNS)} lần chạy gần nhất. Bước lồng nhau (tab, bước con) được tính riêng.")
+        st.dataframe(
+            performance_df.assign(
+                ms=performance_df['seconds'] * 1000,
+                p50_ms=performance_df['p50_seconds'] * 1000,
+                p95_ms=performance_df['p95_seconds'] * 1000,
+            )[['stage', 'calls', 'rows', 'ms', 'p50_ms', 'p95_ms', 'runs']].rename(columns={
+                'stage': 'Bước', 'calls': 'Số lần gọi', 'rows': 'Số dòng', 'ms': 'Lần này (ms)',
+                'p50_ms': 'p50 (ms)', 'p95_ms': 'p95 (ms)', 'runs': 'Số lần chạy'
+            }).style.format({'Lần này (ms)': '{:,.1f}', 'p50 (ms)': '{:,.1f}', 'p95 (ms)': '{:,.1f}', 'Số dòng': '{:,.0f}'}, na_rep=''),
+            use_container_width=True, hide_index=True
+        )
+    timing_log_path = st.text_input("Ghi JSON lines vào file (để trống: không ghi):", value=timing_recorder.log_path or '', key="timing_log_path")
+    timing_recorder.log_path = timing_log_path.strip() or None
@@ -0,0 +1,317 @@
+# atfm_core/benchmarks.py
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from .analysis import build_demand_analysis
+from .config import VVTS_CONFIG
+from .data_cache import CACHE_DIR_NAME
+from .demand_cube import DemandCube
+from .flight_processing import process_flight_schedules
+from .flight_updates import FlightUpdateStream
+from .gdp_engine import run_gdp_simulation
+from .generate_data import expected_flights_per_day, generate_eets, generate_schedule_chunks
+from .pipeline import (
+    TIMEZONE_OFFSET_HOURS, build_initial_traffic_for_pre_tactical, calculate_initial_schedules, open_schedule_store,
+    run_dual_pass_gdp_simulation, run_gdp_simulation_for_all_traffic, simulate_ctot_compliance
+)
+from .pre_tactical import generate_pre_tactical_demand_data
+from .system_state import SystemState
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+SUITE_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+REGRESSION_THRESHOLD = 0.10
+
+def make_synthetic_raw_schedule(num_flights, seed=0, start_date='2025-06-23', num_days=7):
+    """
+    Tạo lịch bay thô (cùng các cột mà data_loader.load_and_prepare_data trả về) với số chuyến tùy ý.
+    Một nửa là chuyến đến VVTS, một nửa là chuyến đi từ VVTS.
+    """
+    rng = np.random.default_rng(seed)
+    icao = VVTS_CONFIG['ICAO_CODE']
+    others = np.array(['VVDN', 'VVPB', 'VVKR', 'VVCT', 'VVNB', 'WSSS', 'VTBS', 'RKSI', 'RJAA', 'EGLL'])
+    prefixes = np.array(['HVN', 'VJC', 'BAV', 'PIC', 'SIA', 'THA', 'KAL', 'ANA'])
+    aircraft = np.array(['A320', 'A321', 'B737', 'B787', 'A350', 'B777', 'A330', 'A380'])
+
+    is_arrival = rng.random(num_flights) < 0.5
+    other = others[rng.integers(0, len(others), num_flights)]
+    minutes = rng.integers(0, num_days * 24 * 60, num_flights)
+    eobt_local = pd.Timestamp(start_date) + pd.to_timedelta(minutes, unit='m')
+
+    return pd.DataFrame({
+        'callsign': np.char.add(prefixes[rng.integers(0, len(prefixes), num_flights)],
+                                rng.integers(100, 10000, num_flights).astype(str)),
+        'origin': np.where(is_arrival, other, icao),
+        'destination': np.where(is_arrival, icao, other),
+        'aircraft_type': aircraft[rng.integers(0, len(aircraft), num_flights)],
+        'flight_date': eobt_local.date,
+        'eobt_local': eobt_local,
+        'eobt_utc': eobt_local - timedelta(hours=VVTS_CONFIG['TIMEZONE_OFFSET_HOURS']),
+        'origin_eet_to_vvts_minutes': rng.integers(40, 900, num_flights),
+        'origin_taxi_out_minutes': rng.integers(8, 45, num_flights),
+        'dest_eet_from_vvts_minutes': rng.integers(40, 900, num_flights),
+    })
+
+def benchmark_process_flight_schedules(sizes=DEFAULT_SIZES, repeat=3, seed=0):
+    """Đo thời gian process_flight_schedules (giá trị tốt nhất sau `repeat` lần) cho từng kích thước."""
+    results = []
+    for size in sizes:
+        raw_df = make_synthetic_raw_schedule(size, seed=seed)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            process_flight_schedules(raw_df)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        results.append({'stage': 'process_flight_schedules', 'num_flights': size,
+                        'best_seconds': best, 'flights_per_second': size / best})
+    return pd.DataFrame(results)
+
+def benchmark_flight_update_stream(num_flights=100_000, num_messages=200_000, seed=0):
+    """Đo số bản tin cập nhật (delay/change/cancel/new) mỗi giây của FlightUpdateStream trên lịch bay tổng hợp."""
+    rng = np.random.default_rng(seed)
+    schedule = process_flight_schedules(make_synthetic_raw_schedule(num_flights, seed=seed))
+    stream = FlightUpdateStream.from_schedule(schedule, VVTS_CONFIG['LANDING_CAPACITY_HOURLY'], VVTS_CONFIG['TAKEOFF_CAPACITY_HOURLY'])
+
+    keys = list(stream.flights)
+    picks = rng.integers(0, len(keys), num_messages)
+    kinds = rng.choice(['delay', 'change', 'cancel', 'new'], num_messages, p=[0.6, 0.25, 0.05, 0.1])
+    shifts = rng.integers(-15, 120, num_messages).tolist()
+    messages = []
+    for i, (kind, pick, shift) in enumerate(zip(kinds.tolist(), picks.tolist(), shifts)):
+        callsign, flight_date = keys[pick]
+        if kind == 'new':
+            callsign = f'NEW{i}'
+        messages.append({
+            'type': kind, 'callsign': callsign, 'flight_date': flight_date, 'delay_minutes': shift,
+            'flight_type': 'arrival' if shift % 2 else 'departure',
+            'event_time_local': int(stream.flights[keys[pick]][1]) + shift if keys[pick] in stream.flights else None,
+        })
+
+    start = time.perf_counter()
+    applied = stream.apply_many(messages)
+    elapsed = time.perf_counter() - start
+    return pd.DataFrame([{'stage': 'flight_update_stream', 'num_flights': num_flights, 'num_messages': num_messages,
+                          'applied': applied, 'best_seconds': elapsed, 'messages_per_second': num_messages / elapsed}])
+
+def make_synthetic_eets(seed=0):
+    """eets.csv tổng hợp của generate_data.generate_eets (có seed)."""
+    return generate_eets(seed)
+
+def make_synthetic_schedule(num_flights, seed=0, start_date='2025-06-23'):
+    """
+    vvts_schedule.csv tổng hợp: `num_flights` chuyến đầu tiên của generate_data.generate_schedule_chunks (cùng cấu trúc
+    bank giờ cao điểm, tỉ lệ đến/đi và nội địa/quốc tế). Số ngày tăng theo số chuyến thay vì dồn chuyến, nên mật độ
+    mỗi giờ (và các điểm nóng) giống dữ liệu mẫu ở mọi kích thước.
+    """
+    max_days = 2 * int(np.ceil(num_flights / expected_flights_per_day())) + 1
+    chunks, total = [], 0
+    for chunk in generate_schedule_chunks(max_days, pd.Timestamp(start_date).date(), seed=seed):
+        chunks.append(chunk)
+        total += len(chunk)
+        if total >= num_flights:
+            break
+    return pd.concat(chunks, ignore_index=True).iloc[:num_flights]
+
+def _silent(level, message):
+    pass
+
+def _arrival_hotspots(master_df, landing_capacity, takeoff_capacity):
+    """Điểm nóng hạ cánh trên toàn bộ lịch trình chính (mọi giờ, không chỉ một ngày như analyze_hourly_demand)."""
+    demand_cube = DemandCube.from_flights({'master': (master_df, 'event_time_local')}, dimensions=())
+    arrival_demand, departure_demand = demand_cube.series('arrival'), demand_cube.series('departure')
+    _, arrival_hotspots, _ = build_demand_analysis(arrival_demand.index.tz_localize('Asia/Ho_Chi_Minh'), arrival_demand, departure_demand,
+                                                   landing_capacity, takeoff_capacity)
+    return arrival_hotspots
+
+def _suite_stages(seed):
+    """
+    Các bước của pipeline theo thứ tự: (tên, setup(inputs) -> tham số, hàm được đo, tên đầu ra trong inputs).
+    Chỉ lời gọi hàm được đo; setup (xóa cache, sao chép đầu vào bị sửa tại chỗ) không tính vào thời gian.
+    """
+    takeoff, landing = VVTS_CONFIG['TAKEOFF_CAPACITY_HOURLY'], VVTS_CONFIG['LANDING_CAPACITY_HOURLY']
+
+    def cold_load(inputs):
+        shutil.rmtree(os.path.join(inputs['data_dir'], CACHE_DIR_NAME), ignore_errors=True)
+        return inputs['schedule_path'], inputs['eets_path']
+
+    def load_data(schedule_path, eets_path):
+        store, eets_df = open_schedule_store(schedule_path, eets_path, progress=_silent)
+        return {'flights': next(store.iter_chunks(days_per_chunk=max(len(store.dates), 1)))[1], 'eets': eets_df}
+
+    def package_raw_schedule(flights_df):
+        # Lịch bay thô dạng data_loader._prepare_data cho pipeline của package (flight_processing / gdp_engine)
+        return flights_df.rename(columns={'eobt_dt_local': 'eobt_local', 'eobt_dt_utc': 'eobt_utc'})
+
+    def package_gdp(master_df):
+        return {'master': master_df, 'arr_hotspots': _arrival_hotspots(master_df, landing, takeoff)}
+
+    return [
+        ('load_data', cold_load, load_data, None),
+        ('calculate_initial_schedules', lambda inputs: (inputs['flights'], inputs['eets']),
+         calculate_initial_schedules, 'initial'),
+        ('generate_pre_tactical_demand_data', lambda inputs: (build_initial_traffic_for_pre_tactical(*inputs['initial']),),
+         lambda traffic_df: generate_pre_tactical_demand_data(traffic_df, seed=seed, timezone_offset_hours=TIMEZONE_OFFSET_HOURS),
+         'pre_tactical'),
+        ('run_dual_pass_gdp_simulation', lambda inputs: (inputs['pre_tactical'],),
+         lambda pre_tactical_df: run_dual_pass_gdp_simulation(pre_tactical_df, takeoff, landing, [], TIMEZONE_OFFSET_HOURS, progress=_silent)[0],
+         'regulated'),
+        ('run_gdp_simulation_for_all_traffic', lambda inputs: (inputs['pre_tactical'],),
+         lambda pre_tactical_df: run_gdp_simulation_for_all_traffic(pre_tactical_df, takeoff, landing, [], progress=_silent), None),
+        ('simulate_ctot_compliance', lambda inputs: (inputs['regulated'],),
+         lambda regulated_df: simulate_ctot_compliance(regulated_df, rng=random.Random(seed), progress=_silent), None),
+        ('process_flight_schedules', lambda inputs: (package_raw_schedule(inputs['flights']),),
+         lambda raw_df: package_gdp(process_flight_schedules(raw_df)), None),
+        ('gdp_engine.run_gdp_simulation', lambda inputs: (inputs['master'], inputs['arr_hotspots']),
+         lambda master_df, arr_hotspots: run_gdp_simulation(master_df, landing, arr_hotspots), 'package_regulated'),
+        ('SystemState.activate_gdp', lambda inputs: (SystemState(inputs['master'].copy()), inputs['package_regulated'].copy()),
+         lambda state, regulated_df: state.activate_gdp(regulated_df), None),
+    ]
+
+SUITE_STAGES = tuple(name for name, *_ in _suite_stages(0))
+
+def _measure(setup, run, inputs, repeat, profile_memory):
+    """Chạy `run(*setup(inputs))` `repeat` lần; trả về (kết quả lần cuối, các thời gian, đỉnh bộ nhớ MB hoặc None)."""
+    timings = []
+    for _ in range(repeat):
+        args = setup(inputs)
+        start = time.perf_counter()
+        result = run(*args)
+        timings.append(time.perf_counter() - start)
+    peak_mb = None
+    if profile_memory:
+        # Đo bộ nhớ ở một lần chạy riêng: tracemalloc làm chậm phép đo thời gian
+        args = setup(inputs)
+        tracemalloc.start()
+        try:
+            run(*args)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result, timings, peak_mb
+
+def run_benchmark_suite(sizes=SUITE_SIZES, repeat=3, seed=0, stages=None, profile_memory=True, progress=None):
+    """
+    Đo từng bước của pipeline trên lịch bay tổng hợp (make_synthetic_schedule ghi ra CSV trong thư mục tạm) ở mỗi kích thước.
+
+    Mỗi bước nhận đầu ra của bước trước, nên các bước không được chọn trong `stages` vẫn chạy (không đo) khi bước sau cần.
+    Returns:
+        pd.DataFrame: một dòng mỗi (bước, kích thước) với best_seconds, mean_seconds, flights_per_second, peak_memory_mb.
+    """
+    suite = _suite_stages(seed)
+    selected = set(SUITE_STAGES if stages is None else stages)
+    unknown = selected - set(SUITE_STAGES)
+    if unknown:
+        raise ValueError(f"Bước không có trong bộ benchmark: {sorted(unknown)}; các bước hợp lệ: {SUITE_STAGES}.")
+    last_needed = max(SUITE_STAGES.index(name) for name in selected)
+
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix='atfm_bench.') as data_dir:
+            inputs = {'data_dir': data_dir, 'schedule_path': os.path.join(data_dir, 'vvts_schedule.csv'),
+                      'eets_path': os.path.join(data_dir, 'eets.csv')}
+            make_synthetic_schedule(size, seed=seed).to_csv(inputs['schedule_path'], index=False)
+            make_synthetic_eets(seed).to_csv(inputs['eets_path'], index=False)
+
+            for name, setup, run, output in suite[:last_needed + 1]:
+                measured = name in selected
+                result, timings, peak_mb = _measure(setup, run, inputs, repeat if measured else 1, profile_memory and measured)
+                if output:
+                    inputs[output] = result
+                elif isinstance(result, dict):
+                    inputs.update(result)
+                if not measured:
+                    continue
+                best = min(timings)
+                results.append({'stage': name, 'num_flights': size, 'repeat': repeat, 'best_seconds': best,
+                                'mean_seconds': float(np.mean(timings)), 'flights_per_second': size / best if best > 0 else float('inf'),
+                                'peak_memory_mb': peak_mb})
+                if progress:
+                    progress('info', f"{name} ({size:,} chuyến): {best:.3f} s" + (f", đỉnh {peak_mb:.1f} MB" if peak_mb is not None else ''))
+    return pd.DataFrame(results, columns=['stage', 'num_flights', 'repeat', 'best_seconds', 'mean_seconds',
+                                          'flights_per_second', 'peak_memory_mb'])
+
+def benchmark_metadata(seed, repeat):
+    """Thông tin môi trường ghi kèm kết quả: commit git (nếu có), phiên bản Python/numpy/pandas, nền tảng."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'git_commit': commit, 'created_at': pd.Timestamp.now(tz='UTC').isoformat(),
+        'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+        'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'seed': seed, 'repeat': repeat,
+    }
+
+def save_results(results_df, path, metadata=None):
+    """Ghi kết quả benchmark ra JSON: {'metadata': {...}, 'results': [một dict mỗi dòng]}."""
+    with open(path, 'w', encoding='utf-8') as results_file:
+        json.dump({'metadata': metadata or {}, 'results': json.loads(results_df.to_json(orient='records'))},
+                  results_file, ensure_ascii=False, indent=2)
+
+def load_results(path):
+    """Đọc file JSON của save_results; trả về (metadata, DataFrame kết quả)."""
+    with open(path, encoding='utf-8') as results_file:
+        content = json.load(results_file)
+    return content.get('metadata', {}), pd.DataFrame(content['results'])
+
+def compare_results(baseline_df, current_df, threshold=REGRESSION_THRESHOLD):
+    """
+    So sánh hai lần đo theo (bước, kích thước) trên best_seconds. change là tỉ lệ thay đổi thời gian
+    (0.15 = chậm hơn 15%); regression đánh dấu các bước chậm hơn quá `threshold`.
+    """
+    keys = ['stage', 'num_flights']
+    compared = baseline_df[keys + ['best_seconds', 'peak_memory_mb']].merge(
+        current_df[keys + ['best_seconds', 'peak_memory_mb']], on=keys, suffixes=('_baseline', '_current'))
+    compared['change'] = compared['best_seconds_current'] / compared['best_seconds_baseline'] - 1
+    compared['regression'] = compared['change'] > threshold
+    return compared
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark từng bước của pipeline ATFM trên lịch bay tổng hợp.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SUITE_SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=SUITE_STAGES, help="Chỉ đo các bước này (mặc định: tất cả).")
+    parser.add_argument('--no-memory', action='store_true', help="Bỏ lần chạy đo bộ nhớ bằng tracemalloc.")
+    parser.add_argument('--output', help="Ghi kết quả ra file JSON.")
+    parser.add_argument('--baseline', help="File JSON của lần đo trước để so sánh.")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help="Chỉ so sánh hai file JSON đã có.")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help="Ngưỡng chậm hơn bị đánh dấu (mặc định 0.10).")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        baseline_path, current_path = args.compare
+        current_df = load_results(current_path)[1]
+    else:
+        baseline_path = args.baseline
+        progress = lambda level, message: print(message, file=sys.stderr)
+        current_df = run_benchmark_suite(args.sizes, args.repeat, args.seed, args.stages, not args.no_memory, progress)
+        print(current_df.to_string(index=False))
+        if args.output:
+            save_results(current_df, args.output, benchmark_metadata(args.seed, args.repeat))
+    if not baseline_path:
+        return 0
+
+    compared = compare_results(load_results(baseline_path)[1], current_df, args.threshold)
+    print(compared.to_string(index=False))
+    regressions = compared[compared['regression']]
+    for row in regressions.itertuples():
+        print(f"CHẬM HƠN: {row.stage} ({row.num_flights:,} chuyến) {row.best_seconds_baseline:.3f} s -> "
+              f"{row.best_seconds_current:.3f} s ({row.change:+.0%})", file=sys.stderr)
+    return 1 if len(regressions) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+# atfm_core/capacity_profile.py
+
+import numpy as np
+import pandas as pd
+try:
+    from .config import VVTS_CONFIG
+    from .slot_allocator import ALL_HOURS_CHANGED_S, SECONDS_PER_HOUR, to_epoch_seconds
+except ImportError:  # Chạy trực tiếp cùng app.py (streamlit run app.py)
+    from config import VVTS_CONFIG
+    from slot_allocator import ALL_HOURS_CHANGED_S, SECONDS_PER_HOUR, to_epoch_seconds
+
+# Năng lực theo thời gian: tốc độ hạ cánh / cất cánh / tổng (lượt/giờ) theo ô 15 phút, dựng một lần từ các sự kiện
+# giảm năng lực (có thể chồng nhau) và/hoặc một file dự báo năng lực. Engine GDP, CDM và các biểu đồ tra năng lực
+# bằng chỉ số mảng thay vì duyệt danh sách sự kiện cho từng giờ. Thời gian là UTC (giây epoch).
+
+PROFILE_BIN_MINUTES = 15
+SECONDS_PER_MINUTE = 60
+# Cột năng lực của file dự báo (lượt/giờ); thiếu cột tổng thì tổng = hạ cánh + cất cánh của dòng đó, thiếu cột
+# hạ cánh / cất cánh thì chia năng lực tổng như sự kiện (hạ cánh tối đa một nửa, cất cánh phần còn lại)
+FORECAST_CAPACITY_COLUMNS = ('landing_capacity', 'takeoff_capacity', 'total_capacity')
+
+class CapacityProfile:
+    """
+    Năng lực cơ bản (takeoff_capacity, landing_capacity) và các mảng arrival / departure / total (lượt/giờ) của
+    từng ô `bin_minutes` phút kể từ start_s. interval_of_bin[k] là vị trí khoảng (sự kiện hoặc dòng dự báo) quyết
+    định ô k, -1 nếu ô dùng năng lực cơ bản. Thời điểm ngoài các ô có năng lực cơ bản.
+    """
+
+    def __init__(self, takeoff_capacity, landing_capacity, start_s, bin_minutes, arrival, departure, total, interval_of_bin):
+        self.takeoff_capacity = takeoff_capacity
+        self.landing_capacity = landing_capacity
+        self.start_s = int(start_s)
+        self.bin_minutes = bin_minutes
+        self.arrival = arrival
+        self.departure = departure
+        self.total = total
+        self.interval_of_bin = interval_of_bin
+
+    @property
+    def bin_s(self):
+        return self.bin_minutes * SECONDS_PER_MINUTE
+
+    @property
+    def end_s(self):
+        return self.start_s + len(self.total) * self.bin_s
+
+    @classmethod
+    def from_intervals(cls, takeoff_capacity, landing_capacity, start_s, end_s, arrival, departure, total, bin_minutes=PROFILE_BIN_MINUTES):
+        """
+        Dựng hồ sơ từ các khoảng [start_s, end_s) (giây epoch UTC) có năng lực riêng. Ô thuộc một khoảng nếu khoảng phủ
+        một phần bất kỳ của ô (sự kiện ngắn hoặc lệch ô vẫn giảm cả ô, thiên về an toàn); khi các khoảng chồng nhau,
+        khoảng đứng trước được ưu tiên (như thứ tự sự kiện trong sidebar).
+        Chỉ mục khoảng -> ô được dựng bằng np.repeat trên mọi cặp (khoảng, ô) và np.minimum.at, không lặp theo giờ.
+        """
+        bin_s = bin_minutes * SECONDS_PER_MINUTE
+        start_s, end_s = np.asarray(start_s, dtype=np.int64), np.asarray(end_s, dtype=np.int64)
+        if not len(start_s):
+            empty = np.empty(0)
+            return cls(takeoff_capacity, landing_capacity, 0, bin_minutes, empty, empty, empty, np.empty(0, dtype=np.int64))
+
+        origin_s = int(start_s.min()) // bin_s * bin_s
+        first_bin = (start_s - origin_s) // bin_s
+        lengths = np.where(end_s > start_s, -(-(end_s - origin_s) // bin_s) - first_bin, 0)
+        n_bins = int((first_bin + lengths).max())
+        interval = np.repeat(np.arange(len(start_s)), lengths)
+        bins = first_bin[interval] + np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        interval_of_bin = np.full(n_bins, len(start_s), dtype=np.int64)
+        np.minimum.at(interval_of_bin, bins, interval)
+        covered = interval_of_bin < len(start_s)
+        interval_of_bin[~covered] = -1
+
+        def paint(values, base):
+            rates = np.full(n_bins, base, dtype=np.float64)
+            rates[covered] = np.asarray(values, dtype=np.float64)[interval_of_bin[covered]]
+            return rates
+
+        return cls(takeoff_capacity, landing_capacity, origin_s, bin_minutes,
+                   paint(arrival, landing_capacity), paint(departure, takeoff_capacity),
+                   paint(total, takeoff_capacity + landing_capacity), interval_of_bin)
+
+    @classmethod
+    def build(cls, takeoff_capacity, landing_capacity, events=None, forecast=None, timezone_offset_hours=VVTS_CONFIG['TIMEZONE_OFFSET_HOURS'],
+              bin_minutes=PROFILE_BIN_MINUTES):
+        """
+        Hồ sơ năng lực của các sự kiện giảm năng lực `events` (dạng của app: start_time_utc, end_time_utc, new_capacity)
+        và file dự báo `forecast` (xem forecast_intervals); sự kiện được ưu tiên hơn dự báo trong khoảng chồng nhau.
+
+        Trong sự kiện, năng lực tổng min(cất cánh + hạ cánh, new_capacity) được chia đôi cho hạ cánh (tối đa năng lực
+        hạ cánh), phần còn lại cho cất cánh (tối đa năng lực cất cánh).
+        """
+        events = list(events or [])
+        event_times = to_epoch_seconds([event[column] for event in events for column in ('start_time_utc', 'end_time_utc')]).reshape(-1, 2)
+        total = np.minimum(takeoff_capacity + landing_capacity, np.array([event['new_capacity'] for event in events], dtype=np.int64))
+        arrival = np.minimum(landing_capacity, total // 2)
+        departure = np.minimum(takeoff_capacity, total - arrival)
+        intervals = [(event_times[:, 0], event_times[:, 1], arrival, departure, total)]
+        if forecast is not None:
+            intervals.append(forecast_intervals(forecast, takeoff_capacity, landing_capacity, timezone_offset_hours, bin_minutes))
+        start_s, end_s, arrival, departure, total = (np.concatenate(parts) for parts in zip(*intervals))
+        return cls.from_intervals(takeoff_capacity, landing_capacity, start_s, end_s, arrival, departure, total, bin_minutes)
+
+    def _positions(self, times_s):
+        position = (np.asarray(times_s, dtype=np.int64) - self.start_s) // self.bin_s
+        in_range = (position >= 0) & (position < len(self.total))
+        return np.where(in_range, position, 0), in_range
+
+    def rates_s(self, times_s):
+        """(arrival, departure, total) lượt/giờ của ô chứa mỗi thời điểm (mảng giây epoch UTC)."""
+        position, in_range = self._positions(times_s)
+        bases = (self.landing_capacity, self.takeoff_capacity, self.takeoff_capacity + self.landing_capacity)
+        if not len(self.total):
+            return tuple(np.full(len(position), base, dtype=np.float64) for base in bases)
+        return tuple(np.where(in_range, rates[position], base) for rates, base in zip((self.arrival, self.departure, self.total), bases))
+
+    def rates(self, times_utc):
+        """Như rates_s với thời điểm UTC dạng datetime (Series, DatetimeIndex hoặc danh sách)."""
+        return self.rates_s(to_epoch_seconds(times_utc))
+
+    def hourly_rates(self, hour_starts_s):
+        """
+        (arrival, departure, total) của từng giờ bắt đầu tại hour_starts_s (giây epoch UTC): trung bình năng lực các ô
+        trong giờ, tức số lượt thực có trong giờ, nên một sự kiện chỉ phủ một phần giờ vẫn giảm năng lực của giờ đó.
+        """
+        hour_starts_s = np.asarray(hour_starts_s, dtype=np.int64)
+        bins_per_hour = SECONDS_PER_HOUR // self.bin_s
+        times_s = (hour_starts_s[:, None] + np.arange(bins_per_hour) * self.bin_s).ravel()
+        return tuple(rates.reshape(-1, bins_per_hour).mean(axis=1) for rates in self.rates_s(times_s))
+
+    def hourly(self, hour_starts_s):
+        """(arr_caps, dep_caps) của lưới slot theo giờ (xem hourly_rates); năng lực lẻ được build_slot_grid cộng dồn."""
+        arrival, departure, _ = self.hourly_rates(hour_starts_s)
+        return arrival, departure
+
+    def reduced_hours(self):
+        """Số giờ (làm tròn lên) có năng lực do sự kiện / dự báo quyết định, dùng làm giờ dự phòng cho lưới slot."""
+        return -(-int((self.interval_of_bin >= 0).sum()) * self.bin_minutes // 60)
+
+    def first_difference_s(self, other):
+        """
+        Đầu giờ (giây epoch) sớm nhất mà năng lực của hai hồ sơ có thể khác nhau: None nếu giống nhau,
+        ALL_HOURS_CHANGED_S (mọi giờ) nếu năng lực cơ bản hoặc độ phân giải khác nhau.
+        """
+        if (self.takeoff_capacity, self.landing_capacity, self.bin_minutes) != (other.takeoff_capacity, other.landing_capacity, other.bin_minutes):
+            return ALL_HOURS_CHANGED_S
+        spans = [(profile.start_s, profile.end_s) for profile in (self, other) if len(profile.total)]
+        if not spans:
+            return None
+        times_s = np.arange(min(start for start, _ in spans), max(end for _, end in spans), self.bin_s, dtype=np.int64)
+        differs = np.zeros(len(times_s), dtype=bool)
+        for own, others in zip(self.rates_s(times_s), other.rates_s(times_s)):
+            differs |= own != others
+        if not differs.any():
+            return None
+        return int(times_s[differs.argmax()]) // SECONDS_PER_HOUR * SECONDS_PER_HOUR
+
+def as_capacity_profile(takeoff_capacity, landing_capacity, capacity):
+    """`capacity` là CapacityProfile (dùng nguyên) hoặc danh sách sự kiện giảm năng lực (dựng hồ sơ bằng CapacityProfile.build)."""
+    if isinstance(capacity, CapacityProfile):
+        return capacity
+    return CapacityProfile.build(takeoff_capacity, landing_capacity, capacity)
+
+def forecast_intervals(forecast, takeoff_capacity, landing_capacity, timezone_offset_hours=VVTS_CONFIG['TIMEZONE_OFFSET_HOURS'],
+                       bin_minutes=PROFILE_BIN_MINUTES):
+    """
+    Các khoảng (start_s, end_s, arrival, departure, total) của một dự báo năng lực: DataFrame hoặc đường dẫn CSV có
+    cột thời điểm bắt đầu 'start_time_utc' hoặc 'start_time_local' (giờ địa phương = UTC + timezone_offset_hours), tùy
+    chọn 'end_time_utc' / 'end_time_local', và các cột FORECAST_CAPACITY_COLUMNS. Dòng không có thời điểm kết thúc kéo
+    dài tới dòng kế tiếp theo thời gian (dòng cuối: một ô bin_minutes phút).
+    """
+    forecast = pd.read_csv(forecast) if isinstance(forecast, str) else pd.DataFrame(forecast)
+    offset = pd.Timedelta(hours=timezone_offset_hours)
+
+    def utc_column(name):
+        if f'{name}_utc' in forecast:
+            return pd.to_datetime(forecast[f'{name}_utc'])
+        if f'{name}_local' in forecast:
+            return pd.to_datetime(forecast[f'{name}_local']) - offset
+        return None
+
+    start_utc = utc_column('start_time')
+    if start_utc is None:
+        raise ValueError("File dự báo năng lực cần cột 'start_time_utc' hoặc 'start_time_local'.")
+    start_s = to_epoch_seconds(start_utc)
+    order = np.argsort(start_s, kind='stable')
+    next_start_s = np.empty_like(start_s)
+    next_start_s[order] = np.append(start_s[order][1:], start_s[order][-1:] + bin_minutes * SECONDS_PER_MINUTE)
+    end_utc = utc_column('end_time')
+    end_s = next_start_s if end_utc is None else np.where(end_utc.notna(), to_epoch_seconds(end_utc.fillna(pd.Timestamp(0))), next_start_s)
+
+    def capacity_column(name):
+        return forecast[name].to_numpy(dtype=np.float64) if name in forecast else np.full(len(forecast), np.nan)
+
+    landing, takeoff, total = (capacity_column(name) for name in FORECAST_CAPACITY_COLUMNS)
+    # Thiếu năng lực tổng: cộng hạ cánh + cất cánh (thiếu thì lấy năng lực cơ bản)
+    total = np.where(np.isnan(total), np.where(np.isnan(landing), landing_capacity, landing) + np.where(np.isnan(takeoff), takeoff_capacity, takeoff), total)
+    # Thiếu hạ cánh / cất cánh: chia năng lực tổng như sự kiện; có đủ thì giới hạn để tổng hai chiều không vượt năng lực tổng
+    arrival = np.minimum(np.where(np.isnan(landing), np.minimum(landing_capacity, total // 2), landing), total)
+    departure = np.minimum(np.where(np.isnan(takeoff), takeoff_capacity, takeoff), total - arrival)
+    return start_s, end_s, arrival, departure, total
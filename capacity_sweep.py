@@ -0,0 +1,105 @@
+# atfm_core/capacity_sweep.py
+
+import itertools
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from .gdp_engine import slot_cost_weights
+    from .pipeline import dual_pass_allocation, dual_pass_demand_cube, dual_pass_inputs
+    from .slot_allocator import REGULATED_DELAY_THRESHOLD_MINUTES
+    from .timing import timed
+except ImportError:  # Chạy trực tiếp cùng app.py (streamlit run app.py)
+    from gdp_engine import slot_cost_weights
+    from pipeline import dual_pass_allocation, dual_pass_demand_cube, dual_pass_inputs
+    from slot_allocator import REGULATED_DELAY_THRESHOLD_MINUTES
+    from timing import timed
+
+SWEEP_METRICS = ('total_delay_minutes', 'average_delay_minutes', 'max_delay_minutes', 'regulated_flights')
+NO_EVENTS = 'Không có sự kiện'
+
+# Dữ liệu Pre-tactical dạng mảng của mỗi worker: được gửi một lần qua initializer, không pickle lại theo từng task
+_WORKER_BASE = {}
+
+def _init_worker(arrays, event_sets, demand_cube, rolling_step_minutes=None):
+    _WORKER_BASE['arrays'] = arrays
+    _WORKER_BASE['event_sets'] = event_sets
+    _WORKER_BASE['demand_cube'] = demand_cube
+    _WORKER_BASE['rolling_step_minutes'] = rolling_step_minutes
+
+def _silent(level, message):
+    pass
+
+def _evaluate_chunk(combinations):
+    """GDP 2 bước cho từng (năng lực hạ cánh, năng lực cất cánh, tên bộ sự kiện); trả về các dòng chỉ số."""
+    desired_s, desired_hour_s, predicted_s, is_arrival, is_departure, weights = _WORKER_BASE['arrays']
+    rows = []
+    for landing_capacity, takeoff_capacity, event_set in combinations:
+        regulated_s, in_arrival_region, in_departure_region, _ = dual_pass_allocation(
+            desired_s, desired_hour_s, is_arrival, is_departure, takeoff_capacity, landing_capacity,
+            _WORKER_BASE['event_sets'][event_set], weights=weights, demand_cube=_WORKER_BASE['demand_cube'],
+            rolling_step_minutes=_WORKER_BASE['rolling_step_minutes'], progress=_silent
+        )
+        # Trễ (phút) như run_dual_pass_gdp_simulation: slot - thời gian dự đoán, chỉ với chuyến trong vùng điều tiết
+        in_region = in_arrival_region | in_departure_region
+        delay = np.where(in_region, np.maximum(regulated_s - predicted_s, 0.0) / 60, 0.0)
+        regulated = delay > REGULATED_DELAY_THRESHOLD_MINUTES
+        rows.append({
+            'landing_capacity': landing_capacity, 'takeoff_capacity': takeoff_capacity, 'event_set': event_set,
+            'total_delay_minutes': float(delay.sum()),
+            'average_delay_minutes': float(delay.sum() / regulated.sum()) if regulated.any() else 0.0,
+            'max_delay_minutes': float(delay.max()) if len(delay) else 0.0,
+            'regulated_flights': int(regulated.sum()),
+        })
+    return rows
+
+def capacity_grid(landing_capacities, takeoff_capacities, event_set_names):
+    """Mọi tổ hợp (năng lực hạ cánh, năng lực cất cánh, tên bộ sự kiện)."""
+    return [(int(landing), int(takeoff), name) for name, landing, takeoff in
+            itertools.product(event_set_names, landing_capacities, takeoff_capacities)]
+
+@timed
+def run_capacity_sweep(pre_tactical_df, landing_capacities, takeoff_capacities, event_sets=None,
+                       assignment_mode='greedy', cost_weights=None, max_workers=None, rolling_step_minutes=None):
+    """
+    Quét what-if năng lực: chạy GDP 2 bước (phần phân bổ slot của run_dual_pass_gdp_simulation) cho mọi tổ hợp
+    năng lực hạ cánh x năng lực cất cánh x bộ sự kiện giảm năng lực, song song trên ProcessPoolExecutor.
+
+    Dữ liệu Pre-tactical được đổi một lần sang mảng (giây epoch, luồng, trọng số) và khối nhu cầu (giờ tắc nghẽn của
+    mọi tổ hợp đọc từ cùng một khối), gửi cho mỗi worker qua initializer; mỗi task chỉ mang danh sách tổ hợp cần tính.
+
+    Args:
+        event_sets (dict, optional): tên -> danh sách sự kiện giảm năng lực (dạng của app, có start_time_utc/end_time_utc);
+            mặc định chỉ một bộ không có sự kiện.
+        rolling_step_minutes (int, optional): phát hiện tắc nghẽn trên cửa sổ trượt 60 phút, như run_dual_pass_gdp_simulation.
+    Returns:
+        pd.DataFrame: một dòng mỗi tổ hợp, các cột landing_capacity, takeoff_capacity, event_set và SWEEP_METRICS.
+    """
+    event_sets = {NO_EVENTS: []} if event_sets is None else {name: list(events or []) for name, events in event_sets.items()}
+    has_time, desired_s, desired_hour_s, is_arrival, is_departure = dual_pass_inputs(pre_tactical_df)
+    predicted_utc = pre_tactical_df['predicted_event_time_utc']
+    predicted_s = predicted_utc.where(has_time, pd.Timestamp(0)).to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+    weights = slot_cost_weights(pre_tactical_df, cost_weights) if assignment_mode == 'optimal' else None
+    arrays = (desired_s, desired_hour_s, predicted_s, is_arrival, is_departure, weights)
+    demand_cube = dual_pass_demand_cube(pre_tactical_df)
+
+    grid = capacity_grid(landing_capacities, takeoff_capacities, list(event_sets))
+    max_workers = max_workers or os.cpu_count() or 1
+    n_chunks = min(len(grid), max_workers * 4)
+    chunks = [list(chunk) for chunk in np.array_split(np.array(grid, dtype=object), n_chunks) if len(chunk)] if grid else []
+
+    if max_workers == 1:
+        _init_worker(arrays, event_sets, demand_cube, rolling_step_minutes)
+        results = [_evaluate_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(arrays, event_sets, demand_cube, rolling_step_minutes)) as executor:
+            results = list(executor.map(_evaluate_chunk, chunks))
+    return pd.DataFrame([row for rows in results for row in rows],
+                        columns=['landing_capacity', 'takeoff_capacity', 'event_set', *SWEEP_METRICS])
+
+def sweep_surface(sweep_df, metric, event_set=NO_EVENTS):
+    """Bề mặt của một chỉ số cho một bộ sự kiện: index là năng lực hạ cánh, cột là năng lực cất cánh."""
+    selected = sweep_df[sweep_df['event_set'] == event_set]
+    return selected.pivot(index='landing_capacity', columns='takeoff_capacity', values=metric).sort_index().sort_index(axis=1)
@@ -1,26 +1,179 @@
 # atfm_core/cdm_services.py
 
+import numpy as np
+import pandas as pd
+from .flight_records import Flight
+from .slot_allocator import REGULATED_DELAY_THRESHOLD_MINUTES, from_epoch_seconds, to_epoch_seconds
+from .timing import timed
+
 def validate_slot_swap(flight1, flight2):
     """
     Kiểm tra xem việc hoán đổi slot giữa hai chuyến bay có hợp lệ không.
+    Mỗi chuyến là một flight_records.Flight (dòng DataFrame hoặc dict cũng được, sẽ được đổi sang Flight).
     
     Returns:
         (bool, str): (True/False, "Lý do nếu không hợp lệ")
     """
+    flight1, flight2 = Flight.from_row(flight1), Flight.from_row(flight2)
+
     # 1. Kiểm tra cơ bản
-    if flight1['flight_type'] != flight2['flight_type']:
+    if flight1.flight_type != flight2.flight_type:
         return False, "Không thể hoán đổi slot giữa chuyến bay đến và chuyến bay đi."
-    if flight1['callsign'][:3] != flight2['callsign'][:3]:
+    if str(flight1.callsign)[:3] != str(flight2.callsign)[:3]:
         return False, "Chỉ có thể hoán đổi slot giữa các chuyến bay của cùng một hãng."
 
     # 2. Lấy thời gian mới sau khi hoán đổi
-    new_time1 = flight2['regulated_time_utc']
-    new_time2 = flight1['regulated_time_utc']
+    new_time1 = flight2.regulated_time_utc
+    new_time2 = flight1.regulated_time_utc
 
     # 3. Kiểm tra xem thời gian mới có sớm hơn thời gian gốc không (không cho phép bay sớm hơn)
-    if new_time1 < flight1['event_time_utc'] or new_time2 < flight2['event_time_utc']:
+    if new_time1 < flight1.event_time_utc or new_time2 < flight2.event_time_utc:
         return False, "Không thể hoán đổi để bay sớm hơn thời gian dự kiến ban đầu."
 
-    # (Các logic kiểm tra phức tạp hơn về năng lực có thể được thêm vào đây trong tương lai)
+    # (Không cần kiểm tra năng lực: hoán đổi chỉ đổi chỗ hai slot có sẵn nên số chuyến mỗi giờ không đổi)
+
+    return True, "Việc hoán đổi slot hợp lệ."
+
+SWAP_REQUEST_TYPES = ('swap', 'substitution')
+
+# Cột thời gian sớm nhất được phép (thời gian dự kiến trước điều tiết), theo thứ tự ưu tiên:
+# lịch trình của GDP hai lượt có 'predicted_event_time_utc', lịch trình của run_gdp_simulation có 'event_time_utc'.
+EARLIEST_TIME_COLUMNS = ('predicted_event_time_utc', 'event_time_utc')
+
+def _flight_key(callsign, flight_date=None):
+    return (str(callsign), None if flight_date is None else pd.Timestamp(flight_date).normalize())
+
+def _build_flight_index(regulated_df):
+    """
+    Chỉ mục chuyến bay theo tiền tố hãng (callsign[:3]) -> {(callsign, ngày bay): vị trí dòng}.
+    Callsign lặp lại trong nhiều ngày chỉ được tìm thấy khi yêu cầu có 'flight_date'.
+    """
+    callsigns = regulated_df['callsign'].astype(str).to_numpy()
+    flight_dates = pd.to_datetime(regulated_df['flight_date']).dt.normalize().to_numpy() if 'flight_date' in regulated_df else [None] * len(callsigns)
+    by_operator = {}
+    for position, (callsign, flight_date) in enumerate(zip(callsigns, flight_dates)):
+        operator_index = by_operator.setdefault(callsign[:3], {})
+        operator_index.setdefault(_flight_key(callsign, flight_date), []).append(position)
+        if flight_date is not None:
+            operator_index.setdefault(_flight_key(callsign), []).append(position)
+    return by_operator
+
+def _lookup_flight(by_operator, callsign, flight_date=None):
+    """Trả về (vị trí, None) hoặc (None, lý do) nếu không tìm thấy / không xác định duy nhất."""
+    callsign = str(callsign)
+    positions = by_operator.get(callsign[:3], {}).get(_flight_key(callsign, flight_date), [])
+    if not positions:
+        return None, f"Không tìm thấy chuyến bay {callsign} trong lịch trình điều tiết."
+    if len(positions) > 1:
+        return None, f"Callsign {callsign} xuất hiện nhiều lần, cần chỉ rõ 'flight_date'."
+    return positions[0], None
+
+@timed
+def process_slot_swap_requests(regulated_df, swap_requests, earliest_time_column=None):
+    """
+    Xử lý theo lô các yêu cầu CDM của hãng bay trên lịch trình đã điều tiết, trong một lượt:
+      - {'type': 'swap', 'callsign_1': ..., 'callsign_2': ...}: hoán đổi slot của hai chuyến cùng hãng, cùng loại.
+      - {'type': 'substitution', 'cancelled_callsign': ..., 'callsign': ...}: chuyến bị hủy nhường slot cho
+        chuyến khác cùng hãng, cùng loại; chuyến bị hủy bị loại khỏi lịch trình.
+    Mỗi yêu cầu có thể kèm 'request_id', 'flight_date' và 'submitted_at'.
+
+    Các yêu cầu được xét theo (submitted_at, thứ tự trong danh sách); một yêu cầu động tới chuyến bay đã được
+    yêu cầu chấp nhận trước đó thay đổi bị từ chối vì xung đột, nên kết quả luôn xác định. Chuyến bay được tra qua
+    chỉ mục theo hãng nên mỗi yêu cầu là O(1). Không có kiểm tra năng lực riêng: hoán đổi đổi chỗ hai slot cùng luồng,
+    thay thế dùng lại slot của chuyến bị hủy, nên số chuyến mỗi (luồng, giờ) không bao giờ tăng so với lịch trình
+    điều tiết. Thời gian mới không được sớm hơn `earliest_time_column` (mặc định: cột đầu tiên có trong
+    EARLIEST_TIME_COLUMNS).
+
+    Returns:
+        (DataFrame kết quả từng yêu cầu, DataFrame lịch trình điều tiết đã cập nhật)
+    """
+    if earliest_time_column is None:
+        earliest_time_column = next((column for column in EARLIEST_TIME_COLUMNS if column in regulated_df), EARLIEST_TIME_COLUMNS[-1])
+    updated_df = regulated_df.copy()
+    regulated_s = to_epoch_seconds(updated_df['regulated_time_utc'])
+    earliest_s = to_epoch_seconds(updated_df[earliest_time_column])
+    has_slot = updated_df['regulated_time_utc'].notna().to_numpy()
+    is_arrival = (updated_df['flight_type'] == 'arrival').to_numpy()
+    by_operator = _build_flight_index(updated_df)
+
+    touched = set()
+    cancelled = set()
+    results = []
+    order = sorted(range(len(swap_requests)), key=lambda k: (pd.Timestamp(swap_requests[k].get('submitted_at', pd.Timestamp.min)), k))
+
+    for k in order:
+        request = swap_requests[k]
+        request_type = request.get('type', 'swap')
+        flight_date = request.get('flight_date')
+        if request_type == 'swap':
+            callsigns = (request.get('callsign_1'), request.get('callsign_2'))
+        elif request_type == 'substitution':
+            callsigns = (request.get('cancelled_callsign'), request.get('callsign'))
+        else:
+            callsigns = (None, None)
+        result = {
+            'request_id': request.get('request_id', k), 'type': request_type,
+            'callsign_1': callsigns[0], 'callsign_2': callsigns[1],
+            'accepted': False, 'reason': '', 'new_time_1_utc': pd.NaT, 'new_time_2_utc': pd.NaT,
+        }
+        results.append(result)
+
+        if request_type not in SWAP_REQUEST_TYPES:
+            result['reason'] = f"Loại yêu cầu không hợp lệ: {request_type}."
+            continue
+        (first, reason_1), (second, reason_2) = (_lookup_flight(by_operator, callsign, flight_date) for callsign in callsigns)
+        if reason_1 or reason_2:
+            result['reason'] = reason_1 or reason_2
+            continue
+
+        # 1. Kiểm tra cơ bản (cùng quy tắc với validate_slot_swap)
+        if first == second:
+            result['reason'] = "Hai chuyến bay trong yêu cầu trùng nhau."
+        elif first in touched or second in touched:
+            result['reason'] = "Xung đột: chuyến bay đã thuộc một yêu cầu được chấp nhận trước đó."
+        elif is_arrival[first] != is_arrival[second]:
+            result['reason'] = "Không thể hoán đổi slot giữa chuyến bay đến và chuyến bay đi."
+        elif str(callsigns[0])[:3] != str(callsigns[1])[:3]:
+            result['reason'] = "Chỉ có thể hoán đổi slot giữa các chuyến bay của cùng một hãng."
+        elif not (has_slot[first] and has_slot[second]):
+            result['reason'] = "Chuyến bay chưa có slot điều tiết."
+        if result['reason']:
+            continue
+
+        # 2. Thời gian mới sau khi hoán đổi / thay thế
+        if request_type == 'swap':
+            new_times = {first: regulated_s[second], second: regulated_s[first]}
+        else:
+            new_times = {second: regulated_s[first]}
+
+        # 3. Không cho phép bay sớm hơn thời gian dự kiến ban đầu
+        if any(new_time < earliest_s[position] for position, new_time in new_times.items()):
+            result['reason'] = "Không thể hoán đổi để bay sớm hơn thời gian dự kiến ban đầu."
+            continue
+
+        # Chấp nhận: cập nhật thời gian và đánh dấu các chuyến đã thay đổi
+        for position, new_time in new_times.items():
+            regulated_s[position] = new_time
+        touched.update((first, second))
+        if request_type == 'substitution':
+            cancelled.add(first)
+        result['accepted'] = True
+        result['reason'] = "Việc hoán đổi slot hợp lệ." if request_type == 'swap' else "Việc thay thế slot hợp lệ."
+        result['new_time_1_utc'] = pd.NaT if request_type == 'substitution' else pd.Timestamp(int(new_times[first]), unit='s')
+        result['new_time_2_utc'] = pd.Timestamp(int(new_times[second]), unit='s')
+
+    # Ghi lại lịch trình trong một lần cho các chuyến đã thay đổi
+    changed = np.array(sorted(touched - cancelled), dtype=np.int64)
+    if len(changed):
+        new_regulated = pd.Series(from_epoch_seconds(regulated_s[changed]), index=updated_df.index[changed])
+        if updated_df['regulated_time_utc'].dt.tz is not None:
+            new_regulated = new_regulated.dt.tz_localize('UTC')
+        updated_df.loc[new_regulated.index, 'regulated_time_utc'] = new_regulated
+        if 'atfm_delay_minutes' in updated_df:
+            delay = (updated_df['regulated_time_utc'] - updated_df[earliest_time_column]).dt.total_seconds() / 60
+            updated_df['atfm_delay_minutes'] = delay.clip(lower=0)
+            if 'is_regulated' in updated_df:
+                updated_df['is_regulated'] = updated_df['atfm_delay_minutes'] > REGULATED_DELAY_THRESHOLD_MINUTES
+    updated_df = updated_df.drop(index=updated_df.index[sorted(cancelled)])
 
-    return True, "Việc hoán đổi slot hợp lệ."
\ No newline at end of file
+    return pd.DataFrame(results), updated_df
@@ -8,6 +8,17 @@ VVTS_CONFIG = {
     "TIMEZONE_OFFSET_HOURS": 7
 }
 
+# Trọng số chi phí trễ cho chế độ phân bổ slot tối ưu (assignment_mode='optimal'):
+# trọng số của một chuyến = hệ số loại tàu bay x hệ số luồng x hệ số phạm vi bay (không có trong bảng: 1.0)
+SLOT_COST_WEIGHTS = {
+    "aircraft_type": {
+        "A380": 3.0, "B777": 2.2, "A350": 2.0, "B787": 1.8, "A330": 1.6,
+        "A321": 1.1, "A320": 1.0, "B737": 1.0
+    },
+    "flight_type": {"arrival": 1.2, "departure": 1.0},
+    "flight_scope": {"international": 1.5, "domestic": 1.0}
+}
+
 def get_master_dataframe_schema():
     columns_with_types = {
         'callsign': str, 'origin': str, 'destination': str, 'aircraft_type': str,
@@ -0,0 +1,339 @@
+# atfm_core/data_cache.py
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR_NAME = '.atfm_cache'
+CACHE_FORMAT_VERSION = 2
+PARTITION_INDEX_NAME = 'partitions.json'
+_HASH_CHUNK_BYTES = 1 << 20
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(_HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def source_fingerprint(source_paths, previous=None):
+    """
+    Dấu vân tay của các file nguồn: kích thước, mtime và SHA-256 nội dung.
+
+    Nếu `previous` (dấu vân tay đã lưu) có cùng kích thước và mtime thì dùng lại hash cũ, nên kiểm tra
+    cache thường chỉ tốn vài lệnh stat; file chỉ bị "touch" vẫn khớp nhờ so sánh hash.
+    """
+    previous_by_path = {entry['path']: entry for entry in (previous or [])}
+    fingerprint = []
+    for path in source_paths:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = previous_by_path.get(path)
+        if cached is not None and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            content_hash = cached['sha256']
+        else:
+            content_hash = None if cached is not None and cached['size'] != stat.st_size else _file_hash(path)
+        fingerprint.append({'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': content_hash})
+    return fingerprint
+
+def _fingerprint_matches(stored, current):
+    return [(entry['path'], entry['size'], entry['sha256']) for entry in stored] == \
+           [(entry['path'], entry['size'], entry['sha256']) for entry in current]
+
+def _column_kind(series):
+    if isinstance(series.dtype, np.dtype) and (pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series)):
+        return 'numeric'
+    if pd.api.types.is_datetime64_dtype(series):
+        return 'datetime'
+    if isinstance(series.dtype, pd.CategoricalDtype) and all(isinstance(category, str) for category in series.cat.categories):
+        return 'category'
+    if series.dtype == object:
+        # infer_dtype duyệt cột trong C; 'empty' là cột rỗng / toàn giá trị thiếu
+        inferred = pd.api.types.infer_dtype(series, skipna=True)
+        if inferred == 'date':
+            return 'date'
+        if inferred in ('string', 'empty'):
+            return 'string'
+    return 'pickle'
+
+def _save_frame(df, frame_dir):
+    """Mỗi cột một file .npy; chuỗi lưu dạng mã số + bảng giá trị để không phải parse khi tải."""
+    os.makedirs(frame_dir)
+    has_default_index = isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1
+    columns = []
+    for position, (name, series) in enumerate(list(df.items()) + ([] if has_default_index else [('__index__', df.index.to_series())])):
+        kind = _column_kind(series)
+        file_stem = os.path.join(frame_dir, f'{position}')
+        if kind == 'numeric':
+            np.save(f'{file_stem}.npy', series.to_numpy())
+        elif kind == 'datetime':
+            np.save(f'{file_stem}.npy', series.to_numpy(dtype='datetime64[ns]'))
+        elif kind == 'date':
+            np.save(f'{file_stem}.npy', pd.to_datetime(series).to_numpy(dtype='datetime64[D]'))
+        elif kind == 'category':
+            np.save(f'{file_stem}.npy', series.cat.codes.to_numpy())
+            np.save(f'{file_stem}_values.npy', np.asarray(series.cat.categories, dtype=str))
+        elif kind == 'string':
+            codes, categories = pd.factorize(series, use_na_sentinel=True)
+            np.save(f'{file_stem}.npy', codes.astype(np.int32))
+            np.save(f'{file_stem}_values.npy', np.asarray(categories, dtype=str))
+        else:
+            np.save(f'{file_stem}.npy', series.to_numpy(dtype=object), allow_pickle=True)
+        columns.append({'name': name, 'kind': kind, 'dtype': str(series.dtype), 'file': f'{position}'})
+    return {'columns': columns, 'length': len(df)}
+
+def _load_frame(frame_dir, frame_manifest):
+    data, index = {}, None
+    for column in frame_manifest['columns']:
+        file_stem = os.path.join(frame_dir, column['file'])
+        kind = column['kind']
+        if kind in ('numeric', 'datetime'):
+            values = np.load(f'{file_stem}.npy')
+        elif kind == 'date':
+            # Chỉ đổi các ngày khác nhau sang datetime.date rồi ánh xạ ngược (lịch bay có ít ngày khác nhau)
+            unique_days, inverse = np.unique(np.load(f'{file_stem}.npy'), return_inverse=True)
+            values = np.array([None if pd.isna(day) else day.date() for day in pd.to_datetime(unique_days)], dtype=object)[inverse]
+        elif kind == 'category':
+            values = pd.Categorical.from_codes(np.load(f'{file_stem}.npy'), np.load(f'{file_stem}_values.npy').astype(object))
+        elif kind == 'string':
+            codes = np.load(f'{file_stem}.npy')
+            categories = np.load(f'{file_stem}_values.npy').astype(object)
+            values = np.where(codes >= 0, categories[np.maximum(codes, 0)] if len(categories) else None, np.nan)
+        else:
+            values = np.load(f'{file_stem}.npy', allow_pickle=True)
+        if column['name'] == '__index__':
+            index = pd.Index(values)
+        else:
+            data[column['name']] = values
+    return pd.DataFrame(data, index=index if index is not None else pd.RangeIndex(frame_manifest['length']))
+
+def _read_manifest(manifest_path):
+    """Manifest/chỉ mục JSON đã lưu, hoặc None nếu chưa có, hỏng hoặc khác phiên bản định dạng."""
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == CACHE_FORMAT_VERSION else None
+
+def _concat_frames(frames):
+    """Nối các frame đọc từ nhiều phần; cột category ở mọi phần được giữ là category (gộp bảng giá trị)."""
+    if len(frames) == 1:
+        return frames[0]
+    result = pd.concat(frames, ignore_index=True)
+    for column in frames[0].columns:
+        if all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            result[column] = pd.api.types.union_categoricals([frame[column] for frame in frames])
+    return result
+
+def load_or_build(name, source_paths, build_fn, cache_dir=None):
+    """
+    Trả về kết quả đã chuẩn bị của build_fn() (một DataFrame hoặc tuple các DataFrame), đọc từ cache cột
+    trên đĩa nếu các file nguồn không đổi (kích thước + hash nội dung), ngược lại gọi build_fn() và ghi lại cache.
+
+    Cache nằm ở `cache_dir` (mặc định thư mục `.atfm_cache` cạnh file nguồn đầu tiên), mỗi cột là một file .npy
+    nên khi tải không cần parse CSV, ghép chuỗi ngày giờ hay merge lại. Lỗi ghi cache (thư mục chỉ đọc, hết chỗ)
+    không làm hỏng việc tải dữ liệu.
+    """
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(source_paths[0])), CACHE_DIR_NAME)
+    entry_dir = os.path.join(cache_dir, name)
+    manifest_path = os.path.join(entry_dir, 'manifest.json')
+
+    manifest = _read_manifest(manifest_path)
+    fingerprint = source_fingerprint(source_paths, manifest['sources'] if manifest else None)
+    if manifest is not None and _fingerprint_matches(manifest['sources'], fingerprint):
+        try:
+            frames = tuple(_load_frame(os.path.join(entry_dir, str(i)), frame) for i, frame in enumerate(manifest['frames']))
+            if manifest['sources'] != fingerprint:
+                # File bị "touch" nhưng nội dung không đổi: cập nhật mtime để lần sau khỏi tính hash
+                manifest['sources'] = fingerprint
+                with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+                    json.dump(manifest, manifest_file)
+            return frames if manifest['is_tuple'] else frames[0]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    result = build_fn()
+    frames = result if isinstance(result, tuple) else (result,)
+    fingerprint = [entry if entry['sha256'] else dict(entry, sha256=_file_hash(entry['path'])) for entry in fingerprint]
+    staging_dir = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=f'{name}.', dir=cache_dir)
+        frame_manifests = [_save_frame(frame, os.path.join(staging_dir, str(i))) for i, frame in enumerate(frames)]
+        with open(os.path.join(staging_dir, 'manifest.json'), 'w', encoding='utf-8') as manifest_file:
+            json.dump({'version': CACHE_FORMAT_VERSION, 'sources': fingerprint, 'frames': frame_manifests,
+                       'is_tuple': isinstance(result, tuple)}, manifest_file)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(staging_dir, entry_dir)
+    except (OSError, TypeError, ValueError):
+        if staging_dir is not None:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    return result
+
+class PartitionedFrameStore:
+    """
+    Bảng dữ liệu (ví dụ lịch bay nhiều tháng) lưu trên đĩa theo phân vùng ngày của cột `partition_column`.
+
+    Mỗi ngày là một thư mục gồm một hoặc vài phần (mỗi khối dữ liệu lúc dựng sinh một phần), mỗi phần là một
+    frame cột .npy như load_or_build. Chỉ mục nhỏ (partitions.json) chỉ ghi số dòng và giá trị nhỏ/lớn nhất
+    của từng ngày, nên chọn một ngày chỉ đọc đúng thư mục của ngày đó, không tải cả lịch bay.
+    """
+
+    def __init__(self, store_dir, index):
+        self.store_dir = store_dir
+        self.partition_column = index['partition_column']
+        self._partitions = index['partitions']
+        self.dates = [datetime.date.fromisoformat(key) for key in sorted(self._partitions)]
+
+    def __len__(self):
+        return sum(partition['rows'] for partition in self._partitions.values())
+
+    def row_count(self, day):
+        partition = self._partitions.get(pd.Timestamp(day).strftime('%Y-%m-%d'))
+        return partition['rows'] if partition else 0
+
+    def _read_partition(self, key):
+        frames = []
+        for part in self._partitions[key]['parts']:
+            part_dir = os.path.join(self.store_dir, key, part)
+            with open(os.path.join(part_dir, 'manifest.json'), encoding='utf-8') as manifest_file:
+                frames.append(_load_frame(part_dir, json.load(manifest_file)))
+        return _concat_frames(frames)
+
+    def _empty_frame(self):
+        key = next(iter(self._partitions), None)
+        return self._read_partition(key).iloc[0:0] if key else pd.DataFrame()
+
+    def read_date(self, day, spill_over_hours=0):
+        """
+        Các dòng có `partition_column` thuộc ngày `day`. Với spill_over_hours > 0 kèm thêm các dòng của (các)
+        ngày trước có giá trị từ (0h ngày `day` - spill_over_hours) trở đi, ví dụ chuyến khởi hành tối hôm
+        trước và hạ cánh sau nửa đêm. Ngày trước chỉ được đọc khi chỉ mục cho thấy nó có dòng trong cửa sổ đó.
+        """
+        day_start = pd.Timestamp(day).normalize()
+        window_start = day_start - pd.Timedelta(hours=spill_over_hours)
+        frames = []
+        previous_day = window_start.normalize()
+        while previous_day < day_start:
+            key = previous_day.strftime('%Y-%m-%d')
+            partition = self._partitions.get(key)
+            if partition and pd.Timestamp(partition['max']) >= window_start:
+                frame = self._read_partition(key)
+                frames.append(frame[frame[self.partition_column] >= window_start])
+            previous_day += pd.Timedelta(days=1)
+        key = day_start.strftime('%Y-%m-%d')
+        if key in self._partitions:
+            frames.append(self._read_partition(key))
+        if not frames:
+            return self._empty_frame()
+        return _concat_frames([frame.reset_index(drop=True) for frame in frames])
+
+    def iter_chunks(self, start=None, end=None, days_per_chunk=7):
+        """
+        Duyệt các ngày từ `start` tới `end` (gồm cả hai đầu, None = hết dữ liệu) theo từng khối `days_per_chunk`
+        ngày, trả về (danh sách ngày, DataFrame). Mỗi lần chỉ một khối nằm trong bộ nhớ, nên có thể xử lý
+        lịch bay nhiều tháng với bộ nhớ giới hạn.
+        """
+        dates = [day for day in self.dates
+                 if (start is None or day >= pd.Timestamp(start).date()) and (end is None or day <= pd.Timestamp(end).date())]
+        for first in range(0, len(dates), days_per_chunk):
+            chunk_dates = dates[first:first + days_per_chunk]
+            yield chunk_dates, _concat_frames([self._read_partition(day.isoformat()) for day in chunk_dates])
+
+def _write_partitions(store_dir, chunks, partition_column):
+    partitions = {}
+    for chunk_number, chunk in enumerate(chunks):
+        # Thứ tự dòng trong mỗi ngày giữ như nguồn
+        chunk = chunk[chunk[partition_column].notna()]
+        day_keys = chunk[partition_column].dt.strftime('%Y-%m-%d')
+        for key, part in chunk.groupby(day_keys.to_numpy(), sort=False):
+            part_dir = os.path.join(store_dir, key, f'{chunk_number:05d}')
+            frame_manifest = _save_frame(part.reset_index(drop=True), part_dir)
+            with open(os.path.join(part_dir, 'manifest.json'), 'w', encoding='utf-8') as manifest_file:
+                json.dump(frame_manifest, manifest_file)
+            low, high = part[partition_column].min().isoformat(), part[partition_column].max().isoformat()
+            partition = partitions.setdefault(key, {'rows': 0, 'min': low, 'max': high, 'parts': []})
+            partition['rows'] += len(part)
+            partition['min'], partition['max'] = min(partition['min'], low), max(partition['max'], high)
+            partition['parts'].append(f'{chunk_number:05d}')
+    return partitions
+
+def open_partitioned(name, source_paths, build_chunks_fn, partition_column, cache_dir=None):
+    """
+    Trả về PartitionedFrameStore của dữ liệu do build_chunks_fn() sinh ra theo từng khối (ví dụ từng khối
+    pd.read_csv(chunksize=...) đã tiền xử lý), phân vùng theo ngày của cột thời gian `partition_column`
+    (dòng thiếu giá trị bị bỏ). Mỗi khối được chia theo ngày và ghi ngay xuống đĩa rồi giải phóng, nên lịch bay
+    nhiều tháng được dựng với bộ nhớ cỡ một khối.
+
+    Giống load_or_build: kho được dùng lại cho tới khi các file nguồn đổi nội dung. Nếu không ghi được vào
+    `cache_dir` thì kho được dựng trong một thư mục tạm và không được dùng lại ở lần sau.
+    """
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(source_paths[0])), CACHE_DIR_NAME)
+    store_dir = os.path.join(cache_dir, name)
+    index_path = os.path.join(store_dir, PARTITION_INDEX_NAME)
+
+    index = _read_manifest(index_path)
+    fingerprint = source_fingerprint(source_paths, index['sources'] if index else None)
+    if index is not None and _fingerprint_matches(index['sources'], fingerprint) and index.get('partition_column') == partition_column:
+        if index['sources'] != fingerprint:
+            index['sources'] = fingerprint
+            try:
+                with open(index_path, 'w', encoding='utf-8') as index_file:
+                    json.dump(index, index_file)
+            except OSError:
+                pass
+        return PartitionedFrameStore(store_dir, index)
+
+    fingerprint = [entry if entry['sha256'] else dict(entry, sha256=_file_hash(entry['path'])) for entry in fingerprint]
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=f'{name}.', dir=cache_dir)
+    except OSError:
+        staging_dir = store_dir = tempfile.mkdtemp(prefix=f'{name}.')
+    index = _build_partitioned(staging_dir, build_chunks_fn(), partition_column, fingerprint)
+    if staging_dir != store_dir:
+        shutil.rmtree(store_dir, ignore_errors=True)
+        os.replace(staging_dir, store_dir)
+    return PartitionedFrameStore(store_dir, index)
+
+def _build_partitioned(staging_dir, chunks, partition_column, sources):
+    """Ghi các khối và chỉ mục vào staging_dir; lỗi giữa chừng thì xóa staging_dir rồi ném lại lỗi."""
+    try:
+        index = {'version': CACHE_FORMAT_VERSION, 'sources': sources, 'partition_column': partition_column,
+                 'partitions': _write_partitions(staging_dir, chunks, partition_column)}
+        with open(os.path.join(staging_dir, PARTITION_INDEX_NAME), 'w', encoding='utf-8') as index_file:
+            json.dump(index, index_file)
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    return index
+
+def write_partitioned(store_dir, chunks, partition_column):
+    """
+    Ghi các khối DataFrame thành một kho phân vùng theo ngày độc lập (không gắn với file nguồn) tại `store_dir`,
+    thay thế kho cũ nếu có. Mỗi khối được ghi xuống đĩa rồi giải phóng. Mở lại bằng open_partitioned_store.
+    """
+    store_dir = os.path.abspath(store_dir)
+    parent_dir = os.path.dirname(store_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix=f'{os.path.basename(store_dir)}.', dir=parent_dir)
+    index = _build_partitioned(staging_dir, chunks, partition_column, [])
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(staging_dir, store_dir)
+    return PartitionedFrameStore(store_dir, index)
+
+def open_partitioned_store(store_dir):
+    """Mở kho do write_partitioned ghi; ValueError nếu thư mục không có chỉ mục hợp lệ."""
+    index = _read_manifest(os.path.join(store_dir, PARTITION_INDEX_NAME))
+    if index is None:
+        raise ValueError(f"'{store_dir}' không phải kho phân vùng (thiếu hoặc sai phiên bản {PARTITION_INDEX_NAME}).")
+    return PartitionedFrameStore(store_dir, index)
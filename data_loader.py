@@ -3,6 +3,28 @@ import pandas as pd
 import streamlit as st
 from datetime import timedelta
 from .config import VVTS_CONFIG
+from .data_cache import load_or_build
+from .flight_records import AirportTable, encode_categorical_columns
+
+def _prepare_data(schedule_path, eets_path):
+    """Đọc hai file CSV, ghép ngày giờ EOBT, đổi sang UTC và gắn EET/taxi của sân bay đi/đến."""
+    flights_df = pd.read_csv(schedule_path)
+    eets_df = pd.read_csv(eets_path)
+
+    flights_df['eobt_local'] = pd.to_datetime(flights_df['flight_date'] + ' ' + flights_df['eobt'], format='%Y-%m-%d %H:%M', errors='coerce')
+    flights_df.dropna(subset=['eobt_local'], inplace=True)
+    flights_df['eobt_utc'] = flights_df['eobt_local'] - timedelta(hours=VVTS_CONFIG['TIMEZONE_OFFSET_HOURS'])
+    flights_df['flight_date'] = flights_df['eobt_local'].dt.date
+
+    # EET/taxi của sân bay đi (tên cột gốc) và sân bay đến (hậu tố _dest) tra từ bảng chiều sân bay, không merge
+    flights_df = flights_df.reset_index(drop=True)
+    airports = AirportTable(eets_df)
+    for code_column, suffix in (('origin', ''), ('destination', '_dest')):
+        positions = airports.positions(flights_df[code_column])
+        for column in eets_df.columns.drop('airport_code'):
+            flights_df[f'{column}{suffix}'] = airports.lookup(column, positions)
+
+    return encode_categorical_columns(flights_df, ('callsign', 'origin', 'destination', 'aircraft_type'))
 
 @st.cache_data
 def load_and_prepare_data():
@@ -17,19 +39,9 @@ def load_and_prepare_data():
         if not os.path.exists(schedule_path) or not os.path.exists(eets_path):
             st.error(f"Lỗi: Không tìm thấy file dữ liệu trong '{data_dir}'. Vui lòng chạy 'generate_data.py' trước.")
             return None
-            
-        flights_df = pd.read_csv(schedule_path)
-        eets_df = pd.read_csv(eets_path)
-        
-        flights_df['eobt_local'] = pd.to_datetime(flights_df['flight_date'] + ' ' + flights_df['eobt'], format='%Y-%m-%d %H:%M', errors='coerce')
-        flights_df.dropna(subset=['eobt_local'], inplace=True)
-        flights_df['eobt_utc'] = flights_df['eobt_local'] - timedelta(hours=VVTS_CONFIG['TIMEZONE_OFFSET_HOURS'])
-        flights_df['flight_date'] = flights_df['eobt_local'].dt.date
-
-        flights_df = pd.merge(flights_df, eets_df, left_on='origin', right_on='airport_code', how='left', suffixes=('', '_origin'))
-        flights_df = pd.merge(flights_df, eets_df, left_on='destination', right_on='airport_code', how='left', suffixes=('', '_dest'))
 
-        return flights_df.drop(columns=['airport_code', 'airport_code_dest'], errors='ignore')
+        # Cache cột trên đĩa (data/.atfm_cache), tự làm mới khi một trong hai file CSV thay đổi
+        return load_or_build('load_and_prepare_data', [schedule_path, eets_path], lambda: _prepare_data(schedule_path, eets_path))
 
     except Exception as e:
         st.error(f"Lỗi nghiêm trọng khi tải dữ liệu: {e}")
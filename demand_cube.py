@@ -0,0 +1,261 @@
+# atfm_core/demand_cube.py
+
+import numpy as np
+import pandas as pd
+
+# Khối nhu cầu: số chuyến theo (ngày x ô 15 phút x luồng x sân bay đối ứng x hãng x kịch bản), dựng bằng một lần
+# np.bincount khi tải dữ liệu hoặc sinh một kịch bản. Biểu đồ, phân tích và engine GDP đọc nhu cầu bằng cắt mảng và
+# cộng theo trục thay vì groupby trên DataFrame. Thời gian là giờ "tường" của dữ liệu đưa vào: giờ địa phương cho
+# biểu đồ / phân tích, UTC cho engine GDP. Khối theo phút (bin_minutes=1) còn cho RollingDemandIndex: tổng tiền tố để
+# đếm số chuyến trong cửa sổ trượt bất kỳ (năng lực công bố theo cửa sổ 60 phút, kiểm tra mỗi 15 phút).
+
+FLOWS = ('arrival', 'departure')
+BIN_MINUTES = 15
+MINUTES_PER_DAY = 24 * 60
+SECONDS_PER_MINUTE = 60
+# Các trục có thể tách ngoài thời gian / luồng / kịch bản; trục không tách chỉ có một nhãn ALL
+CUBE_DIMENSIONS = ('airport', 'airline')
+ALL = '*'
+# Cửa sổ trượt mặc định: năng lực theo giờ kiểm tra trên cửa sổ 60 phút, bắt đầu mỗi 15 phút
+ROLLING_WINDOW_MINUTES = 60
+ROLLING_STEP_MINUTES = 15
+
+class DemandCube:
+    """
+    `counts` có shape (ngày, ô thời gian trong ngày, luồng, sân bay đối ứng, hãng, kịch bản), kiểu int32.
+    Sân bay đối ứng là sân bay đi của chuyến đến, sân bay đến của chuyến đi; hãng là 3 ký tự đầu của callsign.
+    Ngày thứ d bắt đầu lúc start_date + d ngày (giờ tường).
+    """
+
+    def __init__(self, counts, start_date, bin_minutes, airports, airlines, scenarios):
+        self.counts = counts
+        self.start_date = pd.Timestamp(start_date).normalize()
+        self.bin_minutes = bin_minutes
+        self.airports = pd.Index(airports)
+        self.airlines = pd.Index(airlines)
+        self.scenarios = pd.Index(scenarios)
+
+    @property
+    def days(self):
+        return self.counts.shape[0]
+
+    @property
+    def bins_per_day(self):
+        return self.counts.shape[1]
+
+    @classmethod
+    def from_flights(cls, scenarios, start_date=None, days=None, bin_minutes=BIN_MINUTES, dimensions=CUBE_DIMENSIONS):
+        """
+        Dựng khối từ các DataFrame chuyến bay. `scenarios` là {tên kịch bản: (flights_df, thời gian)}, thời gian là tên
+        cột hoặc Series cùng index với flights_df (giờ tường, naive hoặc tz-aware). flights_df cần cột 'flight_type', và
+        'origin'/'destination' hoặc 'callsign' nếu `dimensions` có 'airport' / 'airline'.
+
+        Mặc định khoảng ngày phủ mọi chuyến; chuyến thiếu thời gian hoặc nằm ngoài [start_date, start_date + days)
+        không được đếm.
+        """
+        unknown = set(dimensions) - set(CUBE_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Trục không hợp lệ: {sorted(unknown)}; chỉ có {CUBE_DIMENSIONS}.")
+        if MINUTES_PER_DAY % bin_minutes:
+            raise ValueError(f"bin_minutes={bin_minutes} phải chia hết số phút trong ngày.")
+
+        time_ns, flow, airport, airline, scenario = [], [], [], [], []
+        for code, (flights_df, times) in enumerate(scenarios.values()):
+            times = pd.to_datetime(flights_df[times] if isinstance(times, str) else times)
+            if times.dt.tz is not None:
+                times = times.dt.tz_localize(None)
+            time_ns.append(times.to_numpy(dtype='datetime64[ns]').astype(np.int64))
+            flow.append(pd.Categorical(flights_df['flight_type'], categories=FLOWS).codes)
+            is_arrival = flow[-1] == 0
+            if 'airport' in dimensions:
+                airport.append(np.where(is_arrival, flights_df['origin'].astype(str).to_numpy(), flights_df['destination'].astype(str).to_numpy()))
+            if 'airline' in dimensions:
+                airline.append(flights_df['callsign'].astype(str).str[:3].to_numpy())
+            scenario.append(np.full(len(flights_df), code, dtype=np.int64))
+
+        time_ns = np.concatenate(time_ns) if time_ns else np.empty(0, dtype=np.int64)
+        has_time = time_ns != np.iinfo(np.int64).min
+        airport_codes, airports = pd.factorize(np.concatenate(airport), sort=True) if airport else (0, [ALL])
+        airline_codes, airlines = pd.factorize(np.concatenate(airline), sort=True) if airline else (0, [ALL])
+
+        if start_date is None:
+            start_date = pd.Timestamp(time_ns[has_time].min()).normalize() if has_time.any() else pd.Timestamp(0)
+        start_date = pd.Timestamp(start_date).normalize()
+        minutes = (time_ns - start_date.value) // (10**9 * SECONDS_PER_MINUTE)
+        if days is None:
+            days = int(minutes[has_time].max()) // MINUTES_PER_DAY + 1 if has_time.any() else 0
+
+        bins = np.where(has_time, minutes, -1) // bin_minutes
+        return cls._count(bins, np.concatenate(flow) if flow else bins, airport_codes, airline_codes,
+                          np.concatenate(scenario) if scenario else bins, start_date, days, bin_minutes,
+                          airports, airlines, list(scenarios))
+
+    @classmethod
+    def from_epoch_seconds(cls, times_s, is_arrival, is_departure, scenario='pre_tactical', bin_minutes=BIN_MINUTES):
+        """Khối chỉ có thời gian x luồng từ mảng giây epoch (dạng dùng trong engine GDP); chuyến không thuộc luồng nào không được đếm."""
+        times_s = np.asarray(times_s, dtype=np.int64)
+        counted = np.asarray(is_arrival) | np.asarray(is_departure)
+        if not counted.any():
+            return cls._count(np.empty(0, dtype=np.int64), 0, 0, 0, 0, pd.Timestamp(0), 0, bin_minutes, [ALL], [ALL], [scenario])
+        start_s = int(times_s[counted].min()) // (MINUTES_PER_DAY * SECONDS_PER_MINUTE) * MINUTES_PER_DAY * SECONDS_PER_MINUTE
+        minutes = (times_s - start_s) // SECONDS_PER_MINUTE
+        days = int(minutes[counted].max()) // MINUTES_PER_DAY + 1
+        bins = np.where(counted, minutes, -1) // bin_minutes
+        return cls._count(bins, np.where(is_arrival, 0, 1), 0, 0, 0, pd.Timestamp(start_s, unit='s'), days, bin_minutes,
+                          [ALL], [ALL], [scenario])
+
+    @classmethod
+    def _count(cls, bins, flow, airport, airline, scenario, start_date, days, bin_minutes, airports, airlines, scenarios):
+        # Một lần np.bincount trên chỉ số phẳng của (ô thời gian, luồng, sân bay, hãng, kịch bản)
+        shape = (days * (MINUTES_PER_DAY // bin_minutes), len(FLOWS), len(airports), len(airlines), len(scenarios))
+        codes = [np.broadcast_to(np.asarray(values, dtype=np.int64), bins.shape) for values in (bins, flow, airport, airline, scenario)]
+        counted = (codes[0] >= 0) & (codes[0] < shape[0]) & (codes[1] >= 0)
+        flat = np.ravel_multi_index(tuple(values[counted] for values in codes), shape)
+        counts = np.bincount(flat, minlength=int(np.prod(shape))).astype(np.int32)
+        return cls(counts.reshape(days, MINUTES_PER_DAY // bin_minutes, *shape[1:]), start_date, bin_minutes, airports, airlines, scenarios)
+
+    def _day_range(self, start_date, days):
+        """(vị trí ngày đầu so với start_date của khối, số ngày) của khoảng cần đọc; mặc định toàn khối."""
+        first_day = 0 if start_date is None else (pd.Timestamp(start_date).normalize() - self.start_date).days
+        return first_day, self.days - first_day if days is None else days
+
+    def select(self, flow=None, scenario=None, airport=None, airline=None, start_date=None, days=None):
+        """
+        Số chuyến theo ô thời gian (mảng 1 chiều, các ngày nối tiếp nhau) trong [start_date, start_date + days),
+        sau khi chọn các nhãn đã cho (một nhãn hoặc danh sách) và cộng các trục còn lại. Ngày ngoài khối có số chuyến 0.
+        """
+        first_day, days = self._day_range(start_date, days)
+        selected = self.counts[max(first_day, 0):max(first_day + days, 0)]
+        for axis, labels, value in ((2, pd.Index(FLOWS), flow), (3, self.airports, airport), (4, self.airlines, airline), (5, self.scenarios, scenario)):
+            if value is not None:
+                positions = labels.get_indexer([value] if isinstance(value, str) else list(value))
+                selected = np.take(selected, positions[positions >= 0], axis=axis)
+        per_bin = selected.sum(axis=(2, 3, 4, 5), dtype=np.int64).reshape(-1)
+
+        result = np.zeros(days * self.bins_per_day, dtype=np.int64)
+        offset = max(-first_day, 0) * self.bins_per_day
+        result[offset:offset + len(per_bin)] = per_bin[:len(result) - offset]
+        return result
+
+    def series(self, flow=None, scenario=None, airport=None, airline=None, freq_minutes=60, start_date=None, days=None):
+        """
+        Như select nhưng gộp theo khoảng `freq_minutes` (bội của bin_minutes, chia hết số phút trong ngày) và trả về
+        Series có index là thời điểm đầu mỗi khoảng (giờ tường).
+        """
+        if freq_minutes % self.bin_minutes or MINUTES_PER_DAY % freq_minutes:
+            raise ValueError(f"freq_minutes={freq_minutes} phải là bội của {self.bin_minutes} và chia hết số phút trong ngày.")
+        first_day, _ = self._day_range(start_date, days)
+        values = self.select(flow, scenario, airport, airline, start_date, days)
+        values = values.reshape(-1, freq_minutes // self.bin_minutes).sum(axis=1)
+        index = pd.date_range(self.start_date + pd.Timedelta(days=first_day), periods=len(values), freq=f'{freq_minutes}min')
+        return pd.Series(values, index=index)
+
+    def hour_counts_s(self, flow=None, scenario=None):
+        """(đầu giờ dạng giây epoch của giờ tường, số chuyến) của các giờ có chuyến, theo thứ tự thời gian."""
+        per_hour = self.select(flow, scenario).reshape(-1, 60 // self.bin_minutes).sum(axis=1)
+        hours = np.flatnonzero(per_hour)
+        return self.start_date.value // 10**9 + hours * 60 * SECONDS_PER_MINUTE, per_hour[hours]
+
+class RollingDemandIndex:
+    """
+    Tổng tiền tố số chuyến theo phút: `cumulative[f, m]` là số chuyến của luồng f (arrival, departure, rồi tổng hai
+    luồng) trong m phút đầu kể từ `start` (giờ tường). Số chuyến trong [t, t + w) là cumulative[t + w] - cumulative[t],
+    nên mỗi truy vấn là O(1) và mọi cửa sổ trượt được đếm bằng một phép trừ mảng. Thời điểm được làm tròn xuống phút;
+    phút ngoài chỉ mục có số chuyến 0.
+    """
+
+    def __init__(self, cumulative, start):
+        self.cumulative = cumulative
+        self.start = pd.Timestamp(start)
+
+    @classmethod
+    def from_cube(cls, demand_cube, scenario=None):
+        """Chỉ mục của một khối nhu cầu theo phút (bin_minutes=1), cộng mọi trục trừ thời gian và luồng."""
+        if demand_cube.bin_minutes != 1:
+            raise ValueError(f"Chỉ mục cửa sổ trượt cần khối theo phút (bin_minutes=1), nhận được bin_minutes={demand_cube.bin_minutes}.")
+        per_minute = np.stack([demand_cube.select(flow, scenario) for flow in FLOWS])
+        per_minute = np.vstack([per_minute, per_minute.sum(axis=0)])
+        cumulative = np.zeros((per_minute.shape[0], per_minute.shape[1] + 1), dtype=np.int64)
+        np.cumsum(per_minute, axis=1, out=cumulative[:, 1:])
+        return cls(cumulative, demand_cube.start_date)
+
+    @property
+    def minutes(self):
+        return self.cumulative.shape[1] - 1
+
+    @property
+    def start_s(self):
+        return self.start.value // 10**9
+
+    def _minute_of(self, times):
+        """Vị trí phút so với start (làm tròn xuống) của một thời điểm hoặc mảng thời điểm giờ tường (naive hoặc tz-aware)."""
+        if np.ndim(times) == 0:
+            times = pd.Timestamp(times)
+            times = times.tz_localize(None) if times.tz is not None else times
+            return (times - self.start) // pd.Timedelta(minutes=1)
+        times = pd.DatetimeIndex(times)
+        times = times.tz_localize(None) if times.tz is not None else times
+        return ((times - self.start) // pd.Timedelta(minutes=1)).to_numpy()
+
+    def _window_counts(self, flow, first_minutes, window_minutes):
+        row = self.cumulative[len(FLOWS) if flow is None else FLOWS.index(flow)]
+        return row[np.clip(first_minutes + window_minutes, 0, self.minutes)] - row[np.clip(first_minutes, 0, self.minutes)]
+
+    def _window_starts(self, step_minutes, start, end):
+        first = 0 if start is None else self._minute_of(start)
+        last = self.minutes if end is None else self._minute_of(end)
+        return np.arange(first, last, step_minutes, dtype=np.int64)
+
+    def count(self, start, window_minutes=ROLLING_WINDOW_MINUTES, flow=None):
+        """Số chuyến trong [start, start + window_minutes) của luồng `flow` (None: cả hai luồng); start là thời điểm hoặc mảng thời điểm."""
+        return self._window_counts(flow, self._minute_of(start), window_minutes)
+
+    def rolling(self, flow=None, window_minutes=ROLLING_WINDOW_MINUTES, step_minutes=ROLLING_STEP_MINUTES, start=None, end=None):
+        """
+        Series số chuyến của các cửa sổ [t, t + window_minutes) với t = start, start + step_minutes, ... < end
+        (mặc định toàn chỉ mục); index là t (giờ tường). step_minutes = window_minutes = 60 là đếm theo giờ cố định.
+        """
+        starts = self._window_starts(step_minutes, start, end)
+        return pd.Series(self._window_counts(flow, starts, window_minutes), index=self.start + pd.to_timedelta(starts, unit='min'))
+
+    def window_capacity(self, first_minutes, window_minutes, hourly_capacity):
+        """
+        Năng lực của các cửa sổ bắt đầu tại `first_minutes` (vị trí phút): tích phân năng lực theo giờ trên cửa sổ
+        (mỗi phút được capacity(giờ chứa phút đó) / 60), cũng bằng tổng tiền tố, nên cửa sổ trùng đúng một giờ có năng lực
+        của giờ đó. `hourly_capacity` là một số (lượt/giờ) hoặc hàm nhận mảng đầu giờ (giây epoch của giờ tường).
+        """
+        first_minutes = np.asarray(first_minutes, dtype=np.int64)
+        if np.ndim(hourly_capacity) == 0 and not callable(hourly_capacity):
+            return np.full(len(first_minutes), hourly_capacity * window_minutes / 60)
+        if not len(first_minutes):
+            return np.empty(0)
+        span = np.arange(first_minutes.min(), first_minutes.max() + window_minutes)
+        minute_hour = (self.start_s + span * SECONDS_PER_MINUTE) // 3600
+        hours_s = np.arange(minute_hour[0], minute_hour[-1] + 1) * 3600
+        per_minute = np.asarray(hourly_capacity(hours_s), dtype=float)[minute_hour - minute_hour[0]]
+        cumulative = np.concatenate([[0.0], np.cumsum(per_minute)])
+        offset = first_minutes - first_minutes.min()
+        return (cumulative[offset + window_minutes] - cumulative[offset]) / 60
+
+    def overloads(self, flow, hourly_capacity, window_minutes=ROLLING_WINDOW_MINUTES, step_minutes=ROLLING_STEP_MINUTES, start=None, end=None):
+        """
+        Chuỗi quá tải cửa sổ trượt trong một lượt: DataFrame (index là đầu cửa sổ, giờ tường) các cột demand, capacity
+        (xem window_capacity) và excess = demand - capacity; cửa sổ quá tải là các dòng có excess > 0.
+        """
+        starts = self._window_starts(step_minutes, start, end)
+        demand = self._window_counts(flow, starts, window_minutes)
+        capacity = self.window_capacity(starts, window_minutes, hourly_capacity)
+        return pd.DataFrame({'demand': demand, 'capacity': capacity, 'excess': demand - capacity},
+                            index=self.start + pd.to_timedelta(starts, unit='min'))
+
+    def overloaded_hours_s(self, flow, hourly_capacity, window_minutes=ROLLING_WINDOW_MINUTES, step_minutes=ROLLING_STEP_MINUTES):
+        """
+        Các giờ (đầu giờ dạng giây epoch của giờ tường, đã sắp xếp) giao với ít nhất một cửa sổ quá tải trên toàn chỉ mục.
+        Với step_minutes = window_minutes = 60 đây đúng là các giờ cố định có số chuyến vượt năng lực.
+        """
+        starts = self._window_starts(step_minutes, None, None)
+        overloaded = starts[self._window_counts(flow, starts, window_minutes) > self.window_capacity(starts, window_minutes, hourly_capacity)]
+        first_hour = (self.start_s + overloaded * SECONDS_PER_MINUTE) // 3600
+        last_hour = (self.start_s + (overloaded + window_minutes - 1) * SECONDS_PER_MINUTE) // 3600
+        candidates = first_hour[:, None] + np.arange((window_minutes - 1) // 60 + 2)
+        return np.unique(candidates[candidates <= last_hour[:, None]]) * 3600
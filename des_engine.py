@@ -0,0 +1,270 @@
+# atfm_core/des_engine.py
+
+import heapq
+import numpy as np
+import pandas as pd
+from .system_state import FLIGHT_PHASES
+
+# Các mốc của một chuyến bay theo thứ tự xảy ra; chuyến bị điều tiết có mốc tại VVTS là CTOT (chuyến đi) / CLDT (chuyến đến)
+MILESTONES = ('EOBT', 'ETOT', 'ELDT', 'CTOT', 'CLDT')
+NUM_STAGES = 3
+# Pha của chuyến bay sau khi mốc EOBT / ETOT / ELDT xảy ra
+_STAGE_PHASE_CODES = np.array([FLIGHT_PHASES.index(phase) for phase in ('off_block', 'airborne', 'landed')], dtype=np.int8)
+_NO_TIME = np.iinfo(np.int64).min
+_END_OF_TIME = np.iinfo(np.int64).max
+
+class DiscreteEventEngine:
+    """
+    Động cơ mô phỏng sự kiện rời rạc chạy đồng hồ của một SystemState qua các mốc EOBT, ETOT, ELDT
+    (hoặc thời gian điều tiết) của từng chuyến bay.
+
+    Hàng đợi ưu tiên chỉ giữ mốc kế tiếp của mỗi chuyến: khi một mốc xảy ra, mốc sau của chuyến đó mới được
+    đưa vào hàng đợi. Khi GDP được kích hoạt, các mốc chưa xảy ra của chuyến bị điều tiết được dời theo độ trễ;
+    bản ghi cũ trong hàng đợi bị bỏ qua nhờ số phiên bản (xóa lười).
+
+    Ba chế độ chạy: `step` (tới mốc kế tiếp), `run_until` (tới một thời điểm, có nhật ký sự kiện) và
+    `fast_forward` (xử lý theo lô bằng numpy giữa các lần kích hoạt GDP, không ghi nhật ký).
+    """
+
+    def __init__(self, system_state):
+        self.state = system_state
+        schedule = system_state.master_schedule
+        n = len(schedule)
+
+        # Độ lệch UTC -> giờ địa phương của từng chuyến, suy ra từ cặp event_time_utc / event_time_local
+        event_utc = self._naive_ns(schedule['event_time_utc'])
+        event_local = self._naive_ns(schedule['event_time_local'])
+        offset = np.where((event_utc != _NO_TIME) & (event_local != _NO_TIME), event_local - event_utc, 0)
+        to_local = lambda column: self._shift(self._naive_ns(schedule[column]), offset) if column in schedule else np.full(n, _NO_TIME)
+
+        self.is_arrival = (schedule['flight_type'] == 'arrival').to_numpy()
+        # stage_times[:, k] là thời điểm (ns, giờ địa phương) của mốc thứ k: EOBT, ETOT, ELDT (chuyến đi không có ELDT tại VVTS)
+        self.stage_times = np.column_stack([
+            self._naive_ns(schedule['eobt_local']),
+            to_local('etot_utc'),
+            np.where(self.is_arrival, to_local('eldt_utc'), _NO_TIME),
+        ])
+        self.is_regulated = np.zeros(n, dtype=bool)
+        self.next_stage = np.zeros(n, dtype=np.int8)
+        self._queued_time = np.zeros(n, dtype=np.int64)
+        self._version = np.zeros(n, dtype=np.int64)
+        self._activations = []
+        self._activation_queue = []
+        self.clock = pd.Timestamp(system_state.simulation_time).value
+
+        self._skip_missing_stages(np.arange(n))
+        self._queued_time = self._stage_time(np.arange(n))
+        self._rebuild_queue()
+
+    @staticmethod
+    def _naive_ns(column):
+        values = pd.to_datetime(column)
+        if values.dt.tz is not None:
+            values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+        return values.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+    @staticmethod
+    def _shift(values, offset):
+        return np.where(values == _NO_TIME, _NO_TIME, values + offset)
+
+    def _skip_missing_stages(self, positions):
+        """Dời next_stage của các chuyến qua các mốc không có thời gian (NaT)."""
+        for _ in range(NUM_STAGES):
+            stage = self.next_stage[positions]
+            pending = stage < NUM_STAGES
+            missing = np.zeros(len(positions), dtype=bool)
+            missing[pending] = self.stage_times[positions[pending], stage[pending]] == _NO_TIME
+            if not missing.any():
+                return
+            self.next_stage[positions[missing]] += 1
+
+    def _stage_time(self, positions):
+        stage = self.next_stage[positions]
+        return np.where(stage < NUM_STAGES, self.stage_times[positions, np.minimum(stage, NUM_STAGES - 1)], _END_OF_TIME)
+
+    def _rebuild_queue(self):
+        pending = np.flatnonzero(self.next_stage < NUM_STAGES)
+        self._queue = list(zip(
+            self._queued_time[pending].tolist(), self.next_stage[pending].tolist(),
+            pending.tolist(), self._version[pending].tolist()
+        ))
+        heapq.heapify(self._queue)
+
+    def _push_next(self, position, not_before):
+        stage = int(self.next_stage[position])
+        if stage < NUM_STAGES:
+            event_time = max(int(self.stage_times[position, stage]), not_before)
+            self._queued_time[position] = event_time
+            heapq.heappush(self._queue, (event_time, stage, position, int(self._version[position])))
+
+    def _is_current(self, entry):
+        _, stage, position, version = entry
+        return version == self._version[position] and stage == self.next_stage[position]
+
+    def _discard_stale(self):
+        while self._queue and not self._is_current(self._queue[0]):
+            heapq.heappop(self._queue)
+
+    def _milestone_name(self, position, stage):
+        if stage == 0:
+            return 'EOBT'
+        # Mốc tại VVTS của chuyến bị điều tiết mang tên thời gian tính toán (CTOT/CLDT)
+        is_vvts_event = (stage == 1) != bool(self.is_arrival[position])
+        if self.is_regulated[position] and is_vvts_event:
+            return 'CTOT' if stage == 1 else 'CLDT'
+        return MILESTONES[stage]
+
+    # --- Kích hoạt GDP ---------------------------------------------------------------------------
+
+    def schedule_gdp_activation(self, at_time, regulated_df):
+        """
+        Lên lịch kích hoạt GDP (SystemState.activate_gdp) tại thời điểm `at_time` (giờ địa phương).
+        Việc kích hoạt xảy ra trước các mốc có cùng thời điểm.
+        """
+        self._activations.append(regulated_df)
+        heapq.heappush(self._activation_queue, (pd.Timestamp(at_time).value, len(self._activations) - 1))
+
+    @property
+    def _next_activation_time(self):
+        return self._activation_queue[0][0] if self._activation_queue else _END_OF_TIME
+
+    def _fire_activation(self):
+        now, activation = heapq.heappop(self._activation_queue)
+        self.clock = max(self.clock, now)
+        old_event = self._naive_ns(self.state.master_schedule['event_time_local'])
+        self.state.activate_gdp(self._activations[activation].copy())
+        new_event = self._naive_ns(self.state.master_schedule['event_time_local'])
+        self.is_regulated |= self.state.master_schedule['is_regulated'].to_numpy(dtype=bool)
+
+        # Dời các mốc chưa xảy ra của chuyến bị điều tiết (giữ chậm mặt đất), bỏ bản ghi cũ trong hàng đợi
+        delay = np.where((old_event != _NO_TIME) & (new_event != _NO_TIME), new_event - old_event, 0)
+        shifted = np.flatnonzero((delay != 0) & (self.next_stage < NUM_STAGES))
+        pending = np.arange(NUM_STAGES)[None, :] >= self.next_stage[shifted, None]
+        times = self.stage_times[shifted]
+        self.stage_times[shifted] = np.where(pending & (times != _NO_TIME), times + delay[shifted, None], times)
+        self._version[shifted] += 1
+        for position in shifted.tolist():
+            self._push_next(position, now)
+        return now
+
+    # --- Xử lý từng mốc -----------------------------------------------------------------------------
+
+    def _fire_next(self, log):
+        """Xử lý bản ghi đầu hàng đợi (kích hoạt GDP nếu đến trước); trả về False nếu bản ghi đã cũ."""
+        if self._activation_queue and (not self._queue or self._next_activation_time <= self._queue[0][0]):
+            now = self._fire_activation()
+            if log is not None:
+                log.append((now, 'GDP', -1))
+            return True
+        entry = heapq.heappop(self._queue)
+        if not self._is_current(entry):
+            return False
+        event_time, stage, position, _ = entry
+        self.clock = max(self.clock, event_time)
+        self.state.flight_phase[position] = _STAGE_PHASE_CODES[stage]
+        if log is not None:
+            log.append((event_time, self._milestone_name(position, stage), position))
+        self.next_stage[position] = stage + 1
+        self._skip_missing_stages(np.array([position]))
+        self._push_next(position, event_time)
+        return True
+
+    def _next_time(self):
+        self._discard_stale()
+        return min(self._queue[0][0] if self._queue else _END_OF_TIME, self._next_activation_time)
+
+    def _event_log(self, log):
+        times, milestones, positions = zip(*log) if log else ((), (), ())
+        positions = np.asarray(positions, dtype=np.int64)
+        schedule = self.state.master_schedule
+        is_flight = positions >= 0
+        callsigns = np.full(len(positions), '', dtype=object)
+        callsigns[is_flight] = schedule['callsign'].to_numpy()[positions[is_flight]]
+        flight_types = np.full(len(positions), '', dtype=object)
+        flight_types[is_flight] = schedule['flight_type'].to_numpy()[positions[is_flight]]
+        return pd.DataFrame({
+            'event_time_local': pd.to_datetime(np.asarray(times, dtype=np.int64)),
+            'milestone': list(milestones),
+            'callsign': callsigns,
+            'flight_type': flight_types,
+            'position': positions,
+        })
+
+    def _sync_state(self, to_time_ns):
+        self.clock = max(self.clock, to_time_ns)
+        self.state.update_simulation_time(pd.Timestamp(self.clock))
+
+    # --- Xử lý theo lô (tua nhanh) ------------------------------------------------------------------
+
+    def _bulk_advance(self, limit, inclusive=True):
+        """
+        Xử lý cùng lúc mọi mốc có thời gian <= limit (< limit nếu inclusive=False) bằng numpy.
+        Một mốc xảy ra không sớm hơn mốc trước nó của cùng chuyến, nên thời gian hiệu dụng là cực đại lũy tích.
+        Trả về số mốc đã xử lý.
+        """
+        active = np.flatnonzero(self.next_stage < NUM_STAGES)
+        if len(active) == 0:
+            return 0
+        stage = self.next_stage[active]
+        times = self.stage_times[active].copy()
+        considered = (np.arange(NUM_STAGES)[None, :] >= stage[:, None]) & (times != _NO_TIME)
+        times[np.arange(len(active)), stage] = self._queued_time[active]
+        effective = np.maximum.accumulate(np.where(considered, times, _NO_TIME), axis=1)
+        due = considered & ((effective <= limit) if inclusive else (effective < limit))
+        advanced = due.any(axis=1)
+        if not advanced.any():
+            return 0
+
+        last_due = NUM_STAGES - 1 - np.argmax(due[:, ::-1], axis=1)
+        positions = active[advanced]
+        self.state.flight_phase[positions] = _STAGE_PHASE_CODES[last_due[advanced]]
+        self.next_stage[positions] = last_due[advanced] + 1
+        self._skip_missing_stages(positions)
+        last_fired = effective[advanced, last_due[advanced]]
+        self._queued_time[positions] = np.maximum(self._stage_time(positions), last_fired)
+        self.clock = max(self.clock, int(last_fired.max()))
+        self._rebuild_queue()
+        return int(due.sum())
+
+    # --- Các chế độ chạy ----------------------------------------------------------------------------
+
+    def run_until(self, until_time, record=True):
+        """
+        Xử lý mọi mốc có thời gian <= until_time rồi đặt đồng hồ tại until_time.
+        Trả về DataFrame các mốc đã xảy ra; record=False tương đương fast_forward(until_time).
+        """
+        if not record:
+            return self.fast_forward(until_time)
+        limit = pd.Timestamp(until_time).value
+        log = []
+        while self._next_time() <= limit:
+            self._fire_next(log)
+        self._sync_state(limit)
+        return self._event_log(log)
+
+    def step(self):
+        """Nhảy tới thời điểm của mốc kế tiếp và xử lý mọi mốc tại thời điểm đó."""
+        next_time = self._next_time()
+        if next_time == _END_OF_TIME:
+            return self._event_log([])
+        return self.run_until(pd.Timestamp(next_time))
+
+    def fast_forward(self, until_time=None):
+        """
+        Tua nhanh tới until_time (mặc định: hết mọi mốc) mà không ghi nhật ký sự kiện.
+        Giữa hai lần kích hoạt GDP các mốc được xử lý theo lô. Trả về số mốc đã xử lý.
+        """
+        limit = _END_OF_TIME if until_time is None else pd.Timestamp(until_time).value
+        fired = 0
+        while self._activation_queue and self._next_activation_time <= limit:
+            fired += self._bulk_advance(self._next_activation_time, inclusive=False)
+            self._fire_activation()
+        fired += self._bulk_advance(limit)
+        self._sync_state(self.clock if until_time is None else limit)
+        return fired
+
+    @property
+    def next_event_time(self):
+        """Thời điểm mốc kế tiếp (giờ địa phương), None nếu đã hết."""
+        next_time = self._next_time()
+        return None if next_time == _END_OF_TIME else pd.Timestamp(next_time)
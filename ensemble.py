@@ -0,0 +1,110 @@
+# atfm_core/ensemble.py
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+
+try:
+    from .pre_tactical import resolve_params, sample_prediction_offsets
+    from .timing import timed
+except ImportError:  # Chạy trực tiếp cùng app.py (streamlit run app.py)
+    from pre_tactical import resolve_params, sample_prediction_offsets
+    from timing import timed
+
+PERCENTILES = (10, 50, 90)
+FLOWS = ('arrival', 'departure', 'total')
+
+# Lịch bay gốc của mỗi worker: được gửi một lần qua initializer, không pickle lại theo từng task
+_WORKER_BASE = {}
+
+def _init_worker(event_minutes, is_arrival, params):
+    _WORKER_BASE['event_minutes'] = event_minutes
+    _WORKER_BASE['is_arrival'] = is_arrival
+    _WORKER_BASE['params'] = params
+
+def _simulate_chunk(seeds):
+    """Chạy một nhóm realisation, trả về số chuyến ARR/DEP theo giờ, shape (len(seeds), 24)."""
+    event_minutes = _WORKER_BASE['event_minutes']
+    is_arrival = _WORKER_BASE['is_arrival']
+    params = _WORKER_BASE['params']
+
+    arrivals = np.zeros((len(seeds), 24), dtype=np.int32)
+    departures = np.zeros((len(seeds), 24), dtype=np.int32)
+    for i, seed in enumerate(seeds):
+        _, offset_minutes = sample_prediction_offsets(np.random.default_rng(seed), is_arrival, params)
+        hours = (event_minutes + offset_minutes) // 60
+        in_day = (hours >= 0) & (hours < 24)
+        arrivals[i] = np.bincount(hours[in_day & is_arrival], minlength=24)
+        departures[i] = np.bincount(hours[in_day & ~is_arrival], minlength=24)
+    return arrivals, departures
+
+def _per_hour(capacity):
+    """Năng lực (một số hoặc mảng 24 giờ) -> mảng float 24 giờ."""
+    return np.broadcast_to(np.asarray(capacity, dtype=np.float64), 24).copy()
+
+def realisation_seeds(base_seed, n_realisations):
+    """Seed của từng realisation; realisation i tái lập được bằng pre_tactical.generate_pre_tactical_demand_data(seed=seeds[i])."""
+    return np.random.SeedSequence(base_seed).spawn(n_realisations)
+
+@timed
+def run_pre_tactical_ensemble(all_initial_traffic_df, selected_date, landing_capacity, takeoff_capacity,
+                              n_realisations=500, base_seed=0, params=None, timezone_offset_hours=7,
+                              max_workers=None, total_capacity=None):
+    """
+    Chạy N realisation Pre-tactical có seed trên ProcessPoolExecutor và tổng hợp nhu cầu theo giờ.
+    Năng lực (landing_capacity, takeoff_capacity, total_capacity) là một số hoặc mảng 24 giờ địa phương của ngày
+    (ví dụ CapacityProfile.hourly_rates, đã tính sự kiện giảm năng lực / dự báo); total_capacity mặc định là
+    hạ cánh + cất cánh.
+
+    Returns:
+        pd.DataFrame: index là 24 giờ địa phương của ngày được chọn; các cột `<flow>_p10/_p50/_p90`
+        và `prob_<flow>_overload` (xác suất vượt năng lực) cho flow = arrival, departure, total.
+    """
+    day_start_local = datetime.combine(selected_date, time.min)
+    hourly_index = pd.date_range(start=day_start_local, periods=24, freq='H')
+
+    valid = all_initial_traffic_df['event_time_utc'].notna()
+    event_local = all_initial_traffic_df.loc[valid, 'event_time_utc'] + timedelta(hours=timezone_offset_hours)
+    event_minutes = ((event_local - day_start_local) // pd.Timedelta(minutes=1)).to_numpy(dtype=np.int64)
+    is_arrival = (all_initial_traffic_df.loc[valid, 'flight_type'] == 'arrival').to_numpy()
+    params = resolve_params(params)
+
+    seeds = realisation_seeds(base_seed, n_realisations)
+    max_workers = max_workers or os.cpu_count() or 1
+    n_chunks = min(n_realisations, max_workers * 4)
+    chunks = [list(chunk) for chunk in np.array_split(np.array(seeds, dtype=object), n_chunks) if len(chunk)]
+
+    if max_workers == 1:
+        _init_worker(event_minutes, is_arrival, params)
+        results = [_simulate_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(event_minutes, is_arrival, params)) as executor:
+            results = list(executor.map(_simulate_chunk, chunks))
+
+    counts = {
+        'arrival': np.concatenate([arr for arr, _ in results]),
+        'departure': np.concatenate([dep for _, dep in results]),
+    }
+    counts['total'] = counts['arrival'] + counts['departure']
+    landing_capacity, takeoff_capacity = _per_hour(landing_capacity), _per_hour(takeoff_capacity)
+    total_capacity = landing_capacity + takeoff_capacity if total_capacity is None else _per_hour(total_capacity)
+    capacities = {
+        'arrival': landing_capacity,
+        'departure': takeoff_capacity,
+        'total': total_capacity,
+    }
+
+    summary_df = pd.DataFrame(index=hourly_index)
+    for flow in FLOWS:
+        bands = np.percentile(counts[flow], PERCENTILES, axis=0)
+        for pct, band in zip(PERCENTILES, bands):
+            summary_df[f'{flow}_p{pct}'] = band
+        summary_df[f'prob_{flow}_overload'] = (counts[flow] > capacities[flow]).mean(axis=0)
+    summary_df['landing_capacity'] = landing_capacity
+    summary_df['takeoff_capacity'] = takeoff_capacity
+    summary_df['total_capacity'] = total_capacity
+    summary_df.attrs['n_realisations'] = n_realisations
+    return summary_df
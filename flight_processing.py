@@ -1,55 +1,74 @@
 # atfm_core/flight_processing.py
 
+import numpy as np
 import pandas as pd
 from datetime import timedelta
 from .config import VVTS_CONFIG, get_master_dataframe_schema
+from .flight_records import encode_categorical_columns
+from .timing import timed
 
+DEFAULT_EET_MINUTES = 90
+DEFAULT_ORIGIN_TAXI_OUT_MINUTES = 15
+
+def _minutes_column(df, column, default):
+    """Lấy một cột số phút (nếu có), thay giá trị thiếu bằng giá trị mặc định."""
+    if column not in df.columns:
+        return pd.Series(default, index=df.index, dtype='float64')
+    return pd.to_numeric(df[column], errors='coerce').fillna(default)
+
+@timed
 def process_flight_schedules(raw_flights_df):
     """
     SỬA LỖI: Chuẩn hóa tất cả các cột UTC thành timezone-aware ngay từ đầu.
+
+    Xử lý theo cột (không lặp từng dòng): phân loại ARR/DEP bằng mask và tính
+    etot_utc / eldt_utc / event_time_utc bằng phép cộng timedelta trên cả cột.
+    Kết quả có cùng schema với config.get_master_dataframe_schema (thêm cột event_time_local);
+    flight_type và các cột chuỗi lặp lại (sân bay, loại tàu bay) được lưu dạng category.
     """
     if raw_flights_df is None or raw_flights_df.empty:
         return get_master_dataframe_schema()
 
-    df = raw_flights_df.copy()
-    
-    # Chuẩn hóa múi giờ cho cột đầu vào
-    df['eobt_utc'] = pd.to_datetime(df['eobt_utc']).dt.tz_localize('UTC')
-    
-    processed_flights = []
-    for _, row in df.iterrows():
-        flight_data = {
-            'callsign': row['callsign'], 'origin': row['origin'], 'destination': row['destination'],
-            'aircraft_type': row['aircraft_type'], 'flight_date': row['flight_date'],
-            'eobt_utc': row['eobt_utc'], 'eobt_local': row['eobt_local'],
-            'eet_minutes': 0, # Khởi tạo
-        }
-
-        if row['destination'] == VVTS_CONFIG['ICAO_CODE']:
-            flight_data['flight_type'] = 'arrival'
-            flight_data['eet_minutes'] = int(row.get('origin_eet_to_vvts_minutes', 90))
-            flight_data['etot_utc'] = row['eobt_utc'] + timedelta(minutes=row.get('origin_taxi_out_minutes', 15))
-            flight_data['eldt_utc'] = flight_data['etot_utc'] + timedelta(minutes=flight_data['eet_minutes'])
-        elif row['origin'] == VVTS_CONFIG['ICAO_CODE']:
-            flight_data['flight_type'] = 'departure'
-            flight_data['eet_minutes'] = int(row.get('dest_eet_from_vvts_minutes', 90))
-            flight_data['etot_utc'] = row['eobt_utc'] + timedelta(minutes=VVTS_CONFIG['TAXI_OUT_TIME_MINUTES'])
-            flight_data['eldt_utc'] = flight_data['etot_utc'] + timedelta(minutes=flight_data['eet_minutes'])
-        else:
-            continue
-        
-        processed_flights.append(flight_data)
-
-    if not processed_flights:
+    icao = VVTS_CONFIG['ICAO_CODE']
+    is_arrival = (raw_flights_df['destination'] == icao).to_numpy()
+    is_departure = ~is_arrival & (raw_flights_df['origin'] == icao).to_numpy()
+    keep = is_arrival | is_departure
+    if not keep.any():
         return get_master_dataframe_schema()
 
-    master_df = pd.DataFrame(processed_flights)
-    
-    master_df['event_time_utc'] = master_df.apply(lambda r: r['eldt_utc'] if r['flight_type'] == 'arrival' else r['etot_utc'], axis=1)
-    
+    df = raw_flights_df.loc[keep].reset_index(drop=True)
+    is_arrival = is_arrival[keep]
+
+    # Chuẩn hóa múi giờ cho cột đầu vào
+    eobt_utc = pd.to_datetime(df['eobt_utc']).dt.tz_localize('UTC')
+
+    eet_minutes = np.where(
+        is_arrival,
+        _minutes_column(df, 'origin_eet_to_vvts_minutes', DEFAULT_EET_MINUTES),
+        _minutes_column(df, 'dest_eet_from_vvts_minutes', DEFAULT_EET_MINUTES),
+    ).astype('int64')
+    taxi_out_minutes = np.where(
+        is_arrival,
+        _minutes_column(df, 'origin_taxi_out_minutes', DEFAULT_ORIGIN_TAXI_OUT_MINUTES),
+        VVTS_CONFIG['TAXI_OUT_TIME_MINUTES'],
+    )
+
+    etot_utc = eobt_utc + pd.to_timedelta(taxi_out_minutes, unit='m')
+    eldt_utc = etot_utc + pd.to_timedelta(eet_minutes, unit='m')
+
+    master_df = pd.DataFrame({
+        'callsign': df['callsign'], 'origin': df['origin'], 'destination': df['destination'],
+        'aircraft_type': df['aircraft_type'], 'flight_date': df['flight_date'],
+        'eobt_utc': eobt_utc, 'eobt_local': df['eobt_local'],
+        'etot_utc': etot_utc, 'eet_minutes': eet_minutes, 'eldt_utc': eldt_utc,
+        'flight_type': pd.Categorical.from_codes(np.where(is_arrival, 0, 1), categories=['arrival', 'departure']),
+        'event_time_utc': eldt_utc.where(is_arrival, etot_utc),
+    }, columns=get_master_dataframe_schema().columns)
+
     # Tạo cột event_time_local để hiển thị
     tz_offset = timedelta(hours=VVTS_CONFIG['TIMEZONE_OFFSET_HOURS'])
     master_df['event_time_local'] = master_df['event_time_utc'].dt.tz_convert(f'Etc/GMT-{tz_offset.seconds // 3600}').dt.tz_localize(None)
-    
-    master_df.sort_values(by='event_time_utc', inplace=True)
+
+    encode_categorical_columns(master_df, ('callsign', 'origin', 'destination', 'aircraft_type'))
+    master_df.sort_values(by='event_time_utc', inplace=True, kind='stable')
     return master_df
\ No newline at end of file
@@ -0,0 +1,84 @@
+# atfm_core/flight_records.py
+
+import numpy as np
+import pandas as pd
+
+# Các cột chuỗi lặp lại nhiều lần được lưu dạng category (mã số nguyên + bảng giá trị)
+CATEGORICAL_COLUMNS = ('callsign', 'origin', 'destination', 'aircraft_type', 'flight_type', 'flight_scope', 'eobt', 'flight_date')
+
+def encode_categorical_columns(df, columns=CATEGORICAL_COLUMNS, max_unique_ratio=0.5):
+    """
+    Đổi các cột chuỗi (object) trong `columns` sang kiểu category ngay trên df và trả về df.
+    Mỗi ô chỉ còn 1-2 byte mã thay vì một đối tượng str Python; so sánh ==, isin, .str vẫn dùng được.
+    Cột có tỉ lệ giá trị khác nhau lớn hơn `max_unique_ratio` (ví dụ callsign gần như duy nhất) được giữ nguyên.
+    """
+    for column in columns:
+        if column in df.columns and df[column].dtype == object and df[column].nunique() <= max_unique_ratio * len(df):
+            df[column] = df[column].astype('category')
+    return df
+
+class AirportTable:
+    """
+    Bảng chiều sân bay (eets.csv) đánh chỉ mục theo mã sân bay.
+
+    Thay cho việc merge eets vào từng chuyến bay: mã sân bay của các chuyến được đổi một lần sang vị trí dòng
+    (positions), rồi EET/taxi được lấy bằng chỉ số mảng. Mã không có trong bảng trỏ tới dòng cuối (NaN).
+    Giá trị là số phút nhỏ nên được lưu float32 (nửa bộ nhớ so với float64, vẫn chính xác tới phút).
+    """
+
+    def __init__(self, eets_df):
+        eets_df = eets_df.drop_duplicates('airport_code')
+        self.codes = pd.Index(eets_df['airport_code'].astype(str))
+        self._values = {
+            column: np.append(pd.to_numeric(eets_df[column], errors='coerce').to_numpy(dtype=np.float32), np.float32(np.nan))
+            for column in eets_df.columns if column != 'airport_code'
+        }
+
+    def positions(self, airport_codes):
+        """Vị trí dòng trong bảng của từng mã sân bay (len(codes) nếu không có). Cột category chỉ tra các giá trị khác nhau."""
+        missing = len(self.codes)
+        if isinstance(airport_codes.dtype, pd.CategoricalDtype):
+            category_positions = self.codes.get_indexer(airport_codes.cat.categories.astype(str))
+            category_positions = np.append(np.where(category_positions < 0, missing, category_positions), missing)
+            return category_positions[airport_codes.cat.codes.to_numpy()]
+        positions = self.codes.get_indexer(pd.Index(airport_codes).astype(str))
+        return np.where(positions < 0, missing, positions)
+
+    def lookup(self, column, positions, default=np.nan):
+        """Giá trị cột `column` tại các vị trí dòng; mã không có trong bảng (hoặc giá trị thiếu) nhận `default`."""
+        values = self._values[column][positions]
+        return values if np.isnan(default) else np.where(np.isnan(values), np.float32(default), values)
+
+class Flight:
+    """Bản ghi một chuyến bay (dùng __slots__, không có __dict__) cho các thao tác trên từng chuyến."""
+
+    __slots__ = ('callsign', 'flight_type', 'flight_date', 'origin', 'destination', 'aircraft_type',
+                 'event_time_utc', 'regulated_time_utc')
+
+    def __init__(self, callsign, flight_type, flight_date=None, origin=None, destination=None, aircraft_type=None,
+                 event_time_utc=None, regulated_time_utc=None):
+        self.callsign = callsign
+        self.flight_type = flight_type
+        self.flight_date = flight_date
+        self.origin = origin
+        self.destination = destination
+        self.aircraft_type = aircraft_type
+        self.event_time_utc = event_time_utc
+        self.regulated_time_utc = regulated_time_utc
+
+    @classmethod
+    def from_row(cls, row):
+        """Tạo từ một dòng DataFrame (Series), dict hoặc namedtuple của itertuples; trường thiếu là None."""
+        if isinstance(row, cls):
+            return row
+        get = row.get if hasattr(row, 'get') else (lambda field, default=None: getattr(row, field, default))
+        return cls(*(get(field, None) for field in cls.__slots__))
+
+    @classmethod
+    def from_frame(cls, flights_df):
+        """Danh sách Flight cho mọi dòng của flights_df (đọc theo cột, không tạo Series cho từng dòng)."""
+        columns = [flights_df[field].tolist() if field in flights_df.columns else [None] * len(flights_df) for field in cls.__slots__]
+        return [cls(*values) for values in zip(*columns)]
+
+    def __repr__(self):
+        return f"Flight({self.callsign!r}, {self.flight_type!r}, event_time_utc={self.event_time_utc!r})"
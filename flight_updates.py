@@ -0,0 +1,159 @@
+# atfm_core/flight_updates.py
+
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from .analysis import build_demand_analysis
+
+FLOWS = ('arrival', 'departure')
+_EPOCH = datetime(1970, 1, 1)
+_MINUTE = timedelta(minutes=1)
+
+def _flight_date_key(flight_date):
+    """Ngày bay dạng 'YYYY-MM-DD' (nhận date, datetime, Timestamp hoặc chuỗi)."""
+    return str(flight_date)[:10]
+
+def _to_minutes(value):
+    """Thời gian địa phương (datetime, Timestamp, chuỗi ISO hoặc số phút epoch) -> số phút kể từ epoch."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    elif isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    return (value.replace(tzinfo=None) - _EPOCH) // _MINUTE
+
+def _from_minutes(minutes):
+    return _EPOCH + timedelta(minutes=minutes)
+
+class FlightUpdateStream:
+    """
+    Luồng cập nhật kế hoạch bay trong bộ nhớ, giữ bộ đếm nhu cầu đến/đi theo giờ và theo 15 phút.
+
+    Mỗi bản tin (new / delay / change / cancel, khóa theo callsign + ngày bay) chỉ cập nhật vài ô của
+    các Counter theo (luồng, mốc thời gian) và tập giờ điểm nóng, nên tốn O(1) thay vì đọc lại
+    vvts_schedule.csv và dựng lại DataFrame. Thời gian là giờ địa phương như `event_time_local`.
+    """
+
+    def __init__(self, landing_capacity, takeoff_capacity):
+        self.default_capacity = {'arrival': landing_capacity, 'departure': takeoff_capacity}
+        self.capacity_overrides = {'arrival': {}, 'departure': {}}
+        # khóa (callsign, 'YYYY-MM-DD') -> (luồng, phút epoch của thời gian sự kiện)
+        self.flights = {}
+        self.hourly_counts = {flow: Counter() for flow in FLOWS}
+        self.quarter_hour_counts = {flow: Counter() for flow in FLOWS}
+        self._hotspot_hours = {flow: set() for flow in FLOWS}
+        self.applied_count = 0
+        self.rejected_count = 0
+
+    @classmethod
+    def from_schedule(cls, flights_df, landing_capacity, takeoff_capacity, time_column_local='event_time_local'):
+        """
+        Khởi tạo từ một lịch bay; các chuyến thiếu thời gian sự kiện bị bỏ qua,
+        khóa callsign + ngày bay trùng nhau chỉ giữ dòng cuối.
+        """
+        stream = cls(landing_capacity, takeoff_capacity)
+        schedule = flights_df[flights_df[time_column_local].notna() & flights_df['flight_type'].isin(FLOWS)]
+        minutes = (pd.to_datetime(schedule[time_column_local]).to_numpy(dtype='datetime64[m]').astype(np.int64)).tolist()
+        keys = zip(schedule['callsign'].tolist(), pd.to_datetime(schedule['flight_date']).dt.strftime('%Y-%m-%d').tolist())
+        stream.flights = dict(zip(keys, zip(schedule['flight_type'].tolist(), minutes)))
+
+        for flow, minute in stream.flights.values():
+            stream.hourly_counts[flow][minute // 60 * 60] += 1
+            stream.quarter_hour_counts[flow][minute // 15 * 15] += 1
+        for flow in FLOWS:
+            stream._hotspot_hours[flow] = {hour for hour, count in stream.hourly_counts[flow].items() if count > stream._capacity(flow, hour)}
+        return stream
+
+    def _capacity(self, flow, hour_minute):
+        return self.capacity_overrides[flow].get(hour_minute, self.default_capacity[flow])
+
+    def _refresh_hotspot(self, flow, hour_minute):
+        if self.hourly_counts[flow][hour_minute] > self._capacity(flow, hour_minute):
+            self._hotspot_hours[flow].add(hour_minute)
+        else:
+            self._hotspot_hours[flow].discard(hour_minute)
+
+    def _count(self, flow, minute, step):
+        hour_minute = minute // 60 * 60
+        self.hourly_counts[flow][hour_minute] += step
+        self.quarter_hour_counts[flow][minute // 15 * 15] += step
+        self._refresh_hotspot(flow, hour_minute)
+
+    def set_hourly_capacity(self, hour_start_local, landing_capacity=None, takeoff_capacity=None):
+        """Đặt năng lực riêng cho một giờ (ví dụ sự kiện giảm năng lực); None giữ nguyên luồng đó."""
+        hour_minute = _to_minutes(hour_start_local) // 60 * 60
+        for flow, capacity in (('arrival', landing_capacity), ('departure', takeoff_capacity)):
+            if capacity is not None:
+                self.capacity_overrides[flow][hour_minute] = capacity
+                self._refresh_hotspot(flow, hour_minute)
+
+    def apply(self, message):
+        """
+        Áp dụng một bản tin cập nhật. `message` là dict có 'type', 'callsign', 'flight_date' và:
+          - new: 'flight_type', 'event_time_local' (khóa đã có thì coi như change);
+          - delay: 'delay_minutes' (âm nếu sớm hơn);
+          - change: 'event_time_local' và/hoặc 'flight_type';
+          - cancel: không cần thêm trường.
+        Trả về True nếu bản tin được áp dụng, False nếu bị từ chối (sai loại, chuyến không tồn tại, thiếu trường).
+        """
+        message_type = message.get('type')
+        key = (message.get('callsign'), _flight_date_key(message.get('flight_date')))
+        current = self.flights.get(key)
+
+        if message_type == 'new' or (message_type == 'change' and current is not None):
+            flow = message.get('flight_type', current[0] if current else None)
+            event_time = message.get('event_time_local')
+            if flow not in FLOWS or (event_time is None and current is None):
+                self.rejected_count += 1
+                return False
+            updated = (flow, current[1] if event_time is None else _to_minutes(event_time))
+        elif message_type == 'delay' and current is not None and message.get('delay_minutes') is not None:
+            updated = (current[0], current[1] + int(round(message['delay_minutes'])))
+        elif message_type == 'cancel' and current is not None:
+            updated = None
+        else:
+            self.rejected_count += 1
+            return False
+
+        if current is not None:
+            self._count(current[0], current[1], -1)
+        if updated is None:
+            del self.flights[key]
+        else:
+            self.flights[key] = updated
+            self._count(updated[0], updated[1], 1)
+        self.applied_count += 1
+        return True
+
+    def apply_many(self, messages):
+        """Áp dụng lần lượt các bản tin; trả về số bản tin được áp dụng."""
+        return sum(self.apply(message) for message in messages)
+
+    def demand(self, flow, time_local, resolution_minutes=60):
+        """Số chuyến của luồng trong khung giờ (60 phút) hoặc 15 phút chứa time_local."""
+        minute = _to_minutes(time_local)
+        if resolution_minutes == 60:
+            return self.hourly_counts[flow][minute // 60 * 60]
+        if resolution_minutes == 15:
+            return self.quarter_hour_counts[flow][minute // 15 * 15]
+        raise ValueError("resolution_minutes phải là 60 hoặc 15.")
+
+    def hotspot_hours(self, flow):
+        """Các giờ bắt đầu (giờ địa phương, đã sắp xếp) có nhu cầu vượt năng lực của luồng."""
+        return [_from_minutes(hour_minute) for hour_minute in sorted(self._hotspot_hours[flow])]
+
+    def hourly_analysis(self, analysis_date):
+        """
+        Bảng nhu cầu 24 giờ của `analysis_date` và các điểm nóng, cùng định dạng với
+        analysis.analyze_hourly_demand, lấy trực tiếp từ bộ đếm.
+        """
+        start_minute = _to_minutes(pd.Timestamp(analysis_date).normalize())
+        hours = [start_minute + 60 * hour for hour in range(24)]
+        hourly_index = pd.date_range(start=pd.Timestamp(analysis_date).normalize(), periods=24, freq='H', tz='Asia/Ho_Chi_Minh')
+        demand = {flow: [self.hourly_counts[flow].get(hour, 0) for hour in hours] for flow in FLOWS}
+        capacity = {flow: [self._capacity(flow, hour) for hour in hours] for flow in FLOWS}
+        return build_demand_analysis(hourly_index, demand['arrival'], demand['departure'], capacity['arrival'], capacity['departure'])
@@ -1,24 +1,74 @@
 # atfm_core/gdp_engine.py
 
+import numpy as np
 import pandas as pd
 from datetime import timedelta
-from .config import VVTS_CONFIG
+try:
+    from .config import SLOT_COST_WEIGHTS, VVTS_CONFIG
+    from .slot_allocator import NO_SLOT, REGULATED_DELAY_THRESHOLD_MINUTES, SlotStore, compress_slot_times, from_epoch_seconds, regulation_hour_starts, to_epoch_seconds
+    from .timing import timed
+except ImportError:  # Chạy trực tiếp cùng app.py (streamlit run app.py)
+    from config import SLOT_COST_WEIGHTS, VVTS_CONFIG
+    from slot_allocator import NO_SLOT, REGULATED_DELAY_THRESHOLD_MINUTES, SlotStore, compress_slot_times, from_epoch_seconds, regulation_hour_starts, to_epoch_seconds
+    from timing import timed
 
-def run_gdp_simulation(master_schedule_df, landing_capacity, arr_hotspots):
+ASSIGNMENT_MODES = ('greedy', 'optimal')
+
+def slot_cost_weights(flights_df, cost_weights=None):
+    """
+    Trọng số chi phí trễ của từng chuyến = hệ số theo `aircraft_type` x `flight_type` x phạm vi bay
+    (`flight_scope`; nếu thiếu cột thì suy ra từ origin/destination: cả hai bắt đầu bằng 'VV' là nội địa).
+    """
+    cost_weights = SLOT_COST_WEIGHTS if cost_weights is None else cost_weights
+    if 'flight_scope' in flights_df.columns:
+        scope = flights_df['flight_scope']
+    else:
+        is_domestic = flights_df['origin'].astype(str).str.startswith('VV') & flights_df['destination'].astype(str).str.startswith('VV')
+        scope = pd.Series(np.where(is_domestic, 'domestic', 'international'), index=flights_df.index)
+
+    weights = np.ones(len(flights_df), dtype=np.float64)
+    for column, values in (('aircraft_type', flights_df['aircraft_type']), ('flight_type', flights_df['flight_type']), ('flight_scope', scope)):
+        weights *= values.astype(object).map(cost_weights.get(column, {})).fillna(1.0).to_numpy(dtype=np.float64)
+    return weights
+
+def assignment_delay_summary(regulated_df, weights):
+    """Tổng trễ, tổng trễ có trọng số và trễ lớn nhất (phút) của một kết quả phân bổ slot."""
+    delay = regulated_df['atfm_delay_minutes'].fillna(0.0).to_numpy(dtype=np.float64)
+    return {
+        'total_delay_minutes': float(delay.sum()),
+        'weighted_delay_minutes': float((delay * weights).sum()),
+        'max_delay_minutes': float(delay.max()) if len(delay) else 0.0,
+    }
+
+@timed
+def run_gdp_simulation(master_schedule_df, landing_capacity, arr_hotspots, assignment_mode='greedy', cost_weights=None):
     """
     Chạy mô phỏng GDP cho các chuyến bay bị ảnh hưởng bởi các điểm nóng.
+
+    Các chuyến vượt năng lực trong mỗi giờ điểm nóng được cấp slot hạ cánh trống đầu tiên sau giờ đó
+    từ SlotStore; các chuyến đến không bị delay chiếm slot của chính chúng, nên slot cấp thêm không làm
+    quá tải các giờ kế tiếp và slot chưa dùng vẫn còn cho các điểm nóng sau.
+
+    Với assignment_mode='optimal', mỗi giờ điểm nóng delay các chuyến có trọng số chi phí (slot_cost_weights)
+    thấp nhất, và slot được cấp bằng SlotStore.claim_weighted để tổng trễ có trọng số nhỏ nhất.
     """
+    if assignment_mode not in ASSIGNMENT_MODES:
+        raise ValueError(f"assignment_mode phải là một trong {ASSIGNMENT_MODES}, nhận được '{assignment_mode}'.")
     if master_schedule_df.empty or arr_hotspots.empty:
         return master_schedule_df
 
     df = master_schedule_df.copy()
+    if assignment_mode == 'optimal':
+        df['_cost_weight'] = slot_cost_weights(df, cost_weights)
     
     df['regulated_time_utc'] = df['event_time_utc']
     df['is_regulated'] = False
-    
-    last_available_slot = pd.Timestamp.min.tz_localize('UTC')
 
-    for hour, row in arr_hotspots.iterrows():
+    is_arrival = df['flight_type'] == 'arrival'
+    flights_to_delay = []
+    hour_ends_s = []
+
+    for hour, row in arr_hotspots.sort_index().iterrows():
         demand = int(row['arrival_demand'])
         capacity = int(row['landing_capacity'])
         overload = demand - capacity
@@ -30,28 +80,107 @@ def run_gdp_simulation(master_schedule_df, landing_capacity, arr_hotspots):
         end_hour_utc = start_hour_utc + timedelta(hours=1)
         
         flights_in_hour = df[
-            (df['flight_type'] == 'arrival') &
+            is_arrival &
             (df['event_time_utc'] >= start_hour_utc) &
             (df['event_time_utc'] < end_hour_utc)
-        ].copy()
+        ]
 
-        flights_in_hour.sort_values(by='event_time_utc', ascending=False, inplace=True)
-        flights_to_delay = flights_in_hour.head(overload)
-        
-        if last_available_slot < end_hour_utc:
-            last_available_slot = end_hour_utc
-            
-        slot_interval = timedelta(minutes=60 / capacity)
+        if assignment_mode == 'optimal':
+            # Giữ slot trong giờ cho các chuyến có chi phí trễ cao nhất
+            delayed = flights_in_hour.sort_values(by=['_cost_weight', 'event_time_utc'], ascending=[True, False]).head(overload).sort_values(by='event_time_utc')
+        else:
+            delayed = flights_in_hour.sort_values(by='event_time_utc', ascending=False).head(overload).sort_values(by='event_time_utc')
+        flights_to_delay.extend(delayed.index)
+        hour_ends_s.extend([to_epoch_seconds([end_hour_utc])[0]] * len(delayed))
+
+    if flights_to_delay:
+        # Lưới slot hạ cánh từ điểm nóng đầu tiên; chuyến không bị delay chiếm slot trước
+        arrival_times_s = to_epoch_seconds(df.loc[is_arrival, 'event_time_utc'].sort_values(), round_up=True)
+        first_hotspot_s = to_epoch_seconds([arr_hotspots.index.min().tz_convert('UTC')])[0]
+        hour_starts_s = regulation_hour_starts(first_hotspot_s, arrival_times_s, landing_capacity)
+        hourly_capacity = np.full(len(hour_starts_s), landing_capacity, dtype=np.float64)
+        hotspot_hours_s = to_epoch_seconds(arr_hotspots.index.tz_convert('UTC'))
+        hotspot_pos = np.searchsorted(hour_starts_s, hotspot_hours_s)
+        in_grid = (hotspot_pos < len(hour_starts_s)) & (hour_starts_s[np.minimum(hotspot_pos, len(hour_starts_s) - 1)] == hotspot_hours_s)
+        hourly_capacity[hotspot_pos[in_grid]] = arr_hotspots['landing_capacity'].to_numpy()[in_grid]
+        arrival_slots = SlotStore.from_hourly_capacity(hour_starts_s, hourly_capacity, use_slot_windows=True)
 
-        for index, flight in flights_to_delay.sort_values(by='event_time_utc').iterrows():
-            new_slot = last_available_slot + slot_interval
-            df.loc[index, 'regulated_time_utc'] = new_slot
-            df.loc[index, 'is_regulated'] = True
-            last_available_slot = new_slot
+        not_delayed = is_arrival & ~df.index.isin(flights_to_delay)
+        not_delayed_s = to_epoch_seconds(df.loc[not_delayed, 'event_time_utc'], round_up=True)
+        arrival_slots.claim_many(np.sort(not_delayed_s[not_delayed_s >= hour_starts_s[0]]))
+
+        if assignment_mode == 'optimal':
+            slot_s = arrival_slots.claim_weighted(hour_ends_s, df.loc[flights_to_delay, '_cost_weight'].to_numpy())
+            new_slots_s = np.where(slot_s == NO_SLOT, hour_ends_s, slot_s)
+        else:
+            new_slots_s = []
+            for hour_end_s in hour_ends_s:
+                slot_s = arrival_slots.claim(hour_end_s)
+                new_slots_s.append(hour_end_s if slot_s is None else slot_s)
+
+        df.loc[flights_to_delay, 'regulated_time_utc'] = from_epoch_seconds(new_slots_s).tz_localize('UTC')
+        df.loc[flights_to_delay, 'is_regulated'] = True
 
     df['atfm_delay_minutes'] = (df['regulated_time_utc'] - df['event_time_utc']).dt.total_seconds() / 60
     df.loc[df['atfm_delay_minutes'] < 0, 'atfm_delay_minutes'] = 0
-    return df
+    return df.drop(columns='_cost_weight', errors='ignore')
+
+@timed
+def compress_slots(regulated_df, cancelled_index=(), non_compliant_index=(),
+                   earliest_time_column='event_time_utc', ready_time_column='actual_time_utc'):
+    """
+    Nén slot sau khi có chuyến hủy hoặc không tuân thủ slot, riêng cho từng luồng (đến/đi).
+
+    Slot của chuyến hủy và chuyến không tuân thủ được trả lại; các chuyến bị trễ phía sau được chuyển lên slot
+    trống sớm nhất nhưng không sớm hơn `earliest_time_column`. Chuyến không tuân thủ được xếp lại cuối cùng vào
+    slot trống đầu tiên từ thời điểm sẵn sàng (`ready_time_column` nếu có, không sớm hơn thời gian dự kiến);
+    nếu không còn slot trống, chuyến đó giữ thời điểm sẵn sàng. Chuyến hủy bị loại khỏi lịch trình.
+
+    Returns:
+        (DataFrame lịch trình đã nén, DataFrame các chuyến đổi slot kèm số phút trễ giảm được)
+    """
+    df = regulated_df.copy()
+    is_tz_aware = df['regulated_time_utc'].dt.tz is not None
+    cancelled = df.index.isin(cancelled_index)
+    non_compliant = df.index.isin(non_compliant_index) & ~cancelled
+
+    has_slot = df['regulated_time_utc'].notna().to_numpy() & df[earliest_time_column].notna().to_numpy()
+    slot_s = np.where(has_slot, to_epoch_seconds(df['regulated_time_utc'].where(has_slot, df['regulated_time_utc'].min())), 0)
+    earliest_s = np.where(has_slot, to_epoch_seconds(df[earliest_time_column].where(has_slot, df[earliest_time_column].min()), round_up=True), 0)
+    if ready_time_column in df.columns:
+        ready = df[ready_time_column].where(df[ready_time_column].notna(), df[earliest_time_column])
+        ready_s = np.where(has_slot, to_epoch_seconds(ready.where(has_slot, ready.min()), round_up=True), 0)
+        earliest_s = np.where(non_compliant, np.maximum(earliest_s, ready_s), earliest_s)
+
+    new_slot_s = slot_s.copy()
+    for flow in df['flight_type'].dropna().unique():
+        in_flow = has_slot & (df['flight_type'] == flow).to_numpy()
+        new_slot_s[in_flow] = compress_slot_times(
+            slot_s[in_flow], earliest_s[in_flow], (cancelled | non_compliant)[in_flow], non_compliant[in_flow]
+        )
+    # Chuyến không tuân thủ không còn slot trống giữ thời điểm sẵn sàng
+    new_slot_s = np.where(non_compliant & (new_slot_s == NO_SLOT), earliest_s, new_slot_s)
+
+    moved = has_slot & ~cancelled & (new_slot_s != slot_s)
+    new_times = pd.Series(from_epoch_seconds(new_slot_s[moved]), index=df.index[moved])
+    if is_tz_aware:
+        new_times = new_times.dt.tz_localize('UTC')
+    previous_times = df.loc[moved, 'regulated_time_utc']
+    df.loc[moved, 'regulated_time_utc'] = new_times
+
+    delay = (df['regulated_time_utc'] - df[earliest_time_column]).dt.total_seconds() / 60
+    df['atfm_delay_minutes'] = delay.clip(lower=0).fillna(0.0)
+    df['is_regulated'] = df['atfm_delay_minutes'] > REGULATED_DELAY_THRESHOLD_MINUTES
+
+    moves_df = pd.DataFrame({
+        'callsign': df.loc[moved, 'callsign'],
+        'flight_type': df.loc[moved, 'flight_type'],
+        'previous_regulated_time_utc': previous_times,
+        'regulated_time_utc': df.loc[moved, 'regulated_time_utc'],
+        'non_compliant': non_compliant[moved],
+    })
+    moves_df['delay_saved_minutes'] = (moves_df['previous_regulated_time_utc'] - moves_df['regulated_time_utc']).dt.total_seconds() / 60
+    return df[~cancelled], moves_df.sort_values('regulated_time_utc')
 
 def format_gdp_results(regulated_df):
     """
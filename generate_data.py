@@ -1,11 +1,16 @@
+import argparse
+import os
+import numpy as np
 import pandas as pd
-from datetime import date, timedelta
-import random
-import string 
+from datetime import date
+try:
+    from .data_cache import write_partitioned
+except ImportError:  # Chạy trực tiếp: python generate_data.py
+    from data_cache import write_partitioned
 
 # --- Cấu hình Tạo Dữ liệu ---
-NUM_FLIGHTS = 1002 # Tăng số lượng chuyến bay để tạo nhiều tình huống tắc nghẽn
 NUM_DAYS = 7      # Mô phỏng trong 7 ngày liên tiếp
+START_DATE = date(2025, 6, 23)
 
 # Sân bay Tân Sơn Nhất
 HOME_AIRPORT = 'VVTS'
@@ -78,104 +83,217 @@ airport_times_map = {
     'EGLL': (780, 60, 45, 5, 45, 5), 'KJFK': (900, 60, 45, 5, 45, 5) 
 }
 
+# --- Cấu trúc bank (giờ cao điểm) và số chuyến mỗi giờ ---
+# Mỗi bank: các giờ địa phương [start_hour, end_hour] có flights_per_hour ± deviation chuyến (tại mỗi sân bay nhà);
+# giờ ngoài bank có OFF_PEAK_FLIGHTS_PER_HOUR = (số chuyến, độ lệch); mọi giờ có ít nhất MIN_FLIGHTS_PER_HOUR chuyến.
+DEFAULT_BANKS = [
+    {'start_hour': 6, 'end_hour': 9, 'flights_per_hour': 50, 'deviation': 25},
+    {'start_hour': 11, 'end_hour': 14, 'flights_per_hour': 50, 'deviation': 25},
+    {'start_hour': 17, 'end_hour': 20, 'flights_per_hour': 50, 'deviation': 25},
+]
+OFF_PEAK_FLIGHTS_PER_HOUR = (20, 10)
+MIN_FLIGHTS_PER_HOUR = 5
+
+# Số hiệu chuyến bay 3-4 chữ số; mỗi hãng có FLIGHT_NUMBER_COUNT callsign khả dụng
+FLIGHT_NUMBER_RANGE = (100, 9999)
+FLIGHT_NUMBER_COUNT = FLIGHT_NUMBER_RANGE[1] - FLIGHT_NUMBER_RANGE[0] + 1
+
+OUTPUT_FORMATS = ('csv', 'columnar')
+
+def hourly_flight_ranges(banks=DEFAULT_BANKS, off_peak=OFF_PEAK_FLIGHTS_PER_HOUR, scale=1.0):
+    """(số chuyến tối thiểu, tối đa) của từng giờ 0-23 tại một sân bay nhà, đã nhân hệ số `scale`."""
+    base = np.full(24, off_peak[0], dtype=np.float64)
+    deviation = np.full(24, off_peak[1], dtype=np.float64)
+    for bank in banks:
+        hours = np.arange(bank['start_hour'], bank['end_hour'] + 1) % 24
+        base[hours], deviation[hours] = bank['flights_per_hour'], bank['deviation']
+    low = np.maximum(MIN_FLIGHTS_PER_HOUR, np.round((base - deviation) * scale)).astype(np.int64)
+    high = np.maximum(low, np.round((base + deviation) * scale)).astype(np.int64)
+    return low, high
+
+def expected_flights_per_day(home_airports=(HOME_AIRPORT,), banks=DEFAULT_BANKS, off_peak=OFF_PEAK_FLIGHTS_PER_HOUR, scale=1.0):
+    """Số chuyến kỳ vọng mỗi ngày của toàn bộ các sân bay nhà (để chọn số ngày cho một số chuyến mong muốn)."""
+    low, high = hourly_flight_ranges(banks, off_peak, scale)
+    return float((low + high).sum() / 2 * len(home_airports))
+
 # --- Tạo file eets.csv (Airport Metadata) ---
-eets_data_records = []
-for code, (base_eet, dev_eet, base_taxi_in, dev_taxi_in, base_taxi_out, dev_taxi_out) in airport_times_map.items():
-    eet_to_vvts = max(1, base_eet + random.randint(-dev_eet, dev_eet)) 
-    eet_from_vvts = max(1, base_eet + random.randint(-dev_eet, dev_eet)) 
-    taxi_in_minutes = max(5, base_taxi_in + random.randint(-dev_taxi_in, dev_taxi_in))
-    taxi_out_minutes = max(5, base_taxi_out + random.randint(-dev_taxi_out, dev_taxi_out))
-
-    eets_data_records.append({
-        'airport_code': code,
-        'eet_to_vvts_minutes': eet_to_vvts,
-        'eet_from_vvts_minutes': eet_from_vvts,
-        'taxi_in_minutes': taxi_in_minutes,
-        'taxi_out_minutes': taxi_out_minutes 
-    })
+def generate_eets(rng=None, airport_codes=None):
+    """Bảng EET/taxi của từng sân bay: giá trị cơ sở trong airport_times_map cộng độ biến động ngẫu nhiên."""
+    rng = rng if isinstance(rng, np.random.Generator) else np.random.default_rng(rng)
+    codes = list(airport_times_map) if airport_codes is None else [code for code in airport_times_map if code in set(airport_codes)]
+    base_eet, dev_eet, base_taxi_in, dev_taxi_in, base_taxi_out, dev_taxi_out = np.array([airport_times_map[code] for code in codes]).T.reshape(6, -1)
+
+    def vary(base, deviation):
+        return base + rng.integers(-deviation, deviation, endpoint=True)
 
-eets_df_gen = pd.DataFrame(eets_data_records)
-eets_df_gen.to_csv('eets.csv', index=False)
-print("Đã tạo file eets.csv thành công với thông tin EET, Taxi-in, Taxi-out!")
+    return pd.DataFrame({
+        'airport_code': codes,
+        'eet_to_vvts_minutes': np.maximum(1, vary(base_eet, dev_eet)),
+        'eet_from_vvts_minutes': np.maximum(1, vary(base_eet, dev_eet)),
+        'taxi_in_minutes': np.maximum(5, vary(base_taxi_in, dev_taxi_in)),
+        'taxi_out_minutes': np.maximum(5, vary(base_taxi_out, dev_taxi_out)),
+    })
 
 
 # --- Tạo dữ liệu vvts_schedule.csv ---
-flight_records = []
-current_date = date(2025, 6, 23) 
-
-generated_callsigns_set = set() # Để đảm bảo callsign duy nhất
-
-def generate_unique_icao_callsign(airline_code_icao):
-    """Tạo callsign theo format ICAO Operator Designator + Flight Number (duy nhất)"""
-    while True:
-        flight_number = random.randint(100, 9999) # 3-4 chữ số
-        callsign = f"{airline_callsign_map[airline_code_icao]}{flight_number}"
-        if callsign not in generated_callsigns_set:
-            generated_callsigns_set.add(callsign)
-            return callsign
-
-for day_offset in range(NUM_DAYS):
-    current_generating_date = current_date + timedelta(days=day_offset)
-    
-    for hour in range(24):
-        if 6 <= hour <= 9 or 11 <= hour <= 14 or 17 <= hour <= 20:
-            flights_this_hour_base = 50 
-            flights_this_hour_deviation = 25 
-        else:
-            flights_this_hour_base = 20 
-            flights_this_hour_deviation = 10 
-        
-        flights_this_hour = random.randint(max(5, flights_this_hour_base - flights_this_hour_deviation), 
-                                          flights_this_hour_base + flights_this_hour_deviation)
-        flights_this_hour = max(5, flights_this_hour) 
-
-        for i in range(flights_this_hour):
-            flight_direction = random.choice(['arrival', 'departure'])
-            
-            all_other_airports_codes = [code for code in airports.keys() if code != HOME_AIRPORT]
-            
-            domestic_airports = [code for code in all_other_airports_codes if code.startswith('VV')]
-            international_airports = [code for code in all_other_airports_codes if not code.startswith('VV')]
-
-            selected_other_airport = None
-            if random.random() < 0.50 and domestic_airports: 
-                selected_other_airport = random.choice(domestic_airports)
-            elif international_airports: 
-                selected_other_airport = random.choice(international_airports)
-            else: 
-                selected_other_airport = random.choice(all_other_airports_codes)
-
-
-            if flight_direction == 'arrival':
-                origin = selected_other_airport
-                destination = HOME_AIRPORT
-            else: 
-                origin = HOME_AIRPORT
-                destination = selected_other_airport
-            
-            minute = random.randint(0, 59)
-            eobt = f"{hour:02d}:{minute:02d}"
-
-            # Tạo callsign theo ICAO Operator Designator + Flight Number
-            # Đảm bảo chọn một mã hãng hàng không có trong map
-            airline_icao_code = random.choice(airlines_icao_codes) 
-            callsign = generate_unique_icao_callsign(airline_icao_code)
-            
-            aircraft = random.choice(aircraft_types)
-
-            flight_records.append({
-                'callsign': callsign,
-                'origin': origin,
-                'destination': destination,
-                'eobt': eobt,
-                'flight_date': current_generating_date.strftime('%Y-%m-%d'),
-                'aircraft_type': aircraft
-            })
-
-flights_df_gen_schedule = pd.DataFrame(flight_records)
-
-# Lưu DataFrame ra file CSV
-flights_df_gen_schedule.to_csv('vvts_schedule.csv', index=False)
-
-print(f"Đã tạo file vvts_schedule.csv thành công với {len(flights_df_gen_schedule)} chuyến bay trong {NUM_DAYS} ngày!")
-print("Nhớ đặt hai file này cùng thư mục với ứng dụng Streamlit của bạn.")
+class _CallsignPool:
+    """
+    Cấp callsign (ICAO Operator Designator + Flight Number) theo lô: lấy lần lượt từ một hoán vị ngẫu nhiên của mọi
+    tổ hợp hãng x số hiệu, nên callsign không lặp cho tới khi dùng hết (20 hãng x 9.900 số hiệu) và luôn không lặp
+    trong một ngày: khi phần còn lại không đủ cho cả ngày thì chuyển sang hoán vị mới.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+        operators = np.array(list(airline_callsign_map.values()))
+        numbers = np.arange(FLIGHT_NUMBER_RANGE[0], FLIGHT_NUMBER_RANGE[1] + 1).astype(str)
+        self.callsigns = np.char.add(np.repeat(operators, FLIGHT_NUMBER_COUNT), np.tile(numbers, len(operators)))
+        self._order = self.rng.permutation(len(self.callsigns))
+        self._next = 0
+
+    def take_day(self, count):
+        if count > len(self.callsigns):
+            raise ValueError(f"Một ngày có {count} chuyến, vượt số callsign khả dụng ({len(self.callsigns)}).")
+        if self._next + count > len(self._order):
+            self._order, self._next = self.rng.permutation(len(self.callsigns)), 0
+        taken = self.callsigns[self._order[self._next:self._next + count]]
+        self._next += count
+        return taken
+
+def generate_schedule_chunks(num_days=NUM_DAYS, start_date=START_DATE, home_airports=(HOME_AIRPORT,), airport_codes=None,
+                             banks=DEFAULT_BANKS, off_peak=OFF_PEAK_FLIGHTS_PER_HOUR, scale=1.0, domestic_share=0.5,
+                             seed=None, days_per_chunk=7, include_eobt_datetime=False):
+    """
+    Sinh lịch bay theo từng khối `days_per_chunk` ngày (vector hóa, không tạo dict cho từng chuyến).
+
+    Mỗi (ngày, giờ, sân bay nhà) có số chuyến ngẫu nhiên trong hourly_flight_ranges(banks, off_peak, scale);
+    mỗi chuyến là chuyến đến hoặc đi của sân bay nhà (50/50), sân bay còn lại nội địa với xác suất
+    `domestic_share`, phút EOBT, hãng/callsign và loại tàu bay ngẫu nhiên. Cùng seed cho cùng lịch bay.
+    `airport_codes` giới hạn các sân bay còn lại (mặc định mọi sân bay trong airport_times_map).
+
+    Yields:
+        pd.DataFrame: các cột callsign, origin, destination, eobt (HH:MM), flight_date (YYYY-MM-DD), aircraft_type,
+        xếp theo ngày, giờ; thêm eobt_dt_local (datetime) nếu include_eobt_datetime.
+    """
+    rng = np.random.default_rng(seed)
+    home_airports = list(home_airports)
+    others = list(airports if airport_codes is None else airport_codes)
+    low, high = hourly_flight_ranges(banks, off_peak, scale)
+    callsign_pool = _CallsignPool(rng)
+    aircraft = np.array(aircraft_types)
+    time_labels = np.array([f'{hour:02d}:{minute:02d}' for hour in range(24) for minute in range(60)])
+
+    # Sân bay còn lại của từng sân bay nhà, tách nội địa (VV) / quốc tế; thiếu một nhóm thì dùng nhóm kia
+    candidates = []
+    for home in home_airports:
+        pool = np.array([code for code in others if code != home])
+        if not len(pool):
+            raise ValueError(f"Không có sân bay nào khác ngoài {home} để tạo chuyến bay.")
+        domestic, international = pool[np.char.startswith(pool, 'VV')], pool[~np.char.startswith(pool, 'VV')]
+        candidates.append((domestic if len(domestic) else pool, international if len(international) else pool))
+
+    for first_day in range(0, num_days, days_per_chunk):
+        chunk_days = min(days_per_chunk, num_days - first_day)
+        # Lưới (ngày, giờ, sân bay nhà) theo thứ tự xuất ra; mỗi ô lặp lại theo số chuyến của ô
+        day, hour, home = (grid.ravel() for grid in np.meshgrid(np.arange(chunk_days), np.arange(24), np.arange(len(home_airports)), indexing='ij'))
+        counts = rng.integers(low[hour], high[hour], endpoint=True)
+        day, hour, home = np.repeat(day, counts), np.repeat(hour, counts), np.repeat(home, counts)
+        n = len(day)
+
+        is_arrival = rng.random(n) < 0.5
+        is_domestic = rng.random(n) < domestic_share
+        pick = rng.random(n)
+        other = np.empty(n, dtype=object)
+        for position, (domestic, international) in enumerate(candidates):
+            for mask, choices in ((is_domestic, domestic), (~is_domestic, international)):
+                rows = (home == position) & mask
+                other[rows] = choices[(pick[rows] * len(choices)).astype(np.int64)]
+        home_codes = np.array(home_airports, dtype=object)[home]
+
+        minute = rng.integers(0, 60, n)
+        callsigns = np.concatenate([callsign_pool.take_day(int(count)) for count in np.bincount(day, minlength=chunk_days)])
+        chunk_dates = pd.date_range(pd.Timestamp(start_date) + pd.Timedelta(days=first_day), periods=chunk_days, freq='D')
+
+        chunk = pd.DataFrame({
+            'callsign': callsigns,
+            'origin': np.where(is_arrival, other, home_codes),
+            'destination': np.where(is_arrival, home_codes, other),
+            'eobt': time_labels[hour * 60 + minute],
+            'flight_date': chunk_dates.strftime('%Y-%m-%d').to_numpy()[day],
+            'aircraft_type': aircraft[rng.integers(0, len(aircraft), n)],
+        })
+        if include_eobt_datetime:
+            chunk['eobt_dt_local'] = chunk_dates.to_numpy()[day] + pd.to_timedelta(hour * 60 + minute, unit='m').to_numpy()
+        yield chunk
+
+def generate_schedule(num_days=NUM_DAYS, seed=None, **options):
+    """Toàn bộ lịch bay trong một DataFrame (các tham số như generate_schedule_chunks)."""
+    return pd.concat(generate_schedule_chunks(num_days, seed=seed, **options), ignore_index=True)
+
+def write_schedule(path, chunks, output_format='csv'):
+    """
+    Ghi lần lượt các khối lịch bay xuống đĩa, mỗi lần chỉ một khối trong bộ nhớ. 'csv': nối vào một file CSV;
+    'columnar': kho phân vùng theo ngày EOBT (data_cache.write_partitioned, cần cột eobt_dt_local). Trả về số chuyến.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format phải là một trong {OUTPUT_FORMATS}, nhận được {output_format!r}.")
+    written = 0
+
+    def counted(chunks):
+        nonlocal written
+        for chunk in chunks:
+            written += len(chunk)
+            yield chunk
+
+    if output_format == 'columnar':
+        write_partitioned(path, counted(chunks), 'eobt_dt_local')
+    else:
+        for position, chunk in enumerate(counted(chunks)):
+            chunk.to_csv(path, mode='w' if position == 0 else 'a', header=position == 0, index=False)
+    return written
+
+def _parse_banks(specs):
+    """'6-9:50:25' -> {'start_hour': 6, 'end_hour': 9, 'flights_per_hour': 50, 'deviation': 25}."""
+    banks = []
+    for spec in specs:
+        hours, flights_per_hour, deviation = spec.split(':')
+        start_hour, end_hour = hours.split('-')
+        banks.append({'start_hour': int(start_hour), 'end_hour': int(end_hour),
+                      'flights_per_hour': int(flights_per_hour), 'deviation': int(deviation)})
+    return banks
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tạo eets.csv và lịch bay tổng hợp (vvts_schedule.csv hoặc kho dạng cột).")
+    parser.add_argument('--days', type=int, default=NUM_DAYS)
+    parser.add_argument('--start-date', default=START_DATE.isoformat())
+    parser.add_argument('--home-airports', nargs='+', default=[HOME_AIRPORT])
+    parser.add_argument('--airports', nargs='+', help="Các sân bay còn lại được dùng (mặc định: tất cả).")
+    parser.add_argument('--banks', nargs='+', metavar='START-END:FLIGHTS:DEVIATION',
+                        help="Các bank giờ cao điểm, ví dụ 6-9:50:25 (mặc định: 6-9, 11-14, 17-20 với 50 ± 25 chuyến/giờ).")
+    parser.add_argument('--off-peak', type=int, nargs=2, default=list(OFF_PEAK_FLIGHTS_PER_HOUR), metavar=('FLIGHTS', 'DEVIATION'))
+    parser.add_argument('--scale', type=float, default=1.0, help="Hệ số nhân số chuyến mỗi giờ.")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv')
+    parser.add_argument('--chunk-days', type=int, default=7)
+    parser.add_argument('--output-dir', default='.')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    rng = np.random.default_rng(args.seed)
+    eets_df_gen = generate_eets(rng)
+    eets_df_gen.to_csv(os.path.join(args.output_dir, 'eets.csv'), index=False)
+    print("Đã tạo file eets.csv thành công với thông tin EET, Taxi-in, Taxi-out!")
+
+    chunks = generate_schedule_chunks(
+        args.days, date.fromisoformat(args.start_date), args.home_airports, args.airports,
+        _parse_banks(args.banks) if args.banks else DEFAULT_BANKS, tuple(args.off_peak), args.scale,
+        seed=rng.integers(2**63), days_per_chunk=args.chunk_days, include_eobt_datetime=args.format == 'columnar'
+    )
+    schedule_path = os.path.join(args.output_dir, 'vvts_schedule.csv' if args.format == 'csv' else 'vvts_schedule')
+    num_flights = write_schedule(schedule_path, chunks, args.format)
+
+    print(f"Đã tạo {schedule_path} thành công với {num_flights} chuyến bay trong {args.days} ngày!")
+    print("Nhớ đặt hai file này cùng thư mục với ứng dụng Streamlit của bạn.")
+
+if __name__ == '__main__':
+    main()
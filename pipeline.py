@@ -0,0 +1,614 @@
+# atfm_core/pipeline.py
+
+import logging
+import os
+import random
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+try:
+    from .capacity_profile import as_capacity_profile
+    from .config import VVTS_CONFIG
+    from .data_cache import PARTITION_INDEX_NAME, open_partitioned, open_partitioned_store
+    from .demand_cube import DemandCube, RollingDemandIndex
+    from .flight_records import AirportTable, encode_categorical_columns
+    from .gdp_engine import compress_slots, slot_cost_weights
+    from .slot_allocator import (
+        ALL_HOURS_CHANGED_S, NO_SLOT, REGULATED_DELAY_THRESHOLD_MINUTES, SECONDS_PER_HOUR, SlotStore, claim_incremental,
+        from_epoch_seconds, regulation_hour_starts, to_epoch_seconds
+    )
+    from .timing import timed
+except ImportError:  # Chạy trực tiếp cùng app.py (streamlit run app.py)
+    from capacity_profile import as_capacity_profile
+    from config import VVTS_CONFIG
+    from data_cache import PARTITION_INDEX_NAME, open_partitioned, open_partitioned_store
+    from demand_cube import DemandCube, RollingDemandIndex
+    from flight_records import AirportTable, encode_categorical_columns
+    from gdp_engine import compress_slots, slot_cost_weights
+    from slot_allocator import (
+        ALL_HOURS_CHANGED_S, NO_SLOT, REGULATED_DELAY_THRESHOLD_MINUTES, SECONDS_PER_HOUR, SlotStore, claim_incremental,
+        from_epoch_seconds, regulation_hour_starts, to_epoch_seconds
+    )
+    from timing import timed
+
+# Các bước xử lý lõi (lịch bay ban đầu, GDP 2 bước, tuân thủ CTOT, nén slot) không phụ thuộc Streamlit.
+# Thông báo tiến trình đi qua hook `progress(level, message)` với level là 'info', 'warning' hoặc 'success';
+# không truyền hook thì thông báo được ghi vào logger của module. Thời gian mỗi bước được ghi qua timing.timed.
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE_OFFSET_HOURS = VVTS_CONFIG['TIMEZONE_OFFSET_HOURS']
+PROGRESS_LEVELS = ('info', 'warning', 'success')
+
+def log_progress(level, message):
+    """Hook tiến trình mặc định: ghi vào logging (warning -> WARNING, còn lại -> INFO)."""
+    logger.log(logging.WARNING if level == 'warning' else logging.INFO, message)
+
+def report_progress(progress, level, message):
+    """Gửi thông báo tới hook `progress`; None dùng log_progress."""
+    (progress or log_progress)(level, message)
+
+# Hàm giúp khởi tạo DataFrame rỗng với đúng schema và dtypes
+def get_empty_display_dataframe_schema():
+    columns_with_types = {
+        'callsign': str, 'origin': str, 'destination': str, 'aircraft_type': str,
+        'eobt_dt_local': 'datetime64[ns]', 'eobt_dt_utc': 'datetime64[ns]',
+        'eldt_dt_utc': 'datetime64[ns]', 'eet_minutes': float, 'eet_delta': 'timedelta64[ns]',
+        'cldt_dt_utc': 'datetime64[ns]', 'etot_dt_utc': 'datetime64[ns]',
+        'atfm_delay_minutes': float, 'is_regulated': bool, 'flight_type': str, 'flight_scope': str,
+        'regulated_time_utc': 'datetime64[ns]', 'original_event_time_utc': 'datetime64[ns]',
+        'regulated_time_local': 'datetime64[ns]', 'original_event_time_local': 'datetime64[ns]',
+        'eobt_dt_local_display': str, 'ctot_new_local': str,
+        'new_scheduled_time_local': 'datetime64[ns]', 'original_scheduled_time_local': str,
+
+        # Các cột từ eets_df_merged để đảm bảo schema đủ cho strategic data
+        'eet_to_vvts_minutes': float, 'eet_from_vvts_minutes': float,
+        'taxi_in_minutes': float, 'taxi_out_minutes': float,
+        'origin_eet_to_vvts_minutes': float, 'origin_eet_from_vvts_minutes': float, 'origin_taxi_in_minutes': float, 'origin_taxi_out_minutes': float,
+        'dest_eet_to_vvts_minutes': float, 'dest_eet_from_vvts_minutes': float, 'dest_taxi_in_minutes': float, 'dest_taxi_out_minutes': float,
+
+        # Các cột mới tính toán trong calculate_initial_schedules
+        'etot_origin_dt_utc': 'datetime64[ns]', 'eet_to_vvts_delta': 'timedelta64[ns]', 'eibt_vvts_dt_utc': 'datetime64[ns]',
+        'eet_from_vvts_delta': 'timedelta64[ns]', 'eldt_at_dest_dt_utc': 'datetime64[ns]', 'eibt_at_dest_dt_utc': 'datetime64[ns]',
+
+        # Các cột cho Strategic Data Display (dạng string)
+        'EOBT_local_str': str, 'ETOT_local_str': str, 'ELDT_local_str': str, 'EIBT_local_str': str,
+        'EOBT_origin_local_str': str, 'ETOT_origin_local_str': str, 'ELDT_vvts_dt_local_str': str, 'EIBT_vvts_dt_local_str': str,
+
+        # Các cột cho Pre-Tactical Demand Data
+        'predicted_event_time_utc': 'datetime64[ns]',
+        'predicted_event_time_local': 'datetime64[ns]',
+        'is_predicted_delayed': bool,
+        'prediction_delay_minutes': float
+    }
+
+    return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in columns_with_types.items()})
+
+
+@timed
+def prepare_flights(flights_df, eets_df, progress=None):
+    """
+    Tiền xử lý một khối dòng của vvts_schedule.csv (ghép ngày giờ EOBT, đổi sang UTC, gắn EET của sân bay đi/đến).
+    Cột 'aircraft_type' trong vvts_schedule.csv.
+    Các cột 'airport_code', 'eet_to_vvts_minutes', 'eet_from_vvts_minutes', 'taxi_in_minutes', 'taxi_out_minutes' trong eets.csv.
+    """
+    flights_df['eobt_dt_local'] = pd.to_datetime(flights_df['flight_date'] + ' ' + flights_df['eobt'], format='%Y-%m-%d %H:%M', errors='coerce')
+    flights_df.dropna(subset=['eobt_dt_local'], inplace=True)
+    flights_df['eobt_dt_utc'] = flights_df['eobt_dt_local'] - timedelta(hours=TIMEZONE_OFFSET_HOURS)
+
+    if 'aircraft_type' not in flights_df.columns:
+        flights_df['aircraft_type'] = 'N/A'
+        report_progress(progress, 'warning', "File 'vvts_schedule.csv' thiếu cột 'aircraft_type'. Đã thêm cột rỗng.")
+
+    # Tra EET/taxi của sân bay đi và đến từ bảng chiều sân bay bằng chỉ số mảng (không merge eets vào từng dòng);
+    # giá trị thiếu: taxi 15 phút, EET 60 phút
+    flights_df = flights_df.reset_index(drop=True)
+    airports = AirportTable(eets_df)
+    for prefix, code_column in (('origin', 'origin'), ('dest', 'destination')):
+        positions = airports.positions(flights_df[code_column])
+        for column in ('eet_to_vvts_minutes', 'eet_from_vvts_minutes', 'taxi_in_minutes', 'taxi_out_minutes'):
+            flights_df[f'{prefix}_{column}'] = airports.lookup(column, positions, default=15 if 'taxi' in column else 60)
+
+    # Phân loại chuyến bay nội địa/quốc tế dựa trên mã sân bay
+    is_domestic = flights_df['origin'].astype(str).str.startswith('VV') & flights_df['destination'].astype(str).str.startswith('VV')
+    flights_df['flight_scope'] = np.where(is_domestic, 'domestic', 'international')
+
+    # Các cột chuỗi lặp lại (callsign, sân bay, loại tàu bay, ...) lưu dạng category để giảm bộ nhớ mỗi phiên
+    encode_categorical_columns(flights_df)
+
+    return flights_df
+
+# Số dòng CSV đọc mỗi lần khi dựng kho lịch bay: bộ nhớ lúc dựng chỉ cỡ một khối, dù lịch bay dài nhiều tháng
+SCHEDULE_CHUNK_ROWS = 200_000
+
+def read_schedule_chunks(schedule_path, eets_df, chunk_rows=SCHEDULE_CHUNK_ROWS, progress=None):
+    """Đọc vvts_schedule.csv theo từng khối `chunk_rows` dòng, trả về từng khối đã tiền xử lý (prepare_flights)."""
+    for chunk in pd.read_csv(schedule_path, chunksize=chunk_rows):
+        yield prepare_flights(chunk, eets_df, progress)
+
+def read_store_chunks(raw_store, eets_df, progress=None):
+    """Đọc kho lịch bay thô dạng cột (generate_data.py --format columnar) theo từng khối ngày, trả về từng khối đã tiền xử lý."""
+    for _, chunk in raw_store.iter_chunks():
+        yield prepare_flights(chunk, eets_df, progress)
+
+@timed(rows=lambda result: len(result[0]))
+def open_schedule_store(schedule_path, eets_path, progress=None):
+    """
+    Trả về (kho lịch bay phân vùng theo ngày EOBT địa phương, eets_df). Kho được dựng một lần từ vvts_schedule.csv
+    theo từng khối và lưu trên đĩa (data_cache.open_partitioned), dựng lại khi file lịch bay hoặc eets.csv thay đổi.
+    `schedule_path` cũng có thể là thư mục kho dạng cột do generate_data.py --format columnar ghi; kho đã tiền xử lý
+    được lưu trong thư mục đó và dựng lại khi kho được ghi lại.
+    """
+    eets_df = pd.read_csv(eets_path)
+    if os.path.isdir(schedule_path):
+        raw_store = open_partitioned_store(schedule_path)
+        source_path = os.path.join(schedule_path, PARTITION_INDEX_NAME)
+        build_chunks = lambda: read_store_chunks(raw_store, eets_df, progress=progress)
+    else:
+        source_path = schedule_path
+        build_chunks = lambda: read_schedule_chunks(schedule_path, eets_df, progress=progress)
+    store = open_partitioned('schedule_by_date', [source_path, eets_path], build_chunks, 'eobt_dt_local')
+    return store, eets_df
+
+
+def spill_over_hours_for(eets_df):
+    """Số giờ (làm tròn lên) từ EOBT tới khi hạ cánh ở VVTS của chuyến đến dài nhất, tức cửa sổ chuyến bay qua nửa đêm."""
+    longest_minutes = (eets_df['taxi_out_minutes'].fillna(15) + eets_df['eet_to_vvts_minutes'].fillna(60)).max()
+    return int(np.ceil(max(longest_minutes if pd.notna(longest_minutes) else 0, 15 + 60) / 60))
+
+
+@timed
+def keep_flights_for_date(initial_arrivals_df, initial_departures_df, selected_date):
+    """
+    Giữ các chuyến có EOBT trong ngày được chọn, cùng các chuyến của cửa sổ tràn (EOBT hôm trước)
+    có ELDT/ETOT tại VVTS (giờ địa phương) rơi vào ngày được chọn.
+    """
+    offset = timedelta(hours=TIMEZONE_OFFSET_HOURS)
+    kept = []
+    for flights_df, event_column in ((initial_arrivals_df, 'eldt_dt_utc'), (initial_departures_df, 'etot_dt_utc')):
+        in_day = (flights_df['eobt_dt_local'].dt.date == selected_date) | ((flights_df[event_column] + offset).dt.date == selected_date)
+        kept.append(flights_df[in_day].copy())
+    return tuple(kept)
+
+@timed
+def calculate_initial_schedules(flights_df, eets_df):
+    """
+    Tính toán lịch trình ban đầu (ELDT cho chuyến đến, ETOT cho chuyến đi).
+    Tất cả các thời gian được tính toán và lưu trữ ở múi giờ UTC để nhất quán.
+    Bổ sung tính toán ELDT/EIBT cho DEP và EIBT cho ARR cho mục Strategic Data.
+    """
+    # Xử lý chuyến đến (Arrivals)
+    arrivals_df = flights_df[flights_df['destination'] == 'VVTS'].copy()
+
+    # ETOT at Origin for Arrivals = EOBT at Origin + Taxi-out at Origin
+    arrivals_df['origin_taxi_out_delta'] = pd.to_timedelta(arrivals_df['origin_taxi_out_minutes'], unit='m', errors='coerce')
+    arrivals_df['etot_origin_dt_utc'] = arrivals_df['eobt_dt_utc'] + arrivals_df['origin_taxi_out_delta']
+
+    # ELDT at VVTS (Arrivals) = ETOT at Origin + EET from Origin to VVTS
+    arrivals_df['eet_to_vvts_delta'] = pd.to_timedelta(arrivals_df['origin_eet_to_vvts_minutes'], unit='m', errors='coerce')
+    arrivals_df['eldt_dt_utc'] = arrivals_df['etot_origin_dt_utc'] + arrivals_df['eet_to_vvts_delta'] # Corrected ELDT formula from ETOT + EET
+
+    # EIBT at VVTS for Arrivals = ELDT at VVTS + Taxi-in at VVTS
+    arrivals_df['eibt_vvts_dt_utc'] = arrivals_df['eldt_dt_utc'] + pd.to_timedelta(arrivals_df['dest_taxi_in_minutes'], unit='m', errors='coerce') # dest_taxi_in_minutes is VVTS taxi-in here
+
+
+    # Xử lý chuyến đi (Departures)
+    departures_df = flights_df[flights_df['origin'] == 'VVTS'].copy()
+
+    # ETOT at VVTS (Departures) = EOBT at VVTS + Taxi-out from VVTS
+    departures_df['etot_dt_utc'] = departures_df['eobt_dt_utc'] + pd.to_timedelta(VVTS_CONFIG['TAXI_OUT_TIME_MINUTES'], unit='m', errors='coerce') # VVTS_CONFIG['TAXI_OUT_TIME_MINUTES'] is STT for VVTS
+
+    # ELDT at Destination for Departures = ETOT at VVTS + EET from VVTS to Destination
+    departures_df['eet_from_vvts_delta'] = pd.to_timedelta(departures_df['dest_eet_from_vvts_minutes'], unit='m', errors='coerce') # Use dest EET from VVTS
+    departures_df['eldt_at_dest_dt_utc'] = departures_df['etot_dt_utc'] + departures_df['eet_from_vvts_delta']
+
+    # EIBT at Destination for Departures = ELDT at Destination + Taxi-in at Destination
+    departures_df['eibt_at_dest_dt_utc'] = departures_df['eldt_at_dest_dt_utc'] + pd.to_timedelta(departures_df['dest_taxi_in_minutes'], unit='m', errors='coerce')
+
+    return arrivals_df, departures_df
+
+@timed
+def build_initial_traffic_for_pre_tactical(initial_arrivals_df, initial_departures_df):
+    """
+    Gộp chuyến đến và chuyến đi ban đầu thành một DataFrame làm đầu vào cho Pre-tactical
+    (cả bản dự đoán đơn lẻ lẫn chế độ Ensemble).
+    """
+    # Initial traffic for pre-tactical generation should come from initial_arrivals_df and initial_departures_df
+    # Combine initial arrivals and departures into one DataFrame, ensuring all original columns are carried
+    all_initial_traffic_for_pt = pd.concat([
+        initial_arrivals_df.assign(event_time_utc=initial_arrivals_df['eldt_dt_utc'], original_event_time_utc=initial_arrivals_df['eldt_dt_utc'], flight_type='arrival'),
+        initial_departures_df.assign(event_time_utc=initial_departures_df['etot_dt_utc'], original_event_time_utc=initial_departures_df['etot_dt_utc'], flight_type='departure')
+    ])
+
+    # Reindex to ensure all columns from the common initial schema are present
+    common_cols_pt = list(set(initial_arrivals_df.columns.tolist() + initial_departures_df.columns.tolist()))
+    # Reindex with the union of original columns plus the new assigned columns
+    all_initial_traffic_for_pt = all_initial_traffic_for_pt.reindex(columns=list(set(common_cols_pt + ['event_time_utc', 'original_event_time_utc', 'flight_type'])))
+
+    # Fill potential NaN after reindex with appropriate defaults before passing to function
+    for col in all_initial_traffic_for_pt.columns:
+        if 'dt' in str(all_initial_traffic_for_pt[col].dtype) or 'time' in str(all_initial_traffic_for_pt[col].dtype):
+            all_initial_traffic_for_pt[col] = all_initial_traffic_for_pt[col].fillna(pd.NaT)
+        elif 'delta' in str(all_initial_traffic_for_pt[col].dtype):
+            all_initial_traffic_for_pt[col] = all_initial_traffic_for_pt[col].fillna(pd.NaT)
+        elif 'float' in str(all_initial_traffic_for_pt[col].dtype):
+            all_initial_traffic_for_pt[col] = all_initial_traffic_for_pt[col].fillna(0.0)
+        elif 'bool' in str(all_initial_traffic_for_pt[col].dtype):
+            all_initial_traffic_for_pt[col] = all_initial_traffic_for_pt[col].fillna(False)
+        elif isinstance(all_initial_traffic_for_pt[col].dtype, pd.CategoricalDtype):
+            # Cột category (kho lịch bay): chỉ thêm giá trị '' vào bảng category khi thật sự có ô thiếu
+            if all_initial_traffic_for_pt[col].isna().any():
+                all_initial_traffic_for_pt[col] = all_initial_traffic_for_pt[col].cat.add_categories('').fillna('')
+        else:
+            all_initial_traffic_for_pt[col] = all_initial_traffic_for_pt[col].fillna('')
+
+    return all_initial_traffic_for_pt
+
+
+@timed
+def run_gdp_simulation_for_all_traffic(initial_all_traffic_df, takeoff_capacity_hourly, landing_capacity_hourly, reduced_capacity_events,
+                                       assignment_mode='greedy', cost_weights=None, progress=None):
+    """
+    Thực hiện mô phỏng GDP với thuật toán được thiết kế lại:
+    Ưu tiên 1: Kiểm tra năng lực theo giờ.
+    Ưu tiên 2: Kiểm tra khoảng cách theo phút.
+    Với assignment_mode='optimal', slot được cấp sao cho tổng trễ có trọng số (slot_cost_weights) nhỏ nhất.
+    `reduced_capacity_events` là danh sách sự kiện giảm năng lực hoặc một CapacityProfile (ví dụ từ file dự báo).
+    """
+    all_traffic = initial_all_traffic_df.copy()
+    all_traffic['regulated_time_utc'] = pd.NaT
+    all_traffic['atfm_delay_minutes'] = 0.0
+    all_traffic['is_regulated'] = False
+
+    # Sắp xếp các chuyến bay theo thời gian dự kiến để xử lý
+    all_traffic.sort_values(by='predicted_event_time_utc', inplace=True)
+
+    # Các chuyến thiếu thời gian dự đoán không được xếp slot
+    missing_time = all_traffic['predicted_event_time_utc'].isna().to_numpy()
+    for callsign in all_traffic.loc[missing_time, 'callsign']:
+        report_progress(progress, 'warning', f"Bỏ qua chuyến bay {callsign} do thiếu thời gian dự đoán.")
+
+    # Lưới slot ARR và DEP dạng int64 giây epoch, từ giờ đầu tiên đến giờ cuối cùng + 6 giờ
+    if not missing_time.all():
+        start_hour = all_traffic['predicted_event_time_utc'].min().floor('H')
+        end_hour = all_traffic['predicted_event_time_utc'].max().ceil('H') + timedelta(hours=6)
+        hour_starts_s = np.arange(to_epoch_seconds([start_hour])[0], to_epoch_seconds([end_hour])[0] + 1, SECONDS_PER_HOUR)
+        arr_caps, dep_caps = as_capacity_profile(takeoff_capacity_hourly, landing_capacity_hourly, reduced_capacity_events).hourly(hour_starts_s)
+
+        # Mỗi chuyến nhận slot trống đầu tiên >= thời gian mong muốn (searchsorted), ghi lại một lần cho cả cột
+        desired_s = to_epoch_seconds(all_traffic['predicted_event_time_utc'].where(~missing_time, pd.Timestamp(0)), round_up=True)
+        regulated_s = desired_s.copy()
+        is_arrival = (all_traffic['flight_type'] == 'arrival').to_numpy()
+        weights = slot_cost_weights(all_traffic, cost_weights) if assignment_mode == 'optimal' else None
+        for flow_mask, flow_caps in ((is_arrival, arr_caps), (~is_arrival, dep_caps)):
+            flow_mask = flow_mask & ~missing_time
+            flow_slots = SlotStore.from_hourly_capacity(hour_starts_s, flow_caps)
+            if weights is None:
+                slot_s = flow_slots.claim_many(desired_s[flow_mask])
+            else:
+                slot_s = flow_slots.claim_weighted(desired_s[flow_mask], weights[flow_mask])
+            regulated_s[flow_mask] = np.where(slot_s == NO_SLOT, desired_s[flow_mask], slot_s)
+
+        regulated_time = pd.Series(from_epoch_seconds(regulated_s), index=all_traffic.index).where(~missing_time)
+        delay = ((regulated_time - all_traffic['predicted_event_time_utc']).dt.total_seconds() / 60).fillna(0.0)
+        all_traffic['regulated_time_utc'] = regulated_time
+        all_traffic['atfm_delay_minutes'] = delay.where(delay > REGULATED_DELAY_THRESHOLD_MINUTES, 0.0)
+        all_traffic['is_regulated'] = delay > REGULATED_DELAY_THRESHOLD_MINUTES
+
+    # ----- PHẦN CODE CÒN LẠI CỦA HÀM GIỮ NGUYÊN -----
+    df_result_with_display_cols = all_traffic.copy()
+
+    df_result_with_display_cols['regulated_time_local'] = df_result_with_display_cols['regulated_time_utc'] + timedelta(hours=TIMEZONE_OFFSET_HOURS)
+    df_result_with_display_cols['original_event_time_local'] = df_result_with_display_cols['original_event_time_utc'] + timedelta(hours=TIMEZONE_OFFSET_HOURS)
+    df_result_with_display_cols['eobt_dt_local_display'] = df_result_with_display_cols['eobt_dt_local'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+
+    # CTOT: chuyến đến = CLDT - EET từ sân bay đi (EET thiếu coi như 0); chuyến đi = CTOT chính là slot
+    eet_delta = pd.to_timedelta(df_result_with_display_cols['origin_eet_to_vvts_minutes'], unit='m', errors='coerce').fillna(timedelta(0))
+    eet_delta = eet_delta.where(df_result_with_display_cols['flight_type'] == 'arrival', timedelta(0))
+    df_result_with_display_cols['ctot_utc'] = df_result_with_display_cols['regulated_time_utc'] - eet_delta
+    tz_offset = timedelta(hours=TIMEZONE_OFFSET_HOURS)
+    df_result_with_display_cols['ctot_new_local'] = (df_result_with_display_cols['ctot_utc'] + tz_offset).dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+    df_result_with_display_cols.drop(columns=['ctot_utc'], inplace=True)
+
+    df_result_with_display_cols['new_scheduled_time_local'] = df_result_with_display_cols['regulated_time_local'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+    df_result_with_display_cols['original_scheduled_time_local'] = df_result_with_display_cols['original_event_time_local'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+
+    final_schema_cols = get_empty_display_dataframe_schema().columns
+    for col in final_schema_cols:
+        if col not in df_result_with_display_cols.columns:
+            df_result_with_display_cols[col] = pd.NA
+    
+    return df_result_with_display_cols
+
+# --- HÀM MỚI: MÔ PHỎNG SỰ TUÂN THỦ CTOT TRONG THỰC TẾ ---
+@timed
+def simulate_ctot_compliance(regulated_df, rng=random, progress=None):
+    """
+    Mô phỏng sự tuân thủ CTOT với dung sai -5/+10 phút.
+
+    Hàm này lấy DataFrame đã điều tiết và thêm vào các cột:
+      - ``actual_time_utc``: thời gian thực tế sau khi hãng thực hiện.
+      - ``compliance_offset_minutes``: độ lệch so với CTOT.
+      - ``slot_compliance``: đánh dấu tuân thủ (True nếu lệch trong [-5, +10]).
+    ``rng`` là nguồn số ngẫu nhiên có ``randint`` (mặc định module random); truyền ``random.Random(seed)`` để chạy lặp lại được.
+    """
+    report_progress(progress, 'info', "Bước cuối: Mô phỏng sự tuân thủ CTOT với dung sai -5/+10 phút...")
+
+    df_with_actuals = regulated_df.copy()
+
+    # Chỉ áp dụng lệch cho các chuyến bay bị điều tiết
+    is_regulated = (df_with_actuals['is_regulated'] == True).to_numpy()
+
+    # Sinh độ lệch ngẫu nhiên rộng hơn để có trường hợp vi phạm (rút theo thứ tự dòng như trước, nên cùng seed
+    # cho cùng kết quả), rồi gán cả cột một lần thay vì .loc từng chuyến
+    compliance_offsets = np.array([rng.randint(-20, 20) for _ in range(int(is_regulated.sum()))], dtype=np.int64)
+    offset_minutes = np.zeros(len(df_with_actuals), dtype=np.int64)
+    offset_minutes[is_regulated] = compliance_offsets
+    df_with_actuals['actual_time_utc'] = df_with_actuals['regulated_time_utc'] + pd.to_timedelta(offset_minutes, unit='m')
+    df_with_actuals['compliance_offset_minutes'] = offset_minutes
+    df_with_actuals['slot_compliance'] = (offset_minutes >= -5) & (offset_minutes <= 10)
+
+    return df_with_actuals
+
+# --- NÉN SLOT KHI CÓ CHUYẾN HỦY / KHÔNG TUÂN THỦ CTOT ---
+@timed
+def apply_slot_compression(regulated_df, cancelled_callsigns, include_non_compliant, timezone_offset_hours):
+    """
+    Trả lại slot của các chuyến hủy (và chuyến không tuân thủ CTOT nếu chọn), đẩy các chuyến bị trễ phía sau lên sớm
+    hơn (không sớm hơn thời gian dự kiến) rồi cập nhật các cột hiển thị. Trả về (lịch trình mới, các chuyến đổi slot).
+    """
+    cancelled_index = regulated_df.index[regulated_df['callsign'].isin(cancelled_callsigns)]
+    non_compliant_index = regulated_df.index[regulated_df['slot_compliance'] == False] if include_non_compliant else []
+    updated_df, moves_df = compress_slots(
+        regulated_df, cancelled_index, non_compliant_index, earliest_time_column='predicted_event_time_utc'
+    )
+
+    # Chuyến đổi slot và chuyến được xếp lại bay đúng slot mới; cập nhật lại thời gian hiển thị và CTOT của các chuyến này
+    moved = moves_df.index.union(updated_df.index.intersection(non_compliant_index))
+    tz_offset = timedelta(hours=timezone_offset_hours)
+    updated_df.loc[moved, 'actual_time_utc'] = updated_df.loc[moved, 'regulated_time_utc']
+    updated_df.loc[moved, 'compliance_offset_minutes'] = 0
+    updated_df.loc[moved, 'slot_compliance'] = True
+    updated_df.loc[moved, 'regulated_time_local'] = updated_df.loc[moved, 'regulated_time_utc'] + tz_offset
+    updated_df.loc[moved, 'new_scheduled_time_local'] = updated_df.loc[moved, 'regulated_time_local'].dt.strftime('%Y-%m-%d %H:%M:%S')
+
+    eet_delta = pd.to_timedelta(updated_df.loc[moved, 'origin_eet_to_vvts_minutes'], unit='m', errors='coerce').fillna(timedelta(0))
+    eet_delta = eet_delta.where(updated_df.loc[moved, 'flight_type'] == 'arrival', timedelta(0))
+    ctot_local = (updated_df.loc[moved, 'regulated_time_utc'] - eet_delta + tz_offset).where(updated_df.loc[moved, 'is_regulated'])
+    updated_df.loc[moved, 'ctot_new_local'] = ctot_local.dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+    return updated_df, moves_df
+
+# --- CẢI TIẾN: Thuật toán GDP 2 bước (Dual-Pass) phiên bản CUỐI CÙNG, SỬA LỖI MẤT DỮ LIỆU ---
+def _congested_hours_s(demand_cube, flow, hourly_capacity_fn, rolling_index=None, rolling_step_minutes=None):
+    """
+    Các giờ (giây epoch, đã sắp xếp) có số chuyến của luồng `flow` trong khối nhu cầu vượt năng lực do hourly_capacity_fn(hours) trả về.
+    Với `rolling_index` là các giờ giao với một cửa sổ 60 phút quá tải, các cửa sổ bắt đầu mỗi `rolling_step_minutes` phút.
+    """
+    if rolling_index is not None:
+        return rolling_index.overloaded_hours_s(flow, hourly_capacity_fn, step_minutes=rolling_step_minutes)
+    hours_s, demand = demand_cube.hour_counts_s(flow)
+    return hours_s[demand > hourly_capacity_fn(hours_s)]
+
+def _first_membership_change_s(desired_s, in_region, previous_in_region):
+    """Đầu giờ sớm nhất chứa một chuyến bay đổi trạng thái thuộc/không thuộc vùng điều tiết, None nếu không có."""
+    changed = in_region != previous_in_region
+    if not changed.any():
+        return None
+    return int(desired_s[changed].min()) // SECONDS_PER_HOUR * SECONDS_PER_HOUR
+
+def _min_change_s(*bounds):
+    bounds = [bound for bound in bounds if bound is not None]
+    return min(bounds) if bounds else None
+
+def dual_pass_allocation(desired_s, desired_hour_s, is_arrival, is_departure, takeoff_capacity, landing_capacity, capacity_events,
+                         weights=None, previous_allocation=None, recompute_from_s=ALL_HOURS_CHANGED_S, demand_cube=None,
+                         rolling_step_minutes=None, progress=None):
+    """
+    Phần phân bổ slot của GDP 2 bước trên mảng (giây epoch), không dựng DataFrame: luồng đến rồi luồng đi.
+    `desired_s` là thời gian mong muốn (làm tròn lên giây), `desired_hour_s` là đầu giờ chứa nó; is_arrival/is_departure
+    chỉ gồm các chuyến có thời gian. Với `previous_allocation` (tính tăng dần) chỉ phân bổ lại từ `recompute_from_s`.
+    Giờ tắc nghẽn được đọc từ `demand_cube` (DemandCube theo phút UTC của các chuyến, xem dual_pass_demand_cube);
+    không truyền thì khối được dựng từ desired_s. Mặc định tắc nghẽn được xét trên các giờ cố định; với
+    `rolling_step_minutes` thì trên cửa sổ trượt 60 phút bắt đầu mỗi rolling_step_minutes phút (RollingDemandIndex),
+    nên đợt cao điểm vắt qua ranh giới giờ cũng được phát hiện và vùng điều tiết phủ các giờ cửa sổ đó giao.
+    `capacity_events` là danh sách sự kiện giảm năng lực hoặc một CapacityProfile; năng lực mỗi giờ tra từ hồ sơ.
+
+    Returns:
+        (regulated_s, in_arrival_region, in_departure_region, recompute_from_s)
+    """
+    capacity_profile = as_capacity_profile(takeoff_capacity, landing_capacity, capacity_events)
+    hour_caps = capacity_profile.hourly
+    extra_hours = capacity_profile.reduced_hours()
+    previous_regulated_s = previous_allocation['regulated_s'] if previous_allocation is not None else None
+    regulated_s = desired_s.copy()
+    if demand_cube is None:
+        demand_cube = DemandCube.from_epoch_seconds(desired_s, is_arrival, is_departure, bin_minutes=1)
+    rolling_index = RollingDemandIndex.from_cube(demand_cube) if rolling_step_minutes else None
+
+    # ==============================================================================
+    # ===== BƯỚC A: ĐIỀU TIẾT LUỒNG ĐẾN (ARRIVAL PASS) =============================
+    # ==============================================================================
+    report_progress(progress, 'info', "Bước A: Điều tiết các chuyến bay hạ cánh (Arrivals)...")
+
+    in_arrival_region = np.zeros(len(desired_s), dtype=bool)
+    if is_arrival.any():
+        congested_arrival_hours = _congested_hours_s(demand_cube, 'arrival', lambda hours_s: hour_caps(hours_s)[0], rolling_index, rolling_step_minutes)
+        if len(congested_arrival_hours):
+            report_progress(progress, 'warning', f"Phát hiện {len(congested_arrival_hours)} giờ tắc nghẽn hạ cánh.")
+            arr_reg_start_s = int(congested_arrival_hours[0])
+            arr_reg_end_s = int(congested_arrival_hours[-1]) + SECONDS_PER_HOUR
+            in_arrival_region = is_arrival & (desired_s >= arr_reg_start_s) & (desired_s < arr_reg_end_s)
+        else:
+            report_progress(progress, 'success', "Luồng hạ cánh thông thoáng.")
+    else:
+        report_progress(progress, 'success', "Không có chuyến bay hạ cánh nào trong dữ liệu.")
+
+    if previous_allocation is not None:
+        recompute_from_s = _min_change_s(recompute_from_s, _first_membership_change_s(desired_s, in_arrival_region, previous_allocation['in_arrival_region']))
+
+    if in_arrival_region.any():
+        # Lưới slot hạ cánh từ đầu cửa sổ điều tiết; mỗi slot là một cửa sổ 60/năng lực phút,
+        # slot sớm hơn giờ mong muốn của một chuyến vẫn còn trống cho chuyến sau
+        region = np.flatnonzero(in_arrival_region)
+        region = region[np.argsort(desired_s[region], kind='stable')]
+        hour_starts_s = regulation_hour_starts(arr_reg_start_s, desired_s[region], landing_capacity, extra_hours)
+        arrival_slots = SlotStore.from_hourly_capacity(hour_starts_s, hour_caps(hour_starts_s)[0], use_slot_windows=True)
+        slot_s, _ = claim_incremental(
+            arrival_slots, desired_s[region], None if previous_regulated_s is None else previous_regulated_s[region], recompute_from_s,
+            weights=None if weights is None else weights[region]
+        )
+        regulated_s[region] = np.where(slot_s == NO_SLOT, desired_s[region], slot_s)
+
+    # ==============================================================================
+    # ===== BƯỚC B: ĐIỀU TIẾT LUỒNG ĐI (DEPARTURE PASS) ============================
+    # ==============================================================================
+    report_progress(progress, 'info', "Bước B: Điều tiết các chuyến bay cất cánh (Departures)...")
+
+    in_departure_region = np.zeros(len(desired_s), dtype=bool)
+    if is_departure.any():
+        # Năng lực cất cánh còn lại = năng lực tổng của giờ - số chuyến hạ cánh đã điều tiết (tối thiểu 1/4 năng lực cất cánh);
+        # ngoài khung giờ có dữ liệu dùng năng lực cất cánh của giờ đó
+        regulated_hour_s = regulated_s // SECONDS_PER_HOUR * SECONDS_PER_HOUR
+        range_hours_s = np.concatenate([regulated_hour_s[is_arrival], desired_hour_s[is_departure]])
+        first_range_hour_s, last_range_hour_s = range_hours_s.min(), range_hours_s.max()
+        regulated_arrivals_per_hour = pd.Series(regulated_hour_s[is_arrival]).value_counts()
+
+        def departure_capacity(hours_s):
+            arr_caps, dep_caps = hour_caps(hours_s)
+            regulated_arrivals = regulated_arrivals_per_hour.reindex(hours_s, fill_value=0).to_numpy()
+            remaining = np.maximum(dep_caps / 4, arr_caps + dep_caps - regulated_arrivals)
+            in_range = (hours_s >= first_range_hour_s) & (hours_s <= last_range_hour_s)
+            return np.where(in_range, remaining, dep_caps)
+
+        congested_departure_hours = _congested_hours_s(demand_cube, 'departure', departure_capacity, rolling_index, rolling_step_minutes)
+        if len(congested_departure_hours):
+            report_progress(progress, 'warning', f"Phát hiện {len(congested_departure_hours)} giờ tắc nghẽn cất cánh.")
+            dep_reg_start_s = int(congested_departure_hours[0])
+            in_departure_region = is_departure & (desired_s >= dep_reg_start_s)
+        else:
+            report_progress(progress, 'success', "Luồng cất cánh thông thoáng.")
+    else:
+        report_progress(progress, 'success', "Không có chuyến bay cất cánh nào trong dữ liệu.")
+
+    if previous_allocation is not None:
+        recompute_from_s = _min_change_s(recompute_from_s, _first_membership_change_s(desired_s, in_departure_region, previous_allocation['in_departure_region']))
+
+    if in_departure_region.any():
+        # Lưới slot cất cánh theo năng lực còn lại của từng giờ
+        region = np.flatnonzero(in_departure_region)
+        region = region[np.argsort(desired_s[region], kind='stable')]
+        hour_starts_s = regulation_hour_starts(dep_reg_start_s, desired_s[region], takeoff_capacity / 4, extra_hours)
+        departure_slots = SlotStore.from_hourly_capacity(hour_starts_s, departure_capacity(hour_starts_s), use_slot_windows=True)
+        slot_s, _ = claim_incremental(
+            departure_slots, desired_s[region], None if previous_regulated_s is None else previous_regulated_s[region], recompute_from_s,
+            weights=None if weights is None else weights[region]
+        )
+        regulated_s[region] = np.where(slot_s == NO_SLOT, desired_s[region], slot_s)
+
+    return regulated_s, in_arrival_region, in_departure_region, recompute_from_s
+
+def dual_pass_inputs(pre_tactical_df):
+    """Mảng đầu vào của dual_pass_allocation từ dữ liệu Pre-tactical: (has_time, desired_s, desired_hour_s, is_arrival, is_departure)."""
+    predicted_utc = pre_tactical_df['predicted_event_time_utc']
+    has_time = predicted_utc.notna().to_numpy()
+    desired_s = np.where(has_time, to_epoch_seconds(predicted_utc.where(has_time, pd.Timestamp(0)), round_up=True), 0)
+    desired_hour_s = np.where(has_time, to_epoch_seconds(predicted_utc.where(has_time, pd.Timestamp(0))), 0) // SECONDS_PER_HOUR * SECONDS_PER_HOUR
+    is_arrival = (pre_tactical_df['flight_type'] == 'arrival').to_numpy() & has_time
+    is_departure = (pre_tactical_df['flight_type'] == 'departure').to_numpy() & has_time
+    return has_time, desired_s, desired_hour_s, is_arrival, is_departure
+
+def dual_pass_demand_cube(pre_tactical_df):
+    """Khối nhu cầu theo phút (thời gian UTC x luồng) của dữ liệu Pre-tactical, dựng một lần cho dual_pass_allocation."""
+    return DemandCube.from_flights({'pre_tactical': (pre_tactical_df, 'predicted_event_time_utc')}, bin_minutes=1, dimensions=())
+
+@timed
+def run_dual_pass_gdp_simulation(pre_tactical_df, takeoff_capacity, landing_capacity, capacity_events, timezone_offset_hours, previous_allocation=None,
+                                 assignment_mode='greedy', cost_weights=None, rolling_step_minutes=None, progress=None):
+    """
+    Thực hiện mô phỏng GDP 2 bước, phiên bản cuối cùng:
+    - Sửa lỗi mất dữ liệu của các chuyến bay không bị điều tiết.
+    - Đảm bảo tất cả chuyến bay đều có trong kết quả cuối cùng.
+    - Năng lực từng giờ tính cả các sự kiện giảm năng lực (`capacity_events`: danh sách sự kiện hoặc CapacityProfile,
+      ví dụ dựng từ file dự báo năng lực).
+
+    Nếu có `previous_allocation` (phân bổ trả về từ lần chạy trước trên cùng dữ liệu Pre-tactical), chỉ phân bổ lại
+    từ giờ sớm nhất bị ảnh hưởng bởi thay đổi năng lực/sự kiện; các chuyến có slot trước giờ đó giữ nguyên.
+    Trả về (DataFrame kết quả, allocation); allocation['changed_index'] là các chuyến bay có CTOT thay đổi.
+
+    assignment_mode='optimal' cấp slot trong mỗi luồng theo SlotStore.claim_weighted (tổng trễ có trọng số
+    slot_cost_weights nhỏ nhất) thay vì tham lam theo thứ tự thời gian mong muốn.
+
+    rolling_step_minutes (ví dụ ROLLING_STEP_MINUTES = 15) phát hiện tắc nghẽn trên cửa sổ trượt 60 phút thay vì giờ cố định.
+    """
+    report_progress(progress, 'info', "Bắt đầu quy trình điều tiết 2 bước (phiên bản cuối cùng)...")
+
+    has_time, desired_s, desired_hour_s, is_arrival, is_departure = dual_pass_inputs(pre_tactical_df)
+    weights = slot_cost_weights(pre_tactical_df, cost_weights) if assignment_mode == 'optimal' else None
+
+    # Chỉ tính tăng dần khi dữ liệu đầu vào và cách phân bổ trùng với lần chạy trước
+    reuse = (
+        previous_allocation is not None
+        and previous_allocation['flight_index'].equals(pre_tactical_df.index)
+        and np.array_equal(previous_allocation['desired_s'], desired_s)
+        and previous_allocation['assignment_mode'] == assignment_mode
+        and previous_allocation.get('rolling_step_minutes') == rolling_step_minutes
+        and (weights is None or np.array_equal(previous_allocation['weights'], weights))
+    )
+    capacity_profile = as_capacity_profile(takeoff_capacity, landing_capacity, capacity_events)
+    recompute_from_s = capacity_profile.first_difference_s(previous_allocation['capacity_profile']) if reuse else ALL_HOURS_CHANGED_S
+    previous_regulated_s = previous_allocation['regulated_s'] if reuse else None
+    regulated_s, in_arrival_region, in_departure_region, recompute_from_s = dual_pass_allocation(
+        desired_s, desired_hour_s, is_arrival, is_departure, takeoff_capacity, landing_capacity, capacity_profile,
+        weights=weights, previous_allocation=previous_allocation if reuse else None, recompute_from_s=recompute_from_s,
+        demand_cube=dual_pass_demand_cube(pre_tactical_df), rolling_step_minutes=rolling_step_minutes, progress=progress
+    )
+
+    # ==============================================================================
+    # ===== BƯỚC C: KẾT HỢP VÀ HOÀN THIỆN ==========================================
+    # ==============================================================================
+    regulated_by_pass = in_arrival_region | in_departure_region
+    final_df = pre_tactical_df.copy()
+    final_df['regulated_time_utc'] = final_df['predicted_event_time_utc']
+    final_df.loc[regulated_by_pass, 'regulated_time_utc'] = from_epoch_seconds(regulated_s[regulated_by_pass])
+    final_df = final_df.dropna(subset=['callsign'])
+
+    final_df['atfm_delay_minutes'] = ((final_df['regulated_time_utc'] - final_df['predicted_event_time_utc']).dt.total_seconds() / 60).clip(lower=0)
+    final_df['is_regulated'] = final_df['atfm_delay_minutes'] > REGULATED_DELAY_THRESHOLD_MINUTES
+
+    df_result_with_display_cols = final_df.copy()
+    df_result_with_display_cols['regulated_time_local'] = pd.to_datetime(df_result_with_display_cols['regulated_time_utc']).dt.tz_localize('UTC').dt.tz_convert(f'Etc/GMT-{timezone_offset_hours}').dt.tz_localize(None)
+    df_result_with_display_cols['original_event_time_local'] = pd.to_datetime(df_result_with_display_cols['original_event_time_utc']).dt.tz_localize('UTC').dt.tz_convert(f'Etc/GMT-{timezone_offset_hours}').dt.tz_localize(None)
+
+    # CTOT chỉ cho chuyến bị điều tiết: chuyến đến = CLDT - EET từ sân bay đi; chuyến đi = CTOT chính là slot
+    eet_delta = pd.to_timedelta(df_result_with_display_cols['origin_eet_to_vvts_minutes'], unit='m', errors='coerce')
+    eet_delta = eet_delta.where(df_result_with_display_cols['flight_type'] == 'arrival', timedelta(0))
+    ctot_utc = (df_result_with_display_cols['regulated_time_utc'] - eet_delta).where(df_result_with_display_cols['is_regulated'])
+    df_result_with_display_cols['ctot_new_local'] = pd.to_datetime(ctot_utc).dt.tz_localize('UTC').dt.tz_convert(f'Etc/GMT-{timezone_offset_hours}').dt.tz_localize(None).dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+    df_result_with_display_cols['new_scheduled_time_local'] = df_result_with_display_cols['regulated_time_local'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+    df_result_with_display_cols['original_scheduled_time_local'] = pd.to_datetime(df_result_with_display_cols['original_event_time_local']).dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+
+    final_schema_cols = get_empty_display_dataframe_schema().columns
+    for col in final_schema_cols:
+        if col not in df_result_with_display_cols.columns:
+            df_result_with_display_cols[col] = pd.NA
+
+    changed = has_time & (regulated_s != previous_regulated_s) if reuse else has_time & regulated_by_pass
+    allocation = {
+        'capacity_profile': capacity_profile,
+        'flight_index': pre_tactical_df.index.copy(),
+        'desired_s': desired_s,
+        'regulated_s': regulated_s,
+        'in_arrival_region': in_arrival_region,
+        'in_departure_region': in_departure_region,
+        'recompute_from_utc': None if recompute_from_s in (None, ALL_HOURS_CHANGED_S) else from_epoch_seconds([recompute_from_s])[0],
+        'is_incremental': reuse and recompute_from_s != ALL_HOURS_CHANGED_S,
+        'changed_index': pre_tactical_df.index[changed],
+        'assignment_mode': assignment_mode,
+        'weights': weights,
+        'rolling_step_minutes': rolling_step_minutes,
+    }
+
+    report_progress(progress, 'success', "Hoàn tất mô phỏng điều tiết!")
+    return df_result_with_display_cols[list(final_schema_cols)], allocation
+
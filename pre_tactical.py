@@ -0,0 +1,74 @@
+# atfm_core/pre_tactical.py
+
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+try:
+    from .timing import timed
+except ImportError:  # Chạy trực tiếp cùng app.py (streamlit run app.py)
+    from timing import timed
+
+# Các thông số mô phỏng độ trễ/biến động tiền chiến thuật
+PRE_TACTICAL_PARAMS = {
+    'delay_prob_overall': 0.15,  # 15% chuyến bay bị ảnh hưởng
+    'min_delay': 5,
+    'max_delay': 45,             # Có thể delay nặng hơn trong Pre-Tactical
+    'eet_variance_prob': 0.10,   # 10% chuyến bay ARR có biến động EET
+    'max_eet_variance': 20,      # Biến động EET lên đến +-20 phút (gió, đường bay)
+}
+
+def resolve_params(params=None):
+    """Gộp các thông số người dùng truyền vào với giá trị mặc định."""
+    return {**PRE_TACTICAL_PARAMS, **(params or {})}
+
+def sample_prediction_offsets(rng, is_arrival, params=None):
+    """
+    Rút mẫu độ trễ và biến động EET cho toàn bộ chuyến bay trong một lượt.
+
+    Args:
+        rng (np.random.Generator): bộ sinh số ngẫu nhiên đã được seed.
+        is_arrival (np.ndarray): mảng bool, True nếu là chuyến bay đến.
+        params (dict, optional): ghi đè PRE_TACTICAL_PARAMS.
+    Returns:
+        (np.ndarray, np.ndarray): (is_predicted_delayed, độ lệch dự đoán tính bằng phút).
+    """
+    p = resolve_params(params)
+    n = len(is_arrival)
+
+    # 1. Độ trễ ngẫu nhiên tổng thể (cho cả ARR và DEP)
+    is_delayed = rng.random(n) < p['delay_prob_overall']
+    delay_minutes = rng.integers(p['min_delay'], p['max_delay'], n, endpoint=True)
+
+    # 2. Biến động EET (chỉ ảnh hưởng Arrival ELDT)
+    has_eet_change = np.asarray(is_arrival, dtype=bool) & (rng.random(n) < p['eet_variance_prob'])
+    eet_change_minutes = rng.integers(-p['max_eet_variance'], p['max_eet_variance'], n, endpoint=True)
+
+    offset_minutes = np.where(is_delayed, delay_minutes, 0) + np.where(has_eet_change, eet_change_minutes, 0)
+    return is_delayed, offset_minutes
+
+@timed
+def generate_pre_tactical_demand_data(all_initial_traffic_df, seed=None, params=None, timezone_offset_hours=7):
+    """
+    Tạo dữ liệu nhu cầu tiền chiến thuật bằng cách áp dụng độ trễ/biến động ngẫu nhiên.
+    Args:
+        all_initial_traffic_df (pd.DataFrame): DataFrame chứa tất cả các chuyến bay ban đầu (đã được tính toán ELDT/ETOT gốc).
+        seed (int | np.random.SeedSequence, optional): seed cho np.random.Generator; cùng seed cho cùng kết quả.
+        params (dict, optional): ghi đè PRE_TACTICAL_PARAMS.
+        timezone_offset_hours (int): múi giờ sân bay để tính cột giờ địa phương.
+    Returns:
+        pd.DataFrame: DataFrame mới với các cột thời gian dự đoán tiền chiến thuật.
+    """
+    pre_tactical_df = all_initial_traffic_df.copy()
+    rng = np.random.default_rng(seed)
+
+    is_arrival = (pre_tactical_df['flight_type'] == 'arrival').to_numpy()
+    is_delayed, offset_minutes = sample_prediction_offsets(rng, is_arrival, params)
+
+    pre_tactical_df['is_predicted_delayed'] = is_delayed
+    pre_tactical_df['prediction_delay_minutes'] = offset_minutes.astype('float64')
+    pre_tactical_df['predicted_event_time_utc'] = pre_tactical_df['event_time_utc'] + pd.to_timedelta(offset_minutes, unit='m')
+
+    # Tính toán các cột hiển thị thời gian Local cho dữ liệu Pre-Tactical
+    pre_tactical_df['predicted_event_time_local'] = pre_tactical_df['predicted_event_time_utc'] + timedelta(hours=timezone_offset_hours)
+
+    return pre_tactical_df
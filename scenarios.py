@@ -0,0 +1,172 @@
+# atfm_core/scenarios.py
+
+import json
+import os
+import random
+from datetime import timedelta
+
+import pandas as pd
+from .capacity_profile import CapacityProfile
+from .config import VVTS_CONFIG
+from .gdp_engine import ASSIGNMENT_MODES, assignment_delay_summary, slot_cost_weights
+from .pipeline import (
+    TIMEZONE_OFFSET_HOURS, build_initial_traffic_for_pre_tactical, calculate_initial_schedules, keep_flights_for_date,
+    open_schedule_store, report_progress, run_dual_pass_gdp_simulation, simulate_ctot_compliance, spill_over_hours_for
+)
+from .pre_tactical import generate_pre_tactical_demand_data
+from .timing import current_recorder
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Giá trị mặc định của một kịch bản; file kịch bản chỉ cần ghi các trường khác mặc định
+SCENARIO_DEFAULTS = {
+    'takeoff_capacity': VVTS_CONFIG['TAKEOFF_CAPACITY_HOURLY'],
+    'landing_capacity': VVTS_CONFIG['LANDING_CAPACITY_HOURLY'],
+    'reduced_capacity_events': [],
+    'capacity_forecast': None,
+    'seed': 42,
+    'assignment_mode': 'greedy',
+    'pre_tactical_params': {},
+    'simulate_compliance': True,
+    'rolling_step_minutes': None,
+}
+
+# Các cột của lịch trình điều tiết ghi ra regulated_schedule.csv
+REGULATED_SCHEDULE_COLUMNS = [
+    'callsign', 'flight_type', 'origin', 'destination', 'aircraft_type', 'flight_scope', 'eobt_dt_local',
+    'original_event_time_utc', 'predicted_event_time_utc', 'regulated_time_utc', 'regulated_time_local',
+    'ctot_new_local', 'atfm_delay_minutes', 'is_regulated', 'actual_time_utc', 'compliance_offset_minutes', 'slot_compliance',
+]
+
+def load_scenarios(path):
+    """
+    Đọc file kịch bản JSON: một kịch bản (dict), một danh sách kịch bản, hoặc
+    {"defaults": {...}, "scenarios": [...]} với các trường dùng chung trong "defaults".
+
+    Mỗi kịch bản có 'date' (YYYY-MM-DD) và tùy chọn 'name', 'takeoff_capacity', 'landing_capacity',
+    'reduced_capacity_events' (danh sách {'start_time_local', 'end_time_local', 'new_capacity'}), 'capacity_forecast'
+    (đường dẫn CSV dự báo năng lực, xem capacity_profile.forecast_intervals), 'seed',
+    'assignment_mode', 'pre_tactical_params', 'simulate_compliance', 'rolling_step_minutes' (phát hiện tắc nghẽn
+    trên cửa sổ trượt 60 phút bắt đầu mỗi rolling_step_minutes phút; mặc định theo giờ cố định). Thiếu 'name' thì tên là <tên file>-<thứ tự>.
+    """
+    with open(path, encoding='utf-8') as scenario_file:
+        content = json.load(scenario_file)
+    if isinstance(content, dict) and 'scenarios' in content:
+        defaults, scenarios = content.get('defaults', {}), content['scenarios']
+    else:
+        defaults, scenarios = {}, content if isinstance(content, list) else [content]
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    resolved = []
+    for position, scenario in enumerate(scenarios):
+        scenario = {**SCENARIO_DEFAULTS, **defaults, **scenario}
+        if 'date' not in scenario:
+            raise ValueError(f"Kịch bản {position} trong {path} thiếu trường 'date'.")
+        if scenario['assignment_mode'] not in ASSIGNMENT_MODES:
+            raise ValueError(f"assignment_mode phải là một trong {ASSIGNMENT_MODES}, nhận được {scenario['assignment_mode']!r}.")
+        scenario.setdefault('name', stem if len(scenarios) == 1 else f'{stem}-{position}')
+        resolved.append(scenario)
+    return resolved
+
+def capacity_events_utc(events, timezone_offset_hours=TIMEZONE_OFFSET_HOURS):
+    """Sự kiện giảm năng lực theo giờ địa phương -> dạng dùng cho GDP (thêm start_time_utc/end_time_utc), như sidebar của app."""
+    offset = timedelta(hours=timezone_offset_hours)
+    converted = []
+    for event in events:
+        start_local, end_local = pd.Timestamp(event['start_time_local']), pd.Timestamp(event['end_time_local'])
+        if start_local >= end_local:
+            raise ValueError(f"Sự kiện giảm năng lực có thời gian kết thúc không sau thời gian bắt đầu: {event}.")
+        converted.append({
+            'start_time_local': start_local, 'end_time_local': end_local,
+            'start_time_utc': start_local - offset, 'end_time_utc': end_local - offset,
+            'new_capacity': int(event['new_capacity']),
+        })
+    return converted
+
+def scenario_kpis(regulated_df):
+    """
+    Chỉ số tổng hợp của một lịch trình điều tiết (cùng cách tính với phần Thống kê chung của app), kèm
+    tổng trễ có trọng số slot_cost_weights để so sánh các kịch bản tham lam / tối ưu.
+    """
+    total_regulated = int(regulated_df['is_regulated'].sum())
+    total_delay = float(regulated_df['atfm_delay_minutes'].sum())
+    kpis = {
+        'flights': len(regulated_df),
+        'arrivals': int((regulated_df['flight_type'] == 'arrival').sum()),
+        'departures': int((regulated_df['flight_type'] == 'departure').sum()),
+        'regulated_flights': total_regulated,
+        'total_delay_minutes': total_delay,
+        'average_delay_minutes': total_delay / total_regulated if total_regulated > 0 else 0.0,
+        'max_delay_minutes': float(regulated_df['atfm_delay_minutes'].max()) if len(regulated_df) else 0.0,
+    }
+    if 'slot_compliance' in regulated_df:
+        kpis['non_compliant_flights'] = int((regulated_df['slot_compliance'] == False).sum())
+    kpis['weighted_delay_minutes'] = assignment_delay_summary(regulated_df, slot_cost_weights(regulated_df))['weighted_delay_minutes']
+    return kpis
+
+def run_scenario(scenario, schedule_store, eets_df, progress=None):
+    """
+    Chạy một kịch bản (dict đã qua load_scenarios hoặc cùng các trường) trên kho lịch bay của
+    pipeline.open_schedule_store: lịch bay ban đầu của ngày -> Pre-tactical (seed) -> GDP 2 bước -> tuân thủ CTOT.
+    Trả về (lịch trình điều tiết, dict KPI). Không gọi Streamlit; tiến trình đi qua hook `progress`.
+    """
+    scenario = {**SCENARIO_DEFAULTS, **scenario}
+    selected_date = pd.Timestamp(scenario['date']).date()
+    report_progress(progress, 'info', f"Kịch bản {scenario.get('name', selected_date)}: ngày {selected_date:%d/%m/%Y}.")
+
+    flights_df = schedule_store.read_date(selected_date, spill_over_hours_for(eets_df))
+    initial_arrivals_df, initial_departures_df = keep_flights_for_date(*calculate_initial_schedules(flights_df, eets_df), selected_date)
+    pre_tactical_df = generate_pre_tactical_demand_data(
+        build_initial_traffic_for_pre_tactical(initial_arrivals_df, initial_departures_df),
+        seed=scenario['seed'],
+        params=scenario['pre_tactical_params'],
+        timezone_offset_hours=TIMEZONE_OFFSET_HOURS
+    )
+    regulated_df, _ = run_dual_pass_gdp_simulation(
+        pre_tactical_df,
+        scenario['takeoff_capacity'],
+        scenario['landing_capacity'],
+        CapacityProfile.build(scenario['takeoff_capacity'], scenario['landing_capacity'],
+                              capacity_events_utc(scenario['reduced_capacity_events']), scenario['capacity_forecast']),
+        TIMEZONE_OFFSET_HOURS,
+        assignment_mode=scenario['assignment_mode'],
+        rolling_step_minutes=scenario['rolling_step_minutes'],
+        progress=progress
+    )
+    if scenario['simulate_compliance']:
+        regulated_df = simulate_ctot_compliance(regulated_df, rng=random.Random(scenario['seed']), progress=progress)
+    return regulated_df, scenario_kpis(regulated_df)
+
+def write_scenario_outputs(scenario, regulated_df, kpis, output_dir):
+    """Ghi <output_dir>/<name>/regulated_schedule.csv và kpis.json (KPI kèm thông số kịch bản); trả về thư mục kết quả."""
+    scenario_dir = os.path.join(output_dir, str(scenario['name']))
+    os.makedirs(scenario_dir, exist_ok=True)
+    columns = [column for column in REGULATED_SCHEDULE_COLUMNS if column in regulated_df.columns]
+    regulated_df[columns].to_csv(os.path.join(scenario_dir, 'regulated_schedule.csv'), index=False)
+    with open(os.path.join(scenario_dir, 'kpis.json'), 'w', encoding='utf-8') as kpi_file:
+        json.dump({'scenario': scenario, 'kpis': kpis}, kpi_file, ensure_ascii=False, indent=2, default=str)
+    return scenario_dir
+
+def run_scenarios(scenarios, output_dir, schedule_path=None, eets_path=None, progress=None):
+    """
+    Chạy lần lượt các kịch bản trên cùng một kho lịch bay (mặc định vvts_schedule.csv và eets.csv cạnh package),
+    ghi kết quả từng kịch bản và bảng tổng hợp <output_dir>/summary.csv. Trả về DataFrame tổng hợp (một dòng mỗi kịch bản).
+    Mỗi kịch bản là một lần chạy của bộ đo thời gian (timing), gắn nhãn bằng tên kịch bản.
+    """
+    schedule_path = schedule_path or os.path.join(PACKAGE_DIR, 'vvts_schedule.csv')
+    eets_path = eets_path or os.path.join(PACKAGE_DIR, 'eets.csv')
+    schedule_store, eets_df = open_schedule_store(schedule_path, eets_path, progress=progress)
+
+    os.makedirs(output_dir, exist_ok=True)
+    rows = []
+    for position, scenario in enumerate(scenarios, start=1):
+        current_recorder().start_run(label=scenario['name'])
+        regulated_df, kpis = run_scenario(scenario, schedule_store, eets_df, progress)
+        write_scenario_outputs(scenario, regulated_df, kpis, output_dir)
+        rows.append({'name': scenario['name'], 'date': scenario['date'], **kpis})
+        report_progress(progress, 'success', f"[{position}/{len(scenarios)}] {scenario['name']}: {kpis['regulated_flights']} chuyến bị điều tiết, "
+                                     f"tổng trễ {kpis['total_delay_minutes']:,.0f} phút.")
+
+    summary = pd.DataFrame(rows)
+    summary.to_csv(os.path.join(output_dir, 'summary.csv'), index=False)
+    return summary
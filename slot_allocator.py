@@ -0,0 +1,389 @@
+# atfm_core/slot_allocator.py
+
+import heapq
+
+import numpy as np
+import pandas as pd
+
+SECONDS_PER_HOUR = 3600
+NO_SLOT = -1
+ALL_HOURS_CHANGED_S = np.iinfo(np.int64).min
+# Chuyến có trễ ATFM lớn hơn ngưỡng này (phút) mới tính là bị điều tiết (bỏ qua sai số làm tròn giây)
+REGULATED_DELAY_THRESHOLD_MINUTES = 0.1
+
+def to_epoch_seconds(times, round_up=False):
+    """
+    Chuyển một cột/mảng thời gian (naive UTC hoặc tz-aware) sang int64 giây epoch.
+    round_up=True làm tròn lên để slot tìm được không bao giờ sớm hơn thời điểm mong muốn.
+    """
+    values = pd.to_datetime(pd.Series(times))
+    if values.dt.tz is not None:
+        values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+    nanoseconds = values.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    if round_up:
+        return -(-nanoseconds // 10**9)
+    return nanoseconds // 10**9
+
+def from_epoch_seconds(seconds):
+    """Chuyển int64 giây epoch về datetime64[ns] (naive UTC)."""
+    return pd.to_datetime(np.asarray(seconds, dtype=np.int64), unit='s')
+
+def build_slot_grid(hour_starts_s, hourly_capacity, return_ends=False):
+    """
+    Tạo lưới slot (int64 giây epoch, đã sắp xếp) từ năng lực theo giờ.
+
+    Slot thứ k nằm tại thời điểm năng lực tích lũy đạt k, nên giờ có năng lực nguyên c có đúng c slot
+    cách đều 3600/c giây; năng lực lẻ (ví dụ 2.5 lượt/giờ) được cộng dồn sang giờ kế tiếp.
+    return_ends=True trả thêm thời điểm kết thúc cửa sổ của từng slot (slot kế tiếp, tối đa 3600/c giây).
+    """
+    hour_starts_s = np.asarray(hour_starts_s, dtype=np.int64)
+    caps = np.maximum(np.asarray(hourly_capacity, dtype=np.float64), 0.0)
+    cum_end = np.cumsum(caps)
+    cum_start = cum_end - caps
+    first_slot = np.ceil(cum_start - 1e-9).astype(np.int64)
+    slots_per_hour = np.ceil(cum_end - 1e-9).astype(np.int64) - first_slot
+    total = int(slots_per_hour.sum())
+    if total == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return (empty, empty) if return_ends else empty
+    hour_of_slot = np.repeat(np.arange(len(caps)), slots_per_hour)
+    slot_number = first_slot[hour_of_slot] + np.arange(total) - np.repeat(np.cumsum(slots_per_hour) - slots_per_hour, slots_per_hour)
+    slot_length_s = SECONDS_PER_HOUR / caps[hour_of_slot]
+    slot_times = hour_starts_s[hour_of_slot] + np.floor((slot_number - cum_start[hour_of_slot]) * slot_length_s).astype(np.int64)
+    if not return_ends:
+        return slot_times
+    slot_ends = np.minimum(np.append(slot_times[1:], np.iinfo(np.int64).max), slot_times + np.ceil(slot_length_s).astype(np.int64))
+    return slot_times, slot_ends
+
+def regulation_hour_starts(start_s, desired_times_s, min_hourly_capacity, extra_hours=0):
+    """
+    Các mốc đầu giờ (giây epoch) từ giờ chứa start_s, kéo dài qua chuyến muộn nhất đủ số giờ
+    để mọi chuyến đều có slot khi năng lực không thấp hơn `min_hourly_capacity`.
+    `extra_hours` thêm giờ dự phòng cho các giờ bị sự kiện giảm năng lực.
+    """
+    first_hour_s = int(start_s) // SECONDS_PER_HOUR * SECONDS_PER_HOUR
+    last_hour_s = max(int(np.max(desired_times_s, initial=first_hour_s)) // SECONDS_PER_HOUR * SECONDS_PER_HOUR, first_hour_s)
+    overflow_hours = int(np.ceil(len(desired_times_s) / max(min_hourly_capacity, 1))) + 1 + int(extra_hours)
+    return np.arange(first_hour_s, last_hour_s + (overflow_hours + 1) * SECONDS_PER_HOUR, SECONDS_PER_HOUR, dtype=np.int64)
+
+def assign_first_free_slots(slot_times_s, desired_times_s):
+    """
+    Gán cho mỗi chuyến bay (đã sắp xếp theo thời gian mong muốn) slot trống đầu tiên >= thời gian mong muốn.
+
+    Chuyến thứ i nhận slot j_i = max(j_{i-1} + 1, searchsorted(desired_i)), tức j_i = i + cummax(s_i - i),
+    nên toàn bộ phép gán là vector hóa. Trả về (chỉ số slot, NO_SLOT nếu đã hết slot).
+    """
+    desired_times_s = np.asarray(desired_times_s, dtype=np.int64)
+    if len(desired_times_s) == 0:
+        return np.empty(0, dtype=np.int64)
+    order = np.arange(len(desired_times_s), dtype=np.int64)
+    first_candidate = np.searchsorted(slot_times_s, desired_times_s, side='left')
+    slot_index = order + np.maximum.accumulate(first_candidate - order)
+    return np.where(slot_index < len(slot_times_s), slot_index, NO_SLOT)
+
+class SlotStore:
+    """
+    Kho slot hỗ trợ "slot trống đầu tiên >= t" (union-find có nén đường đi): claim gần như O(1) khi chưa có
+    slot nào được release.
+
+    Khác với heap cũ, slot sớm hơn thời gian mong muốn của một chuyến bay không bị bỏ đi: nó vẫn trống
+    cho các chuyến xử lý sau. Slot được release (hủy chuyến, đổi CTOT) dùng lại được ngay: union-find không
+    tách lại được, nên chúng được giữ trong một FreeSlotTree riêng (tạo khi có release đầu tiên); release là
+    O(log n) và claim khi còn slot đã release là O(log n). claim_many/claim_weighted xử lý cả lô trên danh sách
+    slot trống rồi dựng lại union-find, O(n + k log k) mỗi lô.
+
+    Nếu có `slot_ends_s`, mỗi slot là một cửa sổ [start, end): chuyến bay có thời gian mong muốn nằm trong
+    cửa sổ trống được giữ nguyên thời gian đó thay vì bị đẩy tới đầu slot kế tiếp.
+    """
+
+    def __init__(self, slot_times_s, slot_ends_s=None):
+        self.slot_times = np.asarray(slot_times_s, dtype=np.int64)
+        self.slot_ends = None if slot_ends_s is None else np.asarray(slot_ends_s, dtype=np.int64)
+        self._free = np.ones(len(self.slot_times), dtype=bool)
+        self._free_count = len(self.slot_times)
+        self._rebuild()
+
+    @classmethod
+    def from_hourly_capacity(cls, hour_starts_s, hourly_capacity, use_slot_windows=False):
+        if use_slot_windows:
+            return cls(*build_slot_grid(hour_starts_s, hourly_capacity, return_ends=True))
+        return cls(build_slot_grid(hour_starts_s, hourly_capacity))
+
+    def __len__(self):
+        return len(self.slot_times)
+
+    @property
+    def free_count(self):
+        return self._free_count
+
+    def _rebuild(self):
+        # parent[i] = slot trống đầu tiên có chỉ số >= i (len(slot_times) nếu không còn)
+        n = len(self.slot_times)
+        next_free = np.where(self._free, np.arange(n), n)
+        self._parent = np.minimum.accumulate(np.append(next_free, n)[::-1])[::-1].tolist()
+        # Slot đã release nhưng union-find vẫn coi là đã chiếm
+        self._released = None
+        self._released_count = 0
+
+    def _find(self, index):
+        parent = self._parent
+        root = index
+        while parent[root] != root:
+            root = parent[root]
+        while parent[index] != root:
+            parent[index], index = root, parent[index]
+        return root
+
+    def _first_candidate(self, time_s):
+        # Slot đầu tiên có thể phục vụ time_s: bắt đầu >= time_s, hoặc cửa sổ kết thúc sau time_s
+        if self.slot_ends is None:
+            return int(np.searchsorted(self.slot_times, time_s, side='left'))
+        return int(np.searchsorted(self.slot_ends, time_s, side='right'))
+
+    def _granted_time(self, index, time_s):
+        return int(max(self.slot_times[index], time_s)) if self.slot_ends is not None else int(self.slot_times[index])
+
+    def next_free_index(self, start_index):
+        """Chỉ số slot trống đầu tiên >= start_index, hoặc NO_SLOT."""
+        candidate = self._find(start_index)
+        if self._released_count and candidate > start_index:
+            released = self._released.first_free(start_index)
+            if released != NO_SLOT and released < candidate:
+                candidate = released
+        return candidate if candidate < len(self.slot_times) else NO_SLOT
+
+    def next_free(self, time_s):
+        """Thời gian được cấp nếu claim(time_s) ngay bây giờ (không chiếm slot), hoặc None."""
+        index = self.next_free_index(self._first_candidate(time_s))
+        return None if index == NO_SLOT else self._granted_time(index, time_s)
+
+    def claim_index(self, start_index):
+        index = self.next_free_index(start_index)
+        if index == NO_SLOT:
+            return NO_SLOT
+        if self._released_count and self._released.is_free(index):
+            self._released.claim(index)
+            self._released_count -= 1
+        else:
+            self._parent[index] = index + 1
+        self._free[index] = False
+        self._free_count -= 1
+        return index
+
+    def claim(self, time_s):
+        """Chiếm slot trống đầu tiên phục vụ được time_s; trả về thời gian được cấp (giây epoch) hoặc None nếu hết slot."""
+        index = self.claim_index(self._first_candidate(time_s))
+        return None if index == NO_SLOT else self._granted_time(index, time_s)
+
+    def release(self, slot_time_s):
+        """Trả lại slot chứa thời gian đã cấp `slot_time_s` để các chuyến khác dùng ngay."""
+        if self.slot_ends is None:
+            index = int(np.searchsorted(self.slot_times, slot_time_s, side='left'))
+            while index < len(self.slot_times) and self.slot_times[index] == slot_time_s and self._free[index]:
+                index += 1
+            valid = index < len(self.slot_times) and self.slot_times[index] == slot_time_s
+        else:
+            index = self._first_candidate(slot_time_s)
+            valid = index < len(self.slot_times) and self.slot_times[index] <= slot_time_s and not self._free[index]
+        if not valid:
+            raise ValueError(f"Slot {slot_time_s} không tồn tại hoặc chưa được chiếm.")
+        self._free[index] = True
+        self._free_count += 1
+        if self._released is None:
+            self._released = FreeSlotTree(np.zeros(len(self.slot_times), dtype=bool))
+        self._released.release(index)
+        self._released_count += 1
+
+    def claim_many(self, desired_times_s):
+        """
+        Chiếm slot cho một lô chuyến bay đã sắp xếp theo thời gian mong muốn (vector hóa trên danh sách slot trống).
+        Trả về thời gian được cấp của từng chuyến, NO_SLOT nếu đã hết slot.
+        """
+        desired_times_s = np.asarray(desired_times_s, dtype=np.int64)
+        free_index = np.flatnonzero(self._free)
+        if self.slot_ends is None:
+            position = assign_first_free_slots(self.slot_times[free_index], desired_times_s)
+        else:
+            position = assign_first_free_slots(self.slot_ends[free_index], desired_times_s + 1)
+        return self._claim_free_positions(free_index, position, desired_times_s)
+
+    def claim_weighted(self, desired_times_s, weights):
+        """
+        Chiếm slot cho một lô chuyến bay sao cho tổng trễ có trọng số sum(w_i * (slot_i - desired_i)) nhỏ nhất.
+
+        Quét các slot trống theo thời gian; tại mỗi slot, trong các chuyến đã sẵn sàng (slot phục vụ được thời gian
+        mong muốn của chúng) chọn chuyến có trọng số lớn nhất (heap), hòa thì chuyến có thời gian mong muốn sớm hơn.
+        Với slot dạng điểm, đổi chỗ hai chuyến bất kỳ không làm giảm chi phí, nên kết quả là phép gán chi phí nhỏ nhất;
+        với cùng trọng số, kết quả trùng claim_many. Tổng thời gian O(n log n). Không cần sắp xếp đầu vào.
+        Trả về thời gian được cấp của từng chuyến, NO_SLOT nếu đã hết slot.
+        """
+        desired_times_s = np.asarray(desired_times_s, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        free_index = np.flatnonzero(self._free)
+        if self.slot_ends is None:
+            first_candidate = np.searchsorted(self.slot_times, desired_times_s, side='left')
+        else:
+            first_candidate = np.searchsorted(self.slot_ends, desired_times_s, side='right')
+        first_position = np.searchsorted(free_index, first_candidate, side='left')
+
+        position = np.full(len(desired_times_s), NO_SLOT, dtype=np.int64)
+        ready = np.lexsort((desired_times_s, first_position)).tolist()
+        first_position_list, desired_list, weight_list = first_position.tolist(), desired_times_s.tolist(), weights.tolist()
+        waiting, next_ready, current = [], 0, 0
+        while next_ready < len(ready) or waiting:
+            if not waiting:
+                current = max(current, first_position_list[ready[next_ready]])
+            if current >= len(free_index):
+                break
+            while next_ready < len(ready) and first_position_list[ready[next_ready]] <= current:
+                flight = ready[next_ready]
+                heapq.heappush(waiting, (-weight_list[flight], desired_list[flight], flight))
+                next_ready += 1
+            position[heapq.heappop(waiting)[2]] = current
+            current += 1
+        return self._claim_free_positions(free_index, position, desired_times_s)
+
+    def _claim_free_positions(self, free_index, position, desired_times_s):
+        # position: vị trí trong danh sách slot trống `free_index` được cấp cho từng chuyến (NO_SLOT nếu không có)
+        has_slot = position != NO_SLOT
+        claimed = free_index[position[has_slot]]
+        self._free[claimed] = False
+        self._free_count -= len(claimed)
+        self._rebuild()
+
+        granted = np.full(len(desired_times_s), NO_SLOT, dtype=np.int64)
+        granted[has_slot] = self.slot_times[claimed]
+        if self.slot_ends is not None:
+            granted[has_slot] = np.maximum(granted[has_slot], desired_times_s[has_slot])
+        return granted
+
+def claim_incremental(store, desired_times_s, previous_granted_s=None, recompute_from_s=None, weights=None):
+    """
+    Như store.claim_many, nhưng giữ nguyên slot cũ của mọi chuyến có thời gian được cấp trước `recompute_from_s`
+    và chỉ cấp lại cho các chuyến còn lại. Có `previous_granted_s` mà `recompute_from_s` là None (không có thay đổi)
+    thì trả lại nguyên kết quả cũ, không cấp lại chuyến nào (store không bị chiếm slot).
+
+    Với cách cấp tham lam theo thứ tự thời gian mong muốn, nếu lưới slot trước `recompute_from_s` không đổi thì
+    kết quả trùng với việc tính lại toàn bộ: các chuyến giữ slot cũ chiếm slot trước, các chuyến còn lại vốn
+    không tìm được slot trống nào trước mốc đó. Điều này cũng đúng với store.claim_weighted (truyền `weights`),
+    vì phép quét theo slot chỉ dựa vào các chuyến đã sẵn sàng tại mỗi slot.
+    Trả về (thời gian được cấp, mặt nạ các chuyến giữ nguyên).
+    """
+    desired_times_s = np.asarray(desired_times_s, dtype=np.int64)
+    kept = np.zeros(len(desired_times_s), dtype=bool)
+
+    def claim_rest(rest):
+        if weights is None:
+            return store.claim_many(desired_times_s[rest])
+        return store.claim_weighted(desired_times_s[rest], np.asarray(weights, dtype=np.float64)[rest])
+
+    if previous_granted_s is None:
+        return claim_rest(~kept), kept
+    previous_granted_s = np.asarray(previous_granted_s, dtype=np.int64)
+    if recompute_from_s is None:
+        return previous_granted_s.copy(), ~kept
+    kept = (previous_granted_s != NO_SLOT) & (previous_granted_s < recompute_from_s)
+    granted = np.full(len(desired_times_s), NO_SLOT, dtype=np.int64)
+    kept_order = np.flatnonzero(kept)[np.argsort(previous_granted_s[kept], kind='stable')]
+    granted[kept_order] = store.claim_many(previous_granted_s[kept_order])
+    granted[~kept] = claim_rest(~kept)
+    return granted, kept
+
+class FreeSlotTree:
+    """
+    Tập slot trống trên các chỉ số 0..n-1 (cây Fenwick): claim, release và "slot trống đầu tiên >= k"
+    đều O(log n), kể cả khi slot được trả lại liên tục (SlotStore dùng nó cho các slot đã release).
+    """
+
+    def __init__(self, free_mask):
+        free_mask = np.asarray(free_mask, dtype=bool)
+        self._size = len(free_mask)
+        self._free = free_mask.copy()
+        # Dựng cây Fenwick trong O(n) từ tổng tích lũy
+        cumulative = np.concatenate([[0], np.cumsum(free_mask, dtype=np.int64)])
+        index = np.arange(1, self._size + 1)
+        self._tree = [0] + (cumulative[index] - cumulative[index - (index & -index)]).tolist()
+        self._top_bit = 1 << max(self._size.bit_length() - 1, 0)
+
+    def _add(self, index, value):
+        index += 1
+        while index <= self._size:
+            self._tree[index] += value
+            index += index & -index
+
+    def _prefix(self, count):
+        """Số slot trống trong các chỉ số [0, count)."""
+        total = 0
+        while count > 0:
+            total += self._tree[count]
+            count -= count & -count
+        return total
+
+    def is_free(self, index):
+        return bool(self._free[index])
+
+    def claim(self, index):
+        if self._free[index]:
+            self._free[index] = False
+            self._add(index, -1)
+
+    def release(self, index):
+        if not self._free[index]:
+            self._free[index] = True
+            self._add(index, 1)
+
+    def first_free(self, start_index):
+        """Chỉ số slot trống nhỏ nhất >= start_index, hoặc NO_SLOT."""
+        if start_index >= self._size:
+            return NO_SLOT
+        target = self._prefix(max(start_index, 0)) + 1
+        position, step = 0, self._top_bit
+        while step:
+            if position + step <= self._size and self._tree[position + step] < target:
+                position += step
+                target -= self._tree[position]
+            step >>= 1
+        return position if position < self._size else NO_SLOT
+
+def compress_slot_times(slot_times_s, earliest_times_s, releases_slot, needs_new_slot=None):
+    """
+    Nén slot (slot compression) cho một luồng sau khi có chuyến hủy hoặc không tuân thủ slot.
+
+    Slot của các chuyến `releases_slot` được trả lại. Các chuyến còn giữ slot được xét theo thứ tự slot hiện tại;
+    mỗi chuyến chuyển lên slot trống sớm nhất không sớm hơn `earliest_times_s` nếu slot đó sớm hơn slot đang giữ,
+    và slot cũ của nó lại trống cho các chuyến sau. Cuối cùng các chuyến `needs_new_slot` (đã trả slot nhưng vẫn
+    bay, ví dụ lỡ slot) nhận slot trống đầu tiên từ thời điểm sẵn sàng của chúng (`earliest_times_s`).
+    Tổng thời gian O(n log n).
+
+    Trả về thời gian slot mới của từng chuyến (NO_SLOT nếu chuyến đã trả slot và không được cấp lại).
+    """
+    slot_times_s = np.asarray(slot_times_s, dtype=np.int64)
+    earliest_times_s = np.asarray(earliest_times_s, dtype=np.int64)
+    releases_slot = np.asarray(releases_slot, dtype=bool)
+    needs_new_slot = np.zeros(len(slot_times_s), dtype=bool) if needs_new_slot is None else np.asarray(needs_new_slot, dtype=bool) & releases_slot
+
+    order = np.argsort(slot_times_s, kind='stable')
+    sorted_slots = slot_times_s[order]
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    free_slots = FreeSlotTree(releases_slot[order])
+    first_candidate = np.searchsorted(sorted_slots, earliest_times_s, side='left')
+
+    new_slot_index = np.where(releases_slot, NO_SLOT, rank)
+    # Chỉ chuyến đang bị trễ (slot muộn hơn thời điểm sớm nhất) mới có thể được chuyển lên
+    can_move = ~releases_slot & (slot_times_s > earliest_times_s)
+    for flight in order[can_move[order]].tolist():
+        candidate = free_slots.first_free(first_candidate[flight])
+        if candidate != NO_SLOT and sorted_slots[candidate] < slot_times_s[flight]:
+            free_slots.claim(candidate)
+            free_slots.release(rank[flight])
+            new_slot_index[flight] = candidate
+
+    requeued = np.flatnonzero(needs_new_slot)
+    for flight in requeued[np.lexsort((slot_times_s[requeued], earliest_times_s[requeued]))].tolist():
+        candidate = free_slots.first_free(first_candidate[flight])
+        if candidate != NO_SLOT:
+            free_slots.claim(candidate)
+            new_slot_index[flight] = candidate
+
+    return np.where(new_slot_index == NO_SLOT, NO_SLOT, sorted_slots[np.maximum(new_slot_index, 0)])
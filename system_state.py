@@ -1,12 +1,21 @@
 # atfm_core/system_state.py
 
+import numpy as np
 import pandas as pd
 from datetime import datetime, time, date
+from .timing import timed
+
+FLIGHT_STATUSES = ('future', 'active', 'completed')
+# Pha của chuyến bay do động cơ mô phỏng sự kiện rời rạc (des_engine) cập nhật
+FLIGHT_PHASES = ('scheduled', 'off_block', 'airborne', 'landed')
 
 class SystemState:
     """
     Lớp quản lý toàn bộ trạng thái của hệ thống mô phỏng.
     Hoạt động như một "single source of truth" mô phỏng kho dữ liệu trên cloud.
+
+    Lịch trình được đánh chỉ mục theo `eobt_local` và `event_time_local` (mảng đã sắp xếp),
+    nên truy vấn trạng thái dùng tìm kiếm nhị phân thay vì quét toàn bộ bảng.
     """
     def __init__(self, master_schedule_df):
         self.master_schedule = master_schedule_df.copy()
@@ -14,54 +23,143 @@ class SystemState:
         self.simulation_time = self.master_schedule['eobt_local'].min()
         self.is_gdp_active = False
         self.regulated_schedule = None
+        self.flight_phase = np.zeros(len(self.master_schedule), dtype=np.int8)
+        self._build_time_index()
+
+    def _build_time_index(self):
+        """Sắp xếp vị trí các chuyến theo EOBT và theo thời gian sự kiện (bỏ qua NaT)."""
+        self._eobt_ns, self._eobt_valid = self._time_values('eobt_local')
+        self._event_ns, self._event_valid = self._time_values('event_time_local')
+
+        self._eobt_order = np.flatnonzero(self._eobt_valid)
+        self._eobt_order = self._eobt_order[np.argsort(self._eobt_ns[self._eobt_order], kind='stable')]
+        self._eobt_sorted = self._eobt_ns[self._eobt_order]
+
+        self._event_order = np.flatnonzero(self._event_valid)
+        self._event_order = self._event_order[np.argsort(self._event_ns[self._event_order], kind='stable')]
+        self._event_sorted = self._event_ns[self._event_order]
+        # Thứ hạng của từng chuyến trong chỉ mục thời gian sự kiện (NaT: -1, không bao giờ "đang hoạt động")
+        self._event_rank = np.full(len(self.master_schedule), -1, dtype=np.int64)
+        self._event_rank[self._event_order] = np.arange(len(self._event_order))
+
+    def _time_values(self, column):
+        values = pd.to_datetime(self.master_schedule[column])
+        valid = values.notna().to_numpy()
+        return values.to_numpy(dtype='datetime64[ns]').astype(np.int64), valid
+
+    @staticmethod
+    def _to_ns(current_time):
+        return pd.Timestamp(current_time).value
+
+    def _status_positions(self, current_time):
+        """Vị trí (theo thứ tự gốc) của các chuyến future/active/completed tại current_time."""
+        t = self._to_ns(current_time)
+        eobt_cut = np.searchsorted(self._eobt_sorted, t, side='right')
+        event_cut = np.searchsorted(self._event_sorted, t, side='right')
+
+        future = np.sort(self._eobt_order[eobt_cut:])
+        started = self._eobt_order[:eobt_cut]
+        active = np.sort(started[self._event_rank[started] >= event_cut])
+        completed = np.sort(self._event_order[:event_cut])
+        return future, active, completed
 
     def get_flights_by_status(self, current_time):
         """
         Phân loại các chuyến bay dựa trên thời gian mô phỏng hiện tại.
         """
-        # Chưa đến giờ cất cánh
-        future_flights = self.master_schedule[self.master_schedule['eobt_local'] > current_time]
-        
-        # Đang hoạt động (đã qua EOBT nhưng chưa qua giờ hạ cánh/cất cánh tại VVTS)
-        active_flights = self.master_schedule[
-            (self.master_schedule['eobt_local'] <= current_time) &
-            (self.master_schedule['event_time_local'] > current_time)
-        ]
-        
-        # Đã hoàn thành
-        completed_flights = self.master_schedule[self.master_schedule['event_time_local'] <= current_time]
-        
-        return future_flights, active_flights, completed_flights
+        future, active, completed = self._status_positions(current_time)
+        # Chưa đến giờ cất cánh / Đang hoạt động (đã qua EOBT nhưng chưa qua giờ hạ cánh/cất cánh tại VVTS) / Đã hoàn thành
+        return (
+            self.master_schedule.iloc[future],
+            self.master_schedule.iloc[active],
+            self.master_schedule.iloc[completed],
+        )
+
+    def count_flights_by_status(self, current_time):
+        """Số chuyến future/active/completed tại current_time (chỉ dùng tìm kiếm nhị phân)."""
+        t = self._to_ns(current_time)
+        eobt_cut = np.searchsorted(self._eobt_sorted, t, side='right')
+        event_cut = np.searchsorted(self._event_sorted, t, side='right')
+        started = self._eobt_order[:eobt_cut]
+        return int(len(self._eobt_order) - eobt_cut), int((self._event_rank[started] >= event_cut).sum()), int(event_cut)
+
+    def _status_of(self, positions, t):
+        eobt, event = self._eobt_ns[positions], self._event_ns[positions]
+        eobt_valid, event_valid = self._eobt_valid[positions], self._event_valid[positions]
+        return np.select(
+            [event_valid & (event <= t), eobt_valid & (eobt <= t) & event_valid, eobt_valid & (eobt > t)],
+            list(reversed(FLIGHT_STATUSES)),
+            default='unknown'
+        )
 
     def update_simulation_time(self, new_time):
         self.simulation_time = new_time
 
+    def set_flight_phase(self, positions, phase):
+        """Gán pha (tên trong FLIGHT_PHASES) cho các chuyến ở vị trí `positions` của lịch trình chính."""
+        self.flight_phase[positions] = FLIGHT_PHASES.index(phase)
+
+    def get_flights_by_phase(self, phase):
+        """Các chuyến bay đang ở pha `phase` theo các mốc đã xảy ra trong mô phỏng sự kiện."""
+        return self.master_schedule.iloc[np.flatnonzero(self.flight_phase == FLIGHT_PHASES.index(phase))]
+
+    def advance_to(self, new_time):
+        """
+        Dời con trỏ thời gian mô phỏng tới new_time và trả về các chuyến bay đổi trạng thái kể từ lần trước
+        (thêm cột `previous_status`, `status`). Chỉ các chuyến có EOBT hoặc thời gian sự kiện nằm giữa hai mốc
+        được xét, nên mỗi tick tốn O(log n + số chuyến thay đổi).
+        """
+        old_ns, new_ns = self._to_ns(self.simulation_time), self._to_ns(new_time)
+        low, high = min(old_ns, new_ns), max(old_ns, new_ns)
+        crossed = np.concatenate([
+            self._eobt_order[np.searchsorted(self._eobt_sorted, low, side='right'):np.searchsorted(self._eobt_sorted, high, side='right')],
+            self._event_order[np.searchsorted(self._event_sorted, low, side='right'):np.searchsorted(self._event_sorted, high, side='right')],
+        ])
+        positions = np.unique(crossed)
+        previous_status, status = self._status_of(positions, old_ns), self._status_of(positions, new_ns)
+        changed = positions[previous_status != status]
+        self.simulation_time = new_time
+        return self.master_schedule.iloc[changed].assign(
+            previous_status=previous_status[previous_status != status],
+            status=status[previous_status != status]
+        )
+
+    def tick(self, minutes=1):
+        """Tăng thời gian mô phỏng thêm `minutes` phút; trả về các chuyến đổi trạng thái như advance_to."""
+        return self.advance_to(pd.Timestamp(self.simulation_time) + pd.Timedelta(minutes=minutes))
+
+    @timed('SystemState.activate_gdp')
     def activate_gdp(self, regulated_df):
         """Cập nhật trạng thái hệ thống khi GDP được kích hoạt."""
         self.is_gdp_active = True
         self.regulated_schedule = regulated_df
-        
+
         # Cập nhật lại lịch trình chính với các thông số điều tiết
         # Dùng một bản sao để tránh lỗi SettingWithCopyWarning
         temp_df = self.master_schedule.copy()
-        
-        # Tạo key duy nhất để merge
-        temp_df['merge_key'] = temp_df['callsign'] + temp_df['flight_date'].astype(str)
-        regulated_df['merge_key'] = regulated_df['callsign'] + regulated_df['flight_date'].astype(str)
-        
+
+        # Tạo key duy nhất để merge (callsign + ngày bay; so khớp cột ngày dạng datetime nhanh hơn nối chuỗi)
+        temp_df['merge_date'] = pd.to_datetime(temp_df['flight_date']).dt.normalize()
+        regulated_df['merge_date'] = pd.to_datetime(regulated_df['flight_date']).dt.normalize()
+
         # Merge các thông tin điều tiết
-        update_cols = ['merge_key', 'regulated_time_utc', 'is_regulated', 'atfm_delay_minutes']
+        # (đổi tên trước khi merge để luôn có hậu tố `_new`, kể cả khi lịch trình chính chưa có các cột này;
+        # bỏ key trùng để merge không nhân bản dòng)
+        update_cols = ['regulated_time_utc', 'is_regulated', 'atfm_delay_minutes']
         temp_df = temp_df.merge(
-            regulated_df[update_cols],
-            on='merge_key',
-            how='left',
-            suffixes=('', '_new')
+            regulated_df[['callsign', 'merge_date'] + update_cols].drop_duplicates(['callsign', 'merge_date']).rename(columns={col: f'{col}_new' for col in update_cols}),
+            on=['callsign', 'merge_date'],
+            how='left'
         )
-        
+
         # Cập nhật lại thời gian sự kiện nếu bị điều tiết
-        regulated_mask = temp_df['is_regulated_new'].fillna(False)
+        regulated_mask = temp_df['is_regulated_new'].fillna(False).astype(bool)
+        time_shift = temp_df.loc[regulated_mask, 'regulated_time_utc_new'] - temp_df.loc[regulated_mask, 'event_time_utc']
         temp_df.loc[regulated_mask, 'event_time_utc'] = temp_df.loc[regulated_mask, 'regulated_time_utc_new']
-        
-        # Cập nhật các cột chính
-        self.master_schedule['event_time_utc'] = temp_df['event_time_utc']
-        self.master_schedule['is_regulated'] = temp_df['is_regulated_new'].fillna(False)
\ No newline at end of file
+        temp_df.loc[regulated_mask, 'event_time_local'] = temp_df.loc[regulated_mask, 'event_time_local'] + time_shift
+
+        # Cập nhật các cột chính (merge giữ thứ tự dòng của lịch trình chính, gán theo vị trí)
+        self.master_schedule['event_time_utc'] = temp_df['event_time_utc'].array
+        self.master_schedule['event_time_local'] = temp_df['event_time_local'].array
+        self.master_schedule['is_regulated'] = temp_df['is_regulated_new'].fillna(False).astype(bool).to_numpy()
+        self._build_time_index()
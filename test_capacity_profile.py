@@ -0,0 +1,99 @@
+# atfm_core/test_capacity_profile.py
+
+import numpy as np
+import pandas as pd
+
+from .capacity_profile import CapacityProfile, forecast_intervals
+from .slot_allocator import ALL_HOURS_CHANGED_S, SECONDS_PER_HOUR, to_epoch_seconds
+
+# Năng lực của CapacityProfile phải bằng cách duyệt danh sách sự kiện cho từng ô 15 phút.
+
+DAY = pd.Timestamp('2025-06-24')
+TAKEOFF, LANDING = 20, 18
+BIN_S = 15 * 60
+
+def random_events(rng, n_events, step_minutes):
+    starts = DAY + pd.to_timedelta(rng.integers(0, 24 * 60 // step_minutes, n_events) * step_minutes, unit='min')
+    return [{'start_time_utc': start, 'end_time_utc': start + pd.Timedelta(minutes=int(rng.integers(1, 12)) * step_minutes),
+             'new_capacity': int(rng.integers(0, 45))} for start in starts]
+
+def naive_rates(events, bin_start_s):
+    """(arrival, departure, total) của ô bắt đầu tại bin_start_s: sự kiện đầu tiên phủ một phần ô, hoặc năng lực cơ bản."""
+    for start_s, end_s, new_capacity in events:
+        if start_s < bin_start_s + BIN_S and end_s > bin_start_s:
+            total = min(TAKEOFF + LANDING, new_capacity)
+            arrival = min(LANDING, total // 2)
+            return arrival, min(TAKEOFF, total - arrival), total
+    return LANDING, TAKEOFF, TAKEOFF + LANDING
+
+def assert_matches_events(profile, events):
+    bin_starts_s = DAY.value // 10**9 + np.arange(-4, 30 * 4) * BIN_S
+    events = [(*to_epoch_seconds([event['start_time_utc'], event['end_time_utc']]).tolist(), event['new_capacity']) for event in events]
+    # Kiểm tra cả đầu ô và một thời điểm giữa ô
+    for offset_s in (0, 7 * 60):
+        rates = profile.rates_s(bin_starts_s + offset_s)
+        expected = np.array([naive_rates(events, bin_start_s) for bin_start_s in bin_starts_s])
+        for flow in range(3):
+            np.testing.assert_array_equal(rates[flow], expected[:, flow])
+
+def test_overlapping_events_are_painted_in_sidebar_order():
+    rng = np.random.default_rng(18)
+    for _ in range(50):
+        events = random_events(rng, int(rng.integers(0, 6)), 15)
+        assert_matches_events(CapacityProfile.build(TAKEOFF, LANDING, events), events)
+
+def test_first_difference_is_the_first_changed_hour():
+    events = [{'start_time_utc': DAY + pd.Timedelta(hours=10), 'end_time_utc': DAY + pd.Timedelta(hours=12), 'new_capacity': 20}]
+    profile = CapacityProfile.build(TAKEOFF, LANDING, events)
+    later = events + [{'start_time_utc': DAY + pd.Timedelta(hours=15, minutes=30), 'end_time_utc': DAY + pd.Timedelta(hours=16), 'new_capacity': 10}]
+
+    assert profile.first_difference_s(CapacityProfile.build(TAKEOFF, LANDING, events)) is None
+    assert profile.first_difference_s(CapacityProfile.build(TAKEOFF, LANDING, later)) == (DAY + pd.Timedelta(hours=15)).value // 10**9
+    assert profile.first_difference_s(CapacityProfile.build(TAKEOFF, LANDING, [])) == (DAY + pd.Timedelta(hours=10)).value // 10**9
+    assert profile.first_difference_s(CapacityProfile.build(TAKEOFF + 1, LANDING, events)) == ALL_HOURS_CHANGED_S
+
+def test_forecast_splits_total_capacity_like_events():
+    forecast = pd.DataFrame({
+        'start_time_local': DAY + pd.to_timedelta([7, 8, 9, 10], unit='h'),
+        'landing_capacity': [np.nan, 15, 30, 12],
+        'takeoff_capacity': [np.nan, 25, np.nan, np.nan],
+        'total_capacity': [24, 30, 26, np.nan],
+    })
+    start_s, end_s, arrival, departure, total = forecast_intervals(forecast, TAKEOFF, LANDING, timezone_offset_hours=7)
+
+    np.testing.assert_array_equal(start_s, DAY.value // 10**9 + np.arange(4) * SECONDS_PER_HOUR)
+    np.testing.assert_array_equal(end_s - start_s, [SECONDS_PER_HOUR] * 3 + [BIN_S])
+    # Chỉ có tổng: chia như sự kiện; có đủ hai chiều: giới hạn theo tổng; thiếu tổng: cộng hai chiều
+    np.testing.assert_array_equal(total, [24, 30, 26, 12 + TAKEOFF])
+    np.testing.assert_array_equal(arrival, [12, 15, 26, 12])
+    np.testing.assert_array_equal(departure, [12, 15, 0, TAKEOFF])
+
+    # Sự kiện được ưu tiên hơn dự báo trong khoảng chồng nhau
+    events = [{'start_time_utc': DAY, 'end_time_utc': DAY + pd.Timedelta(minutes=30), 'new_capacity': 8}]
+    profile = CapacityProfile.build(TAKEOFF, LANDING, events, forecast=forecast, timezone_offset_hours=7)
+    times_s = DAY.value // 10**9 + np.array([0, 45 * 60, 2 * SECONDS_PER_HOUR, 5 * SECONDS_PER_HOUR])
+    np.testing.assert_array_equal(profile.rates_s(times_s)[2], [8, 24, 26, TAKEOFF + LANDING])
+
+def test_unaligned_events_reduce_every_bin_they_touch():
+    rng = np.random.default_rng(19)
+    for _ in range(50):
+        events = random_events(rng, int(rng.integers(1, 6)), 5)
+        assert_matches_events(CapacityProfile.build(TAKEOFF, LANDING, events), events)
+
+def test_partial_hour_event_reduces_the_slots_of_the_hour():
+    events = [{'start_time_utc': DAY + pd.Timedelta(hours=10, minutes=15), 'end_time_utc': DAY + pd.Timedelta(hours=11), 'new_capacity': 4}]
+    arrival, departure = CapacityProfile.build(TAKEOFF, LANDING, events).hourly(DAY.value // 10**9 + np.array([9, 10, 11]) * SECONDS_PER_HOUR)
+    np.testing.assert_array_equal(arrival, [LANDING, (LANDING + 3 * 2) / 4, LANDING])
+    np.testing.assert_array_equal(departure, [TAKEOFF, (TAKEOFF + 3 * 2) / 4, TAKEOFF])
+
+def test_hourly_rates_average_the_bins_of_each_hour():
+    rng = np.random.default_rng(20)
+    for _ in range(50):
+        events = random_events(rng, int(rng.integers(0, 6)), 5)
+        profile = CapacityProfile.build(TAKEOFF, LANDING, events)
+        hour_starts_s = DAY.value // 10**9 + np.arange(-1, 26) * SECONDS_PER_HOUR
+        bin_rates = profile.rates_s((hour_starts_s[:, None] + np.arange(4) * BIN_S).ravel())
+        hourly_rates = profile.hourly_rates(hour_starts_s)
+        for flow in range(3):
+            np.testing.assert_allclose(hourly_rates[flow], bin_rates[flow].reshape(-1, 4).mean(axis=1))
+        np.testing.assert_array_equal(profile.hourly(hour_starts_s), hourly_rates[:2])
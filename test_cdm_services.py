@@ -0,0 +1,96 @@
+# atfm_core/test_cdm_services.py
+
+import pandas as pd
+
+from .cdm_services import process_slot_swap_requests
+
+# Lịch trình điều tiết nhỏ có dạng kết quả của run_dual_pass_gdp_simulation: không có 'flight_date',
+# thời gian sớm nhất là 'predicted_event_time_utc'.
+
+T0 = pd.Timestamp('2025-06-24 10:00')
+
+def regulated_schedule(rows):
+    df = pd.DataFrame(rows, columns=['callsign', 'flight_type', 'predicted_minute', 'regulated_minute'])
+    df['predicted_event_time_utc'] = T0 + pd.to_timedelta(df.pop('predicted_minute'), unit='min')
+    df['original_event_time_utc'] = df['predicted_event_time_utc']
+    df['regulated_time_utc'] = T0 + pd.to_timedelta(df.pop('regulated_minute'), unit='min')
+    df['atfm_delay_minutes'] = (df['regulated_time_utc'] - df['predicted_event_time_utc']).dt.total_seconds() / 60
+    df['is_regulated'] = df['atfm_delay_minutes'] > 0.1
+    return df
+
+SCHEDULE = regulated_schedule([
+    ('VNA100', 'arrival', 0, 30),
+    ('VNA101', 'arrival', 5, 20),
+    ('VNA102', 'arrival', 10, 45),
+    ('VNA103', 'arrival', 15, 50),
+    ('VJC200', 'arrival', 0, 25),
+    ('VNA300', 'departure', 0, 40),
+])
+
+def times_by_callsign(df):
+    return dict(zip(df['callsign'], df['regulated_time_utc']))
+
+def test_swap_and_substitution_on_dual_pass_schedule():
+    requests = [
+        {'request_id': 'r1', 'type': 'swap', 'callsign_1': 'VNA100', 'callsign_2': 'VNA101'},
+        {'request_id': 'r2', 'type': 'substitution', 'cancelled_callsign': 'VNA102', 'callsign': 'VNA103'},
+    ]
+    results, updated = process_slot_swap_requests(SCHEDULE, requests)
+
+    assert results['accepted'].tolist() == [True, True], results['reason'].tolist()
+    times = times_by_callsign(updated)
+    assert times['VNA100'] == T0 + pd.Timedelta(minutes=20)
+    assert times['VNA101'] == T0 + pd.Timedelta(minutes=30)
+    assert times['VNA103'] == T0 + pd.Timedelta(minutes=45)
+    assert 'VNA102' not in times
+    delays = dict(zip(updated['callsign'], updated['atfm_delay_minutes']))
+    assert delays['VNA100'] == 20 and delays['VNA101'] == 25 and delays['VNA103'] == 30
+    # Lịch trình đầu vào không bị sửa
+    assert times_by_callsign(SCHEDULE)['VNA100'] == T0 + pd.Timedelta(minutes=30)
+
+def test_rejected_requests_leave_the_schedule_unchanged():
+    requests = [
+        {'type': 'swap', 'callsign_1': 'VNA100', 'callsign_2': 'VJC200'},     # khác hãng
+        {'type': 'swap', 'callsign_1': 'VNA100', 'callsign_2': 'VNA300'},     # chuyến đến / chuyến đi
+        {'type': 'swap', 'callsign_1': 'VNA999', 'callsign_2': 'VNA100'},     # không tìm thấy
+        {'type': 'upgrade', 'callsign_1': 'VNA100', 'callsign_2': 'VNA101'},  # loại không hợp lệ
+    ]
+    results, updated = process_slot_swap_requests(SCHEDULE, requests)
+
+    assert not results['accepted'].any()
+    assert results['reason'].str.len().gt(0).all()
+    pd.testing.assert_frame_equal(updated, SCHEDULE)
+
+def test_swap_to_an_earlier_time_than_predicted_is_rejected():
+    # VNA101 dự kiến 10:40 không thể nhận slot 10:35 của VNA100
+    schedule = regulated_schedule([('VNA100', 'arrival', 0, 35), ('VNA101', 'arrival', 40, 45)])
+    results, updated = process_slot_swap_requests(schedule, [{'type': 'swap', 'callsign_1': 'VNA100', 'callsign_2': 'VNA101'}])
+
+    assert not results['accepted'].iloc[0]
+    pd.testing.assert_frame_equal(updated, schedule)
+
+def test_conflicting_requests_are_resolved_by_submission_time():
+    requests = [
+        {'request_id': 'late', 'type': 'swap', 'callsign_1': 'VNA100', 'callsign_2': 'VNA102',
+         'submitted_at': T0 + pd.Timedelta(minutes=2)},
+        {'request_id': 'early', 'type': 'swap', 'callsign_1': 'VNA100', 'callsign_2': 'VNA101',
+         'submitted_at': T0 + pd.Timedelta(minutes=1)},
+    ]
+    results, updated = process_slot_swap_requests(SCHEDULE, requests)
+
+    assert results.set_index('request_id')['accepted'].to_dict() == {'early': True, 'late': False}
+    assert times_by_callsign(updated)['VNA102'] == T0 + pd.Timedelta(minutes=45)
+
+def test_repeated_callsign_needs_flight_date():
+    schedule = pd.concat([SCHEDULE.assign(flight_date='2025-06-24'), SCHEDULE.assign(flight_date='2025-06-25')],
+                         ignore_index=True)
+    request = {'type': 'swap', 'callsign_1': 'VNA100', 'callsign_2': 'VNA101'}
+
+    results, _ = process_slot_swap_requests(schedule, [request])
+    assert not results['accepted'].iloc[0]
+
+    results, updated = process_slot_swap_requests(schedule, [dict(request, flight_date='2025-06-25')])
+    assert results['accepted'].iloc[0]
+    second_day = updated[updated['flight_date'] == '2025-06-25']
+    assert times_by_callsign(second_day)['VNA100'] == T0 + pd.Timedelta(minutes=20)
+    assert times_by_callsign(updated[updated['flight_date'] == '2025-06-24'])['VNA100'] == T0 + pd.Timedelta(minutes=30)
@@ -0,0 +1,130 @@
+# atfm_core/test_data_cache.py
+
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .data_cache import load_or_build, open_partitioned, open_partitioned_store, write_partitioned
+
+# Cache chỉ được dựng lại khi nội dung file nguồn đổi; file chỉ bị "touch" vẫn dùng lại cache.
+
+def sample_frame():
+    return pd.DataFrame({
+        'callsign': ['VN001', 'VJ002', np.nan, 'VN001'],
+        'flight_type': pd.Categorical(['arrival', 'departure', 'arrival', 'arrival']),
+        'eobt_dt_utc': pd.to_datetime(['2025-06-24 01:00', '2025-06-24 02:30', None, '2025-06-25 23:55']),
+        'flight_date': [datetime.date(2025, 6, 24), datetime.date(2025, 6, 24), None, datetime.date(2025, 6, 25)],
+        'eet_minutes': [95.0, np.nan, 60.0, 45.0],
+        'is_domestic': [True, False, True, True],
+    }, index=[3, 1, 4, 1])
+
+class CountingBuild:
+    def __init__(self, result):
+        self.result, self.calls = result, 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result
+
+def write_source(path, content, mtime_s):
+    path.write_text(content)
+    os.utime(path, ns=(mtime_s * 10**9, mtime_s * 10**9))
+
+def test_load_or_build_rebuilds_only_when_source_content_changes(tmp_path):
+    source = tmp_path / 'vvts_schedule.csv'
+    write_source(source, 'callsign\nVN001\n', 1_000)
+    build = CountingBuild((sample_frame(), sample_frame().iloc[:0]))
+
+    def load():
+        return load_or_build('schedule', [str(source)], build)
+
+    first = load()
+    cached = load()
+    assert build.calls == 1
+    for expected, frame in zip(first, cached):
+        pd.testing.assert_frame_equal(frame, expected)
+
+    # Chỉ đổi mtime: dùng lại cache và ghi mtime mới vào manifest
+    write_source(source, 'callsign\nVN001\n', 2_000)
+    load()
+    assert build.calls == 1
+    with open(tmp_path / '.atfm_cache' / 'schedule' / 'manifest.json', encoding='utf-8') as manifest_file:
+        assert json.load(manifest_file)['sources'][0]['mtime_ns'] == 2_000 * 10**9
+
+    # Cùng kích thước nhưng khác nội dung, rồi khác kích thước: dựng lại
+    write_source(source, 'callsign\nVN002\n', 3_000)
+    load()
+    assert build.calls == 2
+    write_source(source, 'callsign\nVN002\nVN003\n', 3_000)
+    load()
+    load()
+    assert build.calls == 3
+
+def test_load_or_build_rebuilds_a_corrupt_manifest(tmp_path):
+    source = tmp_path / 'eets.csv'
+    write_source(source, 'airport_code\nVVNB\n', 1_000)
+    build = CountingBuild(sample_frame())
+    load_or_build('eets', [str(source)], build)
+
+    (tmp_path / '.atfm_cache' / 'eets' / 'manifest.json').write_text('{')
+    pd.testing.assert_frame_equal(load_or_build('eets', [str(source)], build), sample_frame())
+    assert build.calls == 2
+    pd.testing.assert_frame_equal(load_or_build('eets', [str(source)], build), sample_frame())
+    assert build.calls == 2
+
+def schedule_chunks(rng, n_chunks=3, rows=40):
+    """Các khối lịch bay trải trên 4 ngày, thời gian không theo thứ tự và có ô thiếu."""
+    for _ in range(n_chunks):
+        eobt = pd.Timestamp('2025-06-24') + pd.to_timedelta(rng.integers(0, 4 * 24 * 60, rows), unit='min')
+        yield pd.DataFrame({'callsign': [f'VN{number:03d}' for number in rng.integers(0, 500, rows)],
+                            'eobt_dt_local': pd.Series(eobt).where(rng.random(rows) > 0.05)})
+
+def test_partitioned_store_reads_a_day_with_spill_over(tmp_path):
+    rng = np.random.default_rng(13)
+    chunks = list(schedule_chunks(rng))
+    schedule = pd.concat(chunks, ignore_index=True).dropna(subset=['eobt_dt_local'])
+    source = tmp_path / 'vvts_schedule.csv'
+    write_source(source, 'a', 1_000)
+    store = open_partitioned('schedule_store', [str(source)], lambda: iter(chunks), 'eobt_dt_local')
+    assert len(store) == len(schedule)
+
+    day = pd.Timestamp('2025-06-26')
+    window = schedule[(schedule['eobt_dt_local'] >= day - pd.Timedelta(hours=6)) & (schedule['eobt_dt_local'] < day + pd.Timedelta(days=1))]
+    read = store.read_date(day, spill_over_hours=6)
+    pd.testing.assert_frame_equal(read.sort_values(['eobt_dt_local', 'callsign']).reset_index(drop=True),
+                                  window.sort_values(['eobt_dt_local', 'callsign']).reset_index(drop=True))
+    assert store.row_count(day) == (schedule['eobt_dt_local'].dt.normalize() == day).sum()
+    assert sum(len(frame) for _, frame in store.iter_chunks(days_per_chunk=3)) == len(schedule)
+
+def test_open_partitioned_rebuilds_when_source_changes(tmp_path):
+    source = tmp_path / 'vvts_schedule.csv'
+    write_source(source, 'a', 1_000)
+    calls = []
+
+    def build_chunks():
+        calls.append(1)
+        return schedule_chunks(np.random.default_rng(len(calls)))
+
+    def open_store():
+        return open_partitioned('schedule_store', [str(source)], build_chunks, 'eobt_dt_local')
+
+    first = open_store()
+    write_source(source, 'a', 2_000)
+    assert len(open_store()) == len(first) and len(calls) == 1
+    write_source(source, 'b', 3_000)
+    open_store()
+    assert len(calls) == 2
+
+def test_written_store_reopens_with_the_same_days(tmp_path):
+    chunks = list(schedule_chunks(np.random.default_rng(14)))
+    store = write_partitioned(tmp_path / 'store', iter(chunks), 'eobt_dt_local')
+    reopened = open_partitioned_store(tmp_path / 'store')
+    assert reopened.dates == store.dates and len(reopened) == len(store)
+    for day in store.dates:
+        pd.testing.assert_frame_equal(reopened.read_date(day, spill_over_hours=3), store.read_date(day, spill_over_hours=3))
+    with pytest.raises(ValueError):
+        open_partitioned_store(tmp_path)
@@ -0,0 +1,107 @@
+# atfm_core/test_demand_cube.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .demand_cube import FLOWS, DemandCube, RollingDemandIndex
+
+# Các view của DemandCube phải bằng cách đếm thẳng trên DataFrame (lọc rồi đếm theo khoảng thời gian).
+
+DAY = pd.Timestamp('2025-06-24')
+
+def random_flights(rng, n_flights=300, days=3):
+    return pd.DataFrame({
+        'callsign': rng.choice(['VNA', 'VJC', 'BAV'], n_flights) + pd.Series(rng.integers(100, 999, n_flights)).astype(str),
+        'flight_type': rng.choice(FLOWS, n_flights),
+        'origin': rng.choice(['VVNB', 'VVDN', 'VTBS'], n_flights),
+        'destination': rng.choice(['VVNB', 'VVDN', 'RKSI'], n_flights),
+        'event_time_local': pd.Series(DAY + pd.to_timedelta(rng.integers(0, days * 24 * 60, n_flights), unit='min'))
+                              .where(rng.random(n_flights) > 0.05),
+    })
+
+def naive_series(flights, freq_minutes, start, end, flow=None, airport=None, airline=None):
+    selected = flights[flights['event_time_local'].notna()]
+    if flow is not None:
+        selected = selected[selected['flight_type'] == flow]
+    if airport is not None:
+        counterpart = selected['origin'].where(selected['flight_type'] == 'arrival', selected['destination'])
+        selected = selected[counterpart == airport]
+    if airline is not None:
+        selected = selected[selected['callsign'].str[:3] == airline]
+    index = pd.date_range(start, end, freq=f'{freq_minutes}min', inclusive='left')
+    counts = selected['event_time_local'].dt.floor(f'{freq_minutes}min').value_counts()
+    return counts.reindex(index, fill_value=0)
+
+@pytest.mark.parametrize('freq_minutes', [15, 60, 24 * 60])
+def test_series_matches_counting_the_flights(freq_minutes):
+    rng = np.random.default_rng(14)
+    today, tomorrow = random_flights(rng), random_flights(rng)
+    cube = DemandCube.from_flights({'today': (today, 'event_time_local'), 'tomorrow': (tomorrow, 'event_time_local')})
+    for flow, airport, airline in [(None, None, None), ('arrival', None, None), ('departure', 'VVDN', None), (None, None, 'VJC')]:
+        series = cube.series(flow=flow, scenario='today', airport=airport, airline=airline, freq_minutes=freq_minutes)
+        expected = naive_series(today, freq_minutes, DAY, DAY + pd.Timedelta(days=cube.days), flow, airport, airline)
+        np.testing.assert_array_equal(series.to_numpy(), expected.to_numpy())
+        assert series.index.equals(expected.index)
+
+    # Khoảng ngày vượt ra ngoài khối: ngày ngoài khối có số chuyến 0
+    series = cube.series(flow='arrival', freq_minutes=freq_minutes, start_date=DAY - pd.Timedelta(days=1), days=5)
+    both = pd.concat([today, tomorrow])
+    expected = naive_series(both, freq_minutes, DAY - pd.Timedelta(days=1), DAY + pd.Timedelta(days=4), 'arrival')
+    np.testing.assert_array_equal(series.to_numpy(), expected.to_numpy())
+
+def test_epoch_second_cube_counts_each_hour():
+    rng = np.random.default_rng(15)
+    times_s = DAY.value // 10**9 + rng.integers(0, 2 * 86400, 200)
+    is_arrival = rng.random(200) < 0.5
+    is_departure = ~is_arrival & (rng.random(200) < 0.8)
+    cube = DemandCube.from_epoch_seconds(times_s, is_arrival, is_departure)
+    for flow, mask in (('arrival', is_arrival), ('departure', is_departure)):
+        hours_s, counts = cube.hour_counts_s(flow)
+        expected_hours, expected_counts = np.unique(times_s[mask] // 3600 * 3600, return_counts=True)
+        np.testing.assert_array_equal(hours_s, expected_hours)
+        np.testing.assert_array_equal(counts, expected_counts)
+
+def minute_index(flights):
+    return RollingDemandIndex.from_cube(DemandCube.from_flights({'today': (flights, 'event_time_local')}, bin_minutes=1, dimensions=()))
+
+def naive_window_count(flights, start, window_minutes, flow=None):
+    times = flights['event_time_local'] if flow is None else flights.loc[flights['flight_type'] == flow, 'event_time_local']
+    return int(((times >= start) & (times < start + pd.Timedelta(minutes=window_minutes))).sum())
+
+@pytest.mark.parametrize('window_minutes', [1, 45, 60, 120])
+def test_rolling_index_counts_any_window(window_minutes):
+    rng = np.random.default_rng(16)
+    flights = random_flights(rng, days=2)
+    index = minute_index(flights)
+    starts = DAY + pd.to_timedelta(rng.integers(-120, 3 * 24 * 60, 50), unit='min')
+    for flow in (None,) + FLOWS:
+        expected = [naive_window_count(flights, start, window_minutes, flow) for start in starts]
+        np.testing.assert_array_equal(index.count(starts, window_minutes, flow), expected)
+        assert index.count(starts[0], window_minutes, flow) == expected[0]
+
+    rolling = index.rolling('arrival', window_minutes, step_minutes=15)
+    assert rolling.index[0] == DAY and (rolling.index[1] - rolling.index[0]) == pd.Timedelta(minutes=15)
+    np.testing.assert_array_equal(rolling.to_numpy(), [naive_window_count(flights, start, window_minutes, 'arrival') for start in rolling.index])
+
+def test_overloaded_hours_match_a_window_scan():
+    rng = np.random.default_rng(17)
+    flights = random_flights(rng, n_flights=150, days=1)
+    index = minute_index(flights)
+
+    def hourly_capacity(hours_s):
+        return np.where(hours_s // 3600 % 24 < 12, 4, 3)
+
+    overloads = index.overloads('departure', hourly_capacity)
+    expected_hours = set()
+    for start, row in overloads.iterrows():
+        assert row['demand'] == naive_window_count(flights, start, 60, 'departure')
+        # Cửa sổ lệch giờ có năng lực là trung bình theo phút của hai giờ nó đi qua
+        minutes_in_first_hour = 60 - start.minute
+        hour_s = start.floor('h').value // 10**9
+        assert row['capacity'] == pytest.approx((hourly_capacity(hour_s) * minutes_in_first_hour + hourly_capacity(hour_s + 3600) * (60 - minutes_in_first_hour)) / 60)
+        if row['excess'] > 0:
+            expected_hours.update({start.floor('h'), (start + pd.Timedelta(minutes=59)).floor('h')})
+    assert expected_hours
+    hours_s = index.overloaded_hours_s('departure', hourly_capacity)
+    np.testing.assert_array_equal(hours_s, sorted(hour.value // 10**9 for hour in expected_hours))
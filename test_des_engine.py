@@ -0,0 +1,92 @@
+# atfm_core/test_des_engine.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .des_engine import DiscreteEventEngine
+from .system_state import SystemState
+
+# Ba chế độ chạy của DiscreteEventEngine (step, run_until, fast_forward) phải cho cùng trạng thái cuối.
+
+DAY = pd.Timestamp('2025-06-24')
+OFFSET = pd.Timedelta(hours=7)
+
+def random_schedule(rng, n_flights=60):
+    """Lịch trình chính nhỏ: chuyến đến có EOBT -> ETOT -> ELDT, chuyến đi có EOBT -> ETOT; một số ETOT thiếu."""
+    is_arrival = rng.random(n_flights) < 0.5
+    eobt_local = DAY + pd.to_timedelta(rng.integers(0, 20 * 60, n_flights), unit='min')
+    etot_utc = pd.Series(eobt_local - OFFSET + pd.to_timedelta(rng.integers(5, 30, n_flights), unit='min'))
+    eldt_utc = pd.Series(etot_utc + pd.to_timedelta(rng.integers(30, 180, n_flights), unit='min')).where(is_arrival)
+    etot_utc = etot_utc.where(rng.random(n_flights) > 0.1)
+    event_time_utc = eldt_utc.where(is_arrival, etot_utc)
+    return pd.DataFrame({
+        'callsign': [f'VN{number:04d}' for number in range(n_flights)],
+        'flight_type': np.where(is_arrival, 'arrival', 'departure'),
+        'flight_date': DAY.strftime('%Y-%m-%d'),
+        'eobt_local': eobt_local,
+        'etot_utc': etot_utc,
+        'eldt_utc': eldt_utc,
+        'event_time_utc': event_time_utc,
+        'event_time_local': event_time_utc + OFFSET,
+    })
+
+def regulated_schedule(rng, schedule):
+    """Kết quả GDP giả: một nửa số chuyến có thời gian sự kiện bị dời 5-60 phút."""
+    is_regulated = (rng.random(len(schedule)) < 0.5) & schedule['event_time_utc'].notna().to_numpy()
+    delay_minutes = np.where(is_regulated, rng.integers(5, 60, len(schedule)), 0)
+    return pd.DataFrame({
+        'callsign': schedule['callsign'],
+        'flight_date': schedule['flight_date'],
+        'regulated_time_utc': schedule['event_time_utc'] + pd.to_timedelta(delay_minutes, unit='min'),
+        'is_regulated': is_regulated,
+        'atfm_delay_minutes': delay_minutes.astype(float),
+    })
+
+def build_engine(schedule, regulated_df, activation_time):
+    engine = DiscreteEventEngine(SystemState(schedule))
+    if regulated_df is not None:
+        engine.schedule_gdp_activation(activation_time, regulated_df)
+    return engine
+
+def engine_state(engine):
+    schedule = engine.state.master_schedule
+    return (engine.clock, engine.state.flight_phase.tolist(), engine.next_stage.tolist(), engine.is_regulated.tolist(),
+            engine.stage_times.tolist(), schedule['event_time_local'].tolist())
+
+@pytest.mark.parametrize('with_gdp', [False, True])
+def test_run_modes_end_in_the_same_state(with_gdp):
+    rng = np.random.default_rng(11)
+    for _ in range(5):
+        schedule = random_schedule(rng)
+        regulated_df = regulated_schedule(rng, schedule) if with_gdp else None
+        activation_time = DAY + pd.Timedelta(hours=10)
+        checkpoints = [DAY + pd.Timedelta(hours=hour) for hour in (6, 10, 14)] + [DAY + pd.Timedelta(days=1)]
+
+        by_run_until = build_engine(schedule, regulated_df, activation_time)
+        by_fast_forward = build_engine(schedule, regulated_df, activation_time)
+        by_step = build_engine(schedule, regulated_df, activation_time)
+        for checkpoint in checkpoints:
+            logged = by_run_until.run_until(checkpoint)
+            fired = by_fast_forward.fast_forward(checkpoint)
+            while by_step.next_event_time is not None and by_step.next_event_time <= checkpoint:
+                by_step.step()
+            by_step.run_until(checkpoint)
+
+            assert (logged['milestone'] != 'GDP').sum() == fired
+            assert engine_state(by_fast_forward) == engine_state(by_run_until)
+            assert engine_state(by_step) == engine_state(by_run_until)
+
+def test_every_milestone_fires_once_in_time_order():
+    rng = np.random.default_rng(12)
+    schedule = random_schedule(rng)
+    engine = build_engine(schedule, regulated_schedule(rng, schedule), DAY + pd.Timedelta(hours=10))
+    log = engine.run_until(DAY + pd.Timedelta(days=1))
+    flights = log[log['milestone'] != 'GDP']
+
+    assert flights['event_time_local'].is_monotonic_increasing
+    # Mỗi chuyến: EOBT, ETOT (nếu có) và ELDT (chỉ chuyến đến)
+    expected_counts = 1 + schedule['etot_utc'].notna().astype(int) + schedule['eldt_utc'].notna().astype(int)
+    np.testing.assert_array_equal(np.bincount(flights['position'], minlength=len(schedule)), expected_counts)
+    assert engine.next_event_time is None
+    assert (engine.state.flight_phase > 0).all()
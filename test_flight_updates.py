@@ -0,0 +1,90 @@
+# atfm_core/test_flight_updates.py
+
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from .flight_updates import FLOWS, FlightUpdateStream
+
+# Bộ đếm của FlightUpdateStream sau mỗi bản tin phải bằng bộ đếm đếm lại từ đầu trên danh sách chuyến bay.
+
+DAY = pd.Timestamp('2025-06-24')
+CALLSIGNS = [f'VN{number:03d}' for number in range(12)]
+
+def random_schedule(rng, n_flights=10):
+    callsigns = rng.choice(CALLSIGNS, n_flights, replace=False)
+    return pd.DataFrame({
+        'callsign': callsigns,
+        'flight_date': DAY.strftime('%Y-%m-%d'),
+        'flight_type': rng.choice(FLOWS, n_flights),
+        'event_time_local': DAY + pd.to_timedelta(rng.integers(0, 24 * 60, n_flights), unit='min'),
+    })
+
+def random_message(rng):
+    message = {'type': rng.choice(['new', 'delay', 'change', 'cancel', 'divert']),
+               'callsign': rng.choice(CALLSIGNS), 'flight_date': DAY.strftime('%Y-%m-%d')}
+    if message['type'] == 'new' or rng.random() < 0.5:
+        message['flight_type'] = rng.choice(FLOWS)
+    if message['type'] == 'new' or (message['type'] == 'change' and rng.random() < 0.7):
+        message['event_time_local'] = DAY + pd.Timedelta(minutes=int(rng.integers(0, 24 * 60)))
+    if message['type'] == 'delay':
+        message['delay_minutes'] = int(rng.integers(-30, 120))
+    return message
+
+def recount(stream):
+    hourly = {flow: Counter() for flow in FLOWS}
+    quarter_hour = {flow: Counter() for flow in FLOWS}
+    for flow, minute in stream.flights.values():
+        hourly[flow][minute // 60 * 60] += 1
+        quarter_hour[flow][minute // 15 * 15] += 1
+    hotspots = {flow: sorted(hour for hour, count in hourly[flow].items() if count > stream._capacity(flow, hour)) for flow in FLOWS}
+    return hourly, quarter_hour, hotspots
+
+def test_counters_match_a_full_recount_after_every_message():
+    rng = np.random.default_rng(12)
+    for _ in range(50):
+        stream = FlightUpdateStream.from_schedule(random_schedule(rng), landing_capacity=2, takeoff_capacity=1)
+        flights = dict(stream.flights)
+        applied = rejected = 0
+        for _ in range(40):
+            message = random_message(rng)
+            key = (message['callsign'], message['flight_date'])
+            current = flights.get(key)
+            ok = stream.apply(message)
+
+            # Kết quả mong đợi của từng loại bản tin trên danh sách chuyến bay
+            if message['type'] in ('new', 'change') and (current is not None or message['type'] == 'new'):
+                flow = message.get('flight_type', current[0] if current else None)
+                minute = current[1] if 'event_time_local' not in message else int((message['event_time_local'] - pd.Timestamp(0)) // pd.Timedelta(minutes=1))
+                flights[key] = (flow, minute)
+            elif message['type'] == 'delay' and current is not None:
+                flights[key] = (current[0], current[1] + message['delay_minutes'])
+            elif message['type'] == 'cancel' and current is not None:
+                del flights[key]
+            else:
+                assert not ok
+            applied, rejected = applied + ok, rejected + (not ok)
+
+            assert stream.flights == flights
+            hourly, quarter_hour, hotspots = recount(stream)
+            for flow in FLOWS:
+                assert +stream.hourly_counts[flow] == hourly[flow]
+                assert +stream.quarter_hour_counts[flow] == quarter_hour[flow]
+                assert sorted(stream._hotspot_hours[flow]) == hotspots[flow]
+            assert (stream.applied_count, stream.rejected_count) == (applied, rejected)
+
+def test_capacity_override_moves_hotspots():
+    schedule = pd.DataFrame({
+        'callsign': ['VN001', 'VN002', 'VN003'], 'flight_date': '2025-06-24', 'flight_type': 'arrival',
+        'event_time_local': DAY + pd.to_timedelta([600, 610, 700], unit='min'),
+    })
+    stream = FlightUpdateStream.from_schedule(schedule, landing_capacity=1, takeoff_capacity=1)
+    assert stream.hotspot_hours('arrival') == [DAY + pd.Timedelta(hours=10)]
+    assert stream.demand('arrival', DAY + pd.Timedelta(minutes=605)) == 2
+    assert stream.demand('arrival', DAY + pd.Timedelta(minutes=605), resolution_minutes=15) == 2
+
+    stream.set_hourly_capacity(DAY + pd.Timedelta(hours=10), landing_capacity=2)
+    assert stream.hotspot_hours('arrival') == []
+    stream.apply({'type': 'delay', 'callsign': 'VN003', 'flight_date': '2025-06-24', 'delay_minutes': -55})
+    assert stream.hotspot_hours('arrival') == [DAY + pd.Timedelta(hours=10)]
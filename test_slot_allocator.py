@@ -0,0 +1,154 @@
+# atfm_core/test_slot_allocator.py
+
+import itertools
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from .slot_allocator import NO_SLOT, SECONDS_PER_HOUR, FreeSlotTree, SlotStore, build_slot_grid, claim_incremental
+
+# Kiểm tra các cấu trúc slot của slot_allocator với cách làm thẳng (duyệt danh sách) trên dữ liệu nhỏ ngẫu nhiên.
+
+def random_grid(rng, n_slots, windows):
+    """
+    Lưới slot ngẫu nhiên: dạng điểm có thể trùng thời điểm; với windows, như build_slot_grid(return_ends=True),
+    mỗi slot là cửa sổ [start, end) kết thúc không muộn hơn slot kế tiếp.
+    """
+    if not windows:
+        return np.sort(rng.integers(0, 50, n_slots)).astype(np.int64), None
+    starts = np.sort(rng.choice(50, n_slots, replace=False)).astype(np.int64)
+    ends = np.minimum(np.append(starts[1:], np.iinfo(np.int64).max), starts + rng.integers(1, 6, n_slots))
+    return starts, ends
+
+def naive_claim(starts, ends, free, time_s):
+    for index in range(len(starts)):
+        if free[index] and (starts[index] >= time_s if ends is None else ends[index] > time_s):
+            free[index] = False
+            return int(starts[index]) if ends is None else int(max(starts[index], time_s))
+    return None
+
+def naive_release(starts, ends, free, slot_time_s):
+    for index in range(len(starts)):
+        if not free[index] and (starts[index] == slot_time_s if ends is None else starts[index] <= slot_time_s < ends[index]):
+            free[index] = True
+            return
+
+@pytest.mark.parametrize('windows', [False, True])
+def test_slot_store_claim_and_release_match_naive_scan(windows):
+    rng = np.random.default_rng(5)
+    for _ in range(200):
+        starts, ends = random_grid(rng, int(rng.integers(1, 30)), windows)
+        store = SlotStore(starts, ends)
+        free = np.ones(len(starts), dtype=bool)
+        granted = []
+        for _ in range(60):
+            if granted and rng.random() < 0.3:
+                slot_time_s = granted.pop(int(rng.integers(len(granted))))
+                store.release(slot_time_s)
+                naive_release(starts, ends, free, slot_time_s)
+            else:
+                time_s = int(rng.integers(-5, 60))
+                assert store.next_free(time_s) == naive_claim(starts, ends, free.copy(), time_s)
+                result = store.claim(time_s)
+                assert result == naive_claim(starts, ends, free, time_s)
+                if result is not None:
+                    granted.append(result)
+            assert store.free_count == free.sum()
+
+@pytest.mark.parametrize('windows', [False, True])
+def test_claim_many_matches_claims_one_by_one(windows):
+    rng = np.random.default_rng(6)
+    for _ in range(200):
+        starts, ends = random_grid(rng, int(rng.integers(1, 30)), windows)
+        batch, single = SlotStore(starts, ends), SlotStore(starts, ends)
+        already_claimed = np.sort(rng.integers(0, 50, 5))
+        for store in (batch, single):
+            store.claim_many(already_claimed)
+        desired = np.sort(rng.integers(-5, 60, int(rng.integers(1, 40))))
+        one_by_one = [single.claim(int(time_s)) for time_s in desired]
+        expected = np.array([NO_SLOT if time_s is None else time_s for time_s in one_by_one])
+        np.testing.assert_array_equal(batch.claim_many(desired), expected)
+        assert batch.free_count == single.free_count
+
+def test_slot_grid_gives_each_hour_its_capacity():
+    hour_starts_s = np.arange(0, 5 * 3600, 3600)
+    slot_times = build_slot_grid(hour_starts_s, [4, 0, 2.5, 2.5, 1])
+    np.testing.assert_array_equal(np.bincount(slot_times // 3600, minlength=5), [4, 0, 3, 2, 1])
+    assert np.all(np.diff(slot_times) > 0)
+
+@pytest.mark.parametrize('windows', [False, True])
+@pytest.mark.parametrize('weighted', [False, True])
+def test_claim_incremental_matches_full_recompute(windows, weighted):
+    rng = np.random.default_rng(7)
+    hour_starts_s = np.arange(12, dtype=np.int64) * SECONDS_PER_HOUR
+    for _ in range(100):
+        n_flights = int(rng.integers(1, 30))
+        desired = np.sort(rng.integers(0, 8 * SECONDS_PER_HOUR, n_flights))
+        weights = rng.integers(1, 4, n_flights).astype(float) if weighted else None
+
+        def store_for(capacity):
+            return SlotStore.from_hourly_capacity(hour_starts_s, capacity, use_slot_windows=windows)
+
+        def full(capacity):
+            store = store_for(capacity)
+            return store.claim_many(desired) if weights is None else store.claim_weighted(desired, weights)
+
+        old_capacity = rng.integers(1, 5, len(hour_starts_s))
+        changed_hour = int(rng.integers(0, len(hour_starts_s)))
+        new_capacity = np.concatenate([old_capacity[:changed_hour], rng.integers(0, 5, len(hour_starts_s) - changed_hour)])
+        previous = full(old_capacity)
+
+        granted, kept = claim_incremental(store_for(new_capacity), desired, previous, int(hour_starts_s[changed_hour]), weights)
+        np.testing.assert_array_equal(granted, full(new_capacity))
+        assert np.all(previous[kept] < hour_starts_s[changed_hour])
+
+        # Không có thay đổi: giữ nguyên kết quả cũ
+        granted, kept = claim_incremental(store_for(old_capacity), desired, previous, None, weights)
+        np.testing.assert_array_equal(granted, previous)
+        assert kept.all()
+
+def test_free_slot_tree_matches_free_mask():
+    rng = np.random.default_rng(8)
+    for _ in range(200):
+        free = rng.random(int(rng.integers(1, 40))) < 0.5
+        tree = FreeSlotTree(free)
+        for _ in range(50):
+            index = int(rng.integers(len(free)))
+            if rng.random() < 0.5:
+                tree.claim(index)
+                free[index] = False
+            else:
+                tree.release(index)
+                free[index] = True
+            start = int(rng.integers(0, len(free) + 2))
+            candidates = np.flatnonzero(free[start:])
+            assert tree.first_free(start) == (start + int(candidates[0]) if len(candidates) else NO_SLOT)
+            assert tree.is_free(index) == free[index]
+
+def test_claim_weighted_finds_minimum_weighted_delay():
+    rng = np.random.default_rng(9)
+    for _ in range(300):
+        slot_times = np.sort(rng.integers(0, 20, int(rng.integers(1, 7))))
+        desired = rng.integers(0, 20, int(rng.integers(1, min(len(slot_times), 5) + 1)))
+        weights = rng.integers(1, 5, len(desired)).astype(float)
+        # Vét cạn mọi cách gán mỗi chuyến một slot khác nhau không sớm hơn thời gian mong muốn
+        costs = [sum(weights[i] * (slot_times[j] - desired[i]) for i, j in enumerate(assignment))
+                 for assignment in itertools.permutations(range(len(slot_times)), len(desired))
+                 if all(slot_times[j] >= desired[i] for i, j in enumerate(assignment))]
+        if not costs:
+            continue
+        granted = SlotStore(slot_times).claim_weighted(desired, weights)
+        assert np.all(granted != NO_SLOT) and np.all(granted >= desired)
+        assert np.sum(weights * (granted - desired)) == pytest.approx(min(costs))
+        # Không slot nào được cấp hai lần (slot có thể trùng thời điểm)
+        assert not Counter(granted.tolist()) - Counter(slot_times.tolist())
+
+@pytest.mark.parametrize('windows', [False, True])
+def test_claim_weighted_with_equal_weights_matches_claim_many(windows):
+    rng = np.random.default_rng(10)
+    for _ in range(200):
+        starts, ends = random_grid(rng, int(rng.integers(1, 30)), windows)
+        desired = np.sort(rng.integers(-5, 60, int(rng.integers(1, 40))))
+        np.testing.assert_array_equal(SlotStore(starts, ends).claim_weighted(desired, np.ones(len(desired))),
+                                      SlotStore(starts, ends).claim_many(desired))
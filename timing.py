@@ -0,0 +1,127 @@
+# atfm_core/timing.py
+
+import contextvars
+import functools
+import json
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Đo thời gian từng bước của pipeline và từng khối hiển thị. Mỗi lần chạy (một lần Streamlit chạy lại script,
+# một kịch bản của `python -m atfm_core run`) ghi các bản ghi (bước, số giây, số dòng) vào TimingRecorder đang dùng;
+# ngoài Streamlit không chọn recorder nào thì dùng DEFAULT_RECORDER.
+
+TIMING_LOG_ENV = 'ATFM_TIMING_LOG'
+DEFAULT_HISTORY_RUNS = 50
+# Giới hạn bản ghi của một lần chạy (tiến trình dùng lâu không gọi start_run vẫn có bộ nhớ giới hạn)
+MAX_RECORDS_PER_RUN = 10_000
+
+class TimingRecorder:
+    """
+    Bản ghi thời gian của `history_runs` lần chạy gần nhất. Mỗi bản ghi: run, stage, seconds, rows, started_at.
+    Nếu có `log_path`, mỗi bản ghi được nối vào file dạng JSON lines ngay khi bước kết thúc.
+    """
+
+    def __init__(self, history_runs=DEFAULT_HISTORY_RUNS, log_path=None):
+        self.log_path = log_path
+        self.run_id = 0
+        self.run_label = None
+        self._runs = deque([deque(maxlen=MAX_RECORDS_PER_RUN)], maxlen=history_runs)
+
+    def start_run(self, label=None):
+        """Bắt đầu một lần chạy mới; các bản ghi sau đó thuộc lần chạy này."""
+        self.run_id += 1
+        self.run_label = label
+        self._runs.append(deque(maxlen=MAX_RECORDS_PER_RUN))
+
+    def record(self, stage, seconds, rows=None, started_at=None):
+        entry = {'run': self.run_id, 'label': self.run_label, 'stage': stage, 'seconds': seconds, 'rows': rows,
+                 'started_at': started_at if started_at is not None else time.time() - seconds}
+        self._runs[-1].append(entry)
+        if self.log_path:
+            with open(self.log_path, 'a', encoding='utf-8') as log_file:
+                log_file.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+        return entry
+
+    def latest(self):
+        """Lần chạy hiện tại, gộp theo bước (theo thứ tự gọi đầu tiên): calls, seconds (tổng), rows (lần gọi cuối)."""
+        records = pd.DataFrame(list(self._runs[-1]), columns=['stage', 'seconds', 'rows'])
+        if records.empty:
+            return pd.DataFrame(columns=['stage', 'calls', 'seconds', 'rows'])
+        return records.groupby('stage', sort=False).agg(
+            calls=('seconds', 'size'), seconds=('seconds', 'sum'), rows=('rows', 'last')).reset_index()
+
+    def rolling_summary(self):
+        """p50/p95 của tổng thời gian mỗi lần chạy, theo bước, trên các lần chạy còn giữ; runs là số lần chạy có bước đó."""
+        per_run = [pd.DataFrame(list(records)).groupby('stage', sort=False)['seconds'].sum() for records in self._runs if records]
+        if not per_run:
+            return pd.DataFrame(columns=['stage', 'runs', 'p50_seconds', 'p95_seconds'])
+        rows = []
+        for stage in dict.fromkeys(stage for totals in per_run for stage in totals.index):
+            seconds = np.array([totals[stage] for totals in per_run if stage in totals.index])
+            rows.append({'stage': stage, 'runs': len(seconds),
+                         'p50_seconds': float(np.percentile(seconds, 50)), 'p95_seconds': float(np.percentile(seconds, 95))})
+        return pd.DataFrame(rows)
+
+DEFAULT_RECORDER = TimingRecorder(log_path=os.environ.get(TIMING_LOG_ENV))
+_current_recorder = contextvars.ContextVar('atfm_timing_recorder', default=None)
+
+def current_recorder():
+    return _current_recorder.get() or DEFAULT_RECORDER
+
+def use_recorder(recorder):
+    """Chọn recorder cho luồng hiện tại (mỗi phiên Streamlit chạy script trong luồng riêng, nên mỗi phiên một recorder)."""
+    _current_recorder.set(recorder)
+    return recorder
+
+def row_count(value):
+    """Số dòng của một DataFrame/Series, hoặc tổng số dòng các DataFrame trong tuple/list; None nếu không có."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        counts = [len(item) for item in value if isinstance(item, (pd.DataFrame, pd.Series))]
+        return sum(counts) if counts else None
+    return None
+
+@contextmanager
+def stage_timer(stage, rows=None):
+    """
+    Đo một khối mã: `with stage_timer('render: biểu đồ nhu cầu') as timing: ...`. Có thể gán timing['rows']
+    trong khối để ghi số dòng đã xử lý.
+    """
+    timing = {'rows': rows}
+    started_at, start = time.time(), time.perf_counter()
+    try:
+        yield timing
+    finally:
+        current_recorder().record(stage, time.perf_counter() - start, timing['rows'], started_at)
+
+def timed(stage=None, rows=None):
+    """
+    Decorator đo mỗi lần gọi hàm; tên bước mặc định là tên hàm. Số dòng là `rows(kết quả)` nếu có, không thì của
+    kết quả (DataFrame hoặc tuple DataFrame), cuối cùng là của tham số DataFrame đầu tiên. Như stage_timer, lần gọi
+    ném lỗi vẫn được ghi (số dòng của tham số).
+    Dùng `@timed`, `@timed('tên bước')` hoặc `@timed(rows=lambda result: ...)`.
+    """
+    def decorate(function, name):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started_at, start = time.time(), time.perf_counter()
+            result_rows = None
+            try:
+                result = function(*args, **kwargs)
+                result_rows = rows(result) if rows else row_count(result)
+                return result
+            finally:
+                if result_rows is None:
+                    result_rows = next((len(arg) for arg in args if isinstance(arg, pd.DataFrame)), None)
+                current_recorder().record(name, time.perf_counter() - start, result_rows, started_at)
+        return wrapper
+
+    if callable(stage):
+        return decorate(stage, stage.__name__)
+    return lambda function: decorate(function, stage or function.__name__)